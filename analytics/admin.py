@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.utils import timezone
-from .models import AnalyticsCache
+from .models import (
+    AnalyticsCache, AttritionScore, HeadcountSnapshot, LeaveDailyStat, PayrollComponentFact, PayrollRunFact,
+)
 
 
 @admin.register(AnalyticsCache)
@@ -19,4 +21,34 @@ class AnalyticsCacheAdmin(admin.ModelAdmin):
         """Custom column to show if cache is still valid."""
         return obj.is_valid()
     is_valid_display.boolean = True  # renders ✓ / ✗
-    is_valid_display.short_description = "Is Valid?"
\ No newline at end of file
+    is_valid_display.short_description = "Is Valid?"
+
+@admin.register(HeadcountSnapshot)
+class HeadcountSnapshotAdmin(admin.ModelAdmin):
+    list_display = ("day", "department", "grade", "region", "headcount")
+    list_filter = ("day", "region")
+    search_fields = ("department", "grade")
+
+
+@admin.register(LeaveDailyStat)
+class LeaveDailyStatAdmin(admin.ModelAdmin):
+    list_display = ("day", "leave_type", "status", "count")
+    list_filter = ("status", "leave_type")
+
+
+@admin.register(PayrollRunFact)
+class PayrollRunFactAdmin(admin.ModelAdmin):
+    list_display = ("run", "slips", "gross_total", "net_total", "refreshed_at")
+
+
+@admin.register(PayrollComponentFact)
+class PayrollComponentFactAdmin(admin.ModelAdmin):
+    list_display = ("run", "code", "name", "kind", "lines", "total")
+    list_filter = ("run", "kind")
+
+
+@admin.register(AttritionScore)
+class AttritionScoreAdmin(admin.ModelAdmin):
+    list_display = ("day", "employee", "department", "region", "score", "leave6m", "unread", "absence_rate")
+    list_filter = ("day", "region", "department")
+    raw_id_fields = ("employee",)
@@ -7,4 +7,7 @@ class AnalyticsConfig(AppConfig):
 
     def ready(self):
         from config.monitoring.metrics import setup_metrics
-        setup_metrics()
\ No newline at end of file
+        setup_metrics()
+        import analytics.signals  # fact table maintenance
+        from analytics.invalidation import connect_signals
+        connect_signals()          # dataset keys marked dirty by their models
\ No newline at end of file
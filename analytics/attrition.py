@@ -0,0 +1,190 @@
+# analytics/attrition.py
+"""
+Attrition-risk scoring over the whole population, column by column.
+
+load_features() runs one query per feature (employees, leave requests of the last 180 days,
+unread notifications, attendance of the last ANALYTICS_ATTRITION_ABSENCE_DAYS days) into
+numpy arrays aligned on the employee order; score() combines them with the
+ANALYTICS_ATTRITION_WEIGHTS, each feature scaled to 0..1 over the population:
+
+  tenure   1 - min(months of service / 120, 1)      (no entry date: 12 months)
+  leave    leave requests started in the last 180 days / population max
+  unread   unread notifications (live + archived) / population max
+  absence  absent days / recorded attendance days
+
+top_k() selects with np.argpartition (O(n)) and only sorts the k kept rows. persist(), called
+by the nightly score_attrition task only, stores one AttritionScore row per employee and day;
+filtered and paginated listings and per-employee trends read those rows instead of rescoring.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from attendance.models import AttendanceRecord
+from employee.models import Employee
+from leave.models import LeaveRequest
+from notifications.retention import unread_by_user
+
+from .models import AttritionScore
+
+DEFAULT_WEIGHTS = {"tenure": 0.40, "leave": 0.30, "unread": 0.15, "absence": 0.15}
+
+
+@dataclass
+class AttritionBatch:
+    """Population features as arrays aligned on `employee_ids`, plus the scores."""
+    day: date
+    employee_ids: np.ndarray        # object (UUID)
+    first_names: np.ndarray         # object
+    last_names: np.ndarray          # object
+    department_ids: np.ndarray      # object (id or None)
+    departments: np.ndarray         # object (name or None)
+    grades: np.ndarray              # object (code or None)
+    regions: np.ndarray             # object
+    tenure_months: np.ndarray       # int64
+    leave6m: np.ndarray             # int64
+    unread: np.ndarray              # int64
+    absence_rate: np.ndarray        # float64
+    tenure_score: np.ndarray = None
+    scores: np.ndarray = None
+
+    def __len__(self):
+        return len(self.employee_ids)
+
+
+def _weights() -> dict:
+    return {**DEFAULT_WEIGHTS, **(getattr(settings, "ANALYTICS_ATTRITION_WEIGHTS", None) or {})}
+
+
+def _lookup(keys: np.ndarray, counts: dict, dtype=np.int64) -> np.ndarray:
+    return np.fromiter((counts.get(k, 0) for k in keys), dtype=dtype, count=len(keys))
+
+
+def load_features(day: date = None) -> AttritionBatch:
+    day = day or timezone.localdate()
+    rows = list(Employee.objects.order_by("id").values_list(
+        "id", "user_id", "first_name", "last_name", "department_id", "department__name",
+        "grade__code", "region", "date_joined",
+    ))
+    cols = list(zip(*rows)) if rows else [()] * 9
+    ids = np.array(cols[0], dtype=object)
+    user_ids = np.array(cols[1], dtype=object)
+
+    default_joined = day - timedelta(days=365)
+    joined = [d or default_joined for d in cols[8]]
+    tenure = np.fromiter(((day.year - d.year) * 12 + day.month - d.month for d in joined),
+                         dtype=np.int64, count=len(joined))
+
+    leave_counts = dict(
+        LeaveRequest.objects.filter(start_date__gte=day - timedelta(days=180))
+        .values("employee_id").annotate(n=Count("id")).values_list("employee_id", "n")
+    )
+    unread_counts = unread_by_user()   # live + archived unread
+
+    since = day - timedelta(days=int(getattr(settings, "ANALYTICS_ATTRITION_ABSENCE_DAYS", 90)))
+    attendance = (AttendanceRecord.objects.filter(date__gte=since, date__lte=day)
+                  .values("employee_id").annotate(days=Count("id"), absent=Count("id", filter=Q(status="absent")))
+                  .values_list("employee_id", "days", "absent"))
+    recorded, absent = {}, {}
+    for emp, n, a in attendance:
+        recorded[emp], absent[emp] = n, a
+    days = _lookup(ids, recorded)
+    absence = np.divide(_lookup(ids, absent), days, out=np.zeros(len(ids)), where=days > 0)
+
+    return AttritionBatch(
+        day=day, employee_ids=ids,
+        first_names=np.array(cols[2], dtype=object), last_names=np.array(cols[3], dtype=object),
+        department_ids=np.array(cols[4], dtype=object), departments=np.array(cols[5], dtype=object),
+        grades=np.array(cols[6], dtype=object), regions=np.array(cols[7], dtype=object),
+        tenure_months=np.maximum(tenure, 1),
+        leave6m=_lookup(ids, leave_counts),
+        unread=_lookup(user_ids, unread_counts),
+        absence_rate=absence,
+    )
+
+
+def _scaled(x: np.ndarray) -> np.ndarray:
+    top = x.max() if len(x) else 0
+    return x / top if top else np.zeros(len(x))
+
+
+def score(batch: AttritionBatch) -> AttritionBatch:
+    w = _weights()
+    batch.tenure_score = 1.0 - np.minimum(batch.tenure_months / 120.0, 1.0)
+    batch.scores = (w["tenure"] * batch.tenure_score
+                    + w["leave"] * _scaled(batch.leave6m.astype(float))
+                    + w["unread"] * _scaled(batch.unread.astype(float))
+                    + w["absence"] * batch.absence_rate)
+    return batch
+
+
+def compute(day: date = None) -> AttritionBatch:
+    return score(load_features(day))
+
+
+def top_k(batch: AttritionBatch, k: int, offset: int = 0, mask: np.ndarray = None) -> np.ndarray:
+    """Indices of the rows ranked offset..offset+k by score (desc), optionally within `mask`."""
+    idx = np.arange(len(batch)) if mask is None else np.flatnonzero(mask)
+    need = min(offset + k, len(idx))
+    if need <= 0:
+        return idx[:0]
+    s = batch.scores[idx]
+    if need < len(idx):
+        cut = s[np.argpartition(-s, need - 1)[need - 1]]
+        part = np.flatnonzero(s >= cut)      # ties at the cut kept: stable order across pages
+    else:
+        part = np.arange(len(idx))
+    ranked = part[np.lexsort((batch.employee_ids[idx][part].astype(str), -s[part]))]
+    return idx[ranked[offset:need]]
+
+
+def row(batch: AttritionBatch, i: int) -> dict:
+    return {
+        "employee": {
+            "id": str(batch.employee_ids[i]),
+            "first_name": batch.first_names[i], "last_name": batch.last_names[i],
+            "department": batch.departments[i],
+            "grade": batch.grades[i],
+        },
+        "score": round(float(batch.scores[i]), 3),
+        "features": {
+            "tenure_score": round(float(batch.tenure_score[i]), 3),
+            "leave6m": int(batch.leave6m[i]),
+            "unread": int(batch.unread[i]),
+            "absence_rate": round(float(batch.absence_rate[i]), 3),
+        },
+    }
+
+
+def persist(batch: AttritionBatch) -> int:
+    """Replace the batch day's AttritionScore rows. Returns the number of rows written."""
+    rows = [
+        AttritionScore(
+            day=batch.day, employee_id=batch.employee_ids[i], department_id=batch.department_ids[i],
+            region=batch.regions[i] or "", score=float(batch.scores[i]),
+            tenure_months=int(batch.tenure_months[i]), leave6m=int(batch.leave6m[i]),
+            unread=int(batch.unread[i]), absence_rate=float(batch.absence_rate[i]),
+        )
+        for i in range(len(batch))
+    ]
+    with transaction.atomic():
+        AttritionScore.objects.filter(day=batch.day).delete()
+        AttritionScore.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def purge(keep_days: int = None) -> int:
+    keep_days = int(keep_days if keep_days is not None else getattr(settings, "ANALYTICS_ATTRITION_KEEP_DAYS", 400))
+    deleted, _ = AttritionScore.objects.filter(day__lt=timezone.localdate() - timedelta(days=keep_days)).delete()
+    return deleted
+
+
+def latest_day():
+    return AttritionScore.objects.order_by("-day").values_list("day", flat=True).first()
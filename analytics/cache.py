@@ -1,7 +1,5 @@
 # analytics/cache.py
 from django.core.cache import cache
-from django.utils import timezone
-from datetime import timedelta
 from .models import AnalyticsCache
 
 # ################################################################################
@@ -79,67 +77,264 @@ from .models import AnalyticsCache
 
 
 # analytics/cache.py
-from datetime import timedelta
+"""
+L1 (Django cache / Redis) -> L2 (AnalyticsCache table) -> L3 (compute), stampede-safe.
+
+Entries carry a soft expiry (the ttl given by the caller) and a hard one (soft + ttl *
+ANALYTICS_CACHE_STALE_FACTOR, the L1 TTL / L2 valid_until):
+
+  - fresh: served; with probability growing as the soft expiry nears (XFetch: compute time *
+    ANALYTICS_CACHE_EARLY_BETA * -ln(rand)) one request refreshes it early in the background
+  - stale (past soft, before hard): served, and refreshed in the background
+  - missing / past hard: computed by one request per key; the others wait for its result
+    (up to ANALYTICS_CACHE_LOCK_WAIT seconds) instead of computing it again
+
+"One request" is a Redis lock per key (lock:<key>, ANALYTICS_CACHE_LOCK_TTL), or a
+process-local lock when Redis is down. Redis errors never fail a request: L1 is skipped.
+Lookups and compute times are exported per key (config/monitoring/metrics.py).
+"""
+import logging
+import math
+import random
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
 from django.core.cache import cache
-from django.utils import timezone
+from django.db import connections
+
+from config.monitoring.metrics import inc_analytics_cache, observe_analytics_compute
 from .models import AnalyticsCache  # key: str, payload: JSON, valid_until: DateTime
 
-def get_or_set(key: str, producer, ttl_seconds: int = 900):
-    """Simple L1+L2 cache (no source tag)."""
-    val = cache.get(key)
-    if val is not None:
-        return val
-    row = AnalyticsCache.objects.filter(key=key).first()
-    if row and row.valid_until and row.valid_until > timezone.now():
-        ttl = int((row.valid_until - timezone.now()).total_seconds())
-        if ttl > 0:
-            cache.set(key, row.payload, ttl)
-        return row.payload
-    data = producer()
-    set_cache(key, data, ttl_seconds)
-    return data
+logger = logging.getLogger(__name__)
 
-def set_cache(key: str, data, ttl_seconds: int = 900):
-    cache.set(key, data, ttl_seconds)  # L1
-    AnalyticsCache.objects.update_or_create(
-        key=key,
-        defaults={"payload": data, "valid_until": timezone.now() + timedelta(seconds=ttl_seconds)}
-    )
-    return data
+ENVELOPE = "__analytics_cache__"
 
-# Instrumented versions (with source tags)
 
-def get_with_source(key: str):
-    val = cache.get(key)
-    if val is not None:
-        return val, "L1"
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _hard_ttl(ttl_seconds: int) -> int:
+    return int(ttl_seconds + ttl_seconds * float(_setting("ANALYTICS_CACHE_STALE_FACTOR", 1.0)))
+
+
+def _envelope(data, ttl_seconds: int, duration: float = 0.0) -> dict:
+    now = time.time()
+    return {ENVELOPE: 1, "v": data, "t": now, "soft": now + ttl_seconds, "hard": now + _hard_ttl(ttl_seconds),
+            "d": duration}
+
+
+def _unwrap(payload, valid_until=None):
+    """Envelope of an L2 payload; legacy rows (raw data) are fresh until valid_until."""
+    if isinstance(payload, dict) and payload.get(ENVELOPE):
+        return payload
+    if valid_until is None:
+        return None
+    until = valid_until.timestamp()
+    return {ENVELOPE: 1, "v": payload, "t": 0.0, "soft": until, "hard": until, "d": 0.0}
+
+
+# ---------------- L1 / L2 ----------------
+
+def _l1_get(key: str):
+    try:
+        env = cache.get(key)
+    except Exception as e:
+        logger.warning("Analytics L1 unavailable (get %s): %s", key, e)
+        return None
+    return env if isinstance(env, dict) and env.get(ENVELOPE) else None
+
+
+def _l1_set(key: str, env: dict) -> None:
+    ttl = int(env["hard"] - time.time())
+    if ttl <= 0:
+        return
+    try:
+        cache.set(key, env, ttl)
+    except Exception as e:
+        logger.warning("Analytics L1 unavailable (set %s): %s", key, e)
+
+
+def _lookup(key: str):
+    """(envelope, "L1" | "L2") of a value not past its hard expiry, or (None, None)."""
+    env = _l1_get(key)
+    if env is not None and env["hard"] > time.time():
+        return env, "L1"
     row = AnalyticsCache.objects.filter(key=key).first()
-    if row and row.valid_until and row.valid_until > timezone.now():
-        ttl = int((row.valid_until - timezone.now()).total_seconds())
-        if ttl > 0:
-            cache.set(key, row.payload, ttl)
-        return row.payload, "L2"
+    if row is not None:
+        env = _unwrap(row.payload, row.valid_until)
+        if env is not None and env["hard"] > time.time():
+            _l1_set(key, env)   # warm L1 for the remaining hard TTL
+            return env, "L2"
     return None, None
 
-def set_with_source(key: str, data, ttl_seconds: int = 900):
-    set_cache(key, data, ttl_seconds)
-    return data, "L1+L2"
 
-def get_or_set_with_source(key: str, producer, ttl_seconds: int = 900):
-    data, src = get_with_source(key)
-    if data is not None:
-        return data, src
+def _store(key: str, env: dict) -> None:
+    _l1_set(key, env)
+    valid_until = datetime.fromtimestamp(env["hard"], tz=dt_timezone.utc)
+    AnalyticsCache.objects.update_or_create(key=key, defaults={"payload": env, "valid_until": valid_until})
+
+
+# ---------------- single flight ----------------
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+class _Flight:
+    """Per-key recompute guard: Redis lock shared by all processes, local lock as fallback."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self._lock = None
+
+    def acquire(self) -> bool:
+        try:
+            from django_redis import get_redis_connection
+            lock = get_redis_connection("default").lock(
+                f"lock:{self.key}", timeout=int(_setting("ANALYTICS_CACHE_LOCK_TTL", 120)))
+            if lock.acquire(blocking=False):
+                self._lock = lock
+                return True
+            return False
+        except Exception:
+            with _local_locks_guard:
+                lock = _local_locks.setdefault(self.key, threading.Lock())
+            if lock.acquire(blocking=False):
+                self._lock = lock
+                return True
+            return False
+
+    def release(self) -> None:
+        lock, self._lock = self._lock, None
+        if lock is None:
+            return
+        try:
+            lock.release()
+        except Exception as e:   # expired under a slow compute: someone else may hold it now
+            logger.warning("Analytics lock %s already released: %s", self.key, e)
+
+
+def _compute(key: str, producer, ttl_seconds: int) -> dict:
+    started = time.monotonic()
     data = producer()
-    set_with_source(key, data, ttl_seconds)
-    return data, "compute→cached"
+    duration = time.monotonic() - started
+    observe_analytics_compute(key, duration)
+    env = _envelope(data, ttl_seconds, duration)
+    _store(key, env)
+    return env
+
+
+def _refresh_in_background(key: str, producer, ttl_seconds: int, flight: _Flight) -> None:
+    def run():
+        try:
+            _compute(key, producer, ttl_seconds)
+        except Exception as e:
+            logger.warning("Analytics background refresh of %s failed: %s", key, e)
+        finally:
+            flight.release()
+
+    def in_thread():
+        try:
+            run()
+        finally:
+            connections.close_all()   # this thread's connections only
+
+    if _setting("ANALYTICS_CACHE_BACKGROUND", True):
+        threading.Thread(target=in_thread, name=f"analytics-refresh:{key}", daemon=True).start()
+    else:
+        run()
 
 
+def _early(env: dict) -> bool:
+    """XFetch: refresh before the soft expiry with probability rising as it nears."""
+    beta = float(_setting("ANALYTICS_CACHE_EARLY_BETA", 1.0))
+    if beta <= 0 or not env.get("d"):
+        return False
+    return time.time() - env["d"] * beta * math.log(1.0 - random.random()) >= env["soft"]
 
 
+# ---------------- public API ----------------
 
+def recompute(key: str, producer, ttl_seconds: int = 900, wait: bool = True):
+    """
+    Compute and store `key` now, unless another process is already doing it: then wait for
+    its result (wait=True) or return None (wait=False).
+    """
+    flight = _Flight(key)
+    if flight.acquire():
+        try:
+            return _compute(key, producer, ttl_seconds)["v"]
+        finally:
+            flight.release()
+    if not wait:
+        return None
+    before = time.time()
+    deadline = time.monotonic() + float(_setting("ANALYTICS_CACHE_LOCK_WAIT", 15))
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        env, _ = _lookup(key)
+        if env is not None and env["t"] >= before:
+            return env["v"]
+        if flight.acquire():   # the holder finished without storing (error) or died
+            try:
+                return _compute(key, producer, ttl_seconds)["v"]
+            finally:
+                flight.release()
+    return _compute(key, producer, ttl_seconds)["v"]   # waited long enough: fail open
 
 
+def get_or_set_with_source(key: str, producer, ttl_seconds: int = 900):
+    env, src = _lookup(key)
+    if env is not None:
+        now = time.time()
+        if now < env["soft"] and not _early(env):
+            inc_analytics_cache(key, "hit")
+            return env["v"], src
+        result = "early" if now < env["soft"] else "stale"
+        inc_analytics_cache(key, result)
+        flight = _Flight(key)
+        if flight.acquire():
+            _refresh_in_background(key, producer, ttl_seconds, flight)
+        return env["v"], src if result == "early" else f"{src}-stale"
+
+    flight = _Flight(key)
+    if flight.acquire():
+        inc_analytics_cache(key, "miss")
+        try:
+            return _compute(key, producer, ttl_seconds)["v"], "compute→cached"
+        finally:
+            flight.release()
+    inc_analytics_cache(key, "wait")
+    return recompute(key, producer, ttl_seconds, wait=True), "wait→cached"
+
+
+def get_with_source(key: str):
+    """Cached value (fresh or stale) and where it came from, without computing."""
+    env, src = _lookup(key)
+    if env is None:
+        return None, None
+    return env["v"], src if time.time() < env["soft"] else f"{src}-stale"
+
+
+def cached_at(key: str):
+    """Epoch seconds the cached value of `key` was computed, or None."""
+    env, _ = _lookup(key)
+    return env.get("t") if env is not None else None
 
 
+def set_with_source(key: str, data, ttl_seconds: int = 900):
+    set_cache(key, data, ttl_seconds)
+    return data, "L1+L2"
 
 
+def set_cache(key: str, data, ttl_seconds: int = 900, duration: float = 0.0):
+    _store(key, _envelope(data, ttl_seconds, duration))
+    return data
+
+
+def get_or_set(key: str, producer, ttl_seconds: int = 900):
+    """Same as get_or_set_with_source, without the source tag."""
+    return get_or_set_with_source(key, producer, ttl_seconds)[0]
@@ -0,0 +1,192 @@
+# analytics/facts.py
+"""
+Maintenance and reads of the analytics fact tables (analytics/models.py):
+
+  - HeadcountSnapshot: one aggregate query per day, written by the nightly job (and on demand
+    for today when the KPIs are computed before the job ran).
+  - LeaveDailyStat: moved by +1/-1 from the LeaveRequest signals (analytics/signals.py) in the
+    same transaction as the request; the nightly job rebuilds it with one GROUP BY to catch
+    queryset .update()/bulk_create() writes, which bypass signals.
+  - PayrollRunFact / PayrollComponentFact: refreshed per run when its status changes, and on
+    read when an open run's slips changed (slip count / last update); closed runs are frozen.
+  - Notification engagement comes from notifications.NotificationDailyStat (retention.py).
+
+The API reads only these tables (plus bounded live data: pending leave requests, one run's
+slip count), so its cost does not grow with the operational history.
+"""
+from __future__ import annotations
+
+import logging
+from collections import defaultdict
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+
+from employee.models import Employee
+from leave.models import LeaveRequest
+from payroll.models import Contract, Payslip, PayrollRun, PayslipItem
+
+from .models import HeadcountSnapshot, LeaveDailyStat, PayrollComponentFact, PayrollRunFact
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------- headcount ----------------
+
+def snapshot_headcount(day: date = None) -> int:
+    """(Re)write the snapshot of `day` (default today). Returns the total headcount."""
+    day = day or timezone.localdate()
+    rows = list(
+        Contract.objects.filter(start_date__lte=day).filter(Q(end_date__isnull=True) | Q(end_date__gte=day))
+        .values(dept=F("employee__department__name"), grd=F("employee__grade__code"), reg=F("employee__region"))
+        .annotate(n=Count("employee_id", distinct=True))
+    )
+    if not rows:
+        # no contracts recorded: same fallback as the KPI always had
+        rows = list(
+            Employee.objects.filter(status__iexact="actif")
+            .values(dept=F("department__name"), grd=F("grade__code"), reg=F("region"))
+            .annotate(n=Count("id"))
+        )
+    merged = defaultdict(int)
+    for r in rows:
+        merged[(r["dept"] or "", r["grd"] or "", r["reg"] or "")] += r["n"]
+    with transaction.atomic():
+        HeadcountSnapshot.objects.filter(day=day).delete()
+        HeadcountSnapshot.objects.bulk_create([
+            HeadcountSnapshot(day=day, department=d, grade=g, region=r, headcount=n)
+            for (d, g, r), n in merged.items()
+        ])
+    return sum(merged.values())
+
+
+def headcount_on(day: date = None) -> int:
+    """Total headcount of `day` from its snapshot, taking the snapshot if missing."""
+    day = day or timezone.localdate()
+    total = HeadcountSnapshot.objects.filter(day=day).aggregate(n=Sum("headcount"))["n"]
+    if total is None:
+        total = snapshot_headcount(day)
+    return total
+
+
+# ---------------- leave ----------------
+
+def leave_key(instance):
+    """(start day, leave type id, status) of a LeaveRequest, or None if a field is deferred."""
+    values = instance.__dict__
+    if any(f not in values for f in ("start_date", "leave_type_id", "status")):
+        return None
+    if values["start_date"] is None or values["leave_type_id"] is None:
+        return None
+    return (values["start_date"], values["leave_type_id"], values["status"])
+
+
+def _bump(key, delta: int) -> None:
+    day, leave_type_id, status = key
+    LeaveDailyStat.objects.bulk_create(
+        [LeaveDailyStat(day=day, leave_type_id=leave_type_id, status=status, count=0)], ignore_conflicts=True,
+    )
+    LeaveDailyStat.objects.filter(day=day, leave_type_id=leave_type_id, status=status)\
+        .update(count=F("count") + delta)
+
+
+def move_leave(old, new) -> None:
+    """Move one request from fact cell `old` to `new` (either may be None)."""
+    if old == new:
+        return
+    if old is not None:
+        _bump(old, -1)
+    if new is not None:
+        _bump(new, +1)
+
+
+def rebuild_leave_facts() -> int:
+    """Recount LeaveDailyStat from LeaveRequest (one GROUP BY). Returns the number of cells."""
+    rows = (LeaveRequest.objects.values("start_date", "leave_type_id", "status")
+            .annotate(n=Count("id")).order_by())
+    cells = [LeaveDailyStat(day=r["start_date"], leave_type_id=r["leave_type_id"], status=r["status"], count=r["n"])
+             for r in rows]
+    with transaction.atomic():
+        LeaveDailyStat.objects.all().delete()
+        LeaveDailyStat.objects.bulk_create(cells, batch_size=1000)
+    return len(cells)
+
+
+def leave_status_counts() -> dict:
+    return {s: n for s, n in LeaveDailyStat.objects.values("status").annotate(n=Sum("count"))
+            .values_list("status", "n") if n}
+
+
+def leave_counts_by_month(start: date, end: date) -> dict:
+    """{"YYYY-MM": requests starting in [start, end]}, months without requests left out."""
+    counts = defaultdict(int)
+    for day, n in LeaveDailyStat.objects.filter(day__gte=start, day__lte=end).values_list("day", "count"):
+        counts[f"{day.year}-{day.month:02d}"] += n
+    return {k: v for k, v in counts.items() if v}
+
+
+# ---------------- payroll ----------------
+
+def _slip_state(run_id) -> tuple:
+    agg = Payslip.objects.filter(run_id=run_id).aggregate(n=Count("id"), last=Max("updated_at"))
+    return agg["n"] or 0, agg["last"]
+
+
+def refresh_payroll_run(run_id) -> PayrollRunFact:
+    """Recompute the run's totals and component totals (two aggregate queries)."""
+    slips = Payslip.objects.filter(run_id=run_id).aggregate(
+        n=Count("id"), last=Max("updated_at"), gross=Sum("gross_pay"), net=Sum("net_pay"),
+    )
+    items = (PayslipItem.objects.filter(payslip__run_id=run_id)
+             .values("component_id", code=F("component__code"), name=F("component__name"), kind=F("component__kind"))
+             .annotate(total=Sum("amount"), lines=Count("id")).order_by())
+    with transaction.atomic():
+        fact, _ = PayrollRunFact.objects.update_or_create(run_id=run_id, defaults={
+            "slips": slips["n"] or 0, "last_slip_at": slips["last"],
+            "gross_total": slips["gross"] or 0, "net_total": slips["net"] or 0,
+        })
+        PayrollComponentFact.objects.filter(run_id=run_id).delete()
+        PayrollComponentFact.objects.bulk_create([
+            PayrollComponentFact(run_id=run_id, component_id=i["component_id"], code=i["code"], name=i["name"] or "",
+                                 kind=i["kind"] or "", lines=i["lines"], total=i["total"] or 0)
+            for i in items
+        ])
+    return fact
+
+
+def payroll_run_fact(run: PayrollRun) -> PayrollRunFact:
+    """The run's fact row, refreshed first if missing or (open runs) out of date."""
+    fact = PayrollRunFact.objects.filter(run=run).first()
+    if fact is None:
+        return refresh_payroll_run(run.id)
+    if run.status != PayrollRun.CLOSED and _slip_state(run.id) != (fact.slips, fact.last_slip_at):
+        return refresh_payroll_run(run.id)
+    return fact
+
+
+def refresh_open_payroll_runs() -> int:
+    """Nightly: refresh every run that is not closed or has no fact row yet."""
+    runs = PayrollRun.objects.filter(Q(fact__isnull=True) | ~Q(status=PayrollRun.CLOSED)).values_list("id", flat=True)
+    n = 0
+    for run_id in runs:
+        refresh_payroll_run(run_id)
+        n += 1
+    return n
+
+
+# ---------------- nightly ----------------
+
+def refresh_all(day: date = None) -> dict:
+    """Nightly delta job: today's headcount snapshot, leave recount, open payroll runs."""
+    out = {}
+    for name, fn in (("headcount", lambda: snapshot_headcount(day)),
+                     ("leave_cells", rebuild_leave_facts),
+                     ("payroll_runs", refresh_open_payroll_runs)):
+        try:
+            out[name] = fn()
+        except Exception as e:
+            logger.warning("Analytics fact refresh %s failed: %s", name, e)
+            out[name] = None
+    return out
@@ -0,0 +1,205 @@
+# analytics/invalidation.py
+"""
+Dependency-tracked invalidation of the cached analytics datasets.
+
+DATASETS declares, per cache key, its producer, TTL and the models it reads. Saving or
+deleting one of those models bumps the key's counter in the Redis hash "analytics:dirty"
+once the transaction commits (signals connected by connect_signals(), from apps.ready).
+refresh_analytics_caches (beat, every 15 seconds) recomputes only the dirty keys and
+clears a counter only if it did not move meanwhile, so a change that lands during the
+recompute keeps the key dirty. Parameterised variants ("analytics:headcount:<months>")
+are dropped and recomputed on their next read.
+
+Writes that bypass signals (queryset .update(), bulk_create) are covered by the TTLs and
+the stale-while-revalidate read path (analytics/cache.py). With Redis down the beat falls
+back to refreshing the keys that are stale or missing.
+
+Notifications are not a model dependency: they are saved several times per message, and a
+Redis write per save would land on the delivery hot path. The datasets depend on
+NotificationDailyStat instead, marked once per batch through notifications.signals.stats_changed
+(rollups, webhook batches); today's raw counts are picked up by the TTLs.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from typing import NamedTuple
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from .cache import cached_at, get_with_source, recompute
+from .models import AnalyticsCache
+from .services import (
+    compute_attrition_top,
+    compute_headcount_series,
+    compute_kpis,
+    compute_leave_series,
+    compute_leave_sla,
+    compute_payroll_components,
+)
+
+logger = logging.getLogger(__name__)
+
+DIRTY_KEY = "analytics:dirty"
+
+TTL_SHORT = 5 * 60     # 5 min
+TTL_MED   = 15 * 60    # 15 min
+TTL_LONG  = 60 * 60    # 1 hour
+
+# HDEL the field only if nobody bumped it since we read it
+CLEAR_IF_UNCHANGED_LUA = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+class Dataset(NamedTuple):
+    producer: object
+    ttl: int
+    models: tuple
+    min_age: int = 0    # seconds: don't recompute more often than this, however busy the writes
+
+
+DATASETS = {
+    "analytics:kpis": Dataset(compute_kpis, TTL_SHORT, (
+        "payroll.Contract", "employee.Employee", "payroll.PayrollRun",
+        "leave.LeaveRequest", "notifications.NotificationDailyStat",
+    ), min_age=60),
+    "analytics:headcount": Dataset(compute_headcount_series, TTL_LONG, ("payroll.Contract", "employee.Employee")),
+    "analytics:leave_series": Dataset(compute_leave_series, TTL_LONG, ("leave.LeaveRequest",)),
+    "analytics:leave_sla": Dataset(compute_leave_sla, TTL_MED, ("leave.LeaveRequest",)),
+    "analytics:payroll_components": Dataset(compute_payroll_components, TTL_MED, (
+        "payroll.PayrollRun", "payroll.Payslip",
+    )),
+    "analytics:attrition_top": Dataset(compute_attrition_top, TTL_MED, (
+        "employee.Employee", "leave.LeaveRequest", "notifications.NotificationDailyStat", "attendance.AttendanceRecord",
+    ), min_age=300),
+}
+
+
+def _redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection("default")
+
+
+def keys_for(model) -> list:
+    label = model._meta.label
+    return [key for key, ds in DATASETS.items() if label in ds.models]
+
+
+# ---------------- marking ----------------
+
+def _flush(keys) -> None:
+    try:
+        pipe = _redis().pipeline(transaction=False)
+        for key in keys:
+            pipe.hincrby(DIRTY_KEY, key, 1)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("Could not mark analytics keys dirty %s: %s", sorted(keys), e)
+
+
+def mark_dirty(keys) -> None:
+    """Mark these dataset keys dirty once the current transaction commits."""
+    keys = set(keys)
+    if keys:
+        transaction.on_commit(lambda: _flush(keys))
+
+
+def _model_changed(sender, instance=None, raw=False, **kwargs):
+    if raw:  # loaddata
+        return
+    mark_dirty(keys_for(sender))
+
+
+def _notification_stats_changed(sender, **kwargs):
+    # sent after commit already: flush now
+    keys = set(keys_for(apps.get_model("notifications.NotificationDailyStat")))
+    if keys:
+        _flush(keys)
+
+
+def connect_signals() -> None:
+    from notifications.signals import stats_changed
+
+    labels = {label for ds in DATASETS.values() for label in ds.models}
+    for label in labels:
+        model = apps.get_model(label)
+        post_save.connect(_model_changed, sender=model, dispatch_uid=f"analytics-dirty-save-{label}")
+        post_delete.connect(_model_changed, sender=model, dispatch_uid=f"analytics-dirty-delete-{label}")
+    stats_changed.connect(_notification_stats_changed, dispatch_uid="analytics-dirty-notification-stats")
+
+
+# ---------------- refreshing ----------------
+
+def dirty_keys() -> dict:
+    """{key: version} of the dirty keys. Raises when Redis is unavailable."""
+    return {k.decode() if isinstance(k, bytes) else k: int(v) for k, v in _redis().hgetall(DIRTY_KEY).items()}
+
+
+def _clear(key: str, version: int) -> None:
+    try:
+        _redis().eval(CLEAR_IF_UNCHANGED_LUA, 1, DIRTY_KEY, key, version)
+    except Exception as e:
+        logger.warning("Could not clear dirty analytics key %s: %s", key, e)
+
+
+def drop_variants(key: str) -> int:
+    """Forget "<key>:<params>" entries (L1 + L2); their next read recomputes them."""
+    variants = list(AnalyticsCache.objects.filter(key__startswith=f"{key}:").values_list("key", flat=True))
+    if not variants:
+        return 0
+    AnalyticsCache.objects.filter(key__in=variants).delete()
+    try:
+        cache.delete_many(variants)
+    except Exception as e:
+        logger.warning("Could not drop analytics variants of %s: %s", key, e)
+    return len(variants)
+
+
+def refresh_expiring() -> list:
+    """Fallback without the dirty set: recompute keys that are stale or missing."""
+    done = []
+    for key, ds in DATASETS.items():
+        value, src = get_with_source(key)
+        if value is None or src.endswith("-stale"):
+            if recompute(key, ds.producer, ds.ttl, wait=False) is not None:
+                done.append(key)
+    return done
+
+
+def refresh_dirty() -> dict:
+    """Recompute the dirty keys. Returns {"recomputed": [...], "deferred": [...]}."""
+    try:
+        dirty = dirty_keys()
+    except Exception as e:
+        logger.warning("Analytics dirty set unavailable, refreshing expiring keys: %s", e)
+        return {"recomputed": refresh_expiring(), "deferred": [], "fallback": True}
+
+    recomputed, deferred = [], []
+    for key, version in dirty.items():
+        ds = DATASETS.get(key)
+        if ds is None:
+            _clear(key, version)
+            continue
+        computed = cached_at(key)
+        if ds.min_age and computed and time.time() - computed < ds.min_age:
+            deferred.append(key)     # stays dirty: next tick
+            continue
+        try:
+            if recompute(key, ds.producer, ds.ttl, wait=False) is None:
+                deferred.append(key)  # being computed elsewhere, maybe from pre-change data
+                continue
+        except Exception as e:
+            logger.warning("Analytics recompute of %s failed: %s", key, e)
+            deferred.append(key)
+            continue
+        drop_variants(key)
+        _clear(key, version)
+        recomputed.append(key)
+    return {"recomputed": recomputed, "deferred": deferred}
@@ -0,0 +1,37 @@
+# analytics/management/commands/refresh_analytics_facts.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from analytics.facts import refresh_all, refresh_payroll_run, snapshot_headcount
+from payroll.models import PayrollRun
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the analytics fact tables now (what the nightly job does). "
+            "--all-runs also refreshes closed payroll runs; --since backfills daily headcount snapshots.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all-runs", action="store_true")
+        parser.add_argument("--since", help="YYYY-MM-DD: take a headcount snapshot for every day since.")
+
+    def handle(self, *args, **opts):
+        self.stdout.write(str(refresh_all()))
+        if opts["all_runs"]:
+            closed = PayrollRun.objects.filter(status=PayrollRun.CLOSED).values_list("id", flat=True)
+            for run_id in closed:
+                refresh_payroll_run(run_id)
+            self.stdout.write(f"closed runs refreshed: {len(closed)}")
+        if opts["since"]:
+            day, today = parse_date(opts["since"]), timezone.localdate()
+            if day is None:
+                raise CommandError("--since expects YYYY-MM-DD.")
+            n = 0
+            while day < today:
+                snapshot_headcount(day)
+                day += timedelta(days=1)
+                n += 1
+            self.stdout.write(f"headcount snapshots backfilled: {n} days")
+        self.stdout.write(self.style.SUCCESS("Analytics facts refreshed."))
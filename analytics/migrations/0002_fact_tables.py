@@ -0,0 +1,89 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_leave_stats(apps, schema_editor):
+    # signals only move counts from here on, so start from the current totals
+    LeaveRequest = apps.get_model("leave", "LeaveRequest")
+    LeaveDailyStat = apps.get_model("analytics", "LeaveDailyStat")
+    rows = (LeaveRequest.objects.values("start_date", "leave_type_id", "status")
+            .annotate(n=models.Count("id")).order_by())
+    LeaveDailyStat.objects.bulk_create([
+        LeaveDailyStat(day=r["start_date"], leave_type_id=r["leave_type_id"], status=r["status"], count=r["n"])
+        for r in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_initial'),
+        ('leave', '0006_leaverequest_leave_leave_start_d_76f11f_idx_and_more'),
+        ('payroll', '0012_payslip_pdf_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeadcountSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('department', models.CharField(blank=True, max_length=100)),
+                ('grade', models.CharField(blank=True, max_length=10)),
+                ('region', models.CharField(blank=True, max_length=50)),
+                ('headcount', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-day', 'department', 'grade', 'region'],
+                'indexes': [models.Index(fields=['day'], name='analytics_h_day_ca2324_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'department', 'grade', 'region'), name='uniq_headcount_snapshot')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PayrollRunFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slips', models.PositiveIntegerField(default=0)),
+                ('last_slip_at', models.DateTimeField(blank=True, null=True)),
+                ('gross_total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('net_total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+                ('run', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fact', to='payroll.payrollrun')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LeaveDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('leave_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='leave.leavetype')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'indexes': [models.Index(fields=['status'], name='analytics_l_status_32c888_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'leave_type', 'status'), name='uniq_leave_daily_stat')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PayrollComponentFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=32)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('kind', models.CharField(blank=True, max_length=16)),
+                ('lines', models.PositiveIntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('component', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='payroll.payrollcomponent')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='component_facts', to='payroll.payrollrun')),
+            ],
+            options={
+                'ordering': ['code'],
+                'constraints': [models.UniqueConstraint(fields=('run', 'component'), name='uniq_payroll_component_fact')],
+            },
+        ),
+        migrations.RunPython(backfill_leave_stats, migrations.RunPython.noop),
+    ]
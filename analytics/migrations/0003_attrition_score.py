@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_fact_tables'),
+        ('employee', '0005_alter_department_options_alter_grade_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttritionScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('region', models.CharField(blank=True, max_length=50)),
+                ('score', models.FloatField()),
+                ('tenure_months', models.PositiveIntegerField(default=0)),
+                ('leave6m', models.PositiveIntegerField(default=0)),
+                ('unread', models.PositiveIntegerField(default=0)),
+                ('absence_rate', models.FloatField(default=0.0)),
+                ('department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='employee.department')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='employee.employee')),
+            ],
+            options={
+                'ordering': ['-day', '-score'],
+                'indexes': [models.Index(fields=['day', '-score'], name='analytics_a_day_f1b723_idx'), models.Index(fields=['day', 'department', '-score'], name='analytics_a_day_84b8c2_idx'), models.Index(fields=['day', 'region', '-score'], name='analytics_a_day_533a85_idx'), models.Index(fields=['employee', 'day'], name='analytics_a_employe_3a3c25_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'employee'), name='uniq_attrition_score')],
+            },
+        ),
+    ]
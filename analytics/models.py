@@ -16,9 +16,87 @@ class AnalyticsCache(models.Model):
         return self.valid_until and self.valid_until > timezone.now()
 
 
+# NEW: fact tables (star schema) read by the analytics API, maintained by analytics/facts.py
 
+class HeadcountSnapshot(models.Model):
+    """Distinct employees under contract on `day`, per (department, grade, region)."""
+    day = models.DateField()
+    department = models.CharField(max_length=100, blank=True)
+    grade = models.CharField(max_length=10, blank=True)
+    region = models.CharField(max_length=50, blank=True)
+    headcount = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "department", "grade", "region"], name="uniq_headcount_snapshot"),
+        ]
+        indexes = [models.Index(fields=["day"])]
+        ordering = ["-day", "department", "grade", "region"]
+
+
+class LeaveDailyStat(models.Model):
+    """Leave requests per start day, type and status (kept in step by analytics.signals)."""
+    day = models.DateField()
+    leave_type = models.ForeignKey("leave.LeaveType", on_delete=models.CASCADE, related_name="+")
+    status = models.CharField(max_length=20)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "leave_type", "status"], name="uniq_leave_daily_stat"),
+        ]
+        indexes = [models.Index(fields=["status"])]
+        ordering = ["-day"]
 
 
+class PayrollRunFact(models.Model):
+    """Per-run totals; slips / last_slip_at tell whether an open run changed since the refresh."""
+    run = models.OneToOneField("payroll.PayrollRun", on_delete=models.CASCADE, related_name="fact")
+    slips = models.PositiveIntegerField(default=0)
+    last_slip_at = models.DateTimeField(null=True, blank=True)
+    gross_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    net_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    refreshed_at = models.DateTimeField(auto_now=True)
 
 
+class PayrollComponentFact(models.Model):
+    """Per-run, per-component totals of the payslip lines."""
+    run = models.ForeignKey("payroll.PayrollRun", on_delete=models.CASCADE, related_name="component_facts")
+    component = models.ForeignKey("payroll.PayrollComponent", on_delete=models.CASCADE, related_name="+")
+    code = models.CharField(max_length=32)
+    name = models.CharField(max_length=100, blank=True)
+    kind = models.CharField(max_length=16, blank=True)
+    lines = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["run", "component"], name="uniq_payroll_component_fact"),
+        ]
+        ordering = ["code"]
+
+
+class AttritionScore(models.Model):
+    """Attrition-risk score of an employee on a day (analytics/attrition.py), kept for trending."""
+    day = models.DateField()
+    employee = models.ForeignKey("employee.Employee", on_delete=models.CASCADE, related_name="+")
+    department = models.ForeignKey("employee.Department", on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name="+")
+    region = models.CharField(max_length=50, blank=True)
+    score = models.FloatField()
+    tenure_months = models.PositiveIntegerField(default=0)
+    leave6m = models.PositiveIntegerField(default=0)
+    unread = models.PositiveIntegerField(default=0)
+    absence_rate = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "employee"], name="uniq_attrition_score"),
+        ]
+        indexes = [
+            models.Index(fields=["day", "-score"]),          # top-K of a day
+            models.Index(fields=["day", "department", "-score"]),
+            models.Index(fields=["day", "region", "-score"]),
+            models.Index(fields=["employee", "day"]),        # trend of one employee
+        ]
+        ordering = ["-day", "-score"]
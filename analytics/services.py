@@ -3,13 +3,15 @@
 from collections import defaultdict
 from calendar import monthrange
 from datetime import date, datetime, timedelta
-from django.db.models import Sum, Count, Q, F
+from django.db.models import Q
 from django.utils import timezone
 
 from employee.models import Employee
 from leave.models import LeaveRequest
-from payroll.models import Payslip, PayrollRun, PayslipItem, Contract
-from notifications.models import Notification
+from payroll.models import PayrollRun, Contract
+from notifications.retention import engagement_by_channel
+from . import attrition
+from .facts import headcount_on, leave_counts_by_month, leave_status_counts, payroll_run_fact
 
 # --- small helpers ---
 def _month_key(dt): return f"{dt.year}-{dt.month:02d}"
@@ -22,12 +24,7 @@ def _add_month(d, k=1):
 # --- computations used by API + Celery ---
 def compute_kpis():
     today = timezone.localdate()
-    active_headcount = Contract.objects.filter(
-        start_date__lte=today
-    ).filter(Q(end_date__isnull=True) | Q(end_date__gte=today))\
-     .values("employee_id").distinct().count()
-    if active_headcount == 0:
-        active_headcount = Employee.objects.filter(status__iexact="actif").count()
+    active_headcount = headcount_on(today)   # daily snapshot (fact table)
 
     twelve_months_ago = today - timedelta(days=365)
     exits = Contract.objects.filter(
@@ -37,37 +34,110 @@ def compute_kpis():
     run = PayrollRun.objects.order_by("-year", "-month").first()
     payroll_net = 0
     if run:
-        payroll_net = Payslip.objects.filter(run=run).aggregate(s=Sum("net_pay"))["s"] or 0
+        payroll_net = payroll_run_fact(run).net_total
 
-    since = timezone.now() - timedelta(days=30)
-    notif_qs = Notification.objects.filter(timestamp__gte=since)
-    sent = notif_qs.exclude(status__in=["failed"]).count()
-    read = notif_qs.filter(is_read=True).count()
+    # daily rollups (+ today's raw rows): unchanged by notification archival.
+    # today + the 29 previous days = the 30 days the rolling window used to cover
+    engagement = engagement_by_channel(29).values()
+    sent = sum(c["total"] - c["failed"] for c in engagement)
+    read = sum(c["read"] for c in engagement)
     read_rate = (read / sent * 100.0) if sent else 0.0
 
     return {
         "headcount": active_headcount,
         "turnover_12m": exits,
         "payroll_latest_total": float(payroll_net),
-        "leave_pending": LeaveRequest.objects.filter(status="pending").count(),
+        "leave_pending": leave_status_counts().get("pending", 0),
         "read_rate_30d": round(read_rate, 1),
     }
 
+HEADCOUNT_DIMENSIONS = {
+    "department": "employee__department__name",
+    "grade": "employee__grade__code",
+    "region": "employee__region",
+}
+
+def _month_index(d, origin):
+    return (d.year - origin.year) * 12 + d.month - origin.month
+
+def _sweep(intervals, n):
+    """Per-month counts from {owner: [(first, last), ...]} month-index intervals; an owner with
+    overlapping intervals counts once per month. Difference array: O(intervals + n)."""
+    diff = [0] * (n + 1)
+    for spans in intervals.values():
+        spans.sort()
+        cur_a, cur_b = spans[0]
+        for a, b in spans[1:]:
+            if a <= cur_b + 1:
+                cur_b = max(cur_b, b)
+                continue
+            diff[cur_a] += 1; diff[cur_b + 1] -= 1
+            cur_a, cur_b = a, b
+        diff[cur_a] += 1; diff[cur_b + 1] -= 1
+    out, running = [], 0
+    for k in range(n):
+        running += diff[k]
+        out.append(running)
+    return out
+
+def _headcount_sweep(rows, n):
+    """rows: (employee_id, first, last, {dimension: label}) -> (totals, {dimension: {label: counts}})."""
+    spans = defaultdict(list)
+    labels = {}
+    for emp, a, b, dims in rows:
+        spans[emp].append((a, b))
+        labels[emp] = dims
+    totals = _sweep(spans, n)
+    breakdowns = {}
+    for dim in HEADCOUNT_DIMENSIONS:
+        groups = defaultdict(dict)
+        for emp, s in spans.items():
+            groups[labels[emp][dim] or "—"][emp] = s
+        breakdowns[dim] = {label: _sweep(g, n) for label, g in groups.items()}
+    return totals, breakdowns
+
 def compute_headcount_series(months_back=18):
+    """
+    Distinct employees under contract per month (any overlap with the month), with department /
+    grade / region breakdowns (current assignment). One contract query for any months_back,
+    swept with difference arrays; months without contracts fall back to active employees who
+    joined by month end (one more query, only when needed).
+    """
     today = timezone.localdate()
+    months_back = max(0, int(months_back))
     start = _add_month(date(today.year, today.month, 1), -months_back)
     end = date(today.year, today.month, 1)
-    series = []
-    cur = start
-    while cur <= end:
-        month_end = date(cur.year, cur.month, monthrange(cur.year, cur.month)[1])
-        c = Contract.objects.filter(start_date__lte=month_end)\
-            .filter(Q(end_date__isnull=True) | Q(end_date__gte=date(cur.year, cur.month, 1)))\
-            .values("employee_id").distinct().count()
-        if c == 0:
-            c = Employee.objects.filter(date_joined__lte=month_end, status__iexact="actif").count()
-        series.append({"month": _month_key(cur), "value": c})
-        cur = _add_month(cur, 1)
+    n = months_back + 1
+    last_day = date(end.year, end.month, monthrange(end.year, end.month)[1])
+    dim_fields = list(HEADCOUNT_DIMENSIONS.values())
+
+    rows = []
+    for emp, s, e, *dims in Contract.objects.filter(start_date__lte=last_day)\
+            .filter(Q(end_date__isnull=True) | Q(end_date__gte=start))\
+            .values_list("employee_id", "start_date", "end_date", *dim_fields):
+        a = max(0, _month_index(s, start))
+        b = n - 1 if e is None else min(n - 1, _month_index(e, start))
+        if a <= b:
+            rows.append((emp, a, b, dict(zip(HEADCOUNT_DIMENSIONS, dims))))
+    totals, breakdowns = _headcount_sweep(rows, n)
+
+    if 0 in totals:
+        fallback = []
+        for emp, joined, *dims in Employee.objects.filter(date_joined__lte=last_day, status__iexact="actif")\
+                .values_list("id", "date_joined", *[f.replace("employee__", "", 1) for f in dim_fields]):
+            fallback.append((emp, max(0, _month_index(joined, start)), n - 1, dict(zip(HEADCOUNT_DIMENSIONS, dims))))
+        fb_totals, fb_breakdowns = _headcount_sweep(fallback, n)
+        empty = [k for k, v in enumerate(totals) if v == 0]
+        for k in empty:
+            totals[k] = fb_totals[k]
+        for dim, groups in fb_breakdowns.items():
+            for label, counts in groups.items():
+                target = breakdowns[dim].setdefault(label, [0] * n)
+                for k in empty:
+                    target[k] = counts[k]
+
+    months = [_month_key(_add_month(start, k)) for k in range(n)]
+    series = [{"month": m, "value": v} for m, v in zip(months, totals)]
 
     # naive forecast 6m
     values = [x["value"] for x in series]
@@ -78,17 +148,21 @@ def compute_headcount_series(months_back=18):
         last = _add_month(last, 1)
         values.append(f)
         fc.append({"month": _month_key(last), "value": round(f, 2)})
-    return {"history": series, "forecast": fc}
+    return {
+        "history": series,
+        "forecast": fc,
+        "breakdowns": {
+            dim: [{"label": label, "history": counts} for label, counts in sorted(groups.items())
+                  if any(counts)]
+            for dim, groups in breakdowns.items()
+        },
+    }
 
 def compute_leave_series(months_back=18):
     today = timezone.localdate()
     start = _add_month(date(today.year, today.month, 1), -months_back)
     end = date(today.year, today.month, 1)
-    counts = defaultdict(int)
-    for lr in LeaveRequest.objects.filter(start_date__gte=start, start_date__lte=end)\
-                                  .values("start_date"):
-        k = f"{lr['start_date'].year}-{lr['start_date'].month:02d}"
-        counts[k] += 1
+    counts = leave_counts_by_month(start, end)   # LeaveDailyStat
     history = [{"month": k, "value": counts[k]} for k in sorted(counts.keys())]
     # naive forecast 6m
     vals = [x["value"] for x in history] or [0]
@@ -130,9 +204,7 @@ def compute_leave_sla():
         elif d <= 20: buckets["11-20"] += 1
         else: buckets["21+"] += 1
 
-    # FIX: use values().annotate(...) then values_list with both fields
-    qs = LeaveRequest.objects.values("status").annotate(n=Count("id"))
-    status_counts = dict(qs.values_list("status", "n"))
+    status_counts = leave_status_counts()   # LeaveDailyStat; aging above only reads pending requests
 
     med = sorted(aging)[len(aging)//2] if aging else 0
     return {"pending_age_buckets": buckets, "status_counts": status_counts, "pending_median_age": med}
@@ -141,49 +213,16 @@ def compute_payroll_components():
     run = PayrollRun.objects.order_by("-status", "-year", "-month").first()
     if not run:
         return {"run": None, "components": []}
-    items = (PayslipItem.objects
-             .filter(payslip__run=run)
-             .values(code=F("component__code"), name=F("component__name"), kind=F("component__kind"))
-             .annotate(total=Sum("amount")).order_by("code"))
+    payroll_run_fact(run)   # refreshes the component facts if the run changed
+    items = run.component_facts.order_by("code").values("code", "name", "kind", "total")
     return {
         "run": {"id": run.id, "year": run.year, "month": run.month, "status": run.status},
         "components": [{"code": i["code"], "name": i["name"], "kind": i["kind"], "total": float(i["total"] or 0)} for i in items],
     }
 
-def compute_attrition_top():
-    today = timezone.localdate()
-    six_months_ago = today - timedelta(days=180)
-    emps = Employee.objects.select_related("department", "grade")
-    leave_counts = dict(
-        LeaveRequest.objects.filter(start_date__gte=six_months_ago)
-        .values("employee_id").annotate(n=Count("id")).values_list("employee_id", "n")
-    )
-    unread_counts = dict(
-        Notification.objects.filter(is_read=False)
-        .values("user_id").annotate(n=Count("id")).values_list("user_id", "n")
-    )
-    max_leave = max(leave_counts.values()) if leave_counts else 1
-    max_unread = max(unread_counts.values()) if unread_counts else 1
-
-    out = []
-    for e in emps:
-        dj = e.date_joined or (today - timedelta(days=365))
-        tenure_m = max(1, (today.year - dj.year)*12 + today.month - dj.month)
-        f_tenure = 1 - min(tenure_m / 120.0, 1.0)
-        f_leave = (leave_counts.get(e.id, 0) / max_leave) if max_leave else 0.0
-        ucount = unread_counts.get(getattr(e, "user_id", None), 0)
-        f_unread = (ucount / max_unread) if max_unread else 0.0
-        risk = 0.45*f_tenure + 0.35*f_leave + 0.20*f_unread
-        out.append({
-            "employee": {
-                "id": str(e.id),
-                "first_name": e.first_name, "last_name": e.last_name,
-                "department": getattr(getattr(e, "department", None), "name", None),
-                "grade": getattr(getattr(e, "grade", None), "code", None),
-            },
-            "score": round(float(risk), 3),
-            "features": {"tenure_score": round(f_tenure,3), "leave6m": leave_counts.get(e.id, 0), "unread": ucount},
-        })
-    out.sort(key=lambda x: x["score"], reverse=True)
-    return {"top": out[:20], "generated_at": timezone.now().isoformat()}
-
+def compute_attrition_top(k=20):
+    # columnar scoring of the whole population (analytics/attrition.py); only the top k rows
+    # are sorted. Scoring only: the nightly score_attrition task persists the daily scores
+    batch = attrition.compute()
+    return {"top": [attrition.row(batch, i) for i in attrition.top_k(batch, k)],
+            "generated_at": timezone.now().isoformat()}
@@ -0,0 +1,71 @@
+# analytics/signals.py
+"""
+Keeps the analytics fact tables in step with writes (see analytics/facts.py):
+
+  - LeaveRequest save/delete moves one count between LeaveDailyStat cells, inside the same
+    transaction as the request. The cell an instance was loaded in is remembered at post_init.
+  - PayrollRun status changes (processed, closed, reopened) refresh the run's payroll facts
+    once the transaction commits.
+  - Contract / Employee changes drop today's HeadcountSnapshot; the next read retakes it.
+
+Cached datasets are marked dirty separately, from their declared models (analytics/invalidation.py).
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from employee.models import Employee
+from leave.models import LeaveRequest
+from payroll.models import Contract, PayrollRun
+
+from .facts import leave_key, move_leave, refresh_payroll_run
+from .models import HeadcountSnapshot
+
+
+@receiver(post_init, sender=LeaveRequest)
+def remember_leave_cell(sender, instance, **kwargs):
+    instance._fact_key = leave_key(instance) if instance.pk else None
+
+
+@receiver(pre_save, sender=LeaveRequest)
+def load_leave_cell(sender, instance, raw=False, **kwargs):
+    # loaded with .only()/.defer(): read the stored cell once
+    if raw or not instance.pk or getattr(instance, "_fact_key", None) is not None:
+        return
+    if not getattr(instance, "_state", None) or instance._state.adding:
+        return
+    old = LeaveRequest.objects.filter(pk=instance.pk).values_list("start_date", "leave_type_id", "status").first()
+    instance._fact_key = tuple(old) if old else None
+
+
+@receiver(post_save, sender=LeaveRequest)
+def leave_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new = leave_key(instance)
+    move_leave(None if created else getattr(instance, "_fact_key", None), new)
+    instance._fact_key = new
+
+
+@receiver(post_delete, sender=LeaveRequest)
+def leave_deleted(sender, instance, **kwargs):
+    move_leave(getattr(instance, "_fact_key", None) or leave_key(instance), None)
+
+
+@receiver(post_save, sender=PayrollRun)
+def payroll_run_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or created or (update_fields is not None and "status" not in update_fields):
+        return
+    run_id = instance.pk
+    transaction.on_commit(lambda: refresh_payroll_run(run_id))
+
+
+@receiver(post_save, sender=Contract)
+@receiver(post_delete, sender=Contract)
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def headcount_inputs_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(lambda: HeadcountSnapshot.objects.filter(day=timezone.localdate()).delete())
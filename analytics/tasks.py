@@ -1,13 +1,21 @@
 # analytics/tasks.py
+import logging
+
+from datetime import timedelta
+
 from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 from .cache import *
 from .services import *
+from . import attrition
+from .facts import refresh_all
+from .invalidation import refresh_dirty
+from notifications.retention import refresh_daily_rollups
 from config.monitoring.metrics import mark_beat_run
 
-TTL_SHORT = 5 * 60     # 5 min
-TTL_MED   = 15 * 60    # 15 min
-TTL_LONG  = 60 * 60    # 1 hour
+logger = logging.getLogger(__name__)
 
 @shared_task
 def refresh_analytics_caches():
@@ -15,19 +23,43 @@ def refresh_analytics_caches():
     # Mark task as run in monitoring
     mark_beat_run("analytics.tasks.refresh_analytics_caches")
     
-    # compute and cache; failures in one block don’t stop others
-    try: set_cache("analytics:kpis", compute_kpis(), TTL_SHORT)
-    except Exception: pass
-    try: set_cache("analytics:headcount", compute_headcount_series(), TTL_LONG)
-    except Exception: pass
-    try: set_cache("analytics:leave_series", compute_leave_series(), TTL_LONG)
-    except Exception: pass
-    try: set_cache("analytics:leave_sla", compute_leave_sla(), TTL_MED)
-    except Exception: pass
-    try: set_cache("analytics:payroll_components", compute_payroll_components(), TTL_MED)
-    except Exception: pass
-    try: set_cache("analytics:attrition_top", compute_attrition_top(), TTL_MED)
-    except Exception: pass
+    # yesterday's rollup keeps moving (late reads / delivery receipts): re-roll it every few minutes
+    # instead of leaving it frozen until the nightly run
+    rerolled = None
+    try:
+        due = cache.add("analytics:reroll_yesterday", 1, timeout=int(getattr(settings, "ANALYTICS_REROLL_SECONDS", 300)))
+    except Exception as e:
+        logger.warning("Re-roll throttle unavailable: %s", e)
+        due = True
+    if due:
+        yesterday = timezone.localdate() - timedelta(days=1)
+        rerolled = refresh_daily_rollups(start=yesterday, end=yesterday)
+
+    # only the datasets whose models changed since their last compute (see invalidation.py)
+    return {**refresh_dirty(), "rerolled": rerolled}
+
+
+@shared_task
+def refresh_analytics_facts():
+
+    # Mark task as run in monitoring
+    mark_beat_run("analytics.tasks.refresh_analytics_facts")
+
+    # nightly delta job: headcount snapshot, leave recount, open payroll runs
+    return refresh_all()
+
+
+@shared_task
+def score_attrition():
+
+    # Mark task as run in monitoring
+    mark_beat_run("analytics.tasks.score_attrition")
+
+    # one persisted score per employee and day, even when nothing changed (trending)
+    batch = attrition.compute()
+    written = attrition.persist(batch)
+    purged = attrition.purge()
+    return {"day": batch.day.isoformat(), "scored": written, "purged": purged}
 
 
 @shared_task
@@ -36,10 +68,13 @@ def spot_check_cache_integrity():
     # Mark task as run in monitoring
     mark_beat_run("analytics.tasks.spot_check_cache_integrity")
     
-    # recompute KPIs and compare to cached
+    # compare the cached KPIs with a recompute; nothing cached -> nothing to check,
+    # and the recompute goes through the key lock (never alongside a request's compute)
     key = "analytics:kpis"
-    cached, _ = get_or_set_with_source(key, compute_kpis, 300)
-    fresh = compute_kpis()
-    if cached != fresh:
-        # log / send alert; here we just refresh to self-heal
-        set_with_source(key, fresh, 300)
+    cached, _ = get_with_source(key)
+    if cached is None:
+        return
+    fresh = recompute(key, compute_kpis, 300, wait=False)
+    if fresh is not None and cached != fresh:
+        # log / send alert; recompute() already stored the fresh value (self-heal)
+        logger.warning("Analytics spot check: cached KPIs differed from a recompute")
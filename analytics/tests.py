@@ -1,3 +1,117 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from analytics import invalidation
+from analytics.attrition import AttritionBatch, top_k
+from analytics.services import _sweep, compute_kpis
+from analytics.tasks import refresh_analytics_caches
+from authentication.models import User
+from notifications.models import Notification, NotificationDailyStat
+from notifications.retention import day_bounds, refresh_daily_rollups
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class EngagementWindowTests(TestCase):
+    """read_rate_30d covers today and the 29 previous days; yesterday's rollup keeps moving."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="kpi_user", password="x")
+        self.today = timezone.localdate()
+
+    def _notification(self, days_ago, **fields):
+        n = Notification.objects.create(user=self.user, channel="SMS", message="x", status="sent", **fields)
+        Notification.objects.filter(id=n.id).update(timestamp=day_bounds(self.today - timedelta(days=days_ago))[0]
+                                                    + timedelta(hours=12))
+        return n
+
+    def test_read_rate_covers_thirty_days(self):
+        self._notification(29, is_read=True)
+        self._notification(30)                 # 31st day back: outside the window
+        self.assertEqual(compute_kpis()["read_rate_30d"], 100.0)
+
+    def test_refresh_rerolls_yesterday(self):
+        n = self._notification(1)
+        NotificationDailyStat.objects.create(day=self.today - timedelta(days=1), channel="SMS", category="",
+                                             total=1, read=0)
+        Notification.objects.filter(id=n.id).update(is_read=True)       # read after the nightly roll
+
+        with mock.patch("analytics.tasks.refresh_dirty", return_value={"recomputed": [], "deferred": []}):
+            out = refresh_analytics_caches()
+            again = refresh_analytics_caches()
+
+        self.assertEqual(out["rerolled"]["days"], 1)
+        self.assertIsNone(again["rerolled"])                              # throttled
+        stat = NotificationDailyStat.objects.get(day=self.today - timedelta(days=1), channel="SMS")
+        self.assertEqual(stat.read, 1)
+
+
+class NotificationInvalidationTests(TestCase):
+    """Notification saves stay off Redis; rollups mark the notification datasets once per batch."""
+
+    def test_notification_save_marks_nothing(self):
+        user = User.objects.create_user(username="inv_user", password="x")
+        with mock.patch.object(invalidation, "_flush") as flush, self.captureOnCommitCallbacks(execute=True):
+            n = Notification.objects.create(user=user, channel="SMS", message="x")
+            n.status = "sent"
+            n.save(update_fields=["status"])
+        flush.assert_not_called()
+
+    def test_rollup_marks_notification_datasets(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        with mock.patch.object(invalidation, "_flush") as flush, self.captureOnCommitCallbacks(execute=True):
+            refresh_daily_rollups(start=yesterday, end=yesterday)
+        flush.assert_called_once_with({"analytics:kpis", "analytics:attrition_top"})
+
+
+class HeadcountSweepTests(SimpleTestCase):
+    """_sweep counts an owner once per month however its intervals overlap or touch."""
+
+    def test_overlapping_and_adjacent_intervals_count_once(self):
+        intervals = {
+            "a": [(1, 4), (0, 2)],          # overlapping
+            "b": [(3, 3), (4, 5)],          # adjacent: merged
+            "c": [(6, 7), (1, 1)],          # disjoint, unsorted
+            "d": [(2, 2), (2, 2)],          # duplicated
+        }
+        expected = [sum(any(a <= m <= b for a, b in spans) for spans in intervals.values()) for m in range(8)]
+        self.assertEqual(_sweep(intervals, 8), expected)
+        self.assertEqual(expected, [1, 2, 2, 2, 2, 1, 1, 1])
+
+    def test_interval_reaching_last_month(self):
+        self.assertEqual(_sweep({"a": [(0, 2)], "b": [(2, 2)]}, 3), [1, 1, 2])
+
+
+class AttritionTopKTests(SimpleTestCase):
+    """top_k ranks by score desc then employee id, so pages never repeat or skip tied rows."""
+
+    def setUp(self):
+        ids = np.array(["f", "a", "e", "b", "c", "d"], dtype=object)
+        empty = np.zeros(len(ids), dtype=object)
+        ints = np.zeros(len(ids), dtype=np.int64)
+        self.batch = AttritionBatch(
+            day=date(2026, 1, 1), employee_ids=ids, first_names=empty, last_names=empty,
+            department_ids=empty, departments=empty, grades=empty, regions=empty,
+            tenure_months=ints, leave6m=ints, unread=ints, absence_rate=np.zeros(len(ids)),
+            scores=np.array([0.5, 0.9, 0.5, 0.5, 0.1, 0.9]),
+        )
+        self.ranking = [1, 5, 3, 2, 0, 4]      # 0.9: a, d; 0.5: b, e, f; 0.1: c
+
+    def _pages(self, size, mask=None):
+        return [int(i) for offset in range(0, len(self.batch), size) for i in top_k(self.batch, size, offset, mask)]
+
+    def test_ties_are_ordered_by_employee_id(self):
+        self.assertEqual(list(top_k(self.batch, len(self.batch))), self.ranking)
+
+    def test_pages_cut_through_ties(self):
+        for size in (1, 2, 4):
+            self.assertEqual(self._pages(size), self.ranking, size)
+        self.assertEqual(list(top_k(self.batch, 3, offset=6)), [])
+
+    def test_mask_keeps_ranking(self):
+        mask = np.ones(len(self.batch), dtype=bool)
+        mask[3] = False
+        self.assertEqual(self._pages(2, mask), [1, 5, 2, 0, 4])
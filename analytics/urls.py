@@ -11,6 +11,7 @@ urlpatterns = [
     path("analytics/leave_sla/", LeaveSLAView.as_view(), name="leave_sla"),
     path("analytics/payroll_components/", PayrollComponentsView.as_view(), name="payroll_components"),
     path("analytics/attrition_risk/", AttritionRiskView.as_view(), name="attrition_risk"),
+    path("analytics/attrition_risk/<uuid:employee_id>/history/", AttritionHistoryView.as_view(), name="attrition_history"),
     path("analytics/notification_engagement/", NotificationEngagementView.as_view(), name="notification_engagement"),
 ]
 
@@ -1,10 +1,12 @@
 # analytics/views.py
 from __future__ import annotations
+import time
 from datetime import date, timedelta
 from calendar import monthrange
 from collections import defaultdict
 
-from django.db.models import Sum, Count, Q, F
+from django.conf import settings
+from django.db.models import Sum, F
 from django.utils import timezone
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import TemplateView
@@ -15,9 +17,11 @@ from rest_framework.permissions import IsAuthenticated
 from employee.models import Employee
 from leave.models import LeaveRequest
 from payroll.models import Payslip, PayrollRun, PayslipItem, Contract
-from notifications.models import Notification
+from notifications.retention import engagement_by_channel, unread_by_role
 
-from .cache import get_or_set_with_source, set_with_source
+from . import attrition
+from .models import AttritionScore
+from .cache import cached_at, get_or_set_with_source, recompute
 from .services import (
     compute_kpis,
     compute_headcount_series,
@@ -42,12 +46,19 @@ class DashboardView(LoginRequiredMixin, TemplateView):
 
 # ---------- cache orchestration ----------
 
+def _can_force(user) -> bool:
+    role = (getattr(user, "role", "") or "").upper()
+    return role in ("HR", "ADMIN") or getattr(user, "is_superuser", False)
+
 def _maybe_fresh(request, key, fn, ttl_seconds: int):
+    # ?fresh=1: HR/admin only, and not when the value is younger than ANALYTICS_FRESH_MIN_AGE
+    # (changes already reach the cache within seconds through dirty-key invalidation)
     fresh = request.query_params.get("fresh", "").lower() in ("1", "true", "yes")
-    if fresh:
-        data = fn()  # L3 compute
-        set_with_source(key, data, ttl_seconds)
-        return data, "fresh-compute"
+    if fresh and _can_force(request.user):
+        computed = cached_at(key)
+        if computed is None or time.time() - computed >= getattr(settings, "ANALYTICS_FRESH_MIN_AGE", 30):
+            data = recompute(key, fn, ttl_seconds)  # L3 compute, once per key however many ask
+            return data, "fresh-compute"
     return get_or_set_with_source(key, fn, ttl_seconds)
 
 # ---------- APIs ----------
@@ -61,7 +72,13 @@ class KPIView(APIView):
 class HeadcountForecastView(APIView):
     permission_classes = [IsAuthenticated]
     def get(self, request):
-        data, src = _maybe_fresh(request, "analytics:headcount", compute_headcount_series, 3600)
+        # ?months=N (1..240): history depth; the query count does not grow with it
+        try:
+            months = max(1, min(240, int(request.query_params.get("months", 18))))
+        except ValueError:
+            months = 18
+        key = "analytics:headcount" if months == 18 else f"analytics:headcount:{months}"
+        data, src = _maybe_fresh(request, key, lambda: compute_headcount_series(months), 3600)
         resp = Response(data); resp["X-Analytics-Source"] = src; return resp
 
 class LeaveForecastView(APIView):
@@ -82,46 +99,107 @@ class PayrollComponentsView(APIView):
         data, src = _maybe_fresh(request, "analytics:payroll_components", compute_payroll_components, 900)
         resp = Response(data); resp["X-Analytics-Source"] = src; return resp
 
+def _int_param(request, name, default, lo, hi):
+    try:
+        return max(lo, min(hi, int(request.query_params.get(name, default))))
+    except ValueError:
+        return default
+
+def _score_row(s: AttritionScore) -> dict:
+    e = s.employee
+    return {
+        "employee": {
+            "id": str(e.id),
+            "first_name": e.first_name, "last_name": e.last_name,
+            "department": getattr(getattr(e, "department", None), "name", None),
+            "grade": getattr(getattr(e, "grade", None), "code", None),
+            "region": s.region or None,
+        },
+        "score": round(s.score, 3),
+        "features": {
+            "tenure_months": s.tenure_months, "leave6m": s.leave6m,
+            "unread": s.unread, "absence_rate": round(s.absence_rate, 3),
+        },
+    }
+
 class AttritionRiskView(APIView):
+    """
+    No parameters: cached top 20. With ?department=<id> / ?region=<code> / ?page / ?page_size:
+    a page of the latest persisted scores (analytics/attrition.py), ranked by score; empty
+    until the nightly score_attrition task has run once.
+    """
     permission_classes = [IsAuthenticated]
     def get(self, request):
-        data, src = _maybe_fresh(request, "analytics:attrition_top", compute_attrition_top, 900)
-        resp = Response(data); resp["X-Analytics-Source"] = src; return resp
+        params = request.query_params
+        if not any(p in params for p in ("department", "region", "page", "page_size")):
+            data, src = _maybe_fresh(request, "analytics:attrition_top", compute_attrition_top, 900)
+            resp = Response(data); resp["X-Analytics-Source"] = src; return resp
+
+        department = params.get("department")
+        if department:
+            try:
+                department = int(department)
+            except ValueError:
+                return Response({"detail": "Paramètre 'department' invalide (identifiant numérique attendu)."},
+                                status=400)
+        page = _int_param(request, "page", 1, 1, 10_000)
+        page_size = _int_param(request, "page_size", 20, 1, 200)
+
+        day = attrition.latest_day()
+        if day is None:
+            # nothing persisted before the first nightly score_attrition: don't score inside a GET
+            resp = Response({"day": None, "count": 0, "page": page, "page_size": page_size, "results": []})
+            resp["X-Analytics-Source"] = "none"
+            return resp
+        src = "persisted"
+        qs = AttritionScore.objects.filter(day=day)
+        if department:
+            qs = qs.filter(department_id=department)
+        if params.get("region"):
+            qs = qs.filter(region__iexact=params["region"])
+        start = (page - 1) * page_size
+        rows = (qs.select_related("employee__department", "employee__grade")
+                .order_by("-score", "employee_id")[start:start + page_size])
+        resp = Response({
+            "day": day.isoformat(), "count": qs.count(), "page": page, "page_size": page_size,
+            "results": [_score_row(s) for s in rows],
+        })
+        resp["X-Analytics-Source"] = src
+        return resp
+
+class AttritionHistoryView(APIView):
+    """Persisted daily scores of one employee (?days=, default 180)."""
+    permission_classes = [IsAuthenticated]
+    def get(self, request, employee_id):
+        days = _int_param(request, "days", 180, 1, 3660)
+        since = timezone.localdate() - timedelta(days=days)
+        rows = (AttritionScore.objects.filter(employee_id=employee_id, day__gte=since).order_by("day")
+                .values("day", "score", "tenure_months", "leave6m", "unread", "absence_rate"))
+        return Response({
+            "employee": str(employee_id),
+            "history": [{**r, "day": r["day"].isoformat(), "score": round(r["score"], 3),
+                         "absence_rate": round(r["absence_rate"], 3)} for r in rows],
+        })
 
 class NotificationEngagementView(APIView):
     permission_classes = [IsAuthenticated]
     def get(self, request):
-        since = timezone.now() - timedelta(days=90)
-        qs = Notification.objects.filter(timestamp__gte=since)
-
-        by_channel = (
-            qs.values("channel")
-              .annotate(
-                  sent=Count("id"),
-                  read=Count("id", filter=Q(is_read=True)),
-              )
-              .order_by("channel")
-        )
-
-        unread_dist = (
-            Notification.objects.filter(is_read=False)
-            .values("user__role")
-            .annotate(n=Count("id"))
-            .order_by()
-        )
+        # daily rollups + today's raw rows, and live + archived unread: same figures after archival
+        by_channel = engagement_by_channel(90)
+        unread_dist = unread_by_role()
 
         data = {
             "channels": [
                 {
-                    "channel": r["channel"],
-                    "sent": r["sent"],
-                    "read": int(r["read"] or 0),
-                    "read_rate": round((int(r["read"] or 0) / r["sent"] * 100.0), 1) if r["sent"] else 0.0,
+                    "channel": channel,
+                    "sent": c["total"],
+                    "read": c["read"],
+                    "read_rate": round((c["read"] / c["total"] * 100.0), 1) if c["total"] else 0.0,
                 }
-                for r in by_channel
+                for channel, c in by_channel.items()
             ],
             "unread_by_role": [
-                {"role": x["user__role"] or "UNKNOWN", "count": x["n"]} for x in unread_dist
+                {"role": role or "UNKNOWN", "count": n} for role, n in unread_dist.items()
             ],
         }
         resp = Response(data)
@@ -37,6 +37,7 @@ from .models import AttendanceRecord
 from employee.models import Employee
 from authentication.models import User
 from notifications.tasks import send_notification
+from leave.workcalendar import is_working_day, previous_working_day
 import logging
 
 logger = logging.getLogger(__name__)
@@ -99,18 +100,24 @@ def daily_attendance_reconciliation():
         absentees = Employee.objects.exclude(attendancerecord__date=today, attendancerecord__status='present').select_related('user', 'manager', 'manager__user')
 
         for emp in absentees:
+            # Weekends / holidays of the employee's region are not absences
+            if not is_working_day(today, emp.region):
+                continue
+
             # Create an absent record for today if not already present
             rec, created = AttendanceRecord.objects.get_or_create(employee=emp, date=today, defaults={'status': 'absent'})
             if not created and rec.status != 'absent':
                 rec.status = 'absent'
                 rec.save(update_fields=['status'])
 
-            # Check for 3+ consecutive days of absence
+            # Check for 3+ consecutive working days of absence
             recent_absences = AttendanceRecord.objects.filter(employee=emp, status='absent').order_by('-date')[:5]
             if len(recent_absences) >= 3:
-                # Check if the first 3 absences are consecutive, including today
+                # Check if the first 3 absences are consecutive working days, including today
                 dates = [r.date for r in recent_absences[:3]]
-                if dates[0] == today and (dates[0] - dates[1]).days == 1 and (dates[1] - dates[2]).days == 1:
+                if (dates[0] == today
+                        and dates[1] == previous_working_day(dates[0], emp.region)
+                        and dates[2] == previous_working_day(dates[1], emp.region)):
                     employee_name = f"{emp.first_name} {emp.last_name}"
                     message = f"Alerte: {employee_name} est absent(e) depuis 3 jours consécutifs (non justifié) jusqu'au {_fmt_d(today)}."
 
@@ -5,6 +5,8 @@ from rest_framework import status, permissions
 from drf_yasg.utils import swagger_auto_schema
 from .feedback_serializers import FeedbackCreateSerializer
 from .tasks import send_feedback_alert
+from django.db import transaction
+from notifications import outbox
 
 class SubmitFeedbackView(APIView):
     permission_classes = [permissions.IsAuthenticated]  # must be logged in
@@ -17,7 +19,8 @@ class SubmitFeedbackView(APIView):
         data.setdefault("user_agent", request.META.get("HTTP_USER_AGENT", "")[:255])
         s = FeedbackCreateSerializer(data=data)
         s.is_valid(raise_exception=True)
-        fb = s.save(user=request.user)
-        # fire-and-forget alert
-        send_feedback_alert.delay(fb.id)
+        with transaction.atomic():
+            fb = s.save(user=request.user)
+            # alert relayed through the outbox once the feedback is committed
+            outbox.enqueue(send_feedback_alert, fb.id)
         return Response({"ok": True, "id": fb.id}, status=status.HTTP_201_CREATED)
@@ -5,6 +5,11 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The notification stream (/api/v1/notifications/stream/) is a long-lived async view:
+docker-compose serves it from the "stream" service (uvicorn on this module) and nginx
+routes only that path there; the rest stays on gunicorn/WSGI, where the view answers
+204 and pages keep polling. NOTIFY_STREAM_ENABLED turns the EventSource on.
 """
 
 import os
@@ -43,11 +43,39 @@ celery_app.conf.beat_schedule = {
     },
     'daily-leave-reminder': {
         'task': 'leave.tasks.upcoming_leave_reminder',
-        'schedule': 24*3600,
+        'schedule': crontab(hour=6, minute=0),  # released at NOTIFY_DIGEST_TIME
     },
-    'analytics-refresh-5min': {
+    'release-scheduled-notifications': {
+        'task': 'notifications.tasks.release_scheduled_notifications',
+        'schedule': 60.0,  # every minute
+    },
+    'relay-outbox': {
+        'task': 'notifications.tasks.relay_outbox',
+        'schedule': 5.0,  # fallback when run_outbox_relay is not running
+    },
+    'apply-webhook-events': {
+        'task': 'notifications.tasks.apply_webhook_events',
+        'schedule': 30.0,  # safety net; bursts are drained right after they arrive
+    },
+    'rollup-notification-engagement': {
+        'task': 'notifications.tasks.rollup_notification_engagement',
+        'schedule': crontab(hour=0, minute=30),
+    },
+    'archive-old-notifications': {
+        'task': 'notifications.tasks.archive_old_notifications',
+        'schedule': crontab(hour=2, minute=15),  # after the rollup
+    },
+    'score-attrition': {
+        'task': 'analytics.tasks.score_attrition',
+        'schedule': crontab(hour=1, minute=0),  # after the fact tables
+    },
+    'refresh-analytics-facts': {
+        'task': 'analytics.tasks.refresh_analytics_facts',
+        'schedule': crontab(hour=0, minute=45),  # after the notification rollup
+    },
+    'analytics-refresh-dirty': {
         'task': 'analytics.tasks.refresh_analytics_caches',
-        'schedule': crontab(minute='*/5'),
+        'schedule': 15.0,  # recomputes only dirty keys: near-free when nothing changed
     },
     'spot-check-cache-integrity': {
         'task': 'analytics.tasks.spot_check_cache_integrity',
@@ -13,6 +13,7 @@ This module adds:
 - Auth signals (login/logout/login_failed)
 - Exception counts by exception class (complements django_prometheus)
 - Integration hooks (Twilio/WhatsApp/Cloudinary)
+- Notification throttling + Celery queue depth per priority band
 - Build info + readiness gauge
 - Optional sidecar /metrics server (disabled by default if using django_prometheus endpoint)
 
@@ -36,7 +37,8 @@ import time
 import socket
 from typing import Dict, Optional
 
-from prometheus_client import Counter, Histogram, Gauge, Info, start_http_server
+from prometheus_client import Counter, Histogram, Gauge, Info, start_http_server, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
 
 from django.conf import settings
 from django.dispatch import receiver
@@ -216,6 +218,93 @@ def inc_whatsapp(event: str) -> None:
 def inc_cloudinary(op: str) -> None:
     CLOUDINARY_OPS.labels(op=op, env=ENV, service=SERVICE).inc()
 
+# --- Notification queues (NEW) ------------------------------------------------
+NOTIFY_THROTTLED = Counter(
+    "hrmis_notifications_throttled_total", "Notification sends deferred by a provider token bucket",
+    ["provider", "env", "service"]
+)
+
+def inc_throttled(provider: Optional[str], n: int = 1) -> None:
+    NOTIFY_THROTTLED.labels(provider=provider or "none", env=ENV, service=SERVICE).inc(n)
+
+NOTIFY_WEBHOOK_EVENTS = Counter(
+    "hrmis_notification_webhook_events_total", "Provider status events by ingestion outcome",
+    ["outcome", "env", "service"]   # applied | stale | unmatched | ignored | duplicate
+)
+
+def inc_webhook_events(outcome: str, n: int = 1) -> None:
+    NOTIFY_WEBHOOK_EVENTS.labels(outcome=outcome, env=ENV, service=SERVICE).inc(n)
+
+# --- Analytics cache (NEW) ---------------------------------------------------
+ANALYTICS_CACHE_LOOKUPS = Counter(
+    "hrmis_analytics_cache_lookups_total", "Analytics cache lookups by outcome",
+    ["key", "result", "env", "service"]   # hit | stale | early | miss | wait
+)
+ANALYTICS_CACHE_COMPUTE = Histogram(
+    "hrmis_analytics_cache_compute_seconds", "Analytics value computation time",
+    ["key", "env", "service"], buckets=TASK_LATENCY_BUCKETS
+)
+
+def _analytics_key(key: str) -> str:
+    # "analytics:headcount:60" -> "analytics:headcount": bounded label cardinality
+    return ":".join(str(key).split(":")[:2])
+
+def inc_analytics_cache(key: str, result: str) -> None:
+    ANALYTICS_CACHE_LOOKUPS.labels(key=_analytics_key(key), result=result, env=ENV, service=SERVICE).inc()
+
+def observe_analytics_compute(key: str, seconds: float) -> None:
+    ANALYTICS_CACHE_COMPUTE.labels(key=_analytics_key(key), env=ENV, service=SERVICE).observe(seconds)
+
+# kombu's Redis transport keeps a list per queue plus one per priority step ("<queue>\x06\x16<step>")
+_KOMBU_PRIORITY_SEP = "\x06\x16"
+_KOMBU_PRIORITY_STEPS = (3, 6, 9)
+_broker_client = None
+
+def monitored_queues() -> list:
+    queues = ["celery"] + list((getattr(settings, "NOTIFY_PRIORITY_QUEUES", None) or {}).values())
+    return list(dict.fromkeys(queues))
+
+def queue_depths() -> Dict[str, int]:
+    """Messages waiting per Celery queue, read straight from the Redis broker (empty if not Redis)."""
+    global _broker_client
+    url = getattr(settings, "CELERY_BROKER_URL", "") or ""
+    if not url.startswith(("redis://", "rediss://")):
+        return {}
+    if _broker_client is None:
+        import redis
+        _broker_client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+    queues = monitored_queues()
+    pipe = _broker_client.pipeline(transaction=False)
+    for q in queues:
+        pipe.llen(q)
+        for step in _KOMBU_PRIORITY_STEPS:
+            pipe.llen(f"{q}{_KOMBU_PRIORITY_SEP}{step}")
+    sizes = pipe.execute()
+    per = 1 + len(_KOMBU_PRIORITY_STEPS)
+    return {q: int(sum(sizes[i * per:(i + 1) * per])) for i, q in enumerate(queues)}
+
+class QueueDepthCollector:
+    """Scrape-time gauge hrmis_celery_queue_depth{queue} (one pipelined LLEN round-trip)."""
+    def collect(self):
+        g = GaugeMetricFamily("hrmis_celery_queue_depth", "Messages waiting in a Celery queue",
+                              labels=["queue", "env", "service"])
+        try:
+            depths = queue_depths()
+        except Exception:
+            depths = {}
+        for q, depth in depths.items():
+            g.add_metric([q, ENV, SERVICE], depth)
+        yield g
+
+_QUEUE_COLLECTOR_REGISTERED = False
+
+def register_queue_depth_collector() -> None:
+    global _QUEUE_COLLECTOR_REGISTERED
+    if _QUEUE_COLLECTOR_REGISTERED:
+        return
+    REGISTRY.register(QueueDepthCollector())
+    _QUEUE_COLLECTOR_REGISTERED = True
+
 # --- Optional sidecar /metrics server -----------------------------------------
 _SERVER_STARTED = False
 
@@ -244,5 +333,6 @@ def setup_metrics() -> None:
     - Optionally starts sidecar /metrics server (when not using django_prometheus endpoint)
     """
     _connect_celery_signals()
+    register_queue_depth_collector()
     # Only starts a sidecar if explicitly requested
     start_metrics_http_server_if_needed()
@@ -323,11 +323,40 @@ CELERY_BEAT_SCHEDULE = {
     },
     'daily-leave-reminder': {
         'task': 'leave.tasks.upcoming_leave_reminder',
-        'schedule': 24*3600,
+        # 'schedule': 24*3600,
+        'schedule': crontab(hour=6, minute=0),  # computed before the digest slot, released at NOTIFY_DIGEST_TIME
     },
-    "analytics-refresh-5min": {
-        "task": "analytics.tasks.refresh_analytics_caches",
-        "schedule": crontab(minute="*/5"),
+    'release-scheduled-notifications': {
+        'task': 'notifications.tasks.release_scheduled_notifications',
+        'schedule': 60.0,  # every minute
+    },
+    'relay-outbox': {
+        'task': 'notifications.tasks.relay_outbox',
+        'schedule': 5.0,  # fallback when run_outbox_relay is not running
+    },
+    'apply-webhook-events': {
+        'task': 'notifications.tasks.apply_webhook_events',
+        'schedule': 30.0,  # safety net; bursts are drained right after they arrive
+    },
+    'rollup-notification-engagement': {
+        'task': 'notifications.tasks.rollup_notification_engagement',
+        'schedule': crontab(hour=0, minute=30),
+    },
+    'archive-old-notifications': {
+        'task': 'notifications.tasks.archive_old_notifications',
+        'schedule': crontab(hour=2, minute=15),  # after the rollup
+    },
+    'score-attrition': {
+        'task': 'analytics.tasks.score_attrition',
+        'schedule': crontab(hour=1, minute=0),  # after the fact tables
+    },
+    'refresh-analytics-facts': {
+        'task': 'analytics.tasks.refresh_analytics_facts',
+        'schedule': crontab(hour=0, minute=45),  # after the notification rollup
+    },
+    'analytics-refresh-dirty': {
+        'task': 'analytics.tasks.refresh_analytics_caches',
+        'schedule': 15.0,  # recomputes only dirty keys: near-free when nothing changed
     },
     'spot-check-cache-integrity': {
         'task': 'analytics.tasks.spot_check_cache_integrity',
@@ -405,6 +434,100 @@ WHATSAPP_PHONE_NUMBER_ID = config("WHATSAPP_PHONE_NUMBER_ID")
 WHATSAPP_WEBHOOK_VERIFY_TOKEN = config("WHATSAPP_WEBHOOK_VERIFY_TOKEN")
 NOTIFY_WHATSAPP_CALLBACK = config("NOTIFY_WHATSAPP_CALLBACK")
 
+# NEW: provider HTTP clients (pooled sessions + async batch sends); base URLs can point to a stub server
+WHATSAPP_API_BASE = config("WHATSAPP_API_BASE", default="https://graph.facebook.com")
+WHATSAPP_API_VERSION = config("WHATSAPP_API_VERSION", default="v23.0")
+TWILIO_API_BASE = config("TWILIO_API_BASE", default="https://api.twilio.com")
+NOTIFY_PROVIDER_POOL_SIZE = config("NOTIFY_PROVIDER_POOL_SIZE", default=20, cast=int)   # keep-alive connections per provider/process
+NOTIFY_PROVIDER_TIMEOUT = config("NOTIFY_PROVIDER_TIMEOUT", default=15, cast=int)
+NOTIFY_BATCH_CONCURRENCY = config("NOTIFY_BATCH_CONCURRENCY", default=50, cast=int)     # in-flight requests per batch
+NOTIFY_ASYNC_BATCH = config("NOTIFY_ASYNC_BATCH", default=True, cast=bool)
+NOTIFY_PROVIDER_RATES = {   # messages / second, per provider, shared by all workers (Redis token bucket)
+    "whatsapp_cloud": config("NOTIFY_RATE_WHATSAPP_CLOUD", default=80, cast=int),
+    "twilio": config("NOTIFY_RATE_TWILIO", default=100, cast=int),
+    "twilio_whatsapp": config("NOTIFY_RATE_TWILIO_WHATSAPP", default=80, cast=int),
+    "smtp": config("NOTIFY_RATE_SMTP", default=20, cast=int),
+}
+NOTIFY_PROVIDER_BURSTS = {}   # provider -> bucket capacity (defaults to one second of rate)
+NOTIFY_FALLBACK_MAX_WAIT = 2.0   # seconds a fallback send (Twilio WhatsApp) may wait for a token
+NOTIFY_SENDING_STALE_MINUTES = 10   # 'sending' rows older than this (crashed worker) are re-queued by the release beat
+
+# NEW: notification priority bands -> Celery queues (1-2 high, 3 default, 4-5 bulk).
+# Every worker must consume them (docker-compose: "worker-high" -Q notifications.high,
+# "worker" -Q celery,notifications.default,notifications.bulk).
+NOTIFY_PRIORITY_QUEUES = {
+    "high": "notifications.high",
+    "default": "notifications.default",
+    "bulk": "notifications.bulk",
+}
+CELERY_TASK_ROUTES = ("notifications.throttle.route_notification_task",)
+
+# NEW: scheduled delivery (local time). Non-urgent messages created in quiet hours wait for the
+# end of the window; reminders are batched to the digest slot.
+NOTIFY_QUIET_HOURS = (config("NOTIFY_QUIET_START", default="21:00"), config("NOTIFY_QUIET_END", default="07:00"))
+NOTIFY_QUIET_MIN_PRIORITY = 3   # priorities 1-2 are never held
+NOTIFY_DIGEST_TIME = config("NOTIFY_DIGEST_TIME", default="08:00")
+
+# NEW: coalescing of HR/ADMIN fan-outs and reminders into one digest per recipient/channel
+NOTIFY_COALESCE_WINDOW = config("NOTIFY_COALESCE_WINDOW", default=15 * 60, cast=int)   # seconds from first event
+NOTIFY_COALESCE_WINDOWS = {}    # per-category override, e.g. {"leave": 1800}
+NOTIFY_DIGEST_MAX_LINES = 10
+
+# NEW: real-time notification center (SSE stream + Redis unread counters)
+NOTIFY_PUBSUB_URL = config("NOTIFY_PUBSUB_URL", default="")   # empty -> CACHES["default"]["LOCATION"]
+NOTIFY_UNREAD_TTL = 3600          # seconds; counters are re-seeded from the DB after this
+NOTIFY_STREAM_KEEPALIVE = 20      # seconds between SSE keepalive comments
+# The stream needs an ASGI server (the "stream" service of docker-compose, routed by nginx).
+# Off: pages keep the 30s unread_count polling, and the endpoint answers 204 under WSGI anyway.
+NOTIFY_STREAM_ENABLED = config("NOTIFY_STREAM_ENABLED", default=False, cast=bool)
+
+# NEW: provider status webhooks (acknowledged at once, applied in batches from a Redis stream)
+NOTIFY_WEBHOOK_BATCH_SIZE = 500
+NOTIFY_WEBHOOK_MAX_BATCHES = 40          # per drain run
+NOTIFY_WEBHOOK_FLUSH_DELAY = 1.0         # seconds a burst is collected before a drain
+NOTIFY_WEBHOOK_DEDUPE_TTL = 24 * 3600    # event ids remembered for replays
+NOTIFY_WEBHOOK_STREAM_MAXLEN = 100000
+NOTIFY_WEBHOOK_CLAIM_IDLE_MS = 60000     # reclaim entries of a crashed consumer after this
+NOTIFY_WEBHOOK_UNMATCHED_RETRIES = 8     # attempts for receipts that arrive before their provider id is stored
+NOTIFY_WEBHOOK_RETRY_DELAY = 15          # seconds before the first retry, doubled each attempt (~1h in total)
+
+# NEW: notification retention (daily rollups, archival to JSONL.gz, monthly partitions on PostgreSQL)
+NOTIFY_RETENTION_MONTHS = config("NOTIFY_RETENTION_MONTHS", default=6, cast=int)
+NOTIFY_ARCHIVE_PREFIX = "notifications/archive"
+NOTIFY_ARCHIVE_MAX_DAYS = 31             # days archived per nightly run
+NOTIFY_ROLLUP_LOOKBACK_DAYS = 30         # closed days re-rolled every night (late reads/receipts)
+NOTIFY_PARTITION_MONTHS_AHEAD = 3
+
+# NEW: resolved-recipient cache (local LRU -> Redis -> DB), invalidated by signals
+NOTIFY_RECIPIENT_TTL = 3600              # Redis, seconds
+NOTIFY_RECIPIENT_LOCAL_TTL = 30          # per-process LRU, seconds (bounds cross-process staleness)
+NOTIFY_RECIPIENT_LRU_SIZE = 2048
+
+# NEW: transactional outbox for tasks fired from views (relayed by beat or run_outbox_relay)
+NOTIFY_OUTBOX_BATCH_SIZE = 200
+NOTIFY_OUTBOX_MAX_BATCHES = 50
+NOTIFY_OUTBOX_POLL_SECONDS = 5
+NOTIFY_OUTBOX_KEEP_DAYS = 7
+
+# NEW: analytics cache - soft TTL = the ttl passed by callers; values stay servable (stale,
+# refreshed in the background) until soft + ttl * STALE_FACTOR
+ANALYTICS_CACHE_STALE_FACTOR = 1.0
+ANALYTICS_CACHE_EARLY_BETA = 1.0         # probabilistic early refresh (0 disables)
+ANALYTICS_CACHE_LOCK_TTL = 120           # seconds a recompute may hold the per-key lock
+ANALYTICS_CACHE_LOCK_WAIT = 15           # seconds a cold-miss request waits for another's compute
+ANALYTICS_CACHE_BACKGROUND = True        # refresh stale values in a thread (False: inline)
+ANALYTICS_FRESH_MIN_AGE = 30             # ?fresh=1 (HR/admin) ignored for values younger than this
+ANALYTICS_REROLL_SECONDS = 300           # yesterday's notification rollup re-rolled at most this often
+
+# NEW: attrition-risk scoring (analytics/attrition.py)
+ANALYTICS_ATTRITION_WEIGHTS = {"tenure": 0.40, "leave": 0.30, "unread": 0.15, "absence": 0.15}
+ANALYTICS_ATTRITION_ABSENCE_DAYS = 90    # attendance window for the absence rate
+ANALYTICS_ATTRITION_KEEP_DAYS = 400      # persisted daily scores kept for trending
+
+# NEW: async (sharded) payroll generation - a RUNNING job without shard progress for this long
+# no longer blocks a new generation and can be resumed or cancelled
+PAYROLL_JOB_STALE_MINUTES = 30
+
 if DEBUG:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
@@ -6,5 +6,7 @@ class LeaveConfig(AppConfig):
     name = 'leave'
 
     def ready(self):
+        import leave.signals  # calendar invalidation on Holiday changes
+
         from config.monitoring.metrics import setup_metrics
         setup_metrics()
\ No newline at end of file
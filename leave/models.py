@@ -6,7 +6,6 @@ from authentication.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.utils.timezone import now
-from datetime import timedelta
 
 class LeaveType(models.Model):
     name = models.CharField(max_length=50)
@@ -74,16 +73,10 @@ class LeaveRequest(models.Model):
     def calculate_working_days(self):
         if self.is_half_day:
             return 0.5
-        delta = self.end_date - self.start_date
-        days = delta.days + 1
-        # Exclude weekends (simplified)
-        start = self.start_date
-        working_days = 0
-        for i in range(days):
-            current_day = start + timedelta(days=i)
-            if current_day.weekday() < 5:  # Monday to Friday
-                working_days += 1
-        return working_days
+        # Weekends and (national + employee's regional) holidays excluded
+        from .workcalendar import working_days_between
+        return working_days_between(self.start_date, self.end_date,
+                                    region=getattr(self.employee, "region", None))
 
     @property
     def calculate_working_days_property(self):
@@ -0,0 +1,15 @@
+# leave/signals.py
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Holiday
+from .workcalendar import invalidate_calendars
+
+
+@receiver(post_save, sender=Holiday)
+@receiver(post_delete, sender=Holiday)
+def holiday_changed(sender, instance, **kwargs):
+    # Working-day tables embed holidays: rebuild on next use, once the change is visible
+    # (bumped before commit, a reader could cache the old bitmap under the new generation)
+    transaction.on_commit(invalidate_calendars)
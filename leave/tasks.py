@@ -209,7 +209,8 @@ from authentication.models import User
 from employee.models import Employee
 from .models import LeaveRequest, LeaveType, Delegation
 
-from notifications.tasks import send_notification  # assumes the task accepts kwargs like title/category/priority/metadata
+from notifications.scheduling import digest_time
+from notifications.tasks import send_notification, create_bulk_notifications  # assumes the task accepts kwargs like title/category/priority/metadata
 
 import logging
 logger = logging.getLogger(__name__)
@@ -227,6 +228,19 @@ def _deeplink(leave_id: int) -> str:
     """
     return f"/leaves/requests/{leave_id}/"
 
+def _meta(leave: LeaveRequest | None = None, extra_meta: dict | None = None) -> dict:
+    meta = {
+        "deeplink": _deeplink(leave.id) if leave else None,
+        "leave_id": getattr(leave, "id", None),
+        "status": getattr(leave, "status", None),
+    }
+    if extra_meta:
+        meta.update(extra_meta)
+    return meta
+
+def _hr_admin_ids() -> list:
+    return list(User.objects.filter(role__in=["HR", "ADMIN"]).values_list("id", flat=True))
+
 def _notify(user, *, title: str, message: str, priority: int = 3, leave: LeaveRequest | None = None, extra_meta: dict | None = None):
     """
     Thin wrapper around send_notification to keep all leave notifications uniform.
@@ -237,13 +251,7 @@ def _notify(user, *, title: str, message: str, priority: int = 3, leave: LeaveRe
         logger.warning(f"Invalid priority {priority} for notification to user {user.id}, defaulting to 3")
         priority = 3
         
-    meta = {
-        "deeplink": _deeplink(leave.id) if leave else None,
-        "leave_id": getattr(leave, "id", None),
-        "status": getattr(leave, "status", None),
-    }
-    if extra_meta:
-        meta.update(extra_meta)
+    meta = _meta(leave, extra_meta)
 
     try:
         # Let the notification service pick the right channel based on user preferences.
@@ -259,6 +267,23 @@ def _notify(user, *, title: str, message: str, priority: int = 3, leave: LeaveRe
     except Exception as e:
         logger.error("Failed to enqueue notification to user=%s: %s", getattr(user, "id", None), e)
 
+def _notify_many(user_ids, *, title: str = "", message: str = "", priority: int = 3, leave: LeaveRequest | None = None, extra_meta: dict | None = None,
+                 scheduled_for=None, expires_at=None, coalesce: bool = False):
+    """
+    Same message to several users (HR/ADMIN, reminders) through one bulk fan-out.
+    user_ids may also hold (user_id, message, title, meta) tuples for per-user messages.
+    coalesce=True merges the SMS/WhatsApp/e-mail copies into one digest per recipient.
+    """
+    meta = _meta(leave, extra_meta)
+    items = [u if isinstance(u, tuple) else (u, message, title, meta) for u in user_ids if u]
+    if not items:
+        return
+    try:
+        create_bulk_notifications(items, category=LEAVE_CATEGORY, priority=priority,
+                                  scheduled_for=scheduled_for, expires_at=expires_at, coalesce=coalesce)
+    except Exception as e:
+        logger.error("Failed to fan out leave notification (%s recipients): %s", len(items), e)
+
 
 # ---------- tasks ----------
 @shared_task
@@ -293,14 +318,14 @@ def notify_leave_request_submission(leave_request_id: int):
             )
 
         # HR / ADMIN
-        for hr in User.objects.filter(role__in=["HR", "ADMIN"]):
-            _notify(
-                hr,
-                title="Nouvelle demande de congé",
-                message=mgmt_msg,
-                priority=2,
-                leave=leave,
-            )
+        _notify_many(
+            _hr_admin_ids(),
+            title="Nouvelle demande de congé",
+            message=mgmt_msg,
+            priority=2,
+            leave=leave,
+            coalesce=True,
+        )
 
         # Employee confirmation
         if getattr(employee, "user", None):
@@ -354,8 +379,7 @@ def notify_leave_request_response(leave_request_id: int):
                 f"Demande de congé approuvée par le manager — {employee_name}, {lt} du {start} au {end}. "
                 f"En attente de validation RH."
             )
-            for hr in User.objects.filter(role__in=["HR", "ADMIN"]):
-                _notify(hr, title="Validation RH requise", message=hr_msg, priority=2, leave=leave)
+            _notify_many(_hr_admin_ids(), title="Validation RH requise", message=hr_msg, priority=2, leave=leave, coalesce=True)
     except Exception as e:
         logger.error("notify_leave_request_response(%s) failed: %s", leave_request_id, e)
 
@@ -383,6 +407,7 @@ def notify_leave_balance_update(employee_id: int, leave_type_id: int, year: int,
 def upcoming_leave_reminder():
     """
     Remind employee/manager/HR 5 days before a leave ends (still approved).
+    Reminders are computed in one pass and released together at the digest slot.
     """
     
     # Mark task as run in monitoring
@@ -392,29 +417,37 @@ def upcoming_leave_reminder():
         today = timezone.localdate()
         in_five_days = today + timezone.timedelta(days=5)
 
-        leaves = LeaveRequest.objects.select_related("employee", "employee__user", "employee__manager", "leave_type").filter(
+        leaves = LeaveRequest.objects.select_related("employee", "employee__user", "employee__manager__user", "leave_type").filter(
             status="hr_approved",
             end_date=in_five_days,
             is_half_day=False,
         )
 
+        # One fan-out per priority for the whole day instead of one task per recipient
+        team, hr_items = [], []
+        hr_ids = _hr_admin_ids()
         for leave in leaves:
             employee = leave.employee
             employee_name = f"{employee.first_name} {employee.last_name}"
             lt = leave.leave_type.name if leave.leave_type_id else "Leave"
             msg = f"Rappel: le congé ({lt}) de {employee_name} se termine le {_fmt_d(leave.end_date)}."
+            meta = _meta(leave)
 
             # Employee
             if getattr(employee, "user", None):
-                _notify(employee.user, title="Rappel — Fin de congé", message=msg, priority=3, leave=leave)
+                team.append((employee.user.id, msg, "Rappel — Fin de congé", meta))
 
             # Manager
             if getattr(employee, "manager", None) and getattr(employee.manager, "user", None):
-                _notify(employee.manager.user, title="Rappel — Fin de congé (équipe)", message=msg, priority=3, leave=leave)
+                team.append((employee.manager.user.id, msg, "Rappel — Fin de congé (équipe)", meta))
 
             # HR / ADMIN
-            for hr in User.objects.filter(role__in=["HR", "ADMIN"]):
-                _notify(hr, title="Rappel — Fin de congé", message=msg, priority=4, leave=leave)
+            hr_items.extend((hr_id, msg, "Rappel — Fin de congé", meta) for hr_id in hr_ids)
+
+        # Released together at the digest slot; dropped if still unsent a day later
+        slot = digest_time()
+        _notify_many(team, priority=3, scheduled_for=slot, expires_at=slot + timezone.timedelta(days=1))
+        _notify_many(hr_items, priority=4, scheduled_for=slot, expires_at=slot + timezone.timedelta(days=1), coalesce=True)
     except Exception as e:
         logger.error("upcoming_leave_reminder failed: %s", e)
 
@@ -444,8 +477,7 @@ def notify_overlapping_leave(leave_request_id: int):
             start, end = _fmt_d(leave.start_date), _fmt_d(leave.end_date)
             msg = f"Attention: demande de congé ({lt}) du {start} au {end} pour {employee_name} chevauche des congés approuvés existants."
 
-            for hr in User.objects.filter(role__in=["HR", "ADMIN"]):
-                _notify(hr, title="Alerte — Chevauchement de congés", message=msg, priority=2, leave=leave)
+            _notify_many(_hr_admin_ids(), title="Alerte — Chevauchement de congés", message=msg, priority=2, leave=leave, coalesce=True)
     except Exception as e:
         logger.error("notify_overlapping_leave(%s) failed: %s", leave_request_id, e)
 
@@ -463,19 +495,19 @@ def notify_delegate_leave(leave_request_id: int):
         leave = LeaveRequest.objects.select_related("employee", "leave_type").get(id=leave_request_id)
         lt = leave.leave_type.name if leave.leave_type_id else "Leave"
 
-        delegations = Delegation.objects.select_related("delegate", "delegate__user").filter(
+        delegations = Delegation.objects.filter(
             delegator=leave.employee,
             start_date__lte=leave.start_date,
             end_date__gte=leave.start_date,
         )
 
-        for d in delegations:
-            msg = (
-                f"Demande de congé soumise par {leave.employee} ({lt}) "
-                f"du {_fmt_d(leave.start_date)} au {_fmt_d(leave.end_date)} pendant votre période de délégation."
-            )
-            if getattr(d.delegate, "user", None):
-                _notify(d.delegate.user, title="Délégation — Nouvelle demande de congé", message=msg, priority=3, leave=leave)
+        msg = (
+            f"Demande de congé soumise par {leave.employee} ({lt}) "
+            f"du {_fmt_d(leave.start_date)} au {_fmt_d(leave.end_date)} pendant votre période de délégation."
+        )
+        # Delegation.delegate is the User itself
+        _notify_many([d.delegate_id for d in delegations], title="Délégation — Nouvelle demande de congé",
+                     message=msg, priority=3, leave=leave, coalesce=True)
     except Exception as e:
         logger.error("notify_delegate_leave(%s) failed: %s", leave_request_id, e)
 
@@ -1,13 +1,10 @@
 # leave/utils.py
 from datetime import date
-from .models import Holiday
+from . import workcalendar
 
-def is_working_day(check_date):
-    if check_date.weekday() >= 5:  # Saturday or Sunday
-        return False
-    if Holiday.objects.filter(date=check_date).exists():
-        return False
-    return True
+def is_working_day(check_date, region=None):
+    # Weekends + holidays, from the cached calendar tables
+    return workcalendar.is_working_day(check_date, region)
 
 
 
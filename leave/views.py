@@ -5,6 +5,8 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
 from django.db.models import Q
+from django.db import transaction
+from notifications import outbox
 from datetime import datetime
 from .models import LeaveRequest, LeaveType, LeaveBalance
 from .serializers import *
@@ -103,11 +105,13 @@ class LeaveRequestViewSet(viewsets.ModelViewSet):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        leave = serializer.instance
-        notify_leave_request_submission.delay(leave.id)
-        notify_overlapping_leave.delay(leave.id)
-        notify_delegate_leave.delay(leave.id)
+        # notifications are written to the outbox with the request: sent only if it commits
+        with transaction.atomic():
+            self.perform_create(serializer)
+            leave = serializer.instance
+            outbox.enqueue(notify_leave_request_submission, leave.id)
+            outbox.enqueue(notify_overlapping_leave, leave.id)
+            outbox.enqueue(notify_delegate_leave, leave.id)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
@@ -117,8 +121,9 @@ class LeaveRequestViewSet(viewsets.ModelViewSet):
             return Response({'error': 'You can only update requests from your subordinates'}, status=status.HTTP_403_FORBIDDEN)
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
-        notify_leave_request_response.delay(instance.id)
+        with transaction.atomic():
+            self.perform_update(serializer)
+            outbox.enqueue(notify_leave_request_response, instance.id)
         return Response(serializer.data)
 
     @action(detail=True, methods=['post'], name='Approve by Manager')
@@ -129,8 +134,9 @@ class LeaveRequestViewSet(viewsets.ModelViewSet):
         leave.status = 'manager_approved'
         leave.approved_by = request.user
         leave.is_read = True
-        leave.save()
-        notify_leave_request_response.delay(leave.id)
+        with transaction.atomic():
+            leave.save()
+            outbox.enqueue(notify_leave_request_response, leave.id)
         return Response({'status': 'manager_approved'}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'], name='Approve by HR')
@@ -140,19 +146,21 @@ class LeaveRequestViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Manager approval required.'}, status=status.HTTP_400_BAD_REQUEST)
         leave.status = 'hr_approved'
         leave.is_read = True
-        leave.save()
         year = leave.start_date.year
         working_days = leave.calculate_working_days()
-        balance = LeaveBalance.objects.get(employee=leave.employee, leave_type=leave.leave_type, year=year)
-        balance.balance -= working_days
-        balance.save()
-        notify_leave_request_response.delay(leave.id)
-        notify_leave_balance_update.delay(
-            employee_id=leave.employee.id,
-            leave_type_id=leave.leave_type.id,
-            year=year,
-            new_balance=balance.balance
-        )
+        with transaction.atomic():
+            leave.save()
+            balance = LeaveBalance.objects.select_for_update().get(employee=leave.employee, leave_type=leave.leave_type, year=year)
+            balance.balance -= working_days
+            balance.save()
+            outbox.enqueue(notify_leave_request_response, leave.id)
+            outbox.enqueue(
+                notify_leave_balance_update,
+                employee_id=leave.employee.id,
+                leave_type_id=leave.leave_type.id,
+                year=year,
+                new_balance=balance.balance
+            )
         return Response({'status': 'hr_approved'}, status=status.HTTP_200_OK)
 
 class LeaveTypeViewSet(viewsets.ModelViewSet):
@@ -178,9 +186,10 @@ def leave_create_view(request):
         data['employee'] = request.user.employee.id if request.user.role == 'EMP' else data['employee']
         serializer = LeaveRequestSerializer(data=data, context={'request': request})
         if serializer.is_valid():
-            leave = serializer.save()
-            notify_leave_request_submission.delay(leave.id)
-            notify_overlapping_leave.delay(leave.id)
+            with transaction.atomic():
+                leave = serializer.save()
+                outbox.enqueue(notify_leave_request_submission, leave.id)
+                outbox.enqueue(notify_overlapping_leave, leave.id)
             return redirect('leave_list')
         context['errors'] = serializer.errors
     return render(request, 'leave/leave_create.html', context)
@@ -0,0 +1,169 @@
+# leave/workcalendar.py
+"""
+Shared working-day calendar (weekends + leave.Holiday).
+
+For each (year, region) a bitmap of working days is built once, with prefix sums, so
+"working days between d1 and d2" is two lookups. Holidays with a blank region apply
+everywhere; others only to employees whose `region` matches (case-insensitive).
+
+Caching: in-process dict + Django cache (Redis) under a generation counter that
+leave.signals bumps on every Holiday change, so all workers drop stale tables.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Optional
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "leave:workcalendar:generation"
+CACHE_TTL = 60 * 60 * 24 * 7   # tables only change through Holiday edits (generation bump)
+GENERATION_CHECK_SECONDS = 5   # how often a process re-reads the shared generation
+
+
+def region_key(region: Optional[str]) -> str:
+    return (region or "").strip().lower()
+
+
+@dataclass
+class YearCalendar:
+    year: int
+    region: str
+    bits: bytes            # bits[i] == 1 -> Jan 1 + i is a working day
+    prefix: list           # prefix[i] = working days in [Jan 1, Jan 1 + i)
+
+    @classmethod
+    def from_bits(cls, year: int, region: str, bits: bytes) -> "YearCalendar":
+        prefix = [0] * (len(bits) + 1)
+        for i, b in enumerate(bits):
+            prefix[i + 1] = prefix[i] + b
+        return cls(year=year, region=region, bits=bits, prefix=prefix)
+
+    def _index(self, d: date) -> int:
+        return (d - date(self.year, 1, 1)).days
+
+    def is_working(self, d: date) -> bool:
+        return bool(self.bits[self._index(d)])
+
+    def count(self, start: date, end: date) -> int:
+        """Working days in [start, end] (both inside this year)."""
+        if end < start:
+            return 0
+        return self.prefix[self._index(end) + 1] - self.prefix[self._index(start)]
+
+
+def build_bits(year: int, region: str) -> bytes:
+    """Bitmap for one year: Mon–Fri minus national + regional holidays (one query)."""
+    from leave.models import Holiday
+
+    jan1 = date(year, 1, 1)
+    days = (date(year + 1, 1, 1) - jan1).days
+    bits = bytearray(1 if (jan1 + timedelta(days=i)).weekday() < 5 else 0 for i in range(days))
+
+    for d, r in Holiday.objects.filter(date__year=year).values_list("date", "region"):
+        if not region_key(r) or region_key(r) == region:
+            bits[(d - jan1).days] = 0
+    return bytes(bits)
+
+
+# ---------------- cache ----------------
+
+_lock = threading.Lock()
+_tables: dict = {}
+_seen_generation = None
+_generation_read = (0.0, None)   # (monotonic time, value)
+
+
+def _generation() -> int:
+    """Shared generation, re-read at most every GENERATION_CHECK_SECONDS (hot loops call this per day)."""
+    global _generation_read
+    now = time.monotonic()
+    checked_at, value = _generation_read
+    if value is not None and now - checked_at < GENERATION_CHECK_SECONDS:
+        return value
+    try:
+        value = int(cache.get(GENERATION_KEY) or 0)
+    except Exception as e:
+        logger.warning("Calendar generation unavailable from cache: %s", e)
+        value = -1
+    _generation_read = (now, value)
+    return value
+
+
+def invalidate_calendars() -> None:
+    """Drop all precomputed tables (this process + every other one via the generation)."""
+    global _generation_read
+    with _lock:
+        _tables.clear()
+    _generation_read = (0.0, None)
+    try:
+        if not cache.add(GENERATION_KEY, 1, timeout=None):
+            cache.incr(GENERATION_KEY)
+    except Exception as e:
+        logger.warning("Could not bump calendar generation: %s", e)
+
+
+def get_calendar(year: int, region: Optional[str] = None) -> YearCalendar:
+    global _seen_generation
+    rk = region_key(region)
+    gen = _generation()
+    with _lock:
+        if gen != _seen_generation:
+            _tables.clear()
+            _seen_generation = gen
+        hit = _tables.get((year, rk))
+    if hit is not None:
+        return hit
+
+    redis_key = f"workcal:{gen}:{year}:{rk}"
+    bits = None
+    if gen >= 0:
+        try:
+            bits = cache.get(redis_key)
+        except Exception:
+            bits = None
+    if bits is None:
+        bits = build_bits(year, rk)
+        if gen >= 0:
+            try:
+                cache.set(redis_key, bits, CACHE_TTL)
+            except Exception:
+                pass
+
+    table = YearCalendar.from_bits(year, rk, bits)
+    with _lock:
+        _tables[(year, rk)] = table
+    return table
+
+
+# ---------------- API ----------------
+
+def is_working_day(d: date, region: Optional[str] = None) -> bool:
+    return get_calendar(d.year, region).is_working(d)
+
+
+def working_days_between(start: date, end: date, region: Optional[str] = None) -> int:
+    """Working days in [start, end], inclusive; O(1) per calendar year spanned."""
+    if end < start:
+        return 0
+    total = 0
+    for year in range(start.year, end.year + 1):
+        s = max(start, date(year, 1, 1))
+        e = min(end, date(year, 12, 31))
+        total += get_calendar(year, region).count(s, e)
+    return total
+
+
+def previous_working_day(d: date, region: Optional[str] = None, max_back: int = 366) -> Optional[date]:
+    """Closest working day strictly before d (None if none within max_back days)."""
+    for i in range(1, max_back + 1):
+        prev = d - timedelta(days=i)
+        if is_working_day(prev, region):
+            return prev
+    return None
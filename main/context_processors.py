@@ -1,14 +1,19 @@
 # notifications/context_processors.py
+from django.conf import settings
+
 from notifications.models import Notification
 
 def unread_notifications_count(request):
+    # NEW: base.html only opens the SSE stream when it is served by an ASGI server
+    stream = bool(getattr(settings, "NOTIFY_STREAM_ENABLED", False))
     if request.user.is_authenticated:
         try:
             return {
                 "unread_notifications_count": Notification.objects.filter(
                     user=request.user, is_read=False
-                ).count()
+                ).count(),
+                "notify_stream_enabled": stream,
             }
         except Exception:
-            return {"unread_notifications_count": 0}
-    return {"unread_notifications_count": 0}
+            return {"unread_notifications_count": 0, "notify_stream_enabled": stream}
+    return {"unread_notifications_count": 0, "notify_stream_enabled": stream}
@@ -7,4 +7,5 @@ class NotificationsConfig(AppConfig):
 
     def ready(self):
         from config.monitoring.metrics import setup_metrics
-        setup_metrics()
\ No newline at end of file
+        setup_metrics()
+        import notifications.signals  # recipient cache invalidation
\ No newline at end of file
@@ -0,0 +1,106 @@
+# notifications/coalescing.py
+"""
+Digest / coalescing of high-volume notifications (HR/ADMIN fan-outs, reminders).
+
+Each coalesced event keeps its individual INAPP row (the in-app feed stays complete), while
+the external channel (SMS / WhatsApp / e-mail) gets ONE digest row per coalescing key
+(category + recipient) and channel. The digest is an ordinary Notification in status
+'pending' with scheduled_for = end of the window: release_scheduled_notifications sends it,
+and events arriving before then are merged into it (title/message re-rendered).
+
+Window: NOTIFY_COALESCE_WINDOWS[category] or NOTIFY_COALESCE_WINDOW seconds from the first
+event. Priority-1 events are never coalesced.
+"""
+from __future__ import annotations
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Notification
+from .scheduling import hold_until
+
+MAX_STORED_ITEMS = 50
+
+
+def coalesce_key(category: str, user_id) -> str:
+    return f"{category or 'general'}:{user_id}"
+
+
+def window_for(category: str) -> timedelta:
+    per_category = getattr(settings, "NOTIFY_COALESCE_WINDOWS", {}) or {}
+    seconds = per_category.get(category, getattr(settings, "NOTIFY_COALESCE_WINDOW", 15 * 60))
+    return timedelta(seconds=int(seconds))
+
+
+def can_coalesce(priority, channel: str) -> bool:
+    return (channel or "").upper() != "INAPP" and isinstance(priority, int) and priority >= 2
+
+
+def render_digest(items: list, count: int) -> tuple:
+    """(title, message) of a digest; a single event keeps its own title and text."""
+    if count == 1 and items:
+        return items[0]["title"], items[0]["message"]
+    max_lines = int(getattr(settings, "NOTIFY_DIGEST_MAX_LINES", 10))
+    lines = [f"• {it['title']}: {it['message']}" if it.get("title") else f"• {it['message']}"
+             for it in items[:max_lines]]
+    more = count - min(len(items), max_lines)
+    text = f"Vous avez {count} nouvelles notifications :\n" + "\n".join(lines)
+    if more > 0:
+        text += f"\n… et {more} autre(s). Détails dans l'application."
+    return f"Récapitulatif — {count} notifications", text
+
+
+def merge_into_digests(events: list, scheduled_for=None, expires_at=None) -> dict:
+    """
+    events: dicts with user_id, channel, recipient, category, priority, title, message.
+    Open digests (pending, same key + channel) are locked and extended; missing ones are
+    created. One SELECT ... FOR UPDATE, one bulk_create, one bulk_update.
+    "rows" holds the digests opened by this call (new unread rows).
+    """
+    if not events:
+        return {"opened": 0, "merged": 0, "rows": []}
+    now = timezone.now()
+    keys = {coalesce_key(e["category"], e["user_id"]) for e in events}
+
+    with transaction.atomic():
+        digests = {
+            (d.coalesce_key, d.channel): d
+            for d in Notification.objects.select_for_update().filter(coalesce_key__in=keys, status="pending")
+        }
+        created, touched = [], {}
+        for e in events:
+            key = coalesce_key(e["category"], e["user_id"])
+            d = digests.get((key, e["channel"]))
+            if d is None:
+                release = now + window_for(e["category"])
+                if scheduled_for and scheduled_for > release:
+                    release = scheduled_for
+                release = hold_until(e["priority"], e["channel"], release) or release
+                d = Notification(
+                    user_id=e["user_id"], channel=e["channel"], recipient=e["recipient"],
+                    category=e["category"], priority=e["priority"], status="pending",
+                    scheduled_for=release, expires_at=expires_at, coalesce_key=key,
+                    metadata={"digest": True, "count": 0, "items": []},
+                )
+                digests[(key, e["channel"])] = d
+                created.append(d)
+            elif d.pk not in touched:
+                touched[d.pk] = d
+
+            meta = d.metadata
+            meta["count"] = meta.get("count", 0) + 1
+            meta["items"] = (meta.get("items") or [])[-(MAX_STORED_ITEMS - 1):] + [
+                {"title": e["title"], "message": e["message"], "priority": e["priority"], "at": now.isoformat()}
+            ]
+            d.priority = min(d.priority, e["priority"])
+            title, message = render_digest(meta["items"], meta["count"])
+            d.title, d.message = title[:120], message
+
+        Notification.objects.bulk_create(created, batch_size=1000)
+        if touched:
+            Notification.objects.bulk_update(list(touched.values()), ["title", "message", "priority", "metadata"], batch_size=500)
+
+    return {"opened": len(created), "merged": len(events) - len(created), "rows": created}
@@ -0,0 +1,330 @@
+# notifications/ingest.py
+"""
+Provider status-webhook ingestion (Twilio status callbacks, WhatsApp Cloud statuses).
+
+The webhook views only normalize the payload and call `enqueue`: events are deduplicated on
+their event id (provider:message id:status, SET NX with NOTIFY_WEBHOOK_DEDUPE_TTL) and appended
+to the Redis stream notify:webhooks in one Lua call, then the request is acknowledged.
+tasks.apply_webhook_events drains the stream through a consumer group in batches of
+NOTIFY_WEBHOOK_BATCH_SIZE and `apply_events` updates the rows with one indexed
+provider_message_id__in lookup and one bulk_update per batch.
+
+Status transitions are monotonic (STATUS_RANK): a late or replayed 'delivered' never
+overwrites 'read', and 'failed' never overwrites 'delivered'. Without Redis, `enqueue` applies
+the events inline (still one query per payload), so receipts are never lost.
+
+A receipt can arrive before its row has a provider_message_id (bulk chunks write the ids in
+one bulk_update at the end). Such unmatched events are not dropped: `defer` parks them in the
+sorted set notify:webhooks:delayed with a doubling delay (NOTIFY_WEBHOOK_RETRY_DELAY) and
+`release_delayed` puts the due ones back on the stream at the start of every drain, up to
+NOTIFY_WEBHOOK_UNMATCHED_RETRIES attempts.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import time
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Notification
+from .signals import stats_changed
+
+logger = logging.getLogger(__name__)
+
+STREAM = "notify:webhooks"
+GROUP = "appliers"
+KICK_KEY = "notify:webhooks:kick"
+DELAYED = "notify:webhooks:delayed"
+
+# provider (as reported by the webhook) -> Notification.provider values it covers
+PROVIDER_GROUPS = {
+    "twilio": ("twilio", "twilio_whatsapp"),
+    "whatsapp_cloud": ("whatsapp_cloud",),
+}
+GROUP_OF = {p: g for g, members in PROVIDER_GROUPS.items() for p in members}
+
+# Only forward moves are applied. Our own pre-send statuses rank 0.
+STATUS_RANK = {
+    "pending": 0, "queued": 0, "sending": 0, "expired": 0,
+    "sent": 1,
+    "failed": 2, "undelivered": 2,
+    "delivered": 3,
+    "read": 4,
+}
+
+# KEYS[1] stream, KEYS[2..] dedupe keys; ARGV[1] dedupe ttl, ARGV[2] stream maxlen, ARGV[3..] payloads.
+ENQUEUE_LUA = """
+local added = 0
+for i = 2, #KEYS do
+  if redis.call('SET', KEYS[i], '1', 'NX', 'EX', tonumber(ARGV[1])) then
+    redis.call('XADD', KEYS[1], 'MAXLEN', '~', tonumber(ARGV[2]), '*', 'e', ARGV[i + 1])
+    added = added + 1
+  end
+end
+return added
+"""
+
+# KEYS[1] delayed zset, KEYS[2] stream; ARGV[1] now, ARGV[2] stream maxlen, ARGV[3] limit.
+RELEASE_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+for _, payload in ipairs(due) do
+  redis.call('XADD', KEYS[2], 'MAXLEN', '~', tonumber(ARGV[2]), '*', 'e', payload)
+end
+if #due > 0 then
+  redis.call('ZREM', KEYS[1], unpack(due))
+end
+return #due
+"""
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection("default")
+
+
+_enqueue_script = None
+
+
+def event_id(provider: str, message_id: str, status: str) -> str:
+    return f"{provider}:{message_id}:{status}"
+
+
+def make_event(provider: str, message_id, status, error_code=None, ts=None) -> dict:
+    """Normalized event; `ts` is the provider's epoch timestamp when it sends one."""
+    status = (status or "").lower()
+    return {
+        "id": event_id(provider, message_id or "", status),
+        "provider": provider,
+        "message_id": message_id or "",
+        "status": status,
+        "error_code": error_code or None,
+        "ts": float(ts) if ts else time.time(),
+    }
+
+
+# ---------------- producer (webhook views) ----------------
+
+def enqueue(events: list) -> dict:
+    """Dedupe + append to the stream and schedule a drain. Falls back to applying inline."""
+    events = [e for e in events if e.get("message_id") and e.get("status") in STATUS_RANK]
+    if not events:
+        return {"queued": 0, "duplicates": 0}
+    global _enqueue_script
+    try:
+        client = _redis()
+        if _enqueue_script is None or _enqueue_script.registered_client is not client:
+            _enqueue_script = client.register_script(ENQUEUE_LUA)
+        ttl = int(_setting("NOTIFY_WEBHOOK_DEDUPE_TTL", 86400))
+        maxlen = int(_setting("NOTIFY_WEBHOOK_STREAM_MAXLEN", 100000))
+        added = int(_enqueue_script(
+            keys=[STREAM] + [f"notify:webhooks:seen:{e['id']}" for e in events],
+            args=[ttl, maxlen] + [json.dumps(e) for e in events],
+        ))
+    except Exception as e:
+        logger.warning("Webhook stream unavailable, applying %s events inline: %s", len(events), e)
+        stats = apply_events(events)
+        return {"queued": 0, "duplicates": 0, "inline": stats}
+
+    if added:
+        _kick(client)
+    _count("duplicate", len(events) - added)
+    return {"queued": added, "duplicates": len(events) - added}
+
+
+def _kick(client) -> None:
+    """At most one drain scheduled per NOTIFY_WEBHOOK_FLUSH_DELAY: a burst becomes one batch."""
+    delay = float(_setting("NOTIFY_WEBHOOK_FLUSH_DELAY", 1.0))
+    try:
+        if client.set(KICK_KEY, "1", nx=True, px=max(1, int(delay * 1000))):
+            from .tasks import apply_webhook_events
+            apply_webhook_events.apply_async(countdown=delay)
+    except Exception as e:
+        # the beat run picks the events up anyway
+        logger.warning("Could not schedule webhook drain: %s", e)
+
+
+# ---------------- consumer ----------------
+
+def consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def ensure_group(client) -> None:
+    try:
+        client.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+    except Exception as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _decode(entries) -> tuple:
+    ids, events = [], []
+    for entry_id, fields in entries or []:
+        ids.append(entry_id)
+        raw = fields.get(b"e") or fields.get("e")
+        try:
+            events.append(json.loads(raw))
+        except (TypeError, ValueError):
+            logger.warning("Dropping malformed webhook event %s", entry_id)
+    return ids, events
+
+
+def read_batch(client, count: int, min_idle_ms: int) -> tuple:
+    """Stale entries of crashed consumers first (XAUTOCLAIM), then new ones (XREADGROUP)."""
+    name = consumer_name()
+    try:
+        claimed = client.xautoclaim(STREAM, GROUP, name, min_idle_time=min_idle_ms, start_id="0-0", count=count)
+        entries = claimed[1] if claimed else []
+    except Exception:
+        entries = []  # Redis < 6.2
+    if not entries:
+        resp = client.xreadgroup(GROUP, name, {STREAM: ">"}, count=count)
+        entries = resp[0][1] if resp else []
+    return _decode(entries)
+
+
+def ack(client, entry_ids) -> None:
+    if entry_ids:
+        pipe = client.pipeline(transaction=False)
+        pipe.xack(STREAM, GROUP, *entry_ids)
+        pipe.xdel(STREAM, *entry_ids)
+        pipe.execute()
+
+
+def defer(client, events: list) -> dict:
+    """Park unmatched events for a later attempt; the ones out of attempts are dropped."""
+    retries = int(_setting("NOTIFY_WEBHOOK_UNMATCHED_RETRIES", 8))
+    base = float(_setting("NOTIFY_WEBHOOK_RETRY_DELAY", 15))
+    now = time.time()
+    parked, dropped = {}, 0
+    for e in events:
+        attempt = int(e.get("attempt", 0)) + 1
+        if attempt > retries:
+            dropped += 1
+            logger.warning("Dropping webhook event %s: no matching notification after %s attempts", e.get("id"), retries)
+            continue
+        parked[json.dumps({**e, "attempt": attempt})] = now + base * 2 ** (attempt - 1)
+    if parked:
+        client.zadd(DELAYED, parked)
+    _count("deferred", len(parked))
+    _count("dropped", dropped)
+    return {"deferred": len(parked), "dropped": dropped}
+
+
+_release_script = None
+
+
+def release_delayed(client, limit: int = 5000) -> int:
+    """Move the due parked events back onto the stream. Returns how many."""
+    global _release_script
+    if _release_script is None or _release_script.registered_client is not client:
+        _release_script = client.register_script(RELEASE_LUA)
+    maxlen = int(_setting("NOTIFY_WEBHOOK_STREAM_MAXLEN", 100000))
+    return int(_release_script(keys=[DELAYED, STREAM], args=[time.time(), maxlen, limit]))
+
+
+def _when(ts) -> datetime:
+    return datetime.fromtimestamp(float(ts), tz=dt_timezone.utc)
+
+
+def apply_events(events: list, unmatched: list = None) -> dict:
+    """
+    Apply a batch of normalized events. Per message only the most advanced status wins,
+    rows are locked and read once (provider_message_id index), and only forward
+    transitions are written (bulk_update). Events with no matching row are appended to
+    `unmatched` when given (see defer).
+    """
+    stats = Counter()
+    best = {}
+    for e in events:
+        status, mid, provider = e.get("status"), e.get("message_id"), e.get("provider")
+        if not mid or status not in STATUS_RANK or provider not in PROVIDER_GROUPS:
+            stats["ignored"] += 1
+            continue
+        key = (provider, mid)
+        cur = best.get(key)
+        if cur is None or STATUS_RANK[status] > STATUS_RANK[cur["status"]]:
+            if cur is not None and cur.get("error_code") and not e.get("error_code"):
+                e = {**e, "error_code": cur["error_code"]}
+            best[key] = e
+        elif e.get("error_code") and not cur.get("error_code"):
+            cur["error_code"] = e["error_code"]
+    if not best:
+        return dict(stats)
+
+    providers = {p for g, _ in best for p in PROVIDER_GROUPS[g]}
+    message_ids = {mid for _, mid in best}
+    fields = set()
+    changed, read_users, matched = [], set(), set()
+
+    with transaction.atomic():
+        rows = (Notification.objects.select_for_update()
+                .filter(provider_message_id__in=message_ids, provider__in=providers)
+                .only("id", "user_id", "provider", "provider_message_id", "status",
+                      "is_read", "read_at", "delivered_at", "metadata")
+                .order_by("id"))
+        for n in rows:
+            key = (GROUP_OF.get(n.provider), n.provider_message_id)
+            e = best.get(key)
+            if e is None:
+                continue
+            matched.add(key)
+            new = "failed" if e["status"] == "undelivered" else e["status"]
+            if STATUS_RANK[new] <= STATUS_RANK.get(n.status, 0):
+                stats["stale"] += 1
+                continue
+            when = _when(e["ts"])
+            n.status = new
+            fields.add("status")
+            if new == "delivered":
+                n.delivered_at = when
+                fields.add("delivered_at")
+            elif new == "read":
+                if n.delivered_at is None:
+                    n.delivered_at = when
+                    fields.add("delivered_at")
+                if not n.is_read:
+                    n.is_read, n.read_at = True, when
+                    fields.update(("is_read", "read_at"))
+                    if n.user_id:
+                        read_users.add(n.user_id)
+            if e.get("error_code"):
+                meta = n.metadata or {}
+                meta["twilio_error_code" if key[0] == "twilio" else "whatsapp_error_code"] = e["error_code"]
+                n.metadata = meta
+                fields.add("metadata")
+            changed.append(n)
+
+        if changed:
+            Notification.objects.bulk_update(changed, sorted(fields), batch_size=500)
+            transaction.on_commit(lambda: stats_changed.send(sender=Notification))
+
+    stats["applied"] += len(changed)
+    stats["unmatched"] += len(best) - len(matched)
+    if unmatched is not None:
+        unmatched.extend(e for key, e in best.items() if key not in matched)
+    if read_users:
+        from .realtime import forget_unread
+        forget_unread(read_users)
+    for outcome in ("applied", "stale", "unmatched", "ignored"):
+        _count(outcome, stats.get(outcome, 0))
+    return dict(stats)
+
+
+def _count(outcome: str, n: int) -> None:
+    if n:
+        try:
+            from config.monitoring.metrics import inc_webhook_events
+            inc_webhook_events(outcome, n)
+        except Exception:
+            pass
@@ -0,0 +1,134 @@
+# notifications/loadtest.py
+"""
+Load-test helpers for the notification pipeline (used by `manage.py benchmark_notifications`).
+
+StubProvider is a local HTTP server that answers like the Twilio Messages API
+(POST .../Accounts/<sid>/Messages.json) and the WhatsApp Cloud API (POST .../<phone>/messages),
+with configurable latency, jitter and error rate. Every message body carries a "[bench:<n>]"
+tag; the stub records when each tagged message first got a 2xx, which gives end-to-end
+latency (enqueue -> provider accepted) whether the pipeline runs eagerly or on real workers.
+"""
+from __future__ import annotations
+
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+TAG_RE = re.compile(r"\[bench:(\d+)\]")
+
+
+def tag(n: int) -> str:
+    return f"[bench:{n}]"
+
+
+def percentile(values, p: float) -> float:
+    """Nearest-rank percentile (p in 0..100) of a list of numbers; 0.0 when empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+class StubProvider:
+    def __init__(self, name: str, port: int = 0, latency_ms: float = 50.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 500, seed=None):
+        self.name = name
+        self.port = port
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.accepted = {}      # tag -> monotonic time of the first 2xx
+        self.requests = 0
+        self.errors = 0
+        self.duplicates = 0
+        self._server = None
+        self._thread = None
+
+    # ---------------- lifecycle ----------------
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "StubProvider":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"      # keep-alive, like the real APIs
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length).decode("utf-8", "replace") if length else ""
+                status, payload = stub.handle(self.path, raw)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"stub-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    # ---------------- behaviour ----------------
+
+    def _body_text(self, path: str, raw: str) -> str:
+        if path.endswith("/Messages.json"):
+            return (parse_qs(raw).get("Body") or [""])[0]
+        try:
+            return ((json.loads(raw) or {}).get("text") or {}).get("body", "")
+        except ValueError:
+            return ""
+
+    def handle(self, path: str, raw: str) -> tuple:
+        delay = self.latency_ms + (self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        twilio = path.endswith("/Messages.json")
+        with self._lock:
+            self.requests += 1
+            failing = self.error_rate > 0 and self._random.random() < self.error_rate
+            if failing:
+                self.errors += 1
+        if failing:
+            if twilio:
+                return self.error_status, {"code": 20429 if self.error_status == 429 else 20500,
+                                           "message": "Stub error", "status": self.error_status}
+            return self.error_status, {"error": {"message": "Stub error", "code": 131000}}
+
+        m = TAG_RE.search(self._body_text(path, raw))
+        if m:
+            with self._lock:
+                if m.group(1) in self.accepted:
+                    self.duplicates += 1
+                else:
+                    self.accepted[m.group(1)] = time.monotonic()
+        if twilio:
+            return 201, {"sid": f"SM{uuid.uuid4().hex}", "status": "queued"}
+        return 200, {"messaging_product": "whatsapp", "messages": [{"id": f"wamid.{uuid.uuid4().hex}"}]}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors,
+                    "accepted": len(self.accepted), "duplicates": self.duplicates}
@@ -0,0 +1,31 @@
+# notifications/management/commands/archive_notifications.py
+from django.core.management.base import BaseCommand
+
+from notifications.retention import archive_old_notifications, engagement_by_channel, refresh_daily_rollups, unread_by_role
+
+
+class Command(BaseCommand):
+    help = ("Refresh the daily engagement rollups and archive notifications older than "
+            "NOTIFY_RETENTION_MONTHS. --check prints the dashboard figures before and after.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-days", type=int, default=None, help="Days archived in this run.")
+        parser.add_argument("--rollups-only", action="store_true")
+        parser.add_argument("--check", action="store_true",
+                            help="Compare 30/90-day engagement and unread by role before/after archival.")
+
+    def _figures(self):
+        return {"30d": engagement_by_channel(30), "90d": engagement_by_channel(90), "unread_by_role": unread_by_role()}
+
+    def handle(self, *args, **opts):
+        self.stdout.write(f"Rollups: {refresh_daily_rollups()}")
+        if opts["rollups_only"]:
+            return
+        before = self._figures() if opts["check"] else None
+        self.stdout.write(f"Archive: {archive_old_notifications(opts['max_days'])}")
+        if before is not None:
+            after = self._figures()
+            if before == after:
+                self.stdout.write(self.style.SUCCESS("Dashboard figures unchanged."))
+            else:
+                self.stdout.write(self.style.ERROR(f"Dashboard figures changed:\nbefore={before}\nafter={after}"))
@@ -0,0 +1,218 @@
+# notifications/management/commands/benchmark_notifications.py
+import time
+from collections import Counter
+
+from celery.signals import task_retry
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from authentication.models import User
+from employee.models import Employee
+from notifications.loadtest import StubProvider, percentile, tag
+from notifications.models import Notification, NotificationPreference
+from notifications.recipients import invalidate
+from notifications.tasks import create_bulk_notifications, send_notification
+
+CHANNELS = {"sms": "SMS", "whatsapp": "WHATSAPP"}
+USER_PREFIX = "bench_notif_"
+
+
+class Command(BaseCommand):
+    help = ("Load-test the notification pipeline against local Twilio / WhatsApp Cloud stubs: "
+            "messages/sec, p50/p99 enqueue->provider latency, DB queries per message, retries. "
+            "--mode eager runs everything in this process inside a rolled-back transaction; "
+            "--mode workers commits N throw-away users and drives real Celery workers, which must "
+            "run with TWILIO_API_BASE / WHATSAPP_API_BASE pointing at the stub ports "
+            "(the bench users are deleted afterwards).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--path", choices=["single", "bulk", "both"], default="both",
+                            help="send_notification per user, create_bulk_notifications, or both.")
+        parser.add_argument("--channels", default="sms,whatsapp", help="Preference channels, assigned round-robin.")
+        parser.add_argument("--mode", choices=["eager", "workers"], default="eager")
+        parser.add_argument("--latency-ms", type=float, default=50.0)
+        parser.add_argument("--jitter-ms", type=float, default=10.0)
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Share of provider calls answered with an error.")
+        parser.add_argument("--error-status", type=int, default=500, help="500 or 429.")
+        parser.add_argument("--twilio-port", type=int, default=0, help="0 = any free port (eager only).")
+        parser.add_argument("--whatsapp-port", type=int, default=0)
+        parser.add_argument("--priority", type=int, default=2, help="2 keeps the sends out of quiet hours.")
+        parser.add_argument("--throttle", action="store_true",
+                            help="Keep the NOTIFY_PROVIDER_RATES token buckets (off by default in eager mode).")
+        parser.add_argument("--timeout", type=float, default=300.0, help="Seconds to wait for workers.")
+        parser.add_argument("--seed", type=int, default=None)
+
+    # ---------------- setup ----------------
+
+    def _make_users(self, n, channels, run_tag):
+        pwd = make_password(None)
+        users = User.objects.bulk_create([
+            User(username=f"{USER_PREFIX}{run_tag}_{i}", email=f"bench{i}@example.com", role="EMP", password=pwd)
+            for i in range(n)
+        ])
+        if any(u.pk is None for u in users):
+            users = list(User.objects.filter(username__startswith=f"{USER_PREFIX}{run_tag}_").order_by("id"))
+        Employee.objects.bulk_create([
+            Employee(user_id=u.pk, first_name="Bench", last_name=str(i), gender="M",
+                     employment_type="bench", contact=f"+22507{i:08d}")
+            for i, u in enumerate(users)
+        ])
+        NotificationPreference.objects.bulk_create([
+            NotificationPreference(user_id=u.pk, channel=channels[i % len(channels)],
+                                   contact=f"+22507{i:08d}", is_active=True)
+            for i, u in enumerate(users)
+        ])
+        return [u.pk for u in users]
+
+    def _cleanup(self, run_tag):
+        ids = list(User.objects.filter(username__startswith=f"{USER_PREFIX}{run_tag}_").values_list("id", flat=True))
+        Notification.objects.filter(user_id__in=ids).delete()
+        Employee.objects.filter(user_id__in=ids).delete()
+        User.objects.filter(id__in=ids).delete()
+        invalidate(ids)
+
+    # ---------------- one scenario ----------------
+
+    def _drive(self, path, user_ids, offset, opts, eager):
+        t0 = {}
+        priority = opts["priority"]
+        if path == "single":
+            for i, uid in enumerate(user_ids):
+                key = str(offset + i)
+                t0[key] = time.monotonic()
+                msg = f"Test de charge {tag(offset + i)}"
+                if eager:
+                    send_notification.apply(args=(uid, msg), kwargs={"title": "Bench", "category": "bench", "priority": priority})
+                else:
+                    send_notification.delay(uid, msg, title="Bench", category="bench", priority=priority)
+        else:
+            items = [(uid, f"Test de charge {tag(offset + i)}", "Bench") for i, uid in enumerate(user_ids)]
+            start = time.monotonic()
+            for i in range(len(user_ids)):
+                t0[str(offset + i)] = start
+            create_bulk_notifications(items, category="bench", priority=priority)
+        return t0
+
+    def _last_id(self):
+        return Notification.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+    def _wait(self, stubs, t0, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if sum(1 for k in t0 if any(k in s.accepted for s in stubs)) >= len(t0):
+                return True
+            time.sleep(0.2)
+        return False
+
+    def _report(self, path, t0, stubs, before, queries, retries, user_ids, since_id, elapsed_total):
+        accepted = {}
+        for s in stubs:
+            for k, t in s.accepted.items():
+                if k in t0:
+                    accepted[k] = t
+        latencies = [(accepted[k] - t0[k]) * 1000.0 for k in accepted]
+        start = min(t0.values()) if t0 else 0.0
+        end = max(accepted.values()) if accepted else start
+        wall = max(end - start, 1e-9) if accepted else elapsed_total
+        after = [s.stats() for s in stubs]
+        provider_errors = sum(a["errors"] - b["errors"] for a, b in zip(after, before))
+        duplicates = sum(a["duplicates"] - b["duplicates"] for a, b in zip(after, before))
+        rows = Notification.objects.filter(user_id__in=user_ids, category="bench", id__gt=since_id)
+        statuses = Counter(rows.values_list("status", flat=True))
+        retry_count = sum(rows.values_list("retry_count", flat=True))
+        n = len(t0)
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{path} ({n} messages)"))
+        self.stdout.write(f"  accepted by provider : {len(accepted)}/{n}")
+        self.stdout.write(f"  throughput           : {len(accepted) / wall:,.1f} msg/s over {wall:.2f}s")
+        self.stdout.write(f"  latency p50 / p99    : {percentile(latencies, 50):.1f} / {percentile(latencies, 99):.1f} ms")
+        if queries is not None:
+            self.stdout.write(f"  DB queries           : {queries} ({queries / max(n, 1):.2f} per message)")
+        else:
+            self.stdout.write("  DB queries           : n/a (run on workers)")
+        self.stdout.write(f"  provider errors      : {provider_errors}  (duplicate sends: {duplicates})")
+        self.stdout.write(f"  retries              : {retries if retries is not None else 'n/a'} task retries, "
+                          f"{retry_count} notification retry_count")
+        self.stdout.write(f"  final statuses       : {dict(statuses)}")
+
+    # ---------------- entry point ----------------
+
+    def handle(self, *args, **opts):
+        channels = []
+        for c in opts["channels"].split(","):
+            c = c.strip().lower()
+            if c not in CHANNELS:
+                raise CommandError(f"Unknown channel {c!r} (use sms, whatsapp).")
+            channels.append(CHANNELS[c])
+        eager = opts["mode"] == "eager"
+        if not eager and not (opts["twilio_port"] and opts["whatsapp_port"]):
+            raise CommandError("--mode workers needs fixed --twilio-port and --whatsapp-port for the workers' settings.")
+        paths = ["single", "bulk"] if opts["path"] == "both" else [opts["path"]]
+        n = opts["users"]
+
+        stub_opts = dict(latency_ms=opts["latency_ms"], jitter_ms=opts["jitter_ms"], error_rate=opts["error_rate"],
+                         error_status=opts["error_status"], seed=opts["seed"])
+        twilio = StubProvider("twilio", port=opts["twilio_port"], **stub_opts).start()
+        whatsapp = StubProvider("whatsapp_cloud", port=opts["whatsapp_port"], **stub_opts).start()
+        stubs = [twilio, whatsapp]
+        self.stdout.write(f"Stubs: TWILIO_API_BASE={twilio.base_url} WHATSAPP_API_BASE={whatsapp.base_url} "
+                          f"(latency {opts['latency_ms']}±{opts['jitter_ms']} ms, errors {opts['error_rate']:.0%})")
+
+        overrides = dict(
+            TWILIO_API_BASE=twilio.base_url, WHATSAPP_API_BASE=whatsapp.base_url,
+            TWILIO_ACCOUNT_SID="ACbench", TWILIO_AUTH_TOKEN="bench", TWILIO_FROM="+15550000000",
+            WHATSAPP_TOKEN="bench", WHATSAPP_PHONE_NUMBER_ID="100000", NOTIFY_TWILIO_CALLBACK=None,
+            NOTIFY_QUIET_HOURS=None,
+        )
+        if not opts["throttle"]:
+            overrides["NOTIFY_PROVIDER_RATES"] = {}
+
+        retries = Counter()
+
+        def _on_retry(sender=None, **kw):
+            retries[getattr(sender, "name", "?")] += 1
+
+        run_tag = str(int(time.time()))
+        task_retry.connect(_on_retry, weak=False)
+        from config.celery import celery_app
+        was_eager = celery_app.conf.task_always_eager
+        user_ids = []
+        try:
+            if eager:
+                celery_app.conf.task_always_eager = True
+                with override_settings(**overrides), transaction.atomic():
+                    user_ids = self._make_users(n, channels, run_tag)
+                    for k, path in enumerate(paths):
+                        before = [s.stats() for s in stubs]
+                        since_id = self._last_id()
+                        retries.clear()
+                        t_start = time.monotonic()
+                        with CaptureQueriesContext(connection) as ctx, \
+                                TestCase.captureOnCommitCallbacks(execute=True):
+                            t0 = self._drive(path, user_ids, k * n, opts, eager=True)
+                        self._report(path, t0, stubs, before, len(ctx.captured_queries), sum(retries.values()),
+                                     user_ids, since_id, time.monotonic() - t_start)
+                    transaction.set_rollback(True)
+            else:
+                user_ids = self._make_users(n, channels, run_tag)
+                for k, path in enumerate(paths):
+                    before = [s.stats() for s in stubs]
+                    since_id = self._last_id()
+                    t_start = time.monotonic()
+                    t0 = self._drive(path, user_ids, k * n, opts, eager=False)
+                    if not self._wait(stubs, t0, opts["timeout"]):
+                        self.stdout.write(self.style.WARNING(f"{path}: timed out after {opts['timeout']}s"))
+                    self._report(path, t0, stubs, before, None, None, user_ids, since_id, time.monotonic() - t_start)
+        finally:
+            celery_app.conf.task_always_eager = was_eager
+            task_retry.disconnect(_on_retry)
+            if eager:
+                invalidate(user_ids)      # ids were rolled back and may be reused
+            else:
+                self._cleanup(run_tag)
+            for s in stubs:
+                s.stop()
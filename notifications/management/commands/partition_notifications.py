@@ -0,0 +1,31 @@
+# notifications/management/commands/partition_notifications.py
+from django.core.management.base import BaseCommand, CommandError
+
+from notifications.partitioning import convert_to_partitioned, ensure_partitions
+
+
+class Command(BaseCommand):
+    help = ("Convert notifications_notification into a table partitioned by month on timestamp "
+            "(PostgreSQL, run once in a maintenance window), or just create upcoming partitions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months-ahead", type=int, default=3)
+        parser.add_argument("--dry-run", action="store_true", help="Print the statements without running them.")
+        parser.add_argument("--ensure", action="store_true",
+                            help="Only create missing partitions on an already partitioned table.")
+
+    def handle(self, *args, **opts):
+        if opts["ensure"]:
+            created = ensure_partitions(opts["months_ahead"])
+            self.stdout.write(self.style.SUCCESS(f"Partitions created: {', '.join(created) or 'none'}"))
+            return
+        try:
+            statements = convert_to_partitioned(opts["months_ahead"], dry_run=opts["dry_run"])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        for sql in statements:
+            self.stdout.write(sql + ";")
+        if opts["dry_run"]:
+            self.stdout.write(self.style.WARNING("Dry run: nothing was changed."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{len(statements)} statements applied."))
@@ -0,0 +1,32 @@
+# notifications/management/commands/run_outbox_relay.py
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from notifications.outbox import relay, wait_for_wake
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Long-running outbox relay: publishes outbox rows as soon as their transaction commits "
+            "(Redis wake-up), polling every NOTIFY_OUTBOX_POLL_SECONDS otherwise.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Relay what is due and exit.")
+
+    def handle(self, *args, **opts):
+        poll = float(getattr(settings, "NOTIFY_OUTBOX_POLL_SECONDS", 5))
+        while True:
+            close_old_connections()
+            try:
+                result = relay()
+                if result["sent"] or result["failed"]:
+                    self.stdout.write(f"Outbox: {result}")
+            except Exception:
+                logger.exception("Outbox relay pass failed")
+            if opts["once"]:
+                return
+            wait_for_wake(poll)
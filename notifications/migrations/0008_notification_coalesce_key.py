@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0007_notification_scheduling'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='coalesce_key',
+            field=models.CharField(blank=True, default='', max_length=96),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['coalesce_key', 'status'], name='notificatio_coalesc_f22625_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 # notifications/models.py
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from authentication.models import User
 
@@ -27,7 +28,8 @@ class Notification(models.Model):
     CHANNEL_CHOICES = [('SMS','SMS'), ('EMAIL','Email'), ('WHATSAPP','WhatsApp'), ('INAPP','InApp')]
     STATUS_CHOICES = [
         ('pending','Pending'), ('queued','Queued'), ('sending','Sending'),
-        ('sent','Sent'), ('delivered','Delivered'), ('read','Read'), ('failed','Failed')
+        ('sent','Sent'), ('delivered','Delivered'), ('read','Read'), ('failed','Failed'),
+        ('expired','Expired'),  # NEW: dropped unsent after expires_at
     ]
 
     user = models.ForeignKey(User, null=True, blank=True, on_delete=models.CASCADE, related_name='notifications')
@@ -50,6 +52,8 @@ class Notification(models.Model):
 
     scheduled_for = models.DateTimeField(null=True, blank=True)
     expires_at = models.DateTimeField(null=True, blank=True)
+    coalesce_key = models.CharField(max_length=96, blank=True, default='')  # NEW: set on digest rows (category:user)
+    claimed_at = models.DateTimeField(null=True, blank=True)                # NEW: when the row went to 'sending'
 
     timestamp = models.DateTimeField(auto_now_add=True)
 
@@ -61,6 +65,11 @@ class Notification(models.Model):
             models.Index(fields=['channel','status']),
             models.Index(fields=['timestamp']),             # NEW
             models.Index(fields=['is_read','timestamp']),  # NEW
+            models.Index(fields=['status','scheduled_for']),  # NEW: scheduled release poll
+            models.Index(fields=['status','expires_at']),     # NEW: expiry sweep
+            models.Index(fields=['coalesce_key','status']),   # NEW: open digest lookup
+            models.Index(fields=['provider_message_id']),     # NEW: status webhook lookup
+            models.Index(fields=['status','claimed_at']),     # NEW: stale 'sending' reaper
         ]
 
     def mark_read(self):
@@ -96,6 +105,77 @@ class NotificationPreference(models.Model):
         return f"{self.user.username if self.user else 'unknown'} prefers {self.channel} at {self.contact}"
 
 
+# NEW: retention (see notifications/retention.py)
+class NotificationDailyStat(models.Model):
+    """Daily engagement rollup; dashboards read this instead of raw rows (kept after archival)."""
+    day = models.DateField()
+    channel = models.CharField(max_length=10)
+    category = models.CharField(max_length=32, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    delivered = models.PositiveIntegerField(default=0)   # delivered or read
+    read = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-day', 'channel']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'channel', 'category'], name='uniq_notif_daily_stat'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.channel}/{self.category or '-'}: {self.total}"
+
+
+class NotificationArchive(models.Model):
+    """One archived day: its rows live in a gzipped JSONL file in default storage."""
+    day = models.DateField(unique=True)
+    path = models.CharField(max_length=255)
+    rows = models.PositiveIntegerField(default=0)
+    unread = models.PositiveIntegerField(default=0)
+    first_id = models.BigIntegerField(null=True, blank=True)
+    last_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-day']
+
+    def __str__(self):
+        return f"{self.day}: {self.rows} rows -> {self.path}"
+
+
+# NEW: transactional outbox (see notifications/outbox.py)
+class OutboxMessage(models.Model):
+    """A Celery task to enqueue once the transaction that wrote it has committed."""
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True, encoder=DjangoJSONEncoder)
+    kwargs = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)   # pushed back after a failed publish
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['dispatched_at', 'available_at']),   # relay poll
+        ]
+
+    def __str__(self):
+        return f"{self.task}{tuple(self.args)} ({'sent' if self.dispatched_at else 'pending'})"
+
+
+class ArchivedUnreadCount(models.Model):
+    """Unread notifications per user that were archived (keeps all-time unread totals stable)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='archived_unread')
+    count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.count}"
+
+
 
 
 
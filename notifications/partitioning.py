@@ -0,0 +1,199 @@
+# notifications/partitioning.py
+"""
+Monthly range partitioning of notifications_notification on "timestamp" (PostgreSQL only).
+
+The conversion is opt-in and done once, in a maintenance window, by
+`python manage.py partition_notifications` (one transaction: the table is renamed, a
+partitioned copy with the same columns, checks, indexes and FKs is created, rows are copied,
+the legacy table is dropped). The primary key becomes (id, timestamp), as PostgreSQL requires
+the partition key in unique constraints; Django keeps using id.
+
+Afterwards retention.archive_old_notifications keeps NOTIFY_PARTITION_MONTHS_AHEAD months of
+partitions ahead and drops month partitions emptied by archival. Everything here is a no-op on
+other databases or when the table is not partitioned.
+"""
+from __future__ import annotations
+
+import logging
+import re
+from datetime import date, datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+TABLE = Notification._meta.db_table
+LEGACY = f"{TABLE}_legacy"
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_RE = re.compile(rf"^{re.escape(TABLE)}_p(\d{{4}})(\d{{2}})$")
+
+
+def _add_month(d: date, k: int = 1) -> date:
+    y = d.year + (d.month + k - 1) // 12
+    m = (d.month + k - 1) % 12 + 1
+    return date(y, m, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{TABLE}_p{month:%Y%m}"
+
+
+def _bound(month: date) -> str:
+    return timezone.make_aware(datetime(month.year, month.month, 1)).isoformat()
+
+
+def is_postgres() -> bool:
+    return connection.vendor == "postgresql"
+
+
+def is_partitioned(cursor, table: str = TABLE) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = %s AND pg_table_is_visible(c.oid)", [table],
+    )
+    return cursor.fetchone() is not None
+
+
+def _create_partition_sql(month: date) -> tuple:
+    return (
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(month)}" PARTITION OF "{TABLE}" '
+        f"FOR VALUES FROM (%s) TO (%s)",
+        [_bound(month), _bound(_add_month(month))],
+    )
+
+
+def partitions(cursor) -> dict:
+    """{month: partition name} of the existing month partitions."""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass", [TABLE],
+    )
+    out = {}
+    for (name,) in cursor.fetchall():
+        m = PARTITION_RE.match(name)
+        if m:
+            out[date(int(m.group(1)), int(m.group(2)), 1)] = name
+    return out
+
+
+def ensure_partitions(months_ahead: int = None) -> list:
+    """Create this month's and the next `months_ahead` month partitions if missing."""
+    if not is_postgres():
+        return []
+    months_ahead = int(months_ahead if months_ahead is not None
+                       else getattr(settings, "NOTIFY_PARTITION_MONTHS_AHEAD", 3))
+    created = []
+    with connection.cursor() as cur:
+        if not is_partitioned(cur):
+            return []
+        existing = partitions(cur)
+        month = timezone.localdate().replace(day=1)
+        for k in range(months_ahead + 1):
+            m = _add_month(month, k)
+            if m in existing:
+                continue
+            try:
+                with transaction.atomic():
+                    sql, params = _create_partition_sql(m)
+                    cur.execute(sql, params)
+                created.append(partition_name(m))
+            except Exception as e:
+                # e.g. rows for that month already sit in the default partition
+                logger.warning("Could not create partition %s: %s", partition_name(m), e)
+    return created
+
+
+def drop_empty_partitions(before: date) -> list:
+    """Drop month partitions that end on or before `before` and hold no rows (archived)."""
+    if not is_postgres():
+        return []
+    dropped = []
+    with connection.cursor() as cur:
+        if not is_partitioned(cur):
+            return []
+        for month, name in sorted(partitions(cur).items()):
+            if _add_month(month) > before:
+                continue
+            cur.execute(f'SELECT EXISTS (SELECT 1 FROM "{name}")')
+            if cur.fetchone()[0]:
+                continue
+            with transaction.atomic():
+                cur.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+                cur.execute(f'DROP TABLE "{name}"')
+            dropped.append(name)
+    return dropped
+
+
+def convert_to_partitioned(months_ahead: int = 3, dry_run: bool = False) -> list:
+    """
+    Convert the plain table into a partitioned one. Returns the executed (or planned)
+    statements. Raises if not on PostgreSQL or already partitioned.
+    """
+    if not is_postgres():
+        raise RuntimeError("Partitioning is only supported on PostgreSQL.")
+    statements = []
+
+    def run(cur, sql, params=None):
+        statements.append(cur.mogrify(sql, params).decode() if params and hasattr(cur, "mogrify") else sql)
+        if not dry_run:
+            cur.execute(sql, params)
+
+    with transaction.atomic(), connection.cursor() as cur:
+        if is_partitioned(cur):
+            raise RuntimeError(f"{TABLE} is already partitioned.")
+
+        cur.execute(f'SELECT MIN("timestamp") FROM "{TABLE}"')
+        oldest = cur.fetchone()[0]
+        # secondary indexes and foreign keys are re-created on the new table
+        cur.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN "
+            "(SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype IN ('p', 'u'))",
+            [TABLE, TABLE],
+        )
+        indexes = cur.fetchall()
+        cur.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'", [TABLE],
+        )
+        fks = cur.fetchall()
+        cur.execute(
+            "SELECT attidentity FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id'", [TABLE],
+        )
+        identity = (cur.fetchone() or [""])[0]
+        cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        sequence = cur.fetchone()[0]
+
+        run(cur, f'ALTER TABLE "{TABLE}" RENAME TO "{LEGACY}"')
+        run(cur, f'CREATE TABLE "{TABLE}" (LIKE "{LEGACY}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS '
+                 f'INCLUDING IDENTITY INCLUDING STORAGE) PARTITION BY RANGE ("timestamp")')
+        run(cur, f'ALTER TABLE "{TABLE}" ADD PRIMARY KEY ("id", "timestamp")')
+
+        first = timezone.localtime(oldest).date().replace(day=1) if oldest else timezone.localdate().replace(day=1)
+        last = _add_month(timezone.localdate().replace(day=1), months_ahead)
+        month = first
+        while month <= last:
+            sql, params = _create_partition_sql(month)
+            run(cur, sql, params)
+            month = _add_month(month)
+        run(cur, f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{TABLE}" DEFAULT')
+
+        run(cur, f'INSERT INTO "{TABLE}" SELECT * FROM "{LEGACY}"')
+        if not identity and sequence:
+            # serial column: keep the sequence alive when the legacy table goes
+            run(cur, f'ALTER SEQUENCE {sequence} OWNED BY "{TABLE}"."id"')
+        run(cur, f'DROP TABLE "{LEGACY}"')
+
+        for name, definition in indexes:
+            definition = re.sub(rf'ON (\S+\.)?"?{re.escape(TABLE)}"?\s', f'ON "{TABLE}" ', definition, count=1)
+            run(cur, definition)
+        for name, definition in fks:
+            run(cur, f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{name}" {definition}')
+        if identity:
+            run(cur, f"SELECT setval(pg_get_serial_sequence('\"{TABLE}\"', 'id'), "
+                     f'COALESCE((SELECT MAX("id") FROM "{TABLE}"), 0) + 1, false)')
+        run(cur, f'ANALYZE "{TABLE}"')
+    return statements
@@ -1,11 +1,190 @@
 # notifications/providers/base.py
+"""
+HTTP provider clients.
+
+Every provider keeps one pooled requests.Session per process (keep-alive, bounded pool),
+recreated after a fork so Celery prefork children never share sockets. send_many() pushes
+a list of messages concurrently on an aiohttp session, under a per-provider token bucket
+(NOTIFY_PROVIDER_RATES, messages/second) and NOTIFY_BATCH_CONCURRENCY in-flight requests.
+Base URLs come from settings, so everything can be pointed at a local stub server.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
 from dataclasses import dataclass
 
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except Exception:
+    aiohttp = None
+    HAS_AIOHTTP = False
+
+logger = logging.getLogger(__name__)
+
+
 @dataclass
 class ProviderResult:
     message_id: str
     delivered: bool = False
     raw: dict | None = None
 
+
+@dataclass
+class HttpCall:
+    method: str
+    url: str
+    json: dict | None = None
+    data: dict | None = None
+    headers: dict | None = None
+    auth: tuple | None = None    # (user, password) basic auth
+
+
+class AsyncRateLimiter:
+    """Token bucket for one event loop: `rate` acquisitions per second, bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _json_or_empty(response) -> dict:
+    try:
+        data = response.json()
+        return data if isinstance(data, dict) else {"data": data}
+    except ValueError:
+        return {}
+
+
 class BaseProvider:
-    def send(self, to: str, message: str, **kwargs) -> ProviderResult: ...
+    """
+    Subclasses describe one request (build_call), how to read a 2xx body (parse) and which
+    exception a 4xx/5xx becomes (error); sync and batch sends share them.
+    """
+    name = "base"
+
+    def __init__(self):
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    # ---------- config ----------
+
+    @property
+    def pool_size(self) -> int:
+        return int(getattr(settings, "NOTIFY_PROVIDER_POOL_SIZE", 20))
+
+    @property
+    def timeout(self) -> float:
+        return float(getattr(settings, "NOTIFY_PROVIDER_TIMEOUT", 15))
+
+    @property
+    def rate(self) -> float:
+        return float((getattr(settings, "NOTIFY_PROVIDER_RATES", {}) or {}).get(self.name, 50))
+
+    @property
+    def concurrency(self) -> int:
+        return int(getattr(settings, "NOTIFY_BATCH_CONCURRENCY", 50))
+
+    # ---------- to implement ----------
+
+    def build_call(self, to: str, message: str, **kwargs) -> HttpCall:
+        raise NotImplementedError
+
+    def parse(self, status: int, data: dict) -> ProviderResult:
+        raise NotImplementedError
+
+    def error(self, status: int, data: dict, response=None) -> Exception:
+        return requests.HTTPError(f"{self.name}: HTTP {status}: {data}", response=response)
+
+    # ---------- sync ----------
+
+    def session(self) -> requests.Session:
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    s = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+                    s.mount("https://", adapter)
+                    s.mount("http://", adapter)
+                    self._session, self._session_pid = s, pid
+        return self._session
+
+    def send(self, to: str, message: str, **kwargs) -> ProviderResult:
+        call = self.build_call(to, message, **kwargs)
+        r = self.session().request(call.method, call.url, json=call.json, data=call.data,
+                                   headers=call.headers, auth=call.auth, timeout=self.timeout)
+        data = _json_or_empty(r)
+        if r.status_code >= 400:
+            raise self.error(r.status_code, data, response=r)
+        return self.parse(r.status_code, data)
+
+    # ---------- batch ----------
+
+    def send_many(self, messages) -> list:
+        """
+        messages: (to, message) or (to, message, kwargs) tuples.
+        Returns, in order, a ProviderResult or the exception raised for each message.
+        Runs its own event loop: call it from sync code (Celery tasks), not from async views.
+        """
+        messages = [m if len(m) > 2 else (m[0], m[1], {}) for m in messages]
+        if not messages:
+            return []
+        if not HAS_AIOHTTP:
+            return [self._send_safe(to, text, **kw) for to, text, kw in messages]
+        return asyncio.run(self._send_many_async(messages))
+
+    def _send_safe(self, to, message, **kwargs):
+        try:
+            return self.send(to, message, **kwargs)
+        except Exception as e:
+            return e
+
+    async def _send_many_async(self, messages) -> list:
+        limiter = AsyncRateLimiter(self.rate)
+        sem = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=30)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+            async def one(to, text, kw):
+                async with sem:
+                    await limiter.acquire()
+                    try:
+                        call = self.build_call(to, text, **kw)
+                        auth = aiohttp.BasicAuth(*call.auth) if call.auth else None
+                        async with http.request(call.method, call.url, json=call.json, data=call.data,
+                                                headers=call.headers, auth=auth) as r:
+                            try:
+                                data = await r.json(content_type=None)
+                            except ValueError:
+                                data = {}
+                            data = data if isinstance(data, dict) else {"data": data}
+                            if r.status >= 400:
+                                return self.error(r.status, data)
+                            return self.parse(r.status, data)
+                    except Exception as e:
+                        return e
+
+            return await asyncio.gather(*(one(*m) for m in messages))
@@ -1,12 +1,46 @@
 # notifications/providers/sms_twilio.py
-from twilio.rest import Client
 from django.conf import settings
-from .base import ProviderResult
+from twilio.base.exceptions import TwilioRestException
+from .base import BaseProvider, HttpCall, ProviderResult
+
+
+class TwilioProvider(BaseProvider):
+    """
+    Twilio Messages REST API over the shared pooled session (instead of a new Client per
+    call). Errors are raised as TwilioRestException, like the SDK, so e.code checks still work.
+    """
+    name = "twilio"
+
+    def sender(self) -> str:
+        return settings.TWILIO_FROM
+
+    def recipient(self, to: str) -> str:
+        return to
+
+    def status_callback(self):
+        return getattr(settings, 'NOTIFY_TWILIO_CALLBACK', None)
+
+    def build_call(self, to: str, message: str, **kwargs) -> HttpCall:
+        sid = getattr(settings, "TWILIO_ACCOUNT_SID", None)
+        token = getattr(settings, "TWILIO_AUTH_TOKEN", None)
+        if not sid or not token:
+            raise RuntimeError("Twilio credentials are not configured.")
+        base = (getattr(settings, "TWILIO_API_BASE", "") or "https://api.twilio.com").rstrip("/")
+        data = {"To": self.recipient(to), "From": self.sender(), "Body": message}
+        if self.status_callback():
+            data["StatusCallback"] = self.status_callback()
+        return HttpCall(method="POST", url=f"{base}/2010-04-01/Accounts/{sid}/Messages.json", data=data, auth=(sid, token))
+
+    def parse(self, status: int, data: dict) -> ProviderResult:
+        return ProviderResult(message_id=data.get("sid", ""), delivered=False, raw={'sid': data.get("sid", "")})
+
+    def error(self, status: int, data: dict, response=None) -> Exception:
+        uri = getattr(getattr(response, "request", None), "url", "") or ""
+        return TwilioRestException(status, uri, msg=data.get("message") or "", code=data.get("code"))
+
+
+twilio_sms = TwilioProvider()
+
 
 def send_sms_twilio(to: str, message: str) -> ProviderResult:
-    client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-    msg = client.messages.create(
-        to=to, from_=settings.TWILIO_FROM, body=message,
-        status_callback=getattr(settings, 'NOTIFY_TWILIO_CALLBACK', None)
-    )
-    return ProviderResult(message_id=msg.sid, delivered=False, raw={'sid': msg.sid})
+    return twilio_sms.send(to, message)
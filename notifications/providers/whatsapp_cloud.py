@@ -1,5 +1,4 @@
 # notifications/providers/whatsapp_cloud.py
-import requests
 from django.conf import settings
 from .base import ProviderResult
 
@@ -22,38 +21,47 @@ from .base import ProviderResult
 #     return ProviderResult(message_id=mid, delivered=False, raw=data)
 
 
-import requests
 from django.conf import settings
-from . base import ProviderResult
+from . base import BaseProvider, HttpCall, ProviderResult
 from requests.exceptions import HTTPError
 
-def send_whatsapp_cloud(to: str, message: str) -> ProviderResult:
-    url = f"https://graph.facebook.com/v23.0/{settings.WHATSAPP_PHONE_NUMBER_ID}/messages"
-    headers = {
-        'Authorization': f'Bearer {settings.WHATSAPP_TOKEN}',
-        'Content-Type': 'application/json'
-    }
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": to,
-        "type": "text",
-        "text": {"preview_url": False, "body": message}
-    }
-    
-    try:
-        r = requests.post(url, headers=headers, json=payload, timeout=15)
-        r.raise_for_status()
-        data = r.json()
+
+class WhatsAppCloudProvider(BaseProvider):
+    name = "whatsapp_cloud"
+
+    def build_call(self, to: str, message: str, **kwargs) -> HttpCall:
+        base = (getattr(settings, "WHATSAPP_API_BASE", "") or "https://graph.facebook.com").rstrip("/")
+        version = getattr(settings, "WHATSAPP_API_VERSION", "") or "v23.0"
+        return HttpCall(
+            method="POST",
+            url=f"{base}/{version}/{settings.WHATSAPP_PHONE_NUMBER_ID}/messages",
+            headers={
+                'Authorization': f'Bearer {settings.WHATSAPP_TOKEN}',
+                'Content-Type': 'application/json'
+            },
+            json={
+                "messaging_product": "whatsapp",
+                "to": to,
+                "type": "text",
+                "text": {"preview_url": False, "body": message}
+            },
+        )
+
+    def parse(self, status: int, data: dict) -> ProviderResult:
         mid = (data.get('messages') or [{}])[0].get('id', '')
         return ProviderResult(message_id=mid, delivered=False, raw=data)
-    except HTTPError as e:
-        if r.status_code == 401:
-            # Log detailed error response for debugging
-            error_data = r.json() if r.content else {'error': 'No response body'}
-            raise HTTPError(f"401 Unauthorized: {error_data.get('error', {}).get('message', 'Unknown error')}")
-        raise
 
+    def error(self, status: int, data: dict, response=None) -> Exception:
+        err = data.get('error') or {}
+        detail = err.get('message', 'Unknown error') if isinstance(err, dict) else str(err)
+        if status == 401:
+            # Log detailed error response for debugging
+            return HTTPError(f"401 Unauthorized: {detail}", response=response)
+        return HTTPError(f"{status} Error: {detail}", response=response)
 
 
+whatsapp_cloud = WhatsAppCloudProvider()
 
 
+def send_whatsapp_cloud(to: str, message: str) -> ProviderResult:
+    return whatsapp_cloud.send(to, message)
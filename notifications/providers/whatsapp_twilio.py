@@ -1,8 +1,7 @@
 # notifications/providers/whatsapp_twilio.py
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioRestException
 from django.conf import settings
 from .base import ProviderResult
+from .sms_twilio import TwilioProvider
 import logging
 logger = logging.getLogger(__name__)
 
@@ -25,6 +24,34 @@ def _from_whatsapp_addr() -> str:
         raise RuntimeError("TWILIO_WHATSAPP_FROM is not configured.")
     return sender if sender.startswith("whatsapp:") else f"whatsapp:{sender}"
 
+class TwilioWhatsAppProvider(TwilioProvider):
+    name = "twilio_whatsapp"
+
+    def sender(self) -> str:
+        return _from_whatsapp_addr()
+
+    def recipient(self, to: str) -> str:
+        return _to_whatsapp_addr(to)
+
+    def status_callback(self):
+        return None
+
+    def parse(self, status: int, data: dict) -> ProviderResult:
+        # Twilio returns a Message resource with sid/status/etc.
+        raw = {
+            "sid": data.get("sid"),
+            "status": data.get("status"),
+            "num_segments": data.get("num_segments"),
+            "error_code": data.get("error_code"),
+            "error_message": data.get("error_message"),
+        }
+        logger.info("Twilio WA sent to=%s sid=%s status=%s", data.get("to"), raw["sid"], raw["status"])
+        return ProviderResult(message_id=raw["sid"] or "", delivered=False, raw=raw)
+
+
+twilio_whatsapp = TwilioWhatsAppProvider()
+
+
 def send_whatsapp_twilio(to_e164: str, message: str) -> ProviderResult:
     """
     Send a WhatsApp message via Twilio's WhatsApp channel.
@@ -33,34 +60,7 @@ def send_whatsapp_twilio(to_e164: str, message: str) -> ProviderResult:
       - settings.TWILIO_ACCOUNT_SID
       - settings.TWILIO_AUTH_TOKEN
       - settings.TWILIO_WHATSAPP_FROM (e.g. '+14155238886' or 'whatsapp:+14155238886')
-    """
-    account_sid = getattr(settings, "TWILIO_ACCOUNT_SID", None)
-    auth_token = getattr(settings, "TWILIO_AUTH_TOKEN", None)
-    if not account_sid or not auth_token:
-        raise RuntimeError("Twilio credentials are not configured.")
-
-    client = Client(account_sid, auth_token)
 
-    from_addr = _from_whatsapp_addr()
-    to_addr = _to_whatsapp_addr(to_e164)
-
-    try:
-        msg = client.messages.create(
-            from_=from_addr,
-            to=to_addr,
-            body=message,
-        )
-        logger.info("Twilio WA sent from=%s to=%s sid=%s status=%s", from_addr, to_addr, msg.sid, msg.status)
-        
-        # Twilio returns a Message instance with sid/status/etc.
-        raw = {
-            "sid": msg.sid,
-            "status": msg.status,
-            "num_segments": getattr(msg, "num_segments", None),
-            "error_code": getattr(msg, "error_code", None),
-            "error_message": getattr(msg, "error_message", None),
-        }
-        return ProviderResult(message_id=msg.sid, delivered=False, raw=raw)
-    except TwilioRestException as e:
-        # Surface Twilio error for upstream handling/fallback
-        raise
+    Raises TwilioRestException on API errors (surfaced for upstream handling/fallback).
+    """
+    return twilio_whatsapp.send(to_e164, message)
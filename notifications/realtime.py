@@ -0,0 +1,174 @@
+# notifications/realtime.py
+"""
+Real-time notification center.
+
+  - Unread counters: one Redis integer per user (notify:unread:<id>). The first read seeds it
+    from the database, then creates/reads adjust it, so unread_count is a single GET.
+    Counters only move when they already exist (incr-if-exists), and expire after
+    NOTIFY_UNREAD_TTL so any drift (e.g. rows changed by raw updates) heals itself.
+  - Push: every change is PUBLISHed on notify:user:<id>; the SSE endpoint
+    (views.notification_stream, served by config/asgi.py) relays it to the browser.
+All Redis calls fail open: without Redis the counters fall back to the DB count and
+nothing is pushed (clients keep polling).
+"""
+from __future__ import annotations
+
+import json
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+UNREAD_TTL = getattr(settings, "NOTIFY_UNREAD_TTL", 3600)
+
+# KEYS: counters; ARGV: deltas. Returns the new values (false where the counter is not seeded).
+INCR_IF_EXISTS_LUA = """
+local out = {}
+for i, key in ipairs(KEYS) do
+  if redis.call('EXISTS', key) == 1 then
+    local v = redis.call('INCRBY', key, tonumber(ARGV[i]))
+    if v < 0 then
+      redis.call('SET', key, 0, 'KEEPTTL')
+      v = 0
+    end
+    out[i] = v
+  else
+    out[i] = false
+  end
+end
+return out
+"""
+
+
+def unread_key(user_id) -> str:
+    return f"notify:unread:{user_id}"
+
+
+def channel_for(user_id) -> str:
+    return f"notify:user:{user_id}"
+
+
+def pubsub_url() -> str:
+    return getattr(settings, "NOTIFY_PUBSUB_URL", None) or settings.CACHES["default"]["LOCATION"]
+
+
+def _redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection("default")
+
+
+_incr_script = None
+
+
+def _incr(keys, deltas) -> list:
+    global _incr_script
+    client = _redis()
+    if _incr_script is None or _incr_script.registered_client is not client:
+        _incr_script = client.register_script(INCR_IF_EXISTS_LUA)
+    return _incr_script(keys=keys, args=deltas)
+
+
+# ---------------- counters ----------------
+
+def get_unread(user_id, compute) -> int:
+    """Cached unread count; `compute()` runs the DB count on a miss (or without Redis)."""
+    try:
+        cached = _redis().get(unread_key(user_id))
+        if cached is not None:
+            return int(cached)
+    except Exception as e:
+        logger.warning("Unread counter unavailable, counting in DB: %s", e)
+        return compute()
+    value = compute()
+    try:
+        _redis().set(unread_key(user_id), value, ex=UNREAD_TTL, nx=True)
+    except Exception:
+        pass
+    return value
+
+
+def set_unread(user_id, value: int) -> None:
+    try:
+        _redis().set(unread_key(user_id), max(0, int(value)), ex=UNREAD_TTL)
+    except Exception as e:
+        logger.warning("Could not set unread counter for %s: %s", user_id, e)
+    _publish_many([(user_id, "unread", {"unread": max(0, int(value))})])
+
+
+def forget_unread(user_ids) -> None:
+    """Drop counters (next read recounts) for users whose rows changed outside these helpers."""
+    keys = [unread_key(u) for u in set(user_ids) if u]
+    if not keys:
+        return
+    try:
+        _redis().delete(*keys)
+    except Exception as e:
+        logger.warning("Could not reset unread counters: %s", e)
+
+
+def adjust_unread(user_id, delta: int) -> None:
+    """+/- delta on an existing counter, and push the new value."""
+    try:
+        value = _incr([unread_key(user_id)], [delta])[0]
+    except Exception as e:
+        logger.warning("Could not adjust unread counter for %s: %s", user_id, e)
+        return
+    if value is not None and value is not False:
+        _publish_many([(user_id, "unread", {"unread": int(value)})])
+
+
+# ---------------- push ----------------
+
+def _payload(n) -> dict:
+    return {
+        "id": n.id,
+        "title": n.title,
+        "message": n.message,
+        "category": n.category,
+        "priority": n.priority,
+        "channel": n.channel,
+        "status": n.status,
+        "timestamp": n.timestamp.isoformat() if n.timestamp else None,
+    }
+
+
+def _publish_many(messages) -> None:
+    """messages: (user_id, event, data) triples, sent in one pipeline."""
+    if not messages:
+        return
+    try:
+        pipe = _redis().pipeline(transaction=False)
+        for user_id, event, data in messages:
+            pipe.publish(channel_for(user_id), json.dumps({"event": event, "data": data}, default=str))
+        pipe.execute()
+    except Exception as e:
+        logger.warning("Could not publish %s notification events: %s", len(messages), e)
+
+
+def publish_created(notifications) -> None:
+    """
+    New rows: bump each recipient's counter once (one script call for the whole batch) and
+    push the notification plus the new unread count.
+    """
+    per_user = defaultdict(list)
+    for n in notifications:
+        if n.user_id and not n.is_read:
+            per_user[n.user_id].append(n)
+    if not per_user:
+        return
+    users = list(per_user)
+    try:
+        values = _incr([unread_key(u) for u in users], [len(per_user[u]) for u in users])
+    except Exception as e:
+        logger.warning("Could not bump unread counters: %s", e)
+        values = [None] * len(users)
+
+    messages = []
+    for user_id, value in zip(users, values):
+        for n in per_user[user_id]:
+            messages.append((user_id, "notification", _payload(n)))
+        if value is not None and value is not False:
+            messages.append((user_id, "unread", {"unread": int(value)}))
+    _publish_many(messages)
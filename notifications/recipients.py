@@ -0,0 +1,189 @@
+# notifications/recipients.py
+"""
+Resolved-recipient cache for send_notification / create_bulk_notifications.
+
+A profile is what delivery needs to know about a user: the raw e-mail (fallback for
+_deliver), the active preference channel, and the route (channel, normalized contact) for
+each requested channel - i.e. the SMS/WhatsApp -> e-mail -> INAPP fallback chain already
+worked out by tasks._pick_contact, so phone normalization and e-mail checks run once.
+
+Lookups go local LRU (NOTIFY_RECIPIENT_LRU_SIZE entries, NOTIFY_RECIPIENT_LOCAL_TTL seconds)
+-> Django cache / Redis (notify:recipient:<id>, NOTIFY_RECIPIENT_TTL) -> database (two
+queries for any number of misses). Signals (notifications/signals.py) drop the entry when a
+NotificationPreference, Employee (contact/user) or User (email) is saved or deleted; other
+processes' local copies expire after the short local TTL. Queryset .update() calls bypass
+the signals - call invalidate() after them.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+ROUTED_CHANNELS = ("SMS", "WHATSAPP", "EMAIL", "INAPP")
+PROFILE_VERSION = 1
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def cache_key(user_id) -> str:
+    return f"notify:recipient:v{PROFILE_VERSION}:{user_id}"
+
+
+class _LocalLRU:
+    def __init__(self):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            expires, value = hit
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = int(_setting("NOTIFY_RECIPIENT_LRU_SIZE", 2048))
+        ttl = float(_setting("NOTIFY_RECIPIENT_LOCAL_TTL", 30))
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > size:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local = _LocalLRU()
+
+
+def build_profile(user_id, email, employee_contact, pref_channel) -> dict:
+    from .tasks import _pick_contact
+    routes = {}
+    for channel in ROUTED_CHANNELS:
+        routes[channel] = list(_pick_contact(email, employee_contact, channel=channel))
+    return {
+        "user_id": user_id,
+        "email": email or "",
+        "contact": employee_contact or "",   # raw, for channels outside ROUTED_CHANNELS
+        "pref": pref_channel,
+        "routes": routes,
+    }
+
+
+def route(profile: dict, channel=None, recipient_override=None) -> tuple:
+    """(channel, contact) for this profile, same rules as tasks._resolve_contact."""
+    from .tasks import _resolve_contact
+    requested = (channel or profile.get("pref") or "EMAIL").upper()
+    cached = profile.get("routes", {}).get(requested)
+    if recipient_override or cached is None:
+        return _resolve_contact(profile["user_id"], profile.get("email"), profile.get("contact"),
+                                pref_channel=profile.get("pref"), channel=channel,
+                                recipient_override=recipient_override)
+    chosen, contact = cached
+    if not contact:
+        logger.error("No valid contact for user %s (channel: %s), using INAPP", profile["user_id"], chosen)
+        return "INAPP", f"user_{profile['user_id']}@no-contact.example.com"
+    return chosen, contact
+
+
+def _load(user_ids) -> dict:
+    from authentication.models import User
+    from .models import NotificationPreference
+    users = User.objects.filter(id__in=user_ids).select_related("employee").only("id", "email", "employee__contact")
+    prefs = dict(NotificationPreference.objects.filter(user_id__in=user_ids, is_active=True)
+                 .order_by("user_id", "-created_at").values_list("user_id", "channel"))  # oldest wins, like .first()
+    return {
+        u.id: build_profile(u.id, u.email, getattr(getattr(u, "employee", None), "contact", None), prefs.get(u.id))
+        for u in users
+    }
+
+
+def get_recipients(user_ids) -> dict:
+    """{user_id: profile} for the known users among `user_ids` (unknown ids are left out)."""
+    wanted = {normalize_user_id(u) for u in user_ids if u}
+    out, missing = {}, []
+    for user_id in wanted:
+        profile = _local.get(user_id)
+        if profile is None:
+            missing.append(user_id)
+        else:
+            out[user_id] = profile
+    if not missing:
+        return out
+
+    try:
+        shared = cache.get_many([cache_key(u) for u in missing])
+    except Exception as e:
+        logger.warning("Recipient cache unavailable: %s", e)
+        shared = {}
+    loaded = []
+    for user_id in missing:
+        profile = shared.get(cache_key(user_id))
+        if profile is None:
+            loaded.append(user_id)
+        else:
+            out[user_id] = profile
+            _local.set(user_id, profile)
+
+    if loaded:
+        fresh = _load(loaded)
+        for user_id, profile in fresh.items():
+            out[user_id] = profile
+            _local.set(user_id, profile)
+        if fresh:
+            try:
+                cache.set_many({cache_key(u): p for u, p in fresh.items()}, int(_setting("NOTIFY_RECIPIENT_TTL", 3600)))
+            except Exception as e:
+                logger.warning("Could not store %s recipient profiles: %s", len(fresh), e)
+    return out
+
+
+def normalize_user_id(user_id):
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return user_id
+
+
+def get_recipient(user_id):
+    return get_recipients([user_id]).get(normalize_user_id(user_id))
+
+
+def invalidate(user_ids) -> None:
+    """Forget these users now (local) and once the current transaction commits (shared)."""
+    ids = {normalize_user_id(u) for u in user_ids if u}
+    if not ids:
+        return
+    for user_id in ids:
+        _local.pop(user_id)
+
+    def _drop():
+        for user_id in ids:
+            _local.pop(user_id)
+        try:
+            cache.delete_many([cache_key(u) for u in ids])
+        except Exception as e:
+            logger.warning("Could not invalidate recipient profiles %s: %s", sorted(ids), e)
+
+    transaction.on_commit(_drop)
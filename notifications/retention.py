@@ -0,0 +1,248 @@
+# notifications/retention.py
+"""
+Notification retention: daily engagement rollups and archival of old rows.
+
+  - Rollups: NotificationDailyStat holds, per (day, channel, category), total / failed /
+    delivered / read counts. refresh_daily_rollups re-rolls the last NOTIFY_ROLLUP_LOOKBACK_DAYS
+    closed days every night (late reads and receipts land there) and backfills any gap.
+    Dashboards read closed days from the rollup and only today from raw rows.
+  - Archival: rows older than NOTIFY_RETENTION_MONTHS (whole months) are archived one day at a
+    time, oldest first. In one transaction the day's rollup is frozen from the rows, the rows
+    are written to <NOTIFY_ARCHIVE_PREFIX>/YYYY/MM/YYYY-MM-DD.jsonl.gz in default storage,
+    their unread counts are folded into ArchivedUnreadCount, and they are deleted.
+    Days already archived are never re-rolled, so every dashboard number (read rates,
+    unread by role/user) is the same before and after archival.
+On PostgreSQL with a partitioned table (notifications/partitioning.py), empty month
+partitions behind the cutoff are dropped afterwards.
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import tempfile
+from collections import Counter, defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ArchivedUnreadCount, Notification, NotificationArchive, NotificationDailyStat
+from .signals import stats_changed
+
+logger = logging.getLogger(__name__)
+
+STAT_FIELDS = ("total", "failed", "delivered", "read")
+ARCHIVE_FIELDS = [
+    "id", "user_id", "channel", "recipient", "title", "message", "category", "priority",
+    "status", "is_read", "read_at", "delivered_at", "provider", "provider_message_id",
+    "retry_count", "metadata", "scheduled_for", "expires_at", "coalesce_key", "timestamp",
+]
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def day_bounds(day: date) -> tuple:
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _stat_counts():
+    return dict(
+        total=Count("id"),
+        failed=Count("id", filter=Q(status="failed")),
+        delivered=Count("id", filter=Q(status__in=("delivered", "read"))),
+        read=Count("id", filter=Q(is_read=True)),
+    )
+
+
+def archived_through():
+    """Last archived day (rollups up to it are frozen)."""
+    return NotificationArchive.objects.aggregate(m=Max("day"))["m"]
+
+
+def rolled_through():
+    return NotificationDailyStat.objects.aggregate(m=Max("day"))["m"]
+
+
+# ---------------- rollups ----------------
+
+def _roll(start: date, end: date) -> int:
+    """Replace the rollup of [start, end] with the live rows (caller holds the transaction)."""
+    lo, _ = day_bounds(start)
+    _, hi = day_bounds(end)
+    rows = (Notification.objects.filter(timestamp__gte=lo, timestamp__lt=hi)
+            .annotate(day=TruncDate("timestamp"))
+            .values("day", "channel", "category")
+            .annotate(**_stat_counts())
+            .order_by())
+    stats = [NotificationDailyStat(**r) for r in rows]
+    NotificationDailyStat.objects.filter(day__gte=start, day__lte=end).delete()
+    NotificationDailyStat.objects.bulk_create(stats, batch_size=1000)
+    transaction.on_commit(lambda: stats_changed.send(sender=NotificationDailyStat))
+    return len(stats)
+
+
+def refresh_daily_rollups(start: date = None, end: date = None) -> dict:
+    """Re-roll closed days: the lookback window plus any gap since the last rollup."""
+    today = timezone.localdate()
+    yesterday = today - timedelta(days=1)
+    end = min(end or yesterday, yesterday)
+    if start is None:
+        last = rolled_through()
+        if last is None:
+            first = Notification.objects.order_by("timestamp").values_list("timestamp", flat=True).first()
+            if first is None:
+                return {"days": 0, "rows": 0}
+            start = timezone.localtime(first).date()
+        else:
+            start = min(last + timedelta(days=1), today - timedelta(days=int(_setting("NOTIFY_ROLLUP_LOOKBACK_DAYS", 30))))
+    frozen = archived_through()
+    if frozen and start <= frozen:
+        start = frozen + timedelta(days=1)
+    if start > end:
+        return {"days": 0, "rows": 0}
+    with transaction.atomic():
+        n = _roll(start, end)
+    return {"from": start.isoformat(), "to": end.isoformat(), "days": (end - start).days + 1, "rows": n}
+
+
+# ---------------- dashboard reads ----------------
+
+def engagement_by_channel(days: int) -> dict:
+    """
+    {channel: {total, failed, delivered, read}} for today and the `days` previous days:
+    rollups for closed days, raw rows only after the last rolled day.
+    """
+    today = timezone.localdate()
+    first = today - timedelta(days=days)
+    out = defaultdict(Counter)
+    raw_from = first
+    last = rolled_through()
+    if last and last >= first:
+        for r in (NotificationDailyStat.objects.filter(day__gte=first, day__lte=last)
+                  .values("channel").annotate(**{f: Sum(f) for f in STAT_FIELDS}).order_by()):
+            out[r["channel"]].update({f: int(r[f] or 0) for f in STAT_FIELDS})
+        raw_from = last + timedelta(days=1)
+    for r in (Notification.objects.filter(timestamp__gte=day_bounds(raw_from)[0])
+              .values("channel").annotate(**_stat_counts()).order_by()):
+        out[r["channel"]].update({f: int(r[f] or 0) for f in STAT_FIELDS})
+    return {ch: {f: c.get(f, 0) for f in STAT_FIELDS} for ch, c in sorted(out.items())}
+
+
+def unread_by_user() -> dict:
+    """All-time unread notifications per user id (live rows + archived ones)."""
+    out = Counter(dict(
+        Notification.objects.filter(is_read=False, user__isnull=False)
+        .values("user_id").annotate(n=Count("id")).values_list("user_id", "n")
+    ))
+    out.update(dict(ArchivedUnreadCount.objects.filter(count__gt=0).values_list("user_id", "count")))
+    return dict(out)
+
+
+def unread_by_role() -> dict:
+    """All-time unread notifications per user role (None for rows without a user)."""
+    out = Counter()
+    for r in Notification.objects.filter(is_read=False).values("user__role").annotate(n=Count("id")).order_by():
+        out[r["user__role"]] += r["n"]
+    for r in (ArchivedUnreadCount.objects.filter(count__gt=0)
+              .values("user__role").annotate(n=Sum("count")).order_by()):
+        out[r["user__role"]] += int(r["n"] or 0)
+    return dict(out)
+
+
+# ---------------- archival ----------------
+
+def _add_month(d: date, k: int) -> date:
+    y = d.year + (d.month + k - 1) // 12
+    m = (d.month + k - 1) % 12 + 1
+    return date(y, m, 1)
+
+
+def archive_cutoff(today: date = None) -> date:
+    """First day still kept: start of the month NOTIFY_RETENTION_MONTHS months ago."""
+    today = today or timezone.localdate()
+    return _add_month(today.replace(day=1), -int(_setting("NOTIFY_RETENTION_MONTHS", 6)))
+
+
+def _archive_path(day: date) -> str:
+    prefix = _setting("NOTIFY_ARCHIVE_PREFIX", "notifications/archive").strip("/")
+    return f"{prefix}/{day:%Y}/{day:%m}/{day.isoformat()}.jsonl.gz"
+
+
+def _write_jsonl(qs, day: date) -> tuple:
+    """Stream the rows into a gzipped JSONL file in default storage; returns (path, rows, first, last)."""
+    rows, first_id, last_id = 0, None, None
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as tmp:
+        with gzip.GzipFile(fileobj=tmp, mode="wb") as gz:
+            for r in qs.order_by("id").values(*ARCHIVE_FIELDS).iterator(chunk_size=2000):
+                gz.write((json.dumps(r, default=str, ensure_ascii=False) + "\n").encode("utf-8"))
+                rows += 1
+                first_id = r["id"] if first_id is None else first_id
+                last_id = r["id"]
+        tmp.seek(0)
+        path = default_storage.save(_archive_path(day), File(tmp, name=f"{day.isoformat()}.jsonl.gz"))
+    return path, rows, first_id, last_id
+
+
+def archive_day(day: date) -> dict:
+    start, end = day_bounds(day)
+    qs = Notification.objects.filter(timestamp__gte=start, timestamp__lt=end)
+    with transaction.atomic():
+        locked = len(list(qs.select_for_update().values_list("id", flat=True)))
+        if not locked:
+            return {"day": day.isoformat(), "rows": 0}
+        _roll(day, day)
+        rolled = NotificationDailyStat.objects.filter(day=day).aggregate(n=Sum("total"))["n"] or 0
+
+        path, rows, first_id, last_id = _write_jsonl(qs, day)
+        if rows != rolled or rows != locked:
+            raise RuntimeError(f"archive {day}: {rows} rows written, {rolled} rolled up, {locked} locked")
+
+        unread = dict(qs.filter(is_read=False, user__isnull=False)
+                      .values("user_id").annotate(n=Count("id")).values_list("user_id", "n"))
+        if unread:
+            existing = set(ArchivedUnreadCount.objects.filter(user_id__in=unread).values_list("user_id", flat=True))
+            for user_id in existing:
+                ArchivedUnreadCount.objects.filter(user_id=user_id).update(count=F("count") + unread[user_id])
+            ArchivedUnreadCount.objects.bulk_create(
+                [ArchivedUnreadCount(user_id=u, count=n) for u, n in unread.items() if u not in existing]
+            )
+
+        qs.delete()
+        NotificationArchive.objects.create(
+            day=day, path=path, rows=rows, unread=sum(unread.values()), first_id=first_id, last_id=last_id,
+        )
+    return {"day": day.isoformat(), "rows": rows, "path": path}
+
+
+def archive_old_notifications(max_days: int = None) -> dict:
+    """Archive whole days before archive_cutoff(), oldest first, at most `max_days` per run."""
+    cutoff = archive_cutoff()
+    before = day_bounds(cutoff)[0]
+    max_days = int(max_days or _setting("NOTIFY_ARCHIVE_MAX_DAYS", 31))
+    days, rows = [], 0
+    for _ in range(max_days):
+        oldest = (Notification.objects.filter(timestamp__lt=before)
+                  .order_by("timestamp").values_list("timestamp", flat=True).first())
+        if oldest is None:
+            break
+        res = archive_day(timezone.localtime(oldest).date())
+        days.append(res["day"])
+        rows += res["rows"]
+
+    dropped = []
+    try:
+        from .partitioning import drop_empty_partitions, ensure_partitions
+        ensure_partitions()
+        dropped = drop_empty_partitions(before=cutoff)
+    except Exception as e:
+        logger.warning("Notification partition maintenance failed: %s", e)
+    return {"cutoff": cutoff.isoformat(), "days": len(days), "rows": rows, "dropped_partitions": dropped}
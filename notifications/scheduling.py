@@ -0,0 +1,90 @@
+# notifications/scheduling.py
+"""
+When a notification should go out.
+
+  - Quiet hours (NOTIFY_QUIET_HOURS = ("21:00", "07:00"), local time): non-urgent notifications
+    (priority >= NOTIFY_QUIET_MIN_PRIORITY) created inside the window are held until it ends.
+    INAPP rows are never held by quiet hours.
+  - Digest slot (NOTIFY_DIGEST_TIME = "08:00"): reminders computed by beat tasks are scheduled
+    for the slot so they all go out together at a sensible time.
+
+Held rows are stored as status='pending' with scheduled_for, and released by
+notifications.tasks.release_scheduled_notifications through the (status, scheduled_for) index.
+"""
+from __future__ import annotations
+
+from datetime import datetime, time, timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+def _hhmm(value, default: str) -> time:
+    h, m = (value or default).split(":")
+    return time(int(h), int(m))
+
+
+def quiet_window() -> Optional[tuple]:
+    hours = getattr(settings, "NOTIFY_QUIET_HOURS", None)
+    if not hours:
+        return None
+    return _hhmm(hours[0], "21:00"), _hhmm(hours[1], "07:00")
+
+
+def in_quiet_hours(when: Optional[datetime] = None) -> bool:
+    window = quiet_window()
+    if not window:
+        return False
+    start, end = window
+    t = timezone.localtime(when or timezone.now()).time()
+    if start <= end:
+        return start <= t < end
+    return t >= start or t < end      # window crosses midnight
+
+
+def quiet_hours_end(when: Optional[datetime] = None) -> datetime:
+    """First instant after `when` that is outside quiet hours (== when if not quiet)."""
+    when = when or timezone.now()
+    if not in_quiet_hours(when):
+        return when
+    start, end = quiet_window()
+    local = timezone.localtime(when)
+    day = local.date()
+    if start > end and local.time() >= start:
+        day += timedelta(days=1)
+    return timezone.make_aware(datetime.combine(day, end), local.tzinfo)
+
+
+def hold_until(priority, channel: str, when: Optional[datetime] = None) -> Optional[datetime]:
+    """scheduled_for for a notification created at `when`; None means send now."""
+    if (channel or "").upper() == "INAPP":
+        return None
+    min_priority = getattr(settings, "NOTIFY_QUIET_MIN_PRIORITY", 3)
+    if not isinstance(priority, int) or priority < min_priority:
+        return None
+    when = when or timezone.now()
+    release = quiet_hours_end(when)
+    return release if release > when else None
+
+
+def digest_time(when: Optional[datetime] = None) -> datetime:
+    """Today's digest slot if it is still ahead, otherwise now (pushed out of quiet hours)."""
+    when = when or timezone.now()
+    local = timezone.localtime(when)
+    slot = timezone.make_aware(
+        datetime.combine(local.date(), _hhmm(getattr(settings, "NOTIFY_DIGEST_TIME", None), "08:00")),
+        local.tzinfo,
+    )
+    return quiet_hours_end(slot if slot > when else when)
+
+
+def as_datetime(value) -> Optional[datetime]:
+    """Celery JSON turns datetimes into ISO strings; accept both."""
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = parse_datetime(str(value))
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
@@ -0,0 +1,40 @@
+# notifications/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from authentication.models import User
+from employee.models import Employee
+
+from .models import NotificationPreference
+from .recipients import invalidate
+
+# Sent once per committed batch that moved delivery/read counts in bulk (rollups, webhook
+# batches); per-row saves don't send it. sender = the model whose rows changed.
+stats_changed = Signal()
+
+
+def _touches(kwargs, fields) -> bool:
+    update_fields = kwargs.get("update_fields")
+    return update_fields is None or bool(set(update_fields) & fields)
+
+
+@receiver(post_save, sender=NotificationPreference)
+@receiver(post_delete, sender=NotificationPreference)
+def preference_changed(sender, instance, **kwargs):
+    # saving an active preference also deactivates the user's others
+    invalidate([instance.user_id])
+
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def employee_contact_changed(sender, instance, **kwargs):
+    if _touches(kwargs, {"contact", "user"}):
+        invalidate([instance.user_id])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_email_changed(sender, instance, **kwargs):
+    # last_login updates (update_fields=['last_login']) keep the cached profile
+    if _touches(kwargs, {"email"}):
+        invalidate([instance.pk])
@@ -414,8 +414,7 @@ from django.conf import settings
 from django.core.mail import send_mail
 from django.db.models import F
 from twilio.base.exceptions import TwilioRestException
-from authentication.models import User
-from .models import Notification, NotificationPreference
+from .models import Notification
 
 logger = logging.getLogger(__name__)
 
@@ -584,16 +583,23 @@ logger = logging.getLogger(__name__)
 
 import re
 import logging
+from datetime import timedelta
 from celery import shared_task
 from django.conf import settings
 from django.core.mail import send_mail
-from django.db.models import F
+from django.db import transaction
+from django.db.models import F, Q
 from twilio.base.exceptions import TwilioRestException
 from requests.exceptions import HTTPError
-from authentication.models import User
-from .models import Notification, NotificationPreference
-from .providers.sms_twilio import send_sms_twilio
-from .providers.whatsapp_cloud import send_whatsapp_cloud
+from .models import Notification
+from .providers.sms_twilio import send_sms_twilio, twilio_sms
+from .providers.whatsapp_cloud import send_whatsapp_cloud, whatsapp_cloud
+from .throttle import acquire, provider_for_channel, wait_for_token
+from .scheduling import as_datetime, hold_until
+from .coalescing import can_coalesce, merge_into_digests
+from .realtime import publish_created
+from .recipients import normalize_user_id, get_recipient, get_recipients, route
+from config.monitoring.metrics import inc_throttled, mark_beat_run
 
 logger = logging.getLogger(__name__)
 
@@ -636,6 +642,261 @@ def normalize_phone_number(phone):
 
     return cleaned
 
+def _pick_contact(email, employee_contact, pref_channel=None, channel=None):
+    """
+    (channel, contact) from plain values: explicit channel > active preference > EMAIL,
+    falling back to e-mail then INAPP when the employee contact does not fit the channel.
+    contact is None when nothing usable exists (see _resolve_contact).
+    """
+    chosen_channel = (channel or pref_channel or 'EMAIL').upper()
+
+    contact = employee_contact
+    if contact:
+        if chosen_channel in ('SMS', 'WHATSAPP'):
+            contact = normalize_phone_number(contact)
+            if not contact:
+                contact = email if is_valid_email(email) else None
+                chosen_channel = 'EMAIL' if contact else 'INAPP'
+        elif chosen_channel == 'EMAIL':
+            if not is_valid_email(contact):
+                contact = email if is_valid_email(email) else None
+                chosen_channel = 'INAPP' if not contact else 'EMAIL'
+    else:
+        contact = email if is_valid_email(email) else None
+        chosen_channel = 'EMAIL' if contact and chosen_channel == 'EMAIL' else 'INAPP'
+    return chosen_channel, contact
+
+
+def _resolve_contact(user_id, email, employee_contact, pref_channel=None, channel=None, recipient_override=None):
+    """
+    Pick (channel, contact) for one user (see _pick_contact). Takes plain values so the bulk
+    path and the recipient cache (notifications.recipients) can feed it prefetched rows.
+    """
+    if recipient_override:
+        chosen_channel, contact = (channel or pref_channel or 'EMAIL').upper(), recipient_override
+    else:
+        chosen_channel, contact = _pick_contact(email, employee_contact, pref_channel=pref_channel, channel=channel)
+
+    if not contact:
+        logger.error("No valid contact for user %s (channel: %s), using INAPP", user_id, chosen_channel)
+        chosen_channel = 'INAPP'
+        contact = f"user_{user_id}@no-contact.example.com"
+
+    return chosen_channel, contact
+
+
+def _deliver(n, fallback_email=None, presend=None):
+    """
+    Push one Notification to its provider. Updates n in memory (status, provider, ids and,
+    on WhatsApp fallback, channel/recipient) without saving.
+    Returns False when the provider definitively rejects the message; raises on other errors.
+    `presend` is the outcome (ProviderResult or exception) of a first attempt already made by
+    a batch send; it replaces the primary provider call, fallbacks still run as usual.
+    """
+    chosen_channel, contact, message, title, user_id = n.channel, n.recipient, n.message, n.title, n.user_id
+
+    def _primary(send, *args):
+        if presend is None:
+            return send(*args)
+        if isinstance(presend, Exception):
+            raise presend
+        return presend
+
+    if chosen_channel == "SMS":
+        try:
+            res = _primary(send_sms_twilio, contact, message)
+            n.provider = "twilio"
+        except TwilioRestException as e:
+            if e.code == 21211:
+                logger.error("Invalid phone number %s for user %s", contact, user_id)
+                n.status = "failed"
+                n.metadata = {**(n.metadata or {}), "error": f"Invalid phone number: {str(e)}"}
+                return False
+            raise
+    # # Without fallbact to twilio whatsapp: using only META whatsapp
+    # elif chosen_channel == "WHATSAPP":
+    #     try:
+    #         res = send_whatsapp_cloud(contact, message)
+    #         n.provider = "whatsapp_cloud"
+    #     except HTTPError as e:
+    #         if e.response.status_code == 401:
+    #             logger.error("WhatsApp authentication failed for user %s: %s", user_id, str(e))
+    #             n.status = "failed"
+    #             n.metadata = {**(n.metadata or {}), "error": f"WhatsApp auth error: {str(e)}"}
+    #             n.save(update_fields=["status", "metadata"])
+    #             # Fall back to EMAIL or INAPP
+    #             if is_valid_email(user.email):
+    #                 chosen_channel = "EMAIL"
+    #                 contact = user.email
+    #                 send_mail(title or "Notification", message, None, [contact], fail_silently=False)
+    #                 n.channel = "EMAIL"
+    #                 n.recipient = contact
+    #                 n.status = "sent"
+    #                 n.provider = "email"
+    #                 n.save(update_fields=["channel", "recipient", "status", "provider"])
+    #                 return True
+    #             else:
+    #                 n.channel = "INAPP"
+    #                 n.recipient = f"user_{user_id}@no-contact.example.com"
+    #                 n.status = "sent"
+    #                 n.provider = "inapp"
+    #                 n.save(update_fields=["channel", "recipient", "status", "provider"])
+    #                 return True
+    #         raise
+
+    # With fallbact to twilio whatsapp
+    elif chosen_channel == "WHATSAPP":
+        logger.info("WA send attempt (cloud) user=%s to=%s", user_id, contact)
+        try:
+            # 1) Try Meta WhatsApp Cloud first
+            res = _primary(send_whatsapp_cloud, contact, message)
+            n.provider = "whatsapp_cloud"
+            logger.info("WA cloud ok user=%s mid=%s", user_id, getattr(res, 'message_id', None))
+
+        except HTTPError as e:
+            # If Cloud auth or API error -> try Twilio WhatsApp as fallback
+            try:
+                from .providers.whatsapp_twilio import send_whatsapp_twilio
+                logger.warning("WA cloud failed (%s). Falling back to Twilio WA. user=%s to=%s", getattr(e.response, 'status_code', None), user_id, contact)
+                wait_for_token("twilio_whatsapp")   # NEW: the fallback has its own rate
+                twilio_res = send_whatsapp_twilio(contact, message)
+                res = twilio_res
+                n.provider = "twilio_whatsapp"   # distinguish from SMS 'twilio'
+                logger.info("Twilio WA ok user=%s sid=%s", user_id, getattr(res, 'message_id', None))
+
+            except TwilioRestException as tw_e:
+                # Hard fail after both providers rejected
+                n.metadata = {
+                    **(n.metadata or {}),
+                    "error": f"WA Cloud+Twilio failed: cloud={str(e)}, twilio={str(tw_e)}",
+                }
+                # Optional: EMAIL/INAPP last-chance fallback
+                if is_valid_email(fallback_email):
+                    send_mail(title or "Notification", message, None, [fallback_email], fail_silently=False)
+                    n.channel = "EMAIL"
+                    n.recipient = fallback_email
+                    n.provider = "email"
+                else:
+                    n.channel = "INAPP"
+                    n.recipient = f"user_{user_id}@no-contact.example.com"
+                    n.provider = "inapp"
+                n.status = "sent"
+                return True
+
+        except Exception as e:
+            # Unknown Cloud error -> try Twilio as best-effort fallback too
+            try:
+                from .providers.whatsapp_twilio import send_whatsapp_twilio
+                wait_for_token("twilio_whatsapp")
+                twilio_res = send_whatsapp_twilio(contact, message)
+                res = twilio_res
+                n.provider = "twilio_whatsapp"
+            except Exception as tw_e:
+                raise  # Let outer handler capture and mark failed
+
+    # # With fallbact to META whatsapp
+    # elif chosen_channel == "WHATSAPP":
+    #     logger.info("WA send attempt (twilio-first) user=%s to=%s", user_id, contact)
+    #     try:
+    #         # 1) Try Twilio WhatsApp first
+    #         from .providers.whatsapp_twilio import send_whatsapp_twilio
+    #         twilio_res = send_whatsapp_twilio(contact, message)
+    #         res = twilio_res
+    #         n.provider = "twilio_whatsapp"   # distinct from SMS 'twilio'
+    #         logger.info("Twilio WA ok user=%s sid=%s", user_id, getattr(res, 'message_id', None))
+
+    #     except TwilioRestException as tw_e:
+    #         # If it's an invalid number, Cloud will almost certainly fail too — short-circuit.
+    #         if getattr(tw_e, "code", None) == 21211:
+    #             logger.error("Twilio WA invalid phone %s for user %s (21211). Skipping Cloud fallback.", contact, user_id)
+    #             n.status = "failed"
+    #             n.metadata = {**(n.metadata or {}), "error": f"Twilio WA invalid phone: {str(tw_e)}"}
+    #             n.save(update_fields=["status", "metadata"])
+
+    #             # Optional last-chance fallback: EMAIL or INAPP
+    #             if is_valid_email(user.email):
+    #                 chosen_channel = "EMAIL"
+    #                 contact = user.email
+    #                 send_mail(title or "Notification", message, None, [contact], fail_silently=False)
+    #                 n.channel = "EMAIL"
+    #                 n.recipient = contact
+    #                 n.status = "sent"
+    #                 n.provider = "email"
+    #                 n.save(update_fields=["channel", "recipient", "status", "provider"])
+    #                 return True
+    #             else:
+    #                 n.channel = "INAPP"
+    #                 n.recipient = f"user_{user_id}@no-contact.example.com"
+    #                 n.status = "sent"
+    #                 n.provider = "inapp"
+    #                 n.save(update_fields=["channel", "recipient", "status", "provider"])
+    #                 return True
+
+    #         # Otherwise, fall back to WhatsApp Cloud
+    #         logger.warning(
+    #             "Twilio WA failed (code=%s). Falling back to WA Cloud. user=%s to=%s",
+    #             getattr(tw_e, "code", None), user_id, contact
+    #         )
+    #         try:
+    #             res = send_whatsapp_cloud(contact, message)
+    #             n.provider = "whatsapp_cloud"
+    #             logger.info("WA Cloud ok user=%s mid=%s", user_id, getattr(res, 'message_id', None))
+    #         except HTTPError as cloud_e:
+    #             # Both providers failed -> EMAIL/INAPP fallback
+    #             n.status = "failed"
+    #             n.metadata = {
+    #                 **(n.metadata or {}),
+    #                 "error": f"Twilio WA+Cloud failed: twilio={str(tw_e)}, cloud={str(cloud_e)}",
+    #             }
+    #             n.save(update_fields=["status", "metadata"])
+
+    #             if is_valid_email(user.email):
+    #                 chosen_channel = "EMAIL"
+    #                 contact = user.email
+    #                 send_mail(title or "Notification", message, None, [contact], fail_silently=False)
+    #                 n.channel = "EMAIL"
+    #                 n.recipient = contact
+    #                 n.status = "sent"
+    #                 n.provider = "email"
+    #                 n.save(update_fields=["channel", "recipient", "status", "provider"])
+    #                 return True
+    #             else:
+    #                 n.channel = "INAPP"
+    #                 n.recipient = f"user_{user_id}@no-contact.example.com"
+    #                 n.status = "sent"
+    #                 n.provider = "inapp"
+    #                 n.save(update_fields=["channel", "recipient", "status", "provider"])
+    #                 return True
+
+    #     except Exception as tw_unknown:
+    #         # Unknown Twilio error -> try Cloud as best-effort
+    #         logger.warning("Twilio WA unexpected error: %s; trying WA Cloud. user=%s", tw_unknown, user_id)
+    #         try:
+    #             res = send_whatsapp_cloud(contact, message)
+    #             n.provider = "whatsapp_cloud"
+    #             logger.info("WA Cloud ok user=%s mid=%s", user_id, getattr(res, 'message_id', None))
+    #         except Exception as cloud_unknown:
+    #             # Let outer handler record failure & retry policy
+    #             raise
+
+    elif chosen_channel == "EMAIL":
+        send_mail(title or "Notification", message, None, [contact], fail_silently=False)
+        res = None
+        n.provider = "email"
+    else:
+        res = None
+        n.provider = chosen_channel.lower()
+
+    message_id, raw = _extract_provider_ids_and_raw(res)
+    n.status = "sent"
+    n.provider_message_id = message_id
+    n.metadata = {**(n.metadata or {}), **raw}
+    return True
+
+
+DELIVERY_FIELDS = ["status", "channel", "recipient", "provider", "provider_message_id", "metadata"]
+
+
 @shared_task(bind=True, max_retries=5, autoretry_for=(Exception,), retry_backoff=True, retry_jitter=True)
 def send_notification(
     self,
@@ -647,40 +908,25 @@ def send_notification(
     recipient_override=None,
     priority=None,
     metadata=None,
+    scheduled_for=None,
+    expires_at=None,
 ):
-    user = User.objects.filter(id=user_id).first()
-    if not user:
+    recipient = get_recipient(user_id)   # cached: no query for users seen recently
+    if not recipient:
         logger.warning("send_notification: user %s not found", user_id)
         return False
 
-    effective_priority = priority if isinstance(priority, int) and 1 <= priority <= 5 else 3
-    pref = NotificationPreference.objects.filter(user=user, is_active=True).first()
-    chosen_channel = (channel or (pref.channel if pref else 'EMAIL')).upper()
-
-    contact = recipient_override
-    if not contact:
-        contact = getattr(getattr(user, 'employee', None), 'contact', None)
-        if contact:
-            if chosen_channel in ('SMS', 'WHATSAPP'):
-                contact = normalize_phone_number(contact)
-                if not contact:
-                    contact = user.email if is_valid_email(user.email) else None
-                    chosen_channel = 'EMAIL' if contact else 'INAPP'
-            elif chosen_channel == 'EMAIL':
-                if not is_valid_email(contact):
-                    contact = user.email if is_valid_email(user.email) else None
-                    chosen_channel = 'INAPP' if not contact else 'EMAIL'
-        else:
-            contact = user.email if is_valid_email(user.email) else None
-            chosen_channel = 'EMAIL' if contact and chosen_channel == 'EMAIL' else 'INAPP'
+    now = timezone.now()
+    scheduled_for, expires_at = as_datetime(scheduled_for), as_datetime(expires_at)
+    if expires_at and expires_at <= now:
+        logger.info("send_notification: already expired for user %s, dropped", user_id)
+        return False
 
-    if not contact:
-        logger.error("No valid contact for user %s (channel: %s), using INAPP", user_id, chosen_channel)
-        chosen_channel = 'INAPP'
-        contact = f"user_{user_id}@no-contact.example.com"
+    effective_priority = priority if isinstance(priority, int) and 1 <= priority <= 5 else 3
+    chosen_channel, contact = route(recipient, channel=channel, recipient_override=recipient_override)
 
     n = Notification.objects.create(
-        user=user,
+        user_id=recipient["user_id"],
         channel=chosen_channel,
         recipient=contact,
         title=title,
@@ -689,210 +935,32 @@ def send_notification(
         status="queued",
         priority=effective_priority,
         metadata=metadata or {},
+        expires_at=expires_at,
     )
+    transaction.on_commit(lambda: publish_created([n]))
+
+    # Scheduled or inside quiet hours: park it, release_scheduled_notifications sends it on time
+    hold = scheduled_for if scheduled_for and scheduled_for > now else hold_until(effective_priority, chosen_channel, now)
+    if hold:
+        n.status, n.scheduled_for = "pending", hold
+        n.save(update_fields=["status", "scheduled_for"])
+        return True
+
+    if _defer_if_throttled(n, effective_priority):
+        return True
+
+    return _send_now(n, recipient["email"])
 
+
+def _send_now(n, fallback_email=None):
     try:
         n.status = "sending"
-        n.save(update_fields=["status"])
+        n.claimed_at = timezone.now()
+        n.save(update_fields=["status", "claimed_at"])
 
-        if chosen_channel == "SMS":
-            try:
-                res = send_sms_twilio(contact, message)
-                n.provider = "twilio"
-            except TwilioRestException as e:
-                if e.code == 21211:
-                    logger.error("Invalid phone number %s for user %s", contact, user_id)
-                    n.status = "failed"
-                    n.metadata = {**(n.metadata or {}), "error": f"Invalid phone number: {str(e)}"}
-                    n.save(update_fields=["status", "metadata"])
-                    return False
-                raise
-        # # Without fallbact to twilio whatsapp: using only META whatsapp
-        # elif chosen_channel == "WHATSAPP":
-        #     try:
-        #         res = send_whatsapp_cloud(contact, message)
-        #         n.provider = "whatsapp_cloud"
-        #     except HTTPError as e:
-        #         if e.response.status_code == 401:
-        #             logger.error("WhatsApp authentication failed for user %s: %s", user_id, str(e))
-        #             n.status = "failed"
-        #             n.metadata = {**(n.metadata or {}), "error": f"WhatsApp auth error: {str(e)}"}
-        #             n.save(update_fields=["status", "metadata"])
-        #             # Fall back to EMAIL or INAPP
-        #             if is_valid_email(user.email):
-        #                 chosen_channel = "EMAIL"
-        #                 contact = user.email
-        #                 send_mail(title or "Notification", message, None, [contact], fail_silently=False)
-        #                 n.channel = "EMAIL"
-        #                 n.recipient = contact
-        #                 n.status = "sent"
-        #                 n.provider = "email"
-        #                 n.save(update_fields=["channel", "recipient", "status", "provider"])
-        #                 return True
-        #             else:
-        #                 n.channel = "INAPP"
-        #                 n.recipient = f"user_{user_id}@no-contact.example.com"
-        #                 n.status = "sent"
-        #                 n.provider = "inapp"
-        #                 n.save(update_fields=["channel", "recipient", "status", "provider"])
-        #                 return True
-        #         raise
-
-        # With fallbact to twilio whatsapp
-        elif chosen_channel == "WHATSAPP":
-            logger.info("WA send attempt (cloud) user=%s to=%s", user_id, contact)
-            try:
-                # 1) Try Meta WhatsApp Cloud first
-                res = send_whatsapp_cloud(contact, message)
-                n.provider = "whatsapp_cloud"
-                logger.info("WA cloud ok user=%s mid=%s", user_id, getattr(res, 'message_id', None))
-
-            except HTTPError as e:
-                # If Cloud auth or API error -> try Twilio WhatsApp as fallback
-                try:
-                    from .providers.whatsapp_twilio import send_whatsapp_twilio
-                    logger.warning("WA cloud failed (%s). Falling back to Twilio WA. user=%s to=%s", getattr(e.response, 'status_code', None), user_id, contact)
-                    twilio_res = send_whatsapp_twilio(contact, message)
-                    res = twilio_res
-                    n.provider = "twilio_whatsapp"   # distinguish from SMS 'twilio'
-                    logger.info("Twilio WA ok user=%s sid=%s", user_id, getattr(res, 'message_id', None))
-                    
-                except TwilioRestException as tw_e:
-                    # Hard fail after both providers rejected
-                    n.status = "failed"
-                    n.metadata = {
-                        **(n.metadata or {}),
-                        "error": f"WA Cloud+Twilio failed: cloud={str(e)}, twilio={str(tw_e)}",
-                    }
-                    n.save(update_fields=["status", "metadata"])
-                    # Optional: EMAIL/INAPP last-chance fallback
-                    if is_valid_email(user.email):
-                        chosen_channel = "EMAIL"
-                        contact = user.email
-                        send_mail(title or "Notification", message, None, [contact], fail_silently=False)
-                        n.channel = "EMAIL"
-                        n.recipient = contact
-                        n.status = "sent"
-                        n.provider = "email"
-                        n.save(update_fields=["channel", "recipient", "status", "provider"])
-                        return True
-                    else:
-                        n.channel = "INAPP"
-                        n.recipient = f"user_{user_id}@no-contact.example.com"
-                        n.status = "sent"
-                        n.provider = "inapp"
-                        n.save(update_fields=["channel", "recipient", "status", "provider"])
-                        return True
-
-            except Exception as e:
-                # Unknown Cloud error -> try Twilio as best-effort fallback too
-                try:
-                    from .providers.whatsapp_twilio import send_whatsapp_twilio
-                    twilio_res = send_whatsapp_twilio(contact, message)
-                    res = twilio_res
-                    n.provider = "twilio_whatsapp"
-                except Exception as tw_e:
-                    raise  # Let outer handler capture and mark failed
-
-        # # With fallbact to META whatsapp
-        # elif chosen_channel == "WHATSAPP":
-        #     logger.info("WA send attempt (twilio-first) user=%s to=%s", user_id, contact)
-        #     try:
-        #         # 1) Try Twilio WhatsApp first
-        #         from .providers.whatsapp_twilio import send_whatsapp_twilio
-        #         twilio_res = send_whatsapp_twilio(contact, message)
-        #         res = twilio_res
-        #         n.provider = "twilio_whatsapp"   # distinct from SMS 'twilio'
-        #         logger.info("Twilio WA ok user=%s sid=%s", user_id, getattr(res, 'message_id', None))
-
-        #     except TwilioRestException as tw_e:
-        #         # If it's an invalid number, Cloud will almost certainly fail too — short-circuit.
-        #         if getattr(tw_e, "code", None) == 21211:
-        #             logger.error("Twilio WA invalid phone %s for user %s (21211). Skipping Cloud fallback.", contact, user_id)
-        #             n.status = "failed"
-        #             n.metadata = {**(n.metadata or {}), "error": f"Twilio WA invalid phone: {str(tw_e)}"}
-        #             n.save(update_fields=["status", "metadata"])
-
-        #             # Optional last-chance fallback: EMAIL or INAPP
-        #             if is_valid_email(user.email):
-        #                 chosen_channel = "EMAIL"
-        #                 contact = user.email
-        #                 send_mail(title or "Notification", message, None, [contact], fail_silently=False)
-        #                 n.channel = "EMAIL"
-        #                 n.recipient = contact
-        #                 n.status = "sent"
-        #                 n.provider = "email"
-        #                 n.save(update_fields=["channel", "recipient", "status", "provider"])
-        #                 return True
-        #             else:
-        #                 n.channel = "INAPP"
-        #                 n.recipient = f"user_{user_id}@no-contact.example.com"
-        #                 n.status = "sent"
-        #                 n.provider = "inapp"
-        #                 n.save(update_fields=["channel", "recipient", "status", "provider"])
-        #                 return True
-
-        #         # Otherwise, fall back to WhatsApp Cloud
-        #         logger.warning(
-        #             "Twilio WA failed (code=%s). Falling back to WA Cloud. user=%s to=%s",
-        #             getattr(tw_e, "code", None), user_id, contact
-        #         )
-        #         try:
-        #             res = send_whatsapp_cloud(contact, message)
-        #             n.provider = "whatsapp_cloud"
-        #             logger.info("WA Cloud ok user=%s mid=%s", user_id, getattr(res, 'message_id', None))
-        #         except HTTPError as cloud_e:
-        #             # Both providers failed -> EMAIL/INAPP fallback
-        #             n.status = "failed"
-        #             n.metadata = {
-        #                 **(n.metadata or {}),
-        #                 "error": f"Twilio WA+Cloud failed: twilio={str(tw_e)}, cloud={str(cloud_e)}",
-        #             }
-        #             n.save(update_fields=["status", "metadata"])
-
-        #             if is_valid_email(user.email):
-        #                 chosen_channel = "EMAIL"
-        #                 contact = user.email
-        #                 send_mail(title or "Notification", message, None, [contact], fail_silently=False)
-        #                 n.channel = "EMAIL"
-        #                 n.recipient = contact
-        #                 n.status = "sent"
-        #                 n.provider = "email"
-        #                 n.save(update_fields=["channel", "recipient", "status", "provider"])
-        #                 return True
-        #             else:
-        #                 n.channel = "INAPP"
-        #                 n.recipient = f"user_{user_id}@no-contact.example.com"
-        #                 n.status = "sent"
-        #                 n.provider = "inapp"
-        #                 n.save(update_fields=["channel", "recipient", "status", "provider"])
-        #                 return True
-
-        #     except Exception as tw_unknown:
-        #         # Unknown Twilio error -> try Cloud as best-effort
-        #         logger.warning("Twilio WA unexpected error: %s; trying WA Cloud. user=%s", tw_unknown, user_id)
-        #         try:
-        #             res = send_whatsapp_cloud(contact, message)
-        #             n.provider = "whatsapp_cloud"
-        #             logger.info("WA Cloud ok user=%s mid=%s", user_id, getattr(res, 'message_id', None))
-        #         except Exception as cloud_unknown:
-        #             # Let outer handler record failure & retry policy
-        #             raise
-
-        elif chosen_channel == "EMAIL":
-            send_mail(title or "Notification", message, None, [contact], fail_silently=False)
-            res = None
-            n.provider = "email"
-        else:
-            res = None
-            n.provider = chosen_channel.lower()
-
-        message_id, raw = _extract_provider_ids_and_raw(res)
-        n.status = "sent"
-        n.provider_message_id = message_id
-        n.metadata = {**(n.metadata or {}), **raw}
-        n.save(update_fields=["status", "provider", "provider_message_id", "metadata"])
-        return True
+        ok = _deliver(n, fallback_email)
+        n.save(update_fields=DELIVERY_FIELDS)
+        return ok
 
     except Exception as e:
         logger.exception("send_notification failed: %s", e)
@@ -902,3 +970,371 @@ def send_notification(
         n.save(update_fields=["status", "retry_count", "metadata"])
         raise
 
+
+def _defer_if_throttled(n, priority=None) -> bool:
+    """
+    Take a token from n's provider bucket. Without one, the delivery is re-enqueued after the
+    bucket's wait (row stays 'queued', no retry consumed) and True is returned.
+    """
+    provider = provider_for_channel(n.channel)
+    granted, wait = acquire(provider)
+    if granted:
+        return False
+    inc_throttled(provider)
+    deliver_notification.apply_async((n.id,), {"priority": priority}, countdown=max(wait, 0.05))
+    return True
+
+
+@shared_task(bind=True, max_retries=5, autoretry_for=(Exception,), retry_backoff=True, retry_jitter=True)
+def deliver_notification(self, notification_id, priority=None):
+    """Deliver an already created notification (send_notification deferred by the token bucket)."""
+    n = (Notification.objects.select_related("user")
+         .filter(id=notification_id, status__in=("queued", "failed")).first())
+    if n is None:
+        return False
+    if n.expires_at and n.expires_at <= timezone.now():
+        Notification.objects.filter(id=n.id).update(status="expired")
+        return False
+    if _defer_if_throttled(n, priority if priority is not None else n.priority):
+        return True
+    return _send_now(n, getattr(n.user, "email", None))
+
+
+# ---------------- Bulk fan-out ----------------
+#
+# One task for a whole audience instead of one send_notification per user:
+# recipients come from the resolved-recipient cache (2 queries for the misses), the rows are
+# bulk_create'd, INAPP rows are final immediately and the rest is delivered by
+# dispatch_notification_batch in chunks of NOTIFY_BULK_CHUNK_SIZE.
+
+BULK_CHUNK_SIZE = getattr(settings, "NOTIFY_BULK_CHUNK_SIZE", 200)
+BULK_MAX_RETRIES = getattr(settings, "NOTIFY_BULK_MAX_RETRIES", 3)
+BULK_RETRY_BASE_SECONDS = 30
+
+
+def create_bulk_notifications(items, *, category="", priority=None, metadata=None, channel=None,
+                              scheduled_for=None, expires_at=None, coalesce=False) -> dict:
+    """
+    items: iterable of (user_id, message, title) tuples; an optional 4th element (dict) is
+    merged into that row's metadata. Unknown users are skipped.
+    Delivery chunks are enqueued on commit, so callers inside a transaction are safe.
+    Rows scheduled in the future (or held by quiet hours) are stored 'pending' and left to
+    release_scheduled_notifications.
+    coalesce=True: each event is stored as an INAPP row and its SMS/WhatsApp/e-mail copy is
+    merged into the recipient's open digest for this category (see notifications.coalescing).
+    """
+    effective_priority = priority if isinstance(priority, int) and 1 <= priority <= 5 else 3
+    now = timezone.now()
+    scheduled_for, expires_at = as_datetime(scheduled_for), as_datetime(expires_at)
+    if scheduled_for and scheduled_for <= now:
+        scheduled_for = None
+    rows = []
+    for item in items:
+        user_id, message = item[0], item[1]
+        title = (item[2] if len(item) > 2 else "") or ""
+        extra = item[3] if len(item) > 3 else None
+        if user_id:
+            rows.append((user_id, message, title, extra))
+    if not rows or (expires_at and expires_at <= now):
+        return {"created": 0, "queued": 0, "inapp": 0, "scheduled": 0, "skipped": len(rows), "chunks": 0, "coalesced": 0}
+
+    recipients = get_recipients({r[0] for r in rows})   # cached profiles, 2 queries for the misses
+
+    objs, events, skipped = [], [], 0
+    for user_id, message, title, extra in rows:
+        recipient = recipients.get(normalize_user_id(user_id))
+        if recipient is None:
+            skipped += 1
+            continue
+        chosen_channel, contact = route(recipient, channel=channel)
+        if coalesce and can_coalesce(effective_priority, chosen_channel):
+            events.append({"user_id": recipient["user_id"], "channel": chosen_channel, "recipient": contact, "category": category,
+                           "priority": effective_priority, "title": title, "message": message})
+            chosen_channel = "INAPP"
+        inapp = chosen_channel == "INAPP"
+        hold = scheduled_for or hold_until(effective_priority, chosen_channel, now)
+        objs.append(Notification(
+            user_id=recipient["user_id"],
+            channel=chosen_channel,
+            recipient=contact,
+            title=title[:120],
+            message=message,
+            category=category,
+            priority=effective_priority,
+            status="pending" if hold else ("sent" if inapp else "queued"),
+            provider="inapp" if inapp else "",
+            metadata={**(metadata or {}), **(extra or {})},
+            scheduled_for=hold,
+            expires_at=expires_at,
+        ))
+
+    Notification.objects.bulk_create(objs, batch_size=1000)
+    digests = merge_into_digests(events, scheduled_for=scheduled_for, expires_at=expires_at)
+    transaction.on_commit(lambda: publish_created(objs + digests["rows"]))
+    pending = [n.id for n in objs if n.status == "queued"]
+    chunks = [pending[i:i + BULK_CHUNK_SIZE] for i in range(0, len(pending), BULK_CHUNK_SIZE)]
+    for chunk in chunks:
+        transaction.on_commit(lambda ids=chunk: dispatch_notification_batch.delay(ids, priority=effective_priority))
+
+    held = sum(1 for n in objs if n.status == "pending")
+    return {"created": len(objs), "queued": len(pending), "inapp": sum(1 for n in objs if n.status == "sent"),
+            "scheduled": held, "skipped": skipped, "chunks": len(chunks),
+            "coalesced": len(events), "digests_opened": digests["opened"]}
+
+
+@shared_task
+def send_bulk_notifications(items, category="", priority=None, metadata=None, channel=None,
+                            scheduled_for=None, expires_at=None, coalesce=False) -> dict:
+    """Celery entry point of create_bulk_notifications (items must be JSON-serializable)."""
+    return create_bulk_notifications(items, category=category, priority=priority, metadata=metadata, channel=channel,
+                                     scheduled_for=scheduled_for, expires_at=expires_at, coalesce=coalesce)
+
+
+def _batch_presend(batch) -> dict:
+    """
+    First delivery attempt for the SMS / WhatsApp rows of a chunk, sent concurrently through
+    the providers' send_many(). Returns {notification_id: ProviderResult | exception}.
+    """
+    if not getattr(settings, "NOTIFY_ASYNC_BATCH", True):
+        return {}
+    out = {}
+    for channel, provider in (("SMS", twilio_sms), ("WHATSAPP", whatsapp_cloud)):
+        rows = [n for n in batch if n.channel == channel]
+        if len(rows) < 2:
+            continue
+        try:
+            results = provider.send_many([(n.recipient, n.message) for n in rows])
+        except Exception as e:
+            logger.warning("Batch send via %s failed, falling back to per-message sends: %s", provider.name, e)
+            continue
+        out.update(zip((n.id for n in rows), results))
+    return out
+
+
+def _take_tokens(batch):
+    """
+    Split a chunk into the rows that got a provider token now and the ones to defer
+    (one bucket call per provider). Returns (ready, deferred, wait_seconds).
+    """
+    by_provider = {}
+    for n in batch:
+        by_provider.setdefault(provider_for_channel(n.channel), []).append(n)
+    ready, deferred, wait = [], [], 0.0
+    for provider, rows in by_provider.items():
+        granted, w = acquire(provider, len(rows))
+        ready.extend(rows[:granted])
+        if granted < len(rows):
+            deferred.extend(rows[granted:])
+            wait = max(wait, w)
+            inc_throttled(provider, len(rows) - granted)
+    return ready, deferred, wait
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def dispatch_notification_batch(self, notification_ids, priority=None) -> dict:
+    """
+    Deliver one chunk of queued notifications. Rows over a provider's rate stay 'queued' and
+    are re-enqueued after the bucket's wait; transient failures go back to 'queued' and are
+    retried together with backoff (up to NOTIFY_BULK_MAX_RETRIES); the chunk is saved with a
+    single bulk_update. Acked late: a chunk lost with its worker is redelivered, and the rows
+    it had already flipped to 'sending' are re-queued by release_scheduled_notifications once
+    claimed_at is older than NOTIFY_SENDING_STALE_MINUTES.
+    """
+    batch = list(Notification.objects.filter(id__in=notification_ids, status="queued").select_related("user"))
+    now = timezone.now()
+    expired = [n.id for n in batch if n.expires_at and n.expires_at <= now]
+    if expired:
+        Notification.objects.filter(id__in=expired, status="queued").update(status="expired")
+        batch = [n for n in batch if not (n.expires_at and n.expires_at <= now)]
+    batch, deferred, wait = _take_tokens(batch)
+    if deferred:
+        dispatch_notification_batch.apply_async(([n.id for n in deferred],), {"priority": priority},
+                                                countdown=max(wait, 0.05))
+    if not batch:
+        return {"sent": 0, "failed": 0, "retry": 0, "deferred": len(deferred)}
+    Notification.objects.filter(id__in=[n.id for n in batch]).update(status="sending", claimed_at=now)
+
+    presend = _batch_presend(batch)
+    sent = failed = 0
+    retry = []
+    for n in batch:
+        try:
+            if _deliver(n, getattr(n.user, "email", None), presend=presend.get(n.id)):
+                sent += 1
+            else:
+                failed += 1
+        except Exception as e:
+            logger.warning("Bulk delivery failed for notification %s: %s", n.id, e)
+            n.retry_count += 1
+            n.metadata = {**(n.metadata or {}), "error": str(e)}
+            if n.retry_count <= BULK_MAX_RETRIES:
+                n.status = "queued"
+                retry.append(n)
+            else:
+                n.status = "failed"
+                failed += 1
+
+    Notification.objects.bulk_update(batch, DELIVERY_FIELDS + ["retry_count"], batch_size=500)
+
+    if retry:
+        attempt = max(n.retry_count for n in retry)
+        dispatch_notification_batch.apply_async(
+            ([n.id for n in retry],), {"priority": priority},
+            countdown=BULK_RETRY_BASE_SECONDS * 2 ** (attempt - 1),
+        )
+    return {"sent": sent, "failed": failed, "retry": len(retry), "deferred": len(deferred)}
+
+
+# ---------------- Scheduled release ----------------
+
+RELEASE_BATCH_SIZE = getattr(settings, "NOTIFY_RELEASE_BATCH_SIZE", 2000)
+RELEASE_MAX_BATCHES = 25     # per tick; the rest waits for the next minute
+SENDING_STALE_MINUTES = getattr(settings, "NOTIFY_SENDING_STALE_MINUTES", 10)
+
+
+@shared_task
+def release_scheduled_notifications() -> dict:
+    """
+    Beat, every minute. Drops unsent rows past expires_at, then claims due 'pending' rows
+    (scheduled_for <= now) and hands them to dispatch_notification_batch by priority band.
+    Both statements walk an index ((status, expires_at) / (status, scheduled_for)), so a tick
+    costs O(due rows), not O(table). Rows are claimed with SKIP LOCKED so overlapping ticks
+    never release the same row twice. Rows stuck in 'sending' for NOTIFY_SENDING_STALE_MINUTES
+    (worker lost mid-chunk) go back to 'queued' and are dispatched again.
+    """
+    mark_beat_run("notifications.tasks.release_scheduled_notifications")
+
+    now = timezone.now()
+    expired = Notification.objects.filter(status__in=("pending", "queued"), expires_at__lte=now).update(status="expired")
+
+    released = inapp = 0
+    for _ in range(RELEASE_MAX_BATCHES):
+        with transaction.atomic():
+            due = list(Notification.objects
+                       .select_for_update(skip_locked=True)
+                       .filter(status="pending", scheduled_for__lte=now)
+                       .order_by("scheduled_for")
+                       .values_list("id", "channel", "priority")[:RELEASE_BATCH_SIZE])
+            if not due:
+                break
+            inapp_ids = [i for i, ch, _ in due if ch == "INAPP"]
+            by_priority = {}
+            for i, ch, p in due:
+                if ch != "INAPP":
+                    by_priority.setdefault(p, []).append(i)
+            if inapp_ids:
+                Notification.objects.filter(id__in=inapp_ids).update(status="sent", provider="inapp")
+            Notification.objects.filter(id__in=[i for ids in by_priority.values() for i in ids]).update(status="queued")
+            for p, ids in by_priority.items():
+                for k in range(0, len(ids), BULK_CHUNK_SIZE):
+                    transaction.on_commit(lambda ids=ids[k:k + BULK_CHUNK_SIZE], p=p: dispatch_notification_batch.delay(ids, priority=p))
+        released += len(due) - len(inapp_ids)
+        inapp += len(inapp_ids)
+        if len(due) < RELEASE_BATCH_SIZE:
+            break
+
+    requeued = _requeue_stale_sending(now)
+    return {"expired": expired, "released": released, "inapp": inapp, "requeued": requeued}
+
+
+def _requeue_stale_sending(now) -> int:
+    """Put 'sending' rows claimed before the stale cutoff back to 'queued' and dispatch them."""
+    cutoff = now - timedelta(minutes=SENDING_STALE_MINUTES)
+    requeued = 0
+    for _ in range(RELEASE_MAX_BATCHES):
+        with transaction.atomic():
+            stale = list(Notification.objects
+                         .select_for_update(skip_locked=True)
+                         .filter(Q(claimed_at__lte=cutoff) | Q(claimed_at__isnull=True, timestamp__lte=cutoff),
+                                 status="sending")
+                         .values_list("id", "priority")[:RELEASE_BATCH_SIZE])
+            if not stale:
+                break
+            by_priority = {}
+            for i, p in stale:
+                by_priority.setdefault(p, []).append(i)
+            Notification.objects.filter(id__in=[i for i, _ in stale]).update(status="queued", claimed_at=None)
+            for p, ids in by_priority.items():
+                for k in range(0, len(ids), BULK_CHUNK_SIZE):
+                    transaction.on_commit(lambda ids=ids[k:k + BULK_CHUNK_SIZE], p=p: dispatch_notification_batch.delay(ids, priority=p))
+        requeued += len(stale)
+        if len(stale) < RELEASE_BATCH_SIZE:
+            break
+    if requeued:
+        logger.warning("Re-queued %s notifications stuck in 'sending'", requeued)
+    return requeued
+
+
+@shared_task
+def apply_webhook_events() -> dict:
+    """
+    Drains the provider status stream (notifications.ingest) in batches of
+    NOTIFY_WEBHOOK_BATCH_SIZE. Scheduled right after a webhook burst and by beat every 30s.
+    Entries are acked only once their batch is committed; a crashed run leaves them pending
+    and the next run reclaims them after NOTIFY_WEBHOOK_CLAIM_IDLE_MS. Receipts for messages
+    whose provider id is not stored yet are parked and retried (ingest.defer), not acked away.
+    """
+    mark_beat_run("notifications.tasks.apply_webhook_events")
+    from . import ingest
+
+    try:
+        client = ingest._redis()
+        ingest.ensure_group(client)
+        released = ingest.release_delayed(client)
+    except Exception as e:
+        logger.warning("apply_webhook_events: stream unavailable: %s", e)
+        return {"batches": 0, "events": 0}
+
+    size = int(getattr(settings, "NOTIFY_WEBHOOK_BATCH_SIZE", 500))
+    idle = int(getattr(settings, "NOTIFY_WEBHOOK_CLAIM_IDLE_MS", 60000))
+    totals, batches, seen = {}, 0, 0
+    for _ in range(int(getattr(settings, "NOTIFY_WEBHOOK_MAX_BATCHES", 40))):
+        entry_ids, events = ingest.read_batch(client, size, idle)
+        if not entry_ids:
+            break
+        unmatched = []
+        try:
+            stats = ingest.apply_events(events, unmatched=unmatched)
+            if unmatched:
+                stats.update(ingest.defer(client, unmatched))
+        except Exception:
+            logger.exception("apply_webhook_events: batch of %s failed, left pending", len(entry_ids))
+            break
+        ingest.ack(client, entry_ids)
+        batches += 1
+        seen += len(events)
+        for k, v in stats.items():
+            totals[k] = totals.get(k, 0) + v
+        if len(entry_ids) < size:
+            break
+
+    return {"batches": batches, "events": seen, "released": released, **totals}
+
+
+@shared_task
+def rollup_notification_engagement() -> dict:
+    """Beat, nightly: re-roll the daily engagement stats of the last NOTIFY_ROLLUP_LOOKBACK_DAYS."""
+    mark_beat_run("notifications.tasks.rollup_notification_engagement")
+    from .retention import refresh_daily_rollups
+    return refresh_daily_rollups()
+
+
+@shared_task
+def archive_old_notifications() -> dict:
+    """
+    Beat, nightly: move rows older than NOTIFY_RETENTION_MONTHS to JSONL archives (see retention.py)
+    and drop outbox rows dispatched more than NOTIFY_OUTBOX_KEEP_DAYS ago.
+    """
+    mark_beat_run("notifications.tasks.archive_old_notifications")
+    from . import outbox, retention
+    result = retention.archive_old_notifications()
+    result["outbox_purged"] = outbox.purge()
+    return result
+
+
+@shared_task
+def relay_outbox() -> dict:
+    """Beat, every few seconds: publish committed outbox rows (see notifications.outbox)."""
+    mark_beat_run("notifications.tasks.relay_outbox")
+    from . import outbox
+    return outbox.relay()
@@ -1,3 +1,329 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from authentication.models import User
+from employee.models import Employee
+from notifications import ingest, outbox
+from notifications.loadtest import StubProvider, tag
+from notifications.models import Notification, NotificationPreference, OutboxMessage
+from notifications.recipients import invalidate
+from notifications.tasks import (
+    BULK_MAX_RETRIES, BULK_RETRY_BASE_SECONDS, SENDING_STALE_MINUTES, apply_webhook_events,
+    create_bulk_notifications, dispatch_notification_batch, release_scheduled_notifications,
+)
+
+
+class BulkNotificationStubTests(TestCase):
+    """
+    create_bulk_notifications -> dispatch_notification_batch against a local Twilio stub
+    (notifications.loadtest.StubProvider), the scenarios of `manage.py benchmark_notifications`.
+    Delivery chunks are captured from on_commit and dispatched by hand; re-enqueues are mocked.
+    """
+
+    USERS = 4
+
+    def setUp(self):
+        self.stub = StubProvider("twilio", latency_ms=0).start()
+        self.addCleanup(self.stub.stop)
+        overrides = override_settings(
+            TWILIO_API_BASE=self.stub.base_url, TWILIO_ACCOUNT_SID="ACtest", TWILIO_AUTH_TOKEN="test",
+            TWILIO_FROM="+15550000000", NOTIFY_TWILIO_CALLBACK=None, NOTIFY_QUIET_HOURS=None,
+            NOTIFY_PROVIDER_RATES={},
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user_ids = []
+        for i in range(self.USERS):
+            user = User.objects.create_user(username=f"notif_test_{i}", password="x", email=f"t{i}@example.com")
+            Employee.objects.create(user=user, first_name="Test", last_name=str(i), gender="M",
+                                    employment_type="test", contact=f"+22507{i:08d}")
+            NotificationPreference.objects.create(user=user, channel="SMS", contact=f"+22507{i:08d}", is_active=True)
+            self.user_ids.append(user.pk)
+        invalidate(self.user_ids)
+        self.addCleanup(invalidate, self.user_ids)
+
+    def _create(self, **kwargs):
+        items = [(uid, f"Bulletin disponible {tag(i)}", "Paie") for i, uid in enumerate(self.user_ids)]
+        with self.captureOnCommitCallbacks(execute=False):
+            result = create_bulk_notifications(items, category="payroll", priority=3, **kwargs)
+        return result
+
+    def _queued_ids(self):
+        return list(Notification.objects.filter(user_id__in=self.user_ids, status="queued").values_list("id", flat=True))
+
+    def test_bulk_send_marks_rows_sent(self):
+        result = self._create()
+        self.assertEqual((result["created"], result["queued"], result["chunks"]), (self.USERS, self.USERS, 1))
+
+        with mock.patch.object(dispatch_notification_batch, "apply_async") as requeue:
+            out = dispatch_notification_batch(self._queued_ids(), priority=3)
+
+        self.assertEqual(out, {"sent": self.USERS, "failed": 0, "retry": 0, "deferred": 0})
+        requeue.assert_not_called()
+        rows = Notification.objects.filter(user_id__in=self.user_ids)
+        self.assertEqual(set(rows.values_list("status", flat=True)), {"sent"})
+        self.assertEqual(set(rows.values_list("provider", flat=True)), {"twilio"})
+        self.assertTrue(all(rows.values_list("provider_message_id", flat=True)))
+        self.assertEqual(len(self.stub.accepted), self.USERS)
+
+    def test_provider_500_requeues_with_retry_count(self):
+        self.stub.error_rate, self.stub.error_status = 1.0, 500
+        self._create()
+        ids = self._queued_ids()
+
+        with mock.patch.object(dispatch_notification_batch, "apply_async") as requeue:
+            out = dispatch_notification_batch(ids, priority=3)
+
+        self.assertEqual(out, {"sent": 0, "failed": 0, "retry": self.USERS, "deferred": 0})
+        rows = Notification.objects.filter(id__in=ids)
+        self.assertEqual(set(rows.values_list("status", flat=True)), {"queued"})
+        self.assertEqual(set(rows.values_list("retry_count", flat=True)), {1})
+        requeue.assert_called_once()
+        args, kwargs = requeue.call_args
+        self.assertEqual(sorted(args[0][0]), sorted(ids))
+        self.assertEqual(kwargs["countdown"], BULK_RETRY_BASE_SECONDS)
+
+        # out of retries: failed for good, no further re-enqueue
+        Notification.objects.filter(id__in=ids).update(retry_count=BULK_MAX_RETRIES)
+        with mock.patch.object(dispatch_notification_batch, "apply_async") as requeue:
+            out = dispatch_notification_batch(ids, priority=3)
+        self.assertEqual(out["failed"], self.USERS)
+        requeue.assert_not_called()
+        self.assertEqual(set(rows.values_list("status", flat=True)), {"failed"})
+
+    def test_throttled_rows_are_deferred_without_retry(self):
+        self._create()
+        ids = self._queued_ids()
+
+        # two tokens left in the twilio bucket, the rest in 0.5s
+        with mock.patch("notifications.tasks.acquire", side_effect=lambda provider, n=1: (min(n, 2), 0.5)), \
+                mock.patch.object(dispatch_notification_batch, "apply_async") as requeue:
+            out = dispatch_notification_batch(ids, priority=3)
+
+        self.assertEqual(out, {"sent": 2, "failed": 0, "retry": 0, "deferred": self.USERS - 2})
+        args, kwargs = requeue.call_args
+        self.assertEqual(len(args[0][0]), self.USERS - 2)
+        self.assertEqual(kwargs["countdown"], 0.5)
+        deferred = Notification.objects.filter(id__in=args[0][0])
+        self.assertEqual(set(deferred.values_list("status", flat=True)), {"queued"})
+        self.assertEqual(set(deferred.values_list("retry_count", flat=True)), {0})
+        self.assertEqual(len(self.stub.accepted), 2)
+
+    def test_coalesced_events_become_one_digest_per_recipient(self):
+        uid = self.user_ids[0]
+        for i in range(3):
+            with self.captureOnCommitCallbacks(execute=False):
+                result = create_bulk_notifications([(uid, f"Demande de congé n°{i}", "Congé")],
+                                                   category="leave", priority=3, coalesce=True)
+            self.assertEqual((result["coalesced"], result["queued"], result["chunks"]), (1, 0, 0))
+
+        rows = Notification.objects.filter(user_id=uid, category="leave")
+        self.assertEqual(rows.filter(channel="INAPP", status="sent").count(), 3)
+        digests = rows.exclude(channel="INAPP")
+        self.assertEqual(digests.count(), 1)
+        digest = digests.get()
+        self.assertEqual((digest.channel, digest.status), ("SMS", "pending"))
+        self.assertIsNotNone(digest.scheduled_for)
+        self.assertIn("3 nouvelles notifications", digest.message)
+        self.assertEqual(self.stub.requests, 0)
+
+    def test_stale_sending_rows_are_requeued(self):
+        self._create()
+        ids = self._queued_ids()
+        stale, fresh = ids[:2], ids[2:]
+        now = timezone.now()
+        Notification.objects.filter(id__in=stale).update(
+            status="sending", claimed_at=now - timedelta(minutes=SENDING_STALE_MINUTES + 1))
+        Notification.objects.filter(id__in=fresh).update(status="sending", claimed_at=now)
+
+        with mock.patch.object(dispatch_notification_batch, "delay") as dispatch, \
+                self.captureOnCommitCallbacks(execute=True):
+            out = release_scheduled_notifications()
+
+        self.assertEqual(out["requeued"], len(stale))
+        dispatch.assert_called_once()
+        self.assertEqual(sorted(dispatch.call_args[0][0]), sorted(stale))
+        self.assertEqual(set(Notification.objects.filter(id__in=stale).values_list("status", flat=True)), {"queued"})
+        self.assertEqual(set(Notification.objects.filter(id__in=fresh).values_list("status", flat=True)), {"sending"})
+
+
+class _StreamClient:
+    """In-memory stand-in for the few Redis calls of notifications.ingest (stream, group, delayed zset)."""
+
+    def __init__(self):
+        self.keys, self.stream, self.delayed, self.acked = set(), [], {}, []
+        self.delivered = 0
+        self.seq = 0
+
+    def register_script(self, body):
+        run = {ingest.ENQUEUE_LUA: self._enqueue, ingest.RELEASE_LUA: self._release}[body]
+        script = lambda keys, args: run(keys, args)   # noqa: E731
+        script.registered_client = self
+        return script
+
+    def _xadd(self, payload):
+        self.seq += 1
+        self.stream.append((f"{self.seq}-0", {"e": payload}))
+
+    def _enqueue(self, keys, args):
+        added = 0
+        for key, payload in zip(keys[1:], args[2:]):
+            if key not in self.keys:
+                self.keys.add(key)
+                self._xadd(payload)
+                added += 1
+        return added
+
+    def _release(self, keys, args):
+        due = [p for p, score in self.delayed.items() if score <= float(args[0])]
+        for payload in due:
+            self._xadd(payload)
+            del self.delayed[payload]
+        return len(due)
+
+    def xgroup_create(self, *args, **kwargs):
+        pass
+
+    def xautoclaim(self, *args, **kwargs):
+        return ["0-0", []]
+
+    def xreadgroup(self, group, name, streams, count):
+        entries = self.stream[self.delivered:self.delivered + count]
+        self.delivered += len(entries)
+        return [["stream", entries]] if entries else []
+
+    def pipeline(self, transaction=False):
+        return self
+
+    def xack(self, stream, group, *ids):
+        self.acked.extend(ids)
+
+    def xdel(self, stream, *ids):
+        pass
+
+    def execute(self):
+        pass
+
+    def zadd(self, key, mapping):
+        self.delayed.update(mapping)
+
+
+class WebhookIngestTests(TestCase):
+    """Status receipts: forward-only transitions, dedupe on event id, unmatched events parked and retried."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="ingest_user", password="x")
+        self.client_ = _StreamClient()
+        for target, value in (("_redis", lambda: self.client_), ("_kick", lambda client: None)):
+            patcher = mock.patch.object(ingest, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _notification(self, mid, status="sent"):
+        return Notification.objects.create(user=self.user, channel="SMS", message="x", status=status,
+                                           provider="twilio", provider_message_id=mid)
+
+    def test_read_is_never_downgraded(self):
+        n = self._notification("SM1")
+        ingest.apply_events([ingest.make_event("twilio", "SM1", "read")])
+        stats = ingest.apply_events([ingest.make_event("twilio", "SM1", "delivered")])
+
+        self.assertEqual(stats, {"stale": 1, "applied": 0, "unmatched": 0})
+        n.refresh_from_db()
+        self.assertEqual(n.status, "read")
+        self.assertTrue(n.is_read)
+        self.assertIsNotNone(n.delivered_at)
+
+        # out of order within one batch: the most advanced status wins
+        m = self._notification("SM2")
+        ingest.apply_events([ingest.make_event("twilio", "SM2", "read"), ingest.make_event("twilio", "SM2", "delivered")])
+        m.refresh_from_db()
+        self.assertEqual(m.status, "read")
+
+    def test_duplicate_event_ids_are_dropped(self):
+        n = self._notification("SM3")
+        event = ingest.make_event("twilio", "SM3", "delivered")
+        self.assertEqual(ingest.enqueue([event]), {"queued": 1, "duplicates": 0})
+        self.assertEqual(ingest.enqueue([dict(event)]), {"queued": 0, "duplicates": 1})
+        self.assertEqual(len(self.client_.stream), 1)
+
+        out = apply_webhook_events()
+        self.assertEqual((out["events"], out["applied"]), (1, 1))
+        n.refresh_from_db()
+        self.assertEqual(n.status, "delivered")
+
+    @override_settings(NOTIFY_WEBHOOK_RETRY_DELAY=15)
+    def test_unmatched_events_are_parked_and_retried(self):
+        ingest.enqueue([ingest.make_event("twilio", "SM4", "delivered")])
+        out = apply_webhook_events()
+
+        self.assertEqual((out["unmatched"], out["deferred"]), (1, 1))
+        self.assertEqual(self.client_.acked, ["1-0"])
+        (payload, due), = self.client_.delayed.items()
+        self.assertEqual(json.loads(payload)["attempt"], 1)
+
+        # the provider id lands later (bulk chunks write it at the end); the parked event is not due yet
+        n = self._notification("SM4")
+        self.assertEqual(apply_webhook_events()["released"], 0)
+        with mock.patch.object(ingest.time, "time", return_value=due):
+            out = apply_webhook_events()
+        self.assertEqual((out["released"], out["applied"]), (1, 1))
+        self.assertEqual(self.client_.delayed, {})
+        n.refresh_from_db()
+        self.assertEqual(n.status, "delivered")
+
+
+class OutboxRelayTests(TestCase):
+    """Outbox rows are published by the relay only once committed; a broker error backs off and ends the batch."""
+
+    TASK = "payroll.tasks.dispatch_payroll_run"
+
+    def test_published_only_after_commit(self):
+        with mock.patch.object(outbox, "_publish") as publish:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                msg = outbox.enqueue(self.TASK, 7)
+            publish.assert_not_called()
+            self.assertEqual(len(callbacks), 1)            # only the wake-up waits on the commit
+
+            try:
+                with transaction.atomic():
+                    outbox.enqueue(self.TASK, 8)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            self.assertEqual(OutboxMessage.objects.count(), 1)
+
+            self.assertEqual(outbox.relay(), {"sent": 1, "failed": 0})
+            self.assertEqual(outbox.relay(), {"sent": 0, "failed": 0})
+
+        publish.assert_called_once()
+        self.assertEqual((publish.call_args[0][0].pk, publish.call_args[0][0].args), (msg.pk, [7]))
+        msg.refresh_from_db()
+        self.assertIsNotNone(msg.dispatched_at)
+
+    def test_broker_error_backs_off_and_stops_batch(self):
+        first = outbox.enqueue(self.TASK, 1)
+        second = outbox.enqueue(self.TASK, 2)
+        before = timezone.now()
+
+        with mock.patch.object(outbox, "_publish", side_effect=ConnectionError("broker down")) as publish:
+            self.assertEqual(outbox.relay(), {"sent": 0, "failed": 1})
+        publish.assert_called_once()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.attempts, first.last_error), (1, "broker down"))
+        self.assertGreaterEqual(first.available_at, before + timedelta(seconds=2))
+        self.assertIsNone(first.dispatched_at)
+        self.assertEqual((second.attempts, second.dispatched_at), (0, None))
+
+        # broker back: the backed-off row waits, the rest goes out
+        with mock.patch.object(outbox, "_publish") as publish:
+            self.assertEqual(outbox.relay(), {"sent": 1, "failed": 0})
+        self.assertEqual(publish.call_args[0][0].pk, second.pk)
@@ -0,0 +1,140 @@
+# notifications/throttle.py
+"""
+Priority bands and provider throttling for notification delivery.
+
+  - Priority bands: Notification.priority 1-2 -> notifications.high, 3 -> notifications.default,
+    4-5 -> notifications.bulk (NOTIFY_PRIORITY_QUEUES). route_notification_task is the Celery
+    router (CELERY_TASK_ROUTES), so a payroll broadcast in the bulk band never sits in front of
+    a leave approval. Give the high band its own worker(s): `-Q notifications.high`, and make
+    sure the others consume notifications.default and notifications.bulk (docker-compose).
+  - Provider token buckets live in Redis (one hash per provider, refilled by a Lua script using
+    Redis' clock), so NOTIFY_PROVIDER_RATES is a global rate shared by every worker. Callers that
+    get no token re-enqueue with a countdown instead of raising into the retry machinery.
+    Fallback providers (Twilio WhatsApp after a WhatsApp Cloud failure) are not the channel's
+    provider: their sends wait for a token with wait_for_token() and raise Throttled past
+    NOTIFY_FALLBACK_MAX_WAIT, which the callers treat as a transient error.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from typing import Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BANDS = {1: "high", 2: "high", 3: "default", 4: "bulk", 5: "bulk"}
+DEFAULT_QUEUES = {"high": "notifications.high", "default": "notifications.default", "bulk": "notifications.bulk"}
+
+CHANNEL_PROVIDERS = {"SMS": "twilio", "WHATSAPP": "whatsapp_cloud", "EMAIL": "smtp"}   # primary provider
+
+ROUTED_TASKS = {
+    "notifications.tasks.send_notification": 6,            # positional index of `priority`
+    "notifications.tasks.deliver_notification": 1,
+    "notifications.tasks.dispatch_notification_batch": 1,
+    "notifications.tasks.send_bulk_notifications": 2,
+}
+
+
+def band_for(priority) -> str:
+    return BANDS.get(priority if isinstance(priority, int) else 3, "default")
+
+
+def queue_for(priority) -> str:
+    queues = getattr(settings, "NOTIFY_PRIORITY_QUEUES", None) or DEFAULT_QUEUES
+    return queues.get(band_for(priority), DEFAULT_QUEUES["default"])
+
+
+def route_notification_task(name, args, kwargs, options, task=None, **kw):
+    """Celery router: notification tasks go to the queue of their priority band."""
+    if name not in ROUTED_TASKS:
+        return None
+    priority = (kwargs or {}).get("priority")
+    idx = ROUTED_TASKS[name]
+    if priority is None and args and len(args) > idx:
+        priority = args[idx]
+    return {"queue": queue_for(priority)}
+
+
+def provider_for_channel(channel: str) -> Optional[str]:
+    return CHANNEL_PROVIDERS.get((channel or "").upper())
+
+
+# ---------------- Redis token bucket ----------------
+
+# KEYS[1] bucket; ARGV rate/s, capacity, requested. Returns {granted, ms until the rest fits}.
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+  tokens = capacity
+  ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+local wait = 0
+if granted < requested then
+  wait = math.ceil((requested - granted - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return {granted, wait}
+"""
+
+_script = None
+_script_client = None
+
+
+def _bucket_script():
+    global _script, _script_client
+    from django_redis import get_redis_connection
+    client = get_redis_connection("default")
+    if _script is None or _script_client is not client:
+        _script, _script_client = client.register_script(TOKEN_BUCKET_LUA), client
+    return _script
+
+
+def acquire(provider: Optional[str], tokens: int = 1) -> tuple[int, float]:
+    """
+    Take up to `tokens` from the provider's shared bucket.
+    Returns (granted, seconds until the remaining ones would be available). Fails open
+    (everything granted) when the provider has no configured rate or Redis is unavailable.
+    """
+    rates = getattr(settings, "NOTIFY_PROVIDER_RATES", {}) or {}
+    rate = rates.get(provider) if provider else None
+    if not rate or tokens <= 0:
+        return tokens, 0.0
+    bursts = getattr(settings, "NOTIFY_PROVIDER_BURSTS", {}) or {}
+    capacity = bursts.get(provider) or rate
+    try:
+        granted, wait_ms = _bucket_script()(keys=[f"notify:bucket:{provider}"], args=[rate, capacity, tokens])
+        return int(granted), int(wait_ms) / 1000.0
+    except Exception as e:
+        logger.warning("Token bucket for %s unavailable, not throttling: %s", provider, e)
+        return tokens, 0.0
+
+
+class Throttled(Exception):
+    """No provider token within the allowed wait."""
+
+
+def wait_for_token(provider: str, max_wait: float = None) -> None:
+    """Block until one token of `provider` is granted; raise Throttled past `max_wait` seconds."""
+    if max_wait is None:
+        max_wait = float(getattr(settings, "NOTIFY_FALLBACK_MAX_WAIT", 2.0))
+    deadline = time.monotonic() + max_wait
+    while True:
+        granted, wait = acquire(provider)
+        if granted:
+            return
+        if time.monotonic() + wait > deadline:
+            raise Throttled(f"{provider}: no token within {max_wait}s")
+        time.sleep(wait)
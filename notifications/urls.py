@@ -1,7 +1,7 @@
 # notifications/urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from notifications.views import NotificationViewSet, NotificationPreferenceViewSet, notification_center_view
+from notifications.views import NotificationViewSet, NotificationPreferenceViewSet, notification_center_view, notification_stream
 
 router = DefaultRouter()
 router.register(r'notifications', NotificationViewSet, basename='notifications')
@@ -10,6 +10,7 @@ router.register(r'preferences', NotificationPreferenceViewSet, basename='prefere
 urlpatterns = [
     path('notifications/', include(router.urls)),
     path('notifications/center/', notification_center_view, name='notification_center'),
+    path('notifications/stream/', notification_stream, name='notification_stream'),
 ]
 
 # notifications/urls.py (add)
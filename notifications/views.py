@@ -10,6 +10,25 @@ from .models import Notification, NotificationPreference
 from .serializers import NotificationSerializer, NotificationPreferenceSerializer
 from django.utils import timezone
 from django.db.models import Q, F
+from . import realtime
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+def owned_by(qs, u):
+    # also include user=NULL but addressed to my email/phone
+    emails = [u.email] if u.email else []
+    phones = []
+    emp = getattr(u, 'employee', None)
+    if emp and getattr(emp, 'contact', None):
+        phones.append(emp.contact)
+    return qs.filter(Q(user=u) | Q(user__isnull=True, recipient__in=(emails+phones)))
+
 
 class NotificationViewSet(ModelViewSet):
     queryset = Notification.objects.all().order_by('-timestamp')
@@ -17,16 +36,7 @@ class NotificationViewSet(ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        u = self.request.user
-        qs = super().get_queryset()
-        # also include user=NULL but addressed to my email/phone
-        emails = [u.email] if u.email else []
-        phones = []
-        emp = getattr(u, 'employee', None)
-        if emp and getattr(emp, 'contact', None):
-            phones.append(emp.contact)
-
-        qs = qs.filter(Q(user=u) | Q(user__isnull=True, recipient__in=(emails+phones)))
+        qs = owned_by(super().get_queryset(), self.request.user)
 
         # filters
         p = self.request.query_params
@@ -42,20 +52,36 @@ class NotificationViewSet(ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def unread_count(self, request):
-        count = self.get_queryset().filter(is_read=False).count()
-        return Response({'unread': count})
+        compute = lambda: self.get_queryset().filter(is_read=False).count()
+        if request.query_params:
+            # filtered counts are not cached
+            return Response({'unread': compute()})
+        return Response({'unread': realtime.get_unread(request.user.pk, compute)})
 
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         n = self.get_object()
+        was_unread = not n.is_read
         n.mark_read()
+        if was_unread:
+            realtime.adjust_unread(request.user.pk, -1)
         return Response({'ok': True, 'read_at': n.read_at})
 
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
         qs = self.get_queryset().filter(is_read=False)
-        qs.update(is_read=True, status='read', read_at=timezone.now())
-        return Response({'ok': True, 'updated': qs.count()})
+        updated = qs.update(is_read=True, status='read', read_at=timezone.now())
+        if not request.query_params:
+            realtime.set_unread(request.user.pk, 0)
+        else:
+            realtime.forget_unread([request.user.pk])
+        return Response({'ok': True, 'updated': updated})
+
+    def perform_destroy(self, instance):
+        was_unread = not instance.is_read
+        super().perform_destroy(instance)
+        if was_unread:
+            realtime.adjust_unread(self.request.user.pk, -1)
 
 
 
@@ -78,3 +104,85 @@ def notification_center_view(request):
         return redirect('login')
     return render(request, 'notifications/notification_center.html')
 
+
+
+# ---------------- real-time stream (SSE) ----------------
+# Replaces the 30s unread_count polling: the browser keeps one EventSource open and gets
+# "notification" / "unread" events pushed from notifications.realtime over Redis pub/sub.
+# Needs the ASGI server (the "stream" service, see config/asgi.py): under WSGI Django drains
+# an async iterator before sending anything, so an endless stream would pin a thread forever.
+# There the view answers 204, which closes the EventSource and the page falls back to polling.
+
+STREAM_KEEPALIVE = getattr(settings, 'NOTIFY_STREAM_KEEPALIVE', 20)
+
+
+async def _stream_user(request):
+    user = await request.auser()
+    if user.is_authenticated:
+        return user
+    token = request.GET.get('token')
+    if not token:
+        return None
+    try:
+        from rest_framework_simplejwt.authentication import JWTAuthentication
+        auth = JWTAuthentication()
+        validated = await sync_to_async(auth.get_validated_token)(token)
+        return await sync_to_async(auth.get_user)(validated)
+    except Exception:
+        return None
+
+
+def _sse(event, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def notification_stream(request):
+    if not isinstance(request, ASGIRequest) or not getattr(settings, 'NOTIFY_STREAM_ENABLED', False):
+        return HttpResponse(status=204)
+    user = await _stream_user(request)
+    if user is None:
+        return JsonResponse({'detail': "Authentification requise."}, status=401)
+
+    def count():
+        return owned_by(Notification.objects.all(), user).filter(is_read=False).count()
+
+    unread = await sync_to_async(realtime.get_unread)(user.pk, count)
+
+    async def events():
+        yield "retry: 5000\n\n"
+        yield _sse('unread', {'unread': unread})
+        try:
+            import redis.asyncio as aioredis
+            client = aioredis.from_url(realtime.pubsub_url())
+            pubsub = client.pubsub()
+            await pubsub.subscribe(realtime.channel_for(user.pk))
+        except Exception as e:
+            logger.warning("Notification stream unavailable for %s: %s", user.pk, e)
+            yield _sse('unavailable', {})
+            return
+        try:
+            while True:
+                msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=STREAM_KEEPALIVE)
+                if msg is None:
+                    yield ": keepalive\n\n"
+                    continue
+                try:
+                    payload = json.loads(msg['data'])
+                except (TypeError, ValueError):
+                    continue
+                yield _sse(payload.get('event', 'message'), payload.get('data'))
+        except Exception as e:
+            logger.warning("Notification stream for %s closed: %s", user.pk, e)
+            yield _sse('unavailable', {})
+        finally:
+            try:
+                await pubsub.unsubscribe()
+                await pubsub.aclose()
+                await client.aclose()
+            except Exception:
+                pass
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
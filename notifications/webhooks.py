@@ -1,8 +1,6 @@
 # notifications/webhooks.py
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse, JsonResponse
-from django.utils import timezone
-from .models import Notification
 from django.conf import settings
 from django.shortcuts import get_object_or_404
 import json
@@ -56,9 +54,8 @@ from config.monitoring.metrics import inc_twilio, inc_whatsapp, inc_cloudinary
 # notifications/webhooks.py
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse, JsonResponse
-from django.utils import timezone
 from django.conf import settings
-from .models import Notification
+from .ingest import enqueue, make_event
 import json
 
 # OPTIONAL: verify the webhook with Twilio signature
@@ -90,39 +87,8 @@ def twilio_status_webhook(request):
     sid = request.POST.get("MessageSid") or request.POST.get("SmsSid")
     status = request.POST.get("MessageStatus") or request.POST.get("SmsStatus")  # queued|sent|delivered|undelivered|failed|read?
     error_code = request.POST.get("ErrorCode")  # may be empty
-    # Match both SMS and WhatsApp providers sent via Twilio
-    q = Notification.objects.filter(provider__in=["twilio", "twilio_whatsapp"], provider_message_id=sid)
-
-    # Normalize and update
-    if status in ("delivered", "read"):
-        updates = {"status": status}
-        if status == "delivered":
-            updates["delivered_at"] = timezone.now()
-        else:  # read
-            updates["is_read"] = True
-            updates["read_at"] = timezone.now()
-        if error_code:
-            # stash last error (if any) into metadata
-            for n in q:
-                m = n.metadata or {}
-                m["twilio_error_code"] = error_code
-                n.metadata = m
-                n.save(update_fields=["status", "delivered_at", "is_read", "read_at", "metadata"] if status == "read"
-                                   else ["status", "delivered_at", "metadata"])
-        else:
-            q.update(**updates)
-    elif status in ("failed", "undelivered"):
-        if error_code:
-            for n in q:
-                m = n.metadata or {}
-                m["twilio_error_code"] = error_code
-                n.metadata = m
-                n.status = "failed"
-                n.save(update_fields=["status", "metadata"])
-        else:
-            q.update(status="failed")
-    elif status in ("sent", "queued"):
-        q.update(status=status)
+    # Matches both SMS and WhatsApp sent via Twilio; applied in batches by tasks.apply_webhook_events
+    enqueue([make_event("twilio", sid, status, error_code=error_code)])
 
     return HttpResponse(status=204)
 
@@ -141,24 +107,25 @@ def whatsapp_cloud_webhook(request):
 
     try:
         data = json.loads(request.body.decode("utf-8"))
-        # parse statuses
-        for entry in data.get("entry", []):
-            for change in entry.get("changes", []):
-                value = change.get("value", {})
-                for s in value.get("statuses", []):
-                    mid = s.get("id")
-                    st = s.get("status")  # sent, delivered, read, failed
-                    q = Notification.objects.filter(provider="whatsapp_cloud", provider_message_id=mid)
-                    if st == "delivered":
-                        q.update(status="delivered", delivered_at=timezone.now())
-                    elif st == "read":
-                        q.update(status="read", is_read=True, read_at=timezone.now())
-                    elif st in ("failed", "undelivered"):
-                        q.update(status="failed")
-                    elif st == "sent":
-                        q.update(status="sent")
     except Exception:
-        pass
+        return HttpResponse(status=200)
+    if not isinstance(data, dict):
+        return HttpResponse(status=200)
+
+    # parse statuses (one payload can carry hundreds): acknowledge now, apply in batches
+    events = []
+    for entry in data.get("entry", []) or []:
+        for change in entry.get("changes", []) or []:
+            value = change.get("value", {}) or {}
+            for s in value.get("statuses", []) or []:
+                errors = s.get("errors") or []
+                events.append(make_event(
+                    "whatsapp_cloud", s.get("id"), s.get("status"),  # sent, delivered, read, failed
+                    error_code=str(errors[0].get("code")) if errors and errors[0].get("code") else None,
+                    ts=s.get("timestamp"),
+                ))
+    if events:
+        enqueue(events)
     return HttpResponse(status=200)
 
 
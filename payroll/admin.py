@@ -83,7 +83,7 @@ class ExchangeRateAdmin(admin.ModelAdmin):
 
 @admin.register(CompanyPolicy)
 class CompanyPolicyAdmin(admin.ModelAdmin):
-    list_display = ('name', 'country', 'currency', 'proration_method')
+    list_display = ('name', 'country', 'currency', 'proration_method', 'shard_size', 'shard_concurrency')
     list_filter = ('country', 'proration_method')
     filter_horizontal = ('active_contribs',)
     search_fields = ('name',)
@@ -98,6 +98,20 @@ class PayrollRunAdmin(admin.ModelAdmin):
     ordering = ('-year', '-month')
 
 
+@admin.register(PayslipPdfJob)
+class PayslipPdfJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'run', 'output', 'status', 'rendered', 'skipped', 'failed', 'total', 'created_at', 'finished_at')
+    list_filter = ('status', 'output')
+    readonly_fields = ('errors',)
+
+
+@admin.register(PayrollRunJob)
+class PayrollRunJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'run', 'status', 'shards_done', 'shards_total', 'slips_written', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('task_id', 'errors')
+
+
 @admin.register(Payslip)
 class PayslipAdmin(admin.ModelAdmin):
     list_display = ('employee', 'run', 'gross_pay', 'net_pay', 'currency', 'finalized', 'created_at')
@@ -6,5 +6,7 @@ class PayrollConfig(AppConfig):
     name = 'payroll'
 
     def ready(self):
+        import payroll.signals  # dirty-set tracking for incremental recompute
+
         from config.monitoring.metrics import setup_metrics
         setup_metrics()
\ No newline at end of file
@@ -0,0 +1,109 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from payroll.models import PayrollRun, Payslip
+from payroll.services.engines import PayrollEngine
+from payroll.services.bulk import BulkPayrollEngine
+from payroll.services.columnar import ColumnarPayrollEngine
+
+TOTALS = ["base_salary", "gross_pay", "taxable_gross", "employee_contrib",
+          "employer_contrib", "income_tax", "other_deductions", "net_pay"]
+
+
+def _snapshot(run, employee_ids):
+    """Comparable view of the slips/items written for these employees."""
+    out = {}
+    qs = (Payslip.objects.filter(run=run, employee_id__in=employee_ids)
+          .prefetch_related("items"))
+    for p in qs:
+        out[p.employee_id] = (
+            p.base_salary, p.gross_pay, p.taxable_gross, p.employee_contrib, p.employer_contrib,
+            p.income_tax, p.other_deductions, p.net_pay, p.currency_id,
+            [(i.component_id, i.quantity, i.rate, i.amount, i.meta) for i in p.items.all()],
+        )
+    return out
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the set-based payroll engine: query count and wall time per headcount step. "
+            "Everything runs in a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("run_id", type=int)
+        parser.add_argument("--steps", default="10,100,1000",
+                            help="Comma-separated headcounts to compute (capped at the run population).")
+        parser.add_argument("--parity", action="store_true",
+                            help="Also run the per-employee engine and check results are identical.")
+        parser.add_argument("--columnar", action="store_true",
+                            help="Time the NumPy columnar engine and check it matches compute_for_employee to the cent.")
+
+    def handle(self, *args, **opts):
+        run = PayrollRun.objects.select_related("company_policy").filter(id=opts["run_id"]).first()
+        if not run:
+            raise CommandError(f"PayrollRun {opts['run_id']} not found.")
+
+        all_ids = list(PayrollEngine(run)._run_employees().values_list("id", flat=True))
+        steps = sorted({min(int(x), len(all_ids)) for x in opts["steps"].split(",") if x.strip()})
+        if not all_ids:
+            raise CommandError("No employee with an active contract in this run's period.")
+
+        self.stdout.write(f"{'headcount':>10} {'queries':>8} {'seconds':>9}")
+        with transaction.atomic():
+            for n in steps:
+                ids = all_ids[:n]
+                engine = BulkPayrollEngine(run)
+                with CaptureQueriesContext(connection) as ctx:
+                    t0 = time.perf_counter()
+                    engine._persist(engine.build_all(ids))
+                    elapsed = time.perf_counter() - t0
+                self.stdout.write(f"{n:>10} {len(ctx.captured_queries):>8} {elapsed:>9.3f}")
+
+            if opts["parity"]:
+                ids = all_ids[:steps[-1]]
+                row = PayrollEngine(run)
+                for emp in row._run_employees(ids):
+                    row.compute_for_employee(emp)
+                expected = _snapshot(run, ids)
+
+                engine = BulkPayrollEngine(run)
+                engine._persist(engine.build_all(ids))
+                got = _snapshot(run, ids)
+
+                diff = [eid for eid in set(expected) | set(got) if expected.get(eid) != got.get(eid)]
+                if diff:
+                    self.stdout.write(self.style.ERROR(f"Parity FAILED for {len(diff)} employee(s): {diff[:10]}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f"Parity OK on {len(expected)} payslips."))
+
+            if opts["columnar"]:
+                ids = all_ids[:steps[-1]]
+                col = ColumnarPayrollEngine(run)
+                t0 = time.perf_counter()
+                col.load_columns(ids)
+                t_load = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                res = col.evaluate()
+                t_eval = time.perf_counter() - t0
+                self.stdout.write(f"columnar: load {t_load:.3f}s, evaluate {t_eval:.4f}s for {len(ids)} employees")
+
+                row = PayrollEngine(run)
+                mismatches = []
+                checked = 0
+                for emp in row._run_employees(ids):
+                    slip = row.compute_for_employee(emp)
+                    if slip is None:
+                        continue
+                    i = list(col.columns.employee_ids).index(emp.id)
+                    checked += 1
+                    for f in TOTALS:
+                        if int(res[f][i]) != int(getattr(slip, f) * 100):
+                            mismatches.append((emp.id, f, getattr(slip, f), int(res[f][i])))
+                if mismatches:
+                    self.stdout.write(self.style.ERROR(f"Columnar parity FAILED: {len(mismatches)} field(s), e.g. {mismatches[:5]}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f"Columnar parity OK on {checked} payslips (to the cent)."))
+
+            transaction.set_rollback(True)
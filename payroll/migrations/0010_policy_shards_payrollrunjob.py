@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0009_contract_document'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='companypolicy',
+            name='shard_concurrency',
+            field=models.PositiveSmallIntegerField(default=4, help_text='Max shards of one run computed in parallel.'),
+        ),
+        migrations.AddField(
+            model_name='companypolicy',
+            name='shard_size',
+            field=models.PositiveIntegerField(default=500, help_text='Employees per shard when a run is generated asynchronously.'),
+        ),
+        migrations.CreateModel(
+            name='PayrollRunJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('task_id', models.CharField(blank=True, max_length=255)),
+                ('shards_total', models.PositiveIntegerField(default=0)),
+                ('shards_done', models.PositiveIntegerField(default=0)),
+                ('slips_written', models.PositiveIntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='payroll.payrollrun')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:06
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employee', '0005_alter_department_options_alter_grade_options_and_more'),
+        ('payroll', '0010_policy_shards_payrollrunjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayrollDirtyMark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.CharField(blank=True, max_length=64)),
+                ('marked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('employee', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='employee.employee')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dirty_marks', to='payroll.payrollrun')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['run', 'marked_at'], name='payroll_pay_run_id_9d7a6e_idx')],
+                'unique_together': {('run', 'employee')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0012_payslip_pdf_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payslippdfjob',
+            name='done_chunks',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 22:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payroll', '0013_payslippdfjob_done_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payrollrunjob',
+            name='done_shards',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='payrollrunjob',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
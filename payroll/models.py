@@ -186,6 +186,12 @@ class CompanyPolicy(models.Model):
     # Link active tax table & contribs
     active_tax_table = models.ForeignKey(TaxTable, on_delete=models.SET_NULL, null=True, blank=True)
     active_contribs = models.ManyToManyField(ContributionScheme, blank=True)
+
+    # NEW: async (sharded) run generation
+    shard_size = models.PositiveIntegerField(default=500,
+        help_text="Employees per shard when a run is generated asynchronously.")
+    shard_concurrency = models.PositiveSmallIntegerField(default=4,
+        help_text="Max shards of one run computed in parallel.")
     
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -216,6 +222,33 @@ class PayrollRun(models.Model):
     def __str__(self): return f"{self.company_policy} {self.month}/{self.year} ({self.status})"
 
 
+class PayrollRunJob(models.Model):
+    """
+    One asynchronous (sharded) generation of a run. Shards update the counters as they finish;
+    the chord callback sets the final status.
+    """
+    PENDING='pending'; RUNNING='running'; DONE='done'; FAILED='failed'
+    STATUS_CHOICES=[(PENDING,'Pending'),(RUNNING,'Running'),(DONE,'Done'),(FAILED,'Failed')]
+
+    run = models.ForeignKey(PayrollRun, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    task_id = models.CharField(max_length=255, blank=True)   # chord id
+    shards_total = models.PositiveIntegerField(default=0)
+    shards_done = models.PositiveIntegerField(default=0)
+    done_shards = models.JSONField(default=list, blank=True)  # shard numbers counted (redelivered shards count once)
+    slips_written = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)      # [{shard, error}]
+    actor = models.ForeignKey('authentication.User', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)          # last shard progress (stale detection)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self): return f"Job {self.id} {self.run} ({self.status} {self.shards_done}/{self.shards_total})"
+
+
 class Payslip(models.Model):
     """
     A.k.a. payroll result per employee within a run (aka 'Payroll' in your minimal model).
@@ -246,6 +279,67 @@ class Payslip(models.Model):
 
 
 
+class PayslipRender(models.Model):
+    """
+    Last rendered PDF of a payslip. content_hash is the sha256 of the rendered HTML, so a slip
+    is only re-rendered when what would be printed changed.
+    """
+    payslip = models.OneToOneField(Payslip, on_delete=models.CASCADE, related_name='render')
+    content_hash = models.CharField(max_length=64)
+    file = models.FileField(upload_to='payroll/payslips/', null=True, blank=True)
+    rendered_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self): return f"PDF {self.payslip_id} ({self.content_hash[:8]})"
+
+
+class PayslipPdfJob(models.Model):
+    """Bulk PDF job of a run: per-slip renders in parallel chunks, then one merged PDF or ZIP."""
+    PENDING='pending'; RUNNING='running'; DONE='done'; FAILED='failed'
+    STATUS_CHOICES=[(PENDING,'Pending'),(RUNNING,'Running'),(DONE,'Done'),(FAILED,'Failed')]
+    PDF='pdf'; ZIP='zip'
+    OUTPUT_CHOICES=[(PDF,'Merged PDF'),(ZIP,'ZIP of PDFs')]
+
+    run = models.ForeignKey(PayrollRun, on_delete=models.CASCADE, related_name='pdf_jobs')
+    output = models.CharField(max_length=8, choices=OUTPUT_CHOICES, default=ZIP)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    total = models.PositiveIntegerField(default=0)
+    rendered = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)     # content hash unchanged
+    failed = models.PositiveIntegerField(default=0)
+    chunks_total = models.PositiveIntegerField(default=0)
+    chunks_done = models.PositiveIntegerField(default=0)
+    done_chunks = models.JSONField(default=list, blank=True)   # chunk numbers counted (redelivered chunks count once)
+    errors = models.JSONField(default=list, blank=True)
+    file = models.FileField(upload_to='payroll/pdf_jobs/', null=True, blank=True)
+    actor = models.ForeignKey('authentication.User', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self): return f"PDF job {self.id} {self.run} ({self.status})"
+
+
+class PayrollDirtyMark(models.Model):
+    """
+    Employee whose payroll inputs changed since their slip in an open run was computed.
+    Written by payroll.signals, consumed by BulkPayrollEngine.recompute_dirty().
+    """
+    run = models.ForeignKey(PayrollRun, on_delete=models.CASCADE, related_name='dirty_marks')
+    # no DB constraint: a mark may outlive an employee deleted in the same transaction
+    employee = models.ForeignKey(Employee, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    reason = models.CharField(max_length=64, blank=True)   # e.g. "variableinput.save"
+    marked_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('run', 'employee')
+        indexes = [models.Index(fields=['run', 'marked_at'])]
+
+    def __str__(self): return f"{self.employee_id} dirty in run {self.run_id} ({self.reason})"
+
+
 class PayslipItem(models.Model):
     payslip = models.ForeignKey(Payslip, on_delete=models.CASCADE, related_name='items')
     component = models.ForeignKey(PayrollComponent, on_delete=models.PROTECT)
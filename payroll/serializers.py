@@ -101,7 +101,8 @@ class CompanyPolicySerializer(serializers.ModelSerializer):
             'currency','currency_id',
             'proration_method',
             'active_tax_table','active_tax_table_id',
-            'active_contribs','active_contribs_ids'
+            'active_contribs','active_contribs_ids',
+            'shard_size','shard_concurrency',
         ]
 
 
@@ -116,6 +117,42 @@ class PayrollRunSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['status','generated_at','processed_at','closed_at']
 
+# NEW: async run generation progress
+class PayrollRunJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PayrollRunJob
+        fields = ['id','run','status','task_id','shards_total','shards_done','slips_written',
+                  'errors','progress','actor','created_at','updated_at','finished_at']
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        if not obj.shards_total:
+            return 1.0 if obj.status == PayrollRunJob.DONE else 0.0
+        return round(obj.shards_done / obj.shards_total, 4)
+
+class PayslipPdfJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+    file_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PayslipPdfJob
+        fields = ['id','run','output','status','total','rendered','skipped','failed','chunks_total','chunks_done',
+                  'errors','progress','file_url','actor','created_at','updated_at','finished_at']
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        if not obj.chunks_total:
+            return 1.0 if obj.status == PayslipPdfJob.DONE else 0.0
+        return round(obj.chunks_done / obj.chunks_total, 4)
+
+    def get_file_url(self, obj):
+        try:
+            return obj.file.url if obj.file else None
+        except Exception:
+            return None
+
 class PayslipItemSerializer(serializers.ModelSerializer):
     component = PayrollComponentSerializer(read_only=True)
     component_id = serializers.PrimaryKeyRelatedField(queryset=PayrollComponent.objects.all(), source='component', write_only=True)
@@ -1,3 +1,5 @@
 from .engines import PayrollEngine
+from .bulk import BulkPayrollEngine
+from .simulation import SimulationEngine, simulate_payroll
 
-__all__ = ["PayrollEngine"]
\ No newline at end of file
+__all__ = ["PayrollEngine", "BulkPayrollEngine", "SimulationEngine", "simulate_payroll"]
\ No newline at end of file
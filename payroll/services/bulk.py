@@ -0,0 +1,233 @@
+# payroll/services/bulk.py
+
+from __future__ import annotations
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from django.db import transaction, models
+from django.utils import timezone
+
+from employee.models import Employee
+from payroll.models import *
+from payroll.services.engines import PayrollEngine, HAS_SITUATION, Situation
+
+# Payslip columns rewritten on every (re)compute
+SLIP_FIELDS = [
+    "base_salary", "gross_pay", "taxable_gross", "employee_contrib",
+    "employer_contrib", "income_tax", "other_deductions", "net_pay", "hash",
+]
+
+
+@dataclass
+class RunInputs:
+    """
+    Everything the engine reads for one run, loaded up-front in a fixed number of queries.
+    Keyed by employee id where per-employee.
+    """
+    employees: list = field(default_factory=list)
+    suspended: set = field(default_factory=set)
+    contracts: dict = field(default_factory=dict)
+    recurring: dict = field(default_factory=dict)
+    variables: dict = field(default_factory=dict)
+    fx_rates: dict = field(default_factory=dict)       # base currency pk -> rate to policy currency
+    basic_component: Optional[PayrollComponent] = None
+
+
+class BulkPayrollEngine(PayrollEngine):
+    """
+    Set-based variant of PayrollEngine for whole runs.
+
+      - Loads contracts, suspending situations, recurring assignments, variable inputs,
+        FX rates and the BASIC component once per run (tax/contribs come compiled
+        and cached from services.evaluators, evaluated for the whole batch at once)
+      - Computes every slip in memory with the same arithmetic as compute_for_employee
+      - Writes Payslip rows with one bulk upsert and PayslipItem rows with bulk_create
+
+    Note: bulk writes bypass model signals, so auditlog does not get one entry per payslip.
+    """
+
+    def __init__(self, run: PayrollRun, batch_size: int = 1000):
+        super().__init__(run)
+        self.batch_size = batch_size
+        self.inputs: Optional[RunInputs] = None
+
+    # -------------- loading --------------
+
+    def load_inputs(self, employee_ids: Optional[Iterable] = None) -> RunInputs:
+        pstart, pend, _ = self._period_bounds()
+        mid = date(self.run.year, self.run.month, min(15, (pend - pstart).days + 1))
+
+        employees = list(self._run_employees(employee_ids))
+        emp_ids = self._run_employees(employee_ids).values("id")
+
+        suspended = set()
+        if HAS_SITUATION:
+            suspended = set(
+                Situation.objects.filter(
+                    situation_type__suspend_payroll=True,
+                    start_date__lte=mid,
+                ).filter(models.Q(end_date__isnull=True) | models.Q(end_date__gte=mid))
+                .values_list("employee_id", flat=True)
+            )
+
+        # latest overlapping ACTIVE contract per employee (same ordering as _active_contract)
+        contracts: dict = {}
+        contract_qs = (Contract.objects
+                       .filter(employee_id__in=emp_ids, status="ACTIVE", start_date__lte=pend)
+                       .filter(models.Q(end_date__isnull=True) | models.Q(end_date__gte=pstart))
+                       .order_by("employee_id", "-start_date", "-id"))
+        for c in contract_qs:
+            contracts.setdefault(c.employee_id, c)
+
+        recurring = defaultdict(list)
+        rec_qs = (RecurringComponentAssignment.objects
+                  .select_related("component")
+                  .filter(employee_id__in=emp_ids, active=True, start_date__lte=pend)
+                  .filter(models.Q(end_date__isnull=True) | models.Q(end_date__gte=pstart))
+                  .order_by("component__sequence", "id"))
+        for r in rec_qs:
+            recurring[r.employee_id].append(r)
+
+        variables = defaultdict(list)
+        run_q = models.Q(run=self.run) if self.run.pk else models.Q(pk__in=[])  # unsaved run (simulation)
+        vi_qs = (VariableInput.objects
+                 .select_related("component")
+                 .filter(employee_id__in=emp_ids)
+                 .filter(run_q |
+                         models.Q(run__isnull=True, created_at__date__gte=pstart, created_at__date__lte=pend))
+                 .order_by("component__sequence", "id"))
+        for v in vi_qs:
+            variables[v.employee_id].append(v)
+
+        fx_rates: dict = {}
+        policy_cur = getattr(self.policy, "currency", None)
+        if policy_cur:
+            fx_qs = (ExchangeRate.objects
+                     .filter(quote=policy_cur, date__lte=pend)
+                     .order_by("base_id", "-date")
+                     .values_list("base_id", "rate"))
+            for base_id, rate in fx_qs:
+                fx_rates.setdefault(base_id, rate)
+
+        return RunInputs(
+            employees=employees,
+            suspended=suspended,
+            contracts=contracts,
+            recurring=dict(recurring),
+            variables=dict(variables),
+            fx_rates=fx_rates,
+            basic_component=super()._get_basic_component(),
+        )
+
+    # -------------- in-memory lookups (override per-employee queries) --------------
+
+    def _eligible(self, emp: Employee) -> bool:
+        if not getattr(emp, "is_active", True):
+            return False
+        return emp.id not in self.inputs.suspended
+
+    def _active_contract(self, emp: Employee):
+        return self.inputs.contracts.get(emp.id)
+
+    def _fx_rate(self, from_cur: Currency, policy_cur: Currency) -> Optional[Decimal]:
+        return self.inputs.fx_rates.get(from_cur.pk)
+
+    def _get_basic_component(self) -> PayrollComponent:
+        return self.inputs.basic_component
+
+    def _recurring_rows(self, emp: Employee):
+        return self.inputs.recurring.get(emp.id, [])
+
+    def _variable_rows(self, emp: Employee):
+        return self.inputs.variables.get(emp.id, [])
+
+    # -------------- compute & persist --------------
+
+    def build_all(self, employee_ids: Optional[Iterable] = None) -> list[tuple[Employee, dict, list[PayslipItem]]]:
+        """Compute every eligible slip of the run in memory (nothing is written)."""
+        self.inputs = self.load_inputs(employee_ids)
+        return self._build_many(self.inputs.employees)
+
+    def _persist(self, built: list[tuple[Employee, dict, list[PayslipItem]]],
+                 hashes: Optional[dict] = None) -> list[int]:
+        if not built:
+            return []
+
+        hashes = hashes or {}
+        slips = [
+            Payslip(run=self.run, employee=emp, currency=self.policy.currency, finalized=False,
+                    hash=hashes.get(emp.id) or self._fingerprint(emp), **totals)
+            for emp, totals, _ in built
+        ]
+        Payslip.objects.bulk_create(
+            slips, batch_size=self.batch_size,
+            update_conflicts=True, unique_fields=["run", "employee"],
+            update_fields=SLIP_FIELDS + ["currency", "finalized", "updated_at"],
+        )
+
+        # Upserts don't return PKs on every backend; resolve them in one query
+        slip_ids = dict(Payslip.objects.filter(run=self.run).values_list("employee_id", "id"))
+        ids = [slip_ids[emp.id] for emp, _, _ in built]
+
+        for start in range(0, len(ids), self.batch_size):
+            PayslipItem.objects.filter(payslip_id__in=ids[start:start + self.batch_size]).delete()
+
+        items: list[PayslipItem] = []
+        for (emp, _, lines), slip_id in zip(built, ids):
+            for i in lines:
+                i.payslip_id = slip_id
+                items.append(i)
+        PayslipItem.objects.bulk_create(items, batch_size=self.batch_size)
+        return ids
+
+    @transaction.atomic
+    def compute_run(self, employee_ids: Optional[Iterable] = None, finalize: bool = True) -> list[int]:
+        started = timezone.now()
+        ids = self._persist(self.build_all(employee_ids))
+        self._clear_dirty(employee_ids, before=started)
+        if finalize:
+            self.mark_processed()
+        return ids
+
+    @transaction.atomic
+    def recompute_dirty(self) -> dict:
+        """
+        Rebuild only the slips of employees marked dirty (see payroll.signals).
+
+          - slips whose input fingerprint (Payslip.hash) is unchanged are left untouched
+          - dirty employees that are no longer payable this period lose their slip
+          - marks set while this runs are kept for the next call
+        One transaction: slips, removals and the cleared marks commit (or roll back) together.
+        """
+        started = timezone.now()
+        dirty = set(PayrollDirtyMark.objects
+                    .filter(run=self.run, marked_at__lte=started)
+                    .values_list("employee_id", flat=True))
+        if not dirty:
+            return {"dirty": 0, "recomputed": 0, "unchanged": 0, "removed": 0, "payslip_ids": []}
+
+        built = self.build_all(dirty)
+        current = dict(Payslip.objects.filter(run=self.run, employee_id__in=dirty)
+                       .values_list("employee_id", "hash"))
+
+        hashes = {emp.id: self._fingerprint(emp) for emp, _, _ in built}
+        changed = [b for b in built if current.get(b[0].id) != hashes[b[0].id]]
+        ids = self._persist(changed, hashes=hashes)
+
+        gone = dirty - {emp.id for emp, _, _ in built}
+        removed = 0
+        if gone:
+            _, per_model = Payslip.objects.filter(run=self.run, employee_id__in=gone).delete()
+            removed = per_model.get(Payslip._meta.label, 0)
+
+        self._clear_dirty(dirty, before=started)
+        return {
+            "dirty": len(dirty),
+            "recomputed": len(changed),
+            "unchanged": len(built) - len(changed),
+            "removed": removed,
+            "payslip_ids": ids,
+        }
@@ -147,9 +147,11 @@
 # payroll/services/engine.py
 
 from __future__ import annotations
+import hashlib
+import json
 from dataclasses import dataclass
 from decimal import Decimal, ROUND_HALF_UP
-from datetime import date, timedelta
+from datetime import date
 from calendar import monthrange
 from typing import Iterable, Optional, Tuple
 
@@ -157,6 +159,8 @@ from django.db import transaction, models
 from django.utils import timezone
 
 from employee.models import Employee
+from leave.models import Holiday
+from leave.workcalendar import working_days_between
 
 # Optional: suspend-payroll situations (safe if absent)
 try:
@@ -167,6 +171,7 @@ except Exception:
     HAS_SITUATION = False
 
 from payroll.models import *
+from payroll.services.evaluators import CompiledPolicy, get_compiled
 
 Q = Decimal
 def q2(x) -> Decimal:
@@ -204,15 +209,9 @@ class PayrollEngine:
         end = date(self.run.year, self.run.month, days)
         return start, end, days
 
-    def _working_days_in(self, start: date, end: date) -> int:
-        """Mon–Fri count between start..end inclusive."""
-        d = start
-        n = 0
-        while d <= end:
-            if d.weekday() < 5:
-                n += 1
-            d += timedelta(days=1)
-        return n
+    def _working_days_in(self, start: date, end: date, region: Optional[str] = None) -> int:
+        """Working days (Mon–Fri minus holidays of the region) between start..end inclusive."""
+        return working_days_between(start, end, region)
 
     def _eligible(self, emp: Employee) -> bool:
         """
@@ -259,8 +258,9 @@ class PayrollEngine:
             return Q("0.00")
 
         if getattr(self.policy, "proration_method", "CALENDAR") == "WORKING":
-            total = self._working_days_in(pstart, pend)
-            part = self._working_days_in(active_start, active_end)
+            region = getattr(emp, "region", None)
+            total = self._working_days_in(pstart, pend, region)
+            part = self._working_days_in(active_start, active_end, region)
         else:
             total = total_days
             part = (active_end - active_start).days + 1
@@ -269,6 +269,14 @@ class PayrollEngine:
             return q2(amount)
         return q2(Q(amount) * Q(part) / Q(total))
 
+    def _fx_rate(self, from_cur: Currency, policy_cur: Currency) -> Optional[Decimal]:
+        """Latest base→policy rate on or before period end (None if not configured)."""
+        _, pend, _ = self._period_bounds()
+        rate = (ExchangeRate.objects
+                .filter(base=from_cur, quote=policy_cur, date__lte=pend)
+                .order_by("-date").first())
+        return rate.rate if rate else None
+
     def _fx_to_policy_currency(self, amount: Decimal, from_cur: Optional[Currency]) -> Decimal:
         if not amount:
             return Q("0.00")
@@ -276,14 +284,11 @@ class PayrollEngine:
         if not from_cur or not policy_cur or from_cur == policy_cur:
             return q2(amount)
 
-        _, pend, _ = self._period_bounds()
-        rate = (ExchangeRate.objects
-                .filter(base=from_cur, quote=policy_cur, date__lte=pend)
-                .order_by("-date").first())
-        if not rate:
+        rate = self._fx_rate(from_cur, policy_cur)
+        if rate is None:
             # fallback 1:1
             return q2(amount)
-        return q2(Q(amount) * Q(rate.rate))
+        return q2(Q(amount) * Q(rate))
 
     def _get_basic_component(self) -> PayrollComponent:
         comp = PayrollComponent.objects.filter(code="BASIC").first()
@@ -296,19 +301,20 @@ class PayrollEngine:
 
     # -------------- collectors (lines) --------------
 
-    def _collect_recurring(self, emp: Employee, base_for_pct: Decimal) -> list[PayslipItem]:
-        """
-        RecurringComponentAssignment active in period (amount or % of base).
-        """
+    def _recurring_rows(self, emp: Employee) -> Iterable[RecurringComponentAssignment]:
         pstart, pend, _ = self._period_bounds()
-        rows = (RecurringComponentAssignment.objects
+        return (RecurringComponentAssignment.objects
                 .select_related("component")
                 .filter(employee=emp, active=True, start_date__lte=pend)
                 .filter(models.Q(end_date__isnull=True) | models.Q(end_date__gte=pstart))
                 .order_by("component__sequence", "id"))
 
+    def _collect_recurring(self, emp: Employee, base_for_pct: Decimal, rows=None) -> list[PayslipItem]:
+        """
+        RecurringComponentAssignment active in period (amount or % of base).
+        """
         items: list[PayslipItem] = []
-        for r in rows:
+        for r in (self._recurring_rows(emp) if rows is None else rows):
             comp = r.component
             amt = Q(r.amount or 0)
             if (not amt) and r.percentage:
@@ -322,22 +328,23 @@ class PayrollEngine:
             ))
         return items
 
-    def _collect_variables(self, emp: Employee) -> list[PayslipItem]:
+    def _variable_rows(self, emp: Employee) -> Iterable[VariableInput]:
+        pstart, pend, _ = self._period_bounds()
+        return (VariableInput.objects
+                .select_related("component")
+                .filter(employee=emp)
+                .filter(models.Q(run=self.run) |
+                        models.Q(run__isnull=True, created_at__date__gte=pstart, created_at__date__lte=pend))
+                .order_by("component__sequence", "id"))
+
+    def _collect_variables(self, emp: Employee, rows=None) -> list[PayslipItem]:
         """
         VariableInput for this run & employee:
           - Prefer rows explicitly linked to run
           - Also accept run=None created in the same period (optional convenience)
         """
-        pstart, pend, _ = self._period_bounds()
-        vi_qs = (VariableInput.objects
-                 .select_related("component")
-                 .filter(employee=emp)
-                 .filter(models.Q(run=self.run) |
-                         models.Q(run__isnull=True, created_at__date__gte=pstart, created_at__date__lte=pend))
-                 .order_by("component__sequence", "id"))
-
         items: list[PayslipItem] = []
-        for v in vi_qs:
+        for v in (self._variable_rows(emp) if rows is None else rows):
             # prefer explicit amount; else qty * rate
             amt = Q(v.amount or 0)
             if not amt:
@@ -356,70 +363,74 @@ class PayrollEngine:
 
     # -------------- taxes & contributions --------------
 
+    def _compiled(self) -> CompiledPolicy:
+        """Compiled tax/contribution evaluators for the policy (cached, see services.evaluators)."""
+        if getattr(self, "_compiled_policy", None) is None:
+            self._compiled_policy = get_compiled(self.policy)
+        return self._compiled_policy
+
     def _compute_tax(self, pit_base: Decimal) -> Decimal:
-        table: Optional[TaxTable] = getattr(self.policy, "active_tax_table", None)
-        if not table:
-            return Q("0.00")
-        base = max(Q("0.00"), Q(pit_base))
-        tax = Q("0.00")
-        for br in table.brackets.all().order_by("lower"):
-            lower = Q(br.lower)
-            upper = Q(br.upper) if br.upper is not None else None
-            if base <= lower:
-                break
-            slab_top = upper if upper is not None else base
-            slab = max(Q("0.00"), min(base, slab_top) - lower)
-            tax += slab * Q(br.rate)
-            if upper is None or base <= upper:
-                break
-        return q2(tax)
+        return self._compiled().tax_for(pit_base)
 
     def _apply_contributions(self, base: Decimal) -> tuple[Decimal, Decimal]:
-        ee = Q("0.00"); er = Q("0.00")
-        contribs = getattr(self.policy, "active_contribs", None)
-        if not contribs:
-            return ee, er
-        for sch in contribs.all():
-            b = Q(base)
-            if getattr(sch, "cap", None):
-                b = min(b, Q(sch.cap))
-            ee += b * Q(sch.ee_rate or 0)
-            er += b * Q(sch.er_rate or 0)
-        return q2(ee), q2(er)
+        return self._compiled().contribs.contributions(base)
 
     # -------------- main compute --------------
 
-    @transaction.atomic
-    def compute_for_employee(self, emp: Employee) -> Optional[Payslip]:
+    def _build(self, emp: Employee) -> Optional[tuple[dict, list[PayslipItem]]]:
+        """
+        Compute one employee's payslip in memory.
+        Returns (totals, items) with unsaved items, or None if not eligible.
+        """
+        pre = self._build_lines(emp)
+        if pre is None:
+            return None
+        ee_contrib, er_contrib = self._apply_contributions(pre["contrib_base"])
+        pit = self._compute_tax(self._pit_base(pre, ee_contrib))
+        return self._finish(pre, ee_contrib, er_contrib, pit)
+
+    def _build_many(self, employees: Iterable[Employee]) -> list[tuple[Employee, dict, list[PayslipItem]]]:
+        """
+        _build for a population: lines per employee, then contributions and PIT for everyone
+        in one call each to the compiled evaluators (contributions_many / tax_many).
+        """
+        pres = [(emp, pre) for emp in employees if (pre := self._build_lines(emp)) is not None]
+        compiled = self._compiled()
+        contribs = compiled.contribs.contributions_many([pre["contrib_base"] for _, pre in pres])
+        taxes = compiled.tax_many([self._pit_base(pre, ee) for (_, pre), (ee, _) in zip(pres, contribs)])
+        return [(emp, *self._finish(pre, ee, er, pit))
+                for (emp, pre), (ee, er), pit in zip(pres, contribs, taxes)]
+
+    def _build_lines(self, emp: Employee) -> Optional[dict]:
+        """Lines and pre-tax aggregates of one slip (everything but contributions and PIT)."""
         if not self._eligible(emp):
             return None
 
         # --- Contract base & FX to policy currency
         contract = self._active_contract(emp)
+        recurring = list(self._recurring_rows(emp))
+        variables = list(self._variable_rows(emp))
+        self._loaded = (emp.id, contract, recurring, variables)   # reused by _fingerprint
         raw_base = Q(getattr(contract, "salary", 0) or 0)
         emp_currency = getattr(contract, "currency", None) or getattr(emp, "currency", None)
         base_policy_ccy = self._fx_to_policy_currency(raw_base, emp_currency)
         base_prorated = self._prorate(base_policy_ccy, emp)
 
-        slip, _ = Payslip.objects.get_or_create(
-            run=self.run, employee=emp, defaults={"currency": self.policy.currency}
-        )
-
         items: list[PayslipItem] = []
 
         # BASIC
         comp_basic = self._get_basic_component()
         items.append(PayslipItem(
-            payslip=slip, component=comp_basic,
+            component=comp_basic,
             quantity=1, rate=base_prorated, amount=base_prorated,
             meta={"source": "basic", "contract_id": getattr(contract, "id", None)}
         ))
 
         # Recurring (allowances/deductions)
-        items += self._collect_recurring(emp, base_prorated)
+        items += self._collect_recurring(emp, base_prorated, recurring)
 
         # Variable inputs (overtime, bonuses, one-offs)
-        items += self._collect_variables(emp)
+        items += self._collect_variables(emp, variables)
 
         # ---- Aggregate totals
         def is_kind(i, kind): return getattr(i.component, "kind", "") == kind
@@ -438,25 +449,108 @@ class PayrollEngine:
         taxable_gross = sum((i.amount for i in items if is_kind(i, PayrollComponent.EARNING) and is_taxable(i)), Q("0.00"))
         contrib_base  = sum((i.amount for i in items if is_kind(i, PayrollComponent.EARNING) and is_contrib(i)), Q("0.00"))
 
-        ee_contrib, er_contrib = self._apply_contributions(contrib_base)
-
-        pit_base = max(Q("0.00"), taxable_gross - ee_contrib - pre_tax_deds)
-        pit = self._compute_tax(pit_base)
+        return {
+            "items": items, "base_prorated": base_prorated, "gross_earnings": gross_earnings,
+            "taxable_gross": taxable_gross, "contrib_base": contrib_base,
+            "pre_tax_deds": pre_tax_deds, "post_tax_deds": post_tax_deds,
+        }
+
+    @staticmethod
+    def _pit_base(pre: dict, ee_contrib: Decimal) -> Decimal:
+        return max(Q("0.00"), pre["taxable_gross"] - ee_contrib - pre["pre_tax_deds"])
+
+    @staticmethod
+    def _finish(pre: dict, ee_contrib: Decimal, er_contrib: Decimal, pit: Decimal) -> tuple[dict, list[PayslipItem]]:
+        other_deductions = q2(pre["pre_tax_deds"] + pre["post_tax_deds"])
+        net = q2(pre["gross_earnings"] - ee_contrib - pit - other_deductions)
+
+        totals = {
+            "base_salary":      q2(pre["base_prorated"]),
+            "gross_pay":        q2(pre["gross_earnings"]),
+            "taxable_gross":    q2(pre["taxable_gross"]),
+            "employee_contrib": q2(ee_contrib),
+            "employer_contrib": q2(er_contrib),
+            "income_tax":       q2(pit),
+            "other_deductions": q2(other_deductions),
+            "net_pay":          q2(net),
+        }
+        return totals, pre["items"]
+
+    # -------------- input fingerprint --------------
+
+    def _policy_fingerprint(self) -> list:
+        """
+        Policy-wide inputs (computed once per engine). WORKING proration also depends on the
+        holidays of the period, so they are part of it (the calendar cache generation would
+        read -1 whenever the cache is down and miss the change).
+        """
+        if not hasattr(self, "_policy_fp"):
+            method = getattr(self.policy, "proration_method", None)
+            holidays = None
+            if method == "WORKING":
+                pstart, pend, _ = self._period_bounds()
+                holidays = list(Holiday.objects.filter(date__gte=pstart, date__lte=pend)
+                                .order_by("date", "region").values_list("date", "region"))
+            self._policy_fp = [
+                getattr(self.policy, "currency_id", None),
+                method,
+                getattr(self.policy, "active_tax_table_id", None),
+                self._compiled().contribs.scheme_ids,
+                holidays,
+            ]
+        return self._policy_fp
+
+    def _fingerprint(self, emp: Employee) -> str:
+        """
+        sha256 of everything the slip is computed from for this employee: eligibility, contract,
+        recurring assignments, variable inputs and the policy settings. Stored in Payslip.hash so
+        recompute_dirty can skip slips whose inputs did not actually change. Reuses the rows the
+        last _build loaded when it was for the same employee (an employee _build accepted is eligible).
+        """
+        loaded = getattr(self, "_loaded", None)
+        if loaded is not None and loaded[0] == emp.id:
+            _, c, recurring, variables = loaded
+            eligible = True
+        else:
+            c, eligible = self._active_contract(emp), self._eligible(emp)
+            recurring, variables = self._recurring_rows(emp), self._variable_rows(emp)
+        payload = [
+            self.run.year, self.run.month,
+            eligible,
+            [getattr(c, "id", None), getattr(c, "salary", None), getattr(c, "start_date", None),
+             getattr(c, "end_date", None), getattr(c, "status", None)],
+            [(r.id, r.component_id, r.amount, r.percentage, r.start_date, r.end_date)
+             for r in recurring],
+            [(v.id, v.component_id, v.quantity, v.rate, v.amount, v.note)
+             for v in variables],
+            self._policy_fingerprint(),
+        ]
+        raw = json.dumps(payload, default=str, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _clear_dirty(self, employee_ids: Optional[Iterable] = None, before=None) -> None:
+        """Drop dirty marks satisfied by a (re)compute that started at `before`."""
+        qs = PayrollDirtyMark.objects.filter(run=self.run, marked_at__lte=before or timezone.now())
+        if employee_ids is not None:
+            qs = qs.filter(employee_id__in=list(employee_ids))
+        qs.delete()
 
-        other_deductions = q2(pre_tax_deds + post_tax_deds)
-        net = q2(gross_earnings - ee_contrib - pit - other_deductions)
+    @transaction.atomic
+    def compute_for_employee(self, emp: Employee) -> Optional[Payslip]:
+        built = self._build(emp)
+        if built is None:
+            return None
+        totals, items = built
 
         # ---- Persist slip
-        slip.base_salary      = q2(base_prorated)
-        slip.gross_pay        = q2(gross_earnings)
-        slip.taxable_gross    = q2(taxable_gross)
-        slip.employee_contrib = q2(ee_contrib)
-        slip.employer_contrib = q2(er_contrib)
-        slip.income_tax       = q2(pit)
-        slip.other_deductions = q2(other_deductions)
-        slip.net_pay          = q2(net)
+        slip, _ = Payslip.objects.get_or_create(
+            run=self.run, employee=emp, defaults={"currency": self.policy.currency}
+        )
+        for field, value in totals.items():
+            setattr(slip, field, value)
         slip.currency         = self.policy.currency
         slip.finalized        = False
+        slip.hash             = self._fingerprint(emp)
         slip.save()
 
         # Replace items
@@ -467,8 +561,8 @@ class PayrollEngine:
 
         return slip
 
-    @transaction.atomic
-    def compute_run(self, employee_ids: Optional[Iterable] = None) -> list[int]:
+    def _run_employees(self, employee_ids: Optional[Iterable] = None):
+        """Employees with an ACTIVE contract overlapping the period (optionally narrowed to ids)."""
         pstart, pend, _ = self._period_bounds()
 
         qs = Employee.objects.filter(user__is_active=True).filter(
@@ -489,17 +583,27 @@ class PayrollEngine:
         if employee_ids:
             qs = qs.filter(id__in=list(employee_ids))
 
-        qs = qs.distinct().select_related("department", "grade")
+        return qs.distinct().select_related("department", "grade")
 
+    @transaction.atomic
+    def compute_run(self, employee_ids: Optional[Iterable] = None, finalize: bool = True) -> list[int]:
+        """
+        Compute (a subset of) the run. finalize=False leaves the run status alone,
+        e.g. when one shard of a sharded run is computed.
+        """
+        started = timezone.now()
         out: list[int] = []
-        for emp in qs:
+        for emp in self._run_employees(employee_ids):
             slip = self.compute_for_employee(emp)
             if slip:
                 out.append(slip.id)
 
+        self._clear_dirty(employee_ids, before=started)
+        if finalize:
+            self.mark_processed()
+        return out
+
+    def mark_processed(self) -> None:
         self.run.status = PayrollRun.PROCESSED
         self.run.processed_at = timezone.now()
         self.run.save(update_fields=["status", "processed_at"])
-        return out
-
-
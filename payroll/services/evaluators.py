@@ -0,0 +1,207 @@
+# payroll/services/evaluators.py
+"""
+Compiled tax / contribution evaluators.
+
+A policy's active TaxTable is compiled once into sorted lower bounds + cumulative tax at each
+bound, so PIT = cum[i] + (base - lower[i]) * rate[i] after one bisect. Contribution schemes are
+compiled into (cap, ee_rate, er_rate) tuples. Both results are cached per process, keyed by
+(policy, tax table, generation); the generation is a counter in the Django cache that
+payroll.signals bumps whenever a TaxTable, TaxBracket, ContributionScheme or CompanyPolicy changes.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Iterable, Optional, Sequence
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+Q = Decimal
+ZERO = Q("0.00")
+GENERATION_KEY = "payroll:evaluators:generation"
+
+
+def q2(x) -> Decimal:
+    return (Q(x)).quantize(Q("0.01"), rounding=ROUND_HALF_UP)
+
+
+def tax_by_slabs(brackets: Iterable, pit_base: Decimal) -> Decimal:
+    """Reference slab walk (what PayrollEngine._compute_tax always did). Unrounded."""
+    base = max(ZERO, Q(pit_base))
+    tax = ZERO
+    for br in brackets:
+        lower = Q(br.lower)
+        upper = Q(br.upper) if br.upper is not None else None
+        if base <= lower:
+            break
+        slab_top = upper if upper is not None else base
+        slab = max(ZERO, min(base, slab_top) - lower)
+        tax += slab * Q(br.rate)
+        if upper is None or base <= upper:
+            break
+    return tax
+
+
+@dataclass(frozen=True)
+class _Slab:
+    lower: Decimal
+    upper: Optional[Decimal]
+    rate: Decimal
+
+
+@dataclass
+class TaxEvaluator:
+    """
+    Progressive PIT for one tax table.
+    Falls back to the slab walk when brackets overlap (the cumulative form assumes they don't).
+    """
+    slabs: list = field(default_factory=list)
+    lowers: list = field(default_factory=list)
+    cum: list = field(default_factory=list)       # tax owed on [lowers[0], lowers[i]]
+    compiled: bool = True
+
+    @classmethod
+    def from_brackets(cls, brackets: Iterable) -> "TaxEvaluator":
+        slabs = []
+        for br in brackets:  # ordered by lower
+            slabs.append(_Slab(Q(br.lower), Q(br.upper) if br.upper is not None else None, Q(br.rate)))
+            if br.upper is None:
+                break        # the slab walk never goes past an open-ended bracket
+
+        lowers = [s.lower for s in slabs]
+        compiled = all(
+            s.upper is not None and s.upper <= nxt.lower and s.lower < nxt.lower
+            for s, nxt in zip(slabs, slabs[1:])
+        )
+        cum = [ZERO]
+        for s in slabs[:-1]:
+            cum.append(cum[-1] + max(ZERO, s.upper - s.lower) * s.rate)
+        return cls(slabs=slabs, lowers=lowers, cum=cum, compiled=compiled)
+
+    def _raw(self, pit_base) -> Decimal:
+        base = max(ZERO, Q(pit_base))
+        if not self.compiled:
+            return tax_by_slabs(self.slabs, base)
+        i = bisect_left(self.lowers, base) - 1   # last bracket with lower < base
+        if i < 0:
+            return ZERO
+        s = self.slabs[i]
+        top = base if s.upper is None else min(base, s.upper)
+        return self.cum[i] + max(ZERO, top - s.lower) * s.rate
+
+    def tax(self, pit_base) -> Decimal:
+        return q2(self._raw(pit_base))
+
+    def tax_many(self, bases: Sequence) -> list[Decimal]:
+        """Vector form: one rounded tax per base, same order."""
+        return [q2(self._raw(b)) for b in bases]
+
+
+@dataclass
+class ContributionEvaluator:
+    """Sum of EE/ER contributions across the active schemes, caps applied."""
+    schemes: list = field(default_factory=list)   # [(cap or None, ee_rate, er_rate)]
+    scheme_ids: list = field(default_factory=list)
+
+    @classmethod
+    def from_schemes(cls, schemes: Iterable) -> "ContributionEvaluator":
+        rows, ids = [], []
+        for sch in schemes:
+            cap = getattr(sch, "cap", None)
+            rows.append((Q(cap) if cap else None, Q(sch.ee_rate or 0), Q(sch.er_rate or 0)))
+            ids.append(sch.id)
+        return cls(schemes=rows, scheme_ids=sorted(ids))
+
+    def _raw(self, base) -> tuple[Decimal, Decimal]:
+        ee = ZERO; er = ZERO
+        for cap, ee_rate, er_rate in self.schemes:
+            b = Q(base)
+            if cap:
+                b = min(b, cap)
+            ee += b * ee_rate
+            er += b * er_rate
+        return ee, er
+
+    def contributions(self, base) -> tuple[Decimal, Decimal]:
+        ee, er = self._raw(base)
+        return q2(ee), q2(er)
+
+    def contributions_many(self, bases: Sequence) -> list[tuple[Decimal, Decimal]]:
+        return [self.contributions(b) for b in bases]
+
+
+@dataclass
+class CompiledPolicy:
+    tax: Optional[TaxEvaluator]           # None = no active tax table (PIT is 0)
+    contribs: ContributionEvaluator
+
+    def tax_for(self, pit_base) -> Decimal:
+        return self.tax.tax(pit_base) if self.tax else ZERO
+
+    def tax_many(self, bases: Sequence) -> list[Decimal]:
+        return self.tax.tax_many(bases) if self.tax else [ZERO for _ in bases]
+
+
+# ---------------- cache ----------------
+
+_lock = threading.Lock()
+_compiled: dict = {}
+_seen_generation = None
+
+
+def current_generation() -> int:
+    try:
+        return int(cache.get(GENERATION_KEY) or 0)
+    except Exception as e:
+        # Cache down: fall back to per-process state (local invalidation still works)
+        logger.warning("Evaluator generation unavailable from cache: %s", e)
+        return -1
+
+
+def invalidate_evaluators() -> None:
+    """Drop compiled evaluators here and, via the shared generation counter, in other workers."""
+    with _lock:
+        _compiled.clear()
+    try:
+        if not cache.add(GENERATION_KEY, 1, timeout=None):
+            cache.incr(GENERATION_KEY)
+    except Exception as e:
+        logger.warning("Could not bump evaluator generation: %s", e)
+
+
+def compile_policy(policy, brackets=None, schemes=None) -> CompiledPolicy:
+    """Build evaluators for a policy (brackets/schemes can be passed in to avoid queries)."""
+    if brackets is None:
+        table = getattr(policy, "active_tax_table", None)
+        brackets = table.brackets.all().order_by("lower") if table else None
+    if schemes is None:
+        contribs = getattr(policy, "active_contribs", None)
+        schemes = contribs.all() if contribs else []
+    return CompiledPolicy(
+        tax=TaxEvaluator.from_brackets(brackets) if brackets is not None else None,
+        contribs=ContributionEvaluator.from_schemes(schemes),
+    )
+
+
+def get_compiled(policy) -> CompiledPolicy:
+    """Cached CompiledPolicy for (policy, tax table version)."""
+    global _seen_generation
+    gen = current_generation()
+    key = (policy.pk, getattr(policy, "active_tax_table_id", None), gen)
+    with _lock:
+        if gen != _seen_generation:
+            _compiled.clear()
+            _seen_generation = gen
+        hit = _compiled.get(key)
+    if hit is not None:
+        return hit
+
+    compiled = compile_policy(policy)
+    with _lock:
+        _compiled[key] = compiled
+    return compiled
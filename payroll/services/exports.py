@@ -0,0 +1,116 @@
+# payroll/services/exports.py
+"""
+Streaming payslip exports.
+
+Rows come from a server-side cursor (`iterator(chunk_size=...)`) with one PayslipItem prefetch
+per chunk, and payroll components are pivoted into one column each. CSV is streamed as it is
+produced; XLSX is written by XlsxWriter in constant_memory mode to a temp file, then streamed.
+"""
+from __future__ import annotations
+import csv
+import tempfile
+from decimal import Decimal
+
+from django.db.models import Prefetch
+from django.http import FileResponse, StreamingHttpResponse
+
+from payroll.models import PayrollComponent, PayslipItem
+
+try:
+    import xlsxwriter
+    HAS_XLSX = True
+except Exception:
+    xlsxwriter = None
+    HAS_XLSX = False
+
+CHUNK_SIZE = 2000
+
+BASE_HEADER = [
+    'Employee', 'Matricule', 'Department', 'Grade',
+    'Gross', 'Taxable Gross', 'EE Contrib', 'ER Contrib',
+    'Income Tax', 'Other Deductions', 'Net Pay',
+    'Currency', 'Finalized', 'Created At',
+]
+
+
+def export_components(slips_qs) -> list[PayrollComponent]:
+    """Components that appear on these slips, in payslip order (one query)."""
+    return list(PayrollComponent.objects
+                .filter(id__in=PayslipItem.objects.filter(payslip__in=slips_qs.values('id')).values('component_id'))
+                .order_by('sequence', 'code'))
+
+
+def iter_payslip_rows(slips_qs, chunk_size: int = CHUNK_SIZE):
+    """
+    Yields the header, then one row per payslip (base columns + one amount per component).
+    """
+    components = export_components(slips_qs)
+    col = {c.id: i for i, c in enumerate(components)}
+    yield BASE_HEADER + [c.code for c in components]
+
+    qs = (slips_qs
+          .select_related('employee', 'employee__department', 'employee__grade', 'currency')
+          .prefetch_related(Prefetch('items', queryset=PayslipItem.objects.only('payslip_id', 'component_id', 'amount')))
+          .order_by('employee__last_name', 'employee__first_name', 'id'))
+
+    for p in qs.iterator(chunk_size=chunk_size):
+        emp = p.employee
+        amounts = [Decimal('0.00')] * len(components)
+        for it in p.items.all():
+            amounts[col[it.component_id]] += it.amount
+        yield [
+            f"{emp.first_name} {emp.last_name}",
+            getattr(emp, 'matricule', '') or '',
+            getattr(getattr(emp, 'department', None), 'name', '') or '',
+            getattr(getattr(emp, 'grade', None), 'code', '') or '',
+            p.gross_pay, p.taxable_gross, p.employee_contrib, p.employer_contrib,
+            p.income_tax, p.other_deductions, p.net_pay,
+            getattr(p.currency, 'code', '') or '',
+            'YES' if p.finalized else 'NO',
+            p.created_at.strftime('%Y-%m-%d %H:%M'),
+        ] + amounts
+
+
+class _Echo:
+    """File-like object whose write() returns the value, for csv.writer + streaming."""
+    def write(self, value):
+        return value
+
+
+def stream_csv(slips_qs, filename: str) -> StreamingHttpResponse:
+    writer = csv.writer(_Echo())
+    rows = (writer.writerow(r) for r in iter_payslip_rows(slips_qs))
+    resp = StreamingHttpResponse(rows, content_type='text/csv; charset=utf-8')
+    resp['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return resp
+
+
+def xlsx_response(slips_qs, filename: str, sheet: str = 'Payslips') -> FileResponse:
+    """
+    XLSX cannot be finalized before the last row (it's a zip), so the workbook goes to a temp
+    file in constant_memory mode (rows are flushed as written) and the file is streamed.
+    """
+    if not HAS_XLSX:
+        raise RuntimeError("XlsxWriter is not installed.")
+
+    tmp = tempfile.TemporaryFile(suffix='.xlsx')
+    wb = xlsxwriter.Workbook(tmp, {'constant_memory': True, 'in_memory': False})
+    ws = wb.add_worksheet(sheet[:31])
+    bold = wb.add_format({'bold': True})
+    money = wb.add_format({'num_format': '#,##0.00'})
+
+    for r, row in enumerate(iter_payslip_rows(slips_qs)):
+        for c, v in enumerate(row):
+            if r == 0:
+                ws.write_string(r, c, str(v), bold)
+            elif isinstance(v, Decimal):
+                ws.write_number(r, c, float(v), money)
+            else:
+                ws.write(r, c, v)
+    wb.close()
+
+    tmp.seek(0)
+    return FileResponse(
+        tmp, as_attachment=True, filename=filename,
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
@@ -0,0 +1,147 @@
+# payroll/services/pdf.py
+"""
+Bulk payslip PDF rendering.
+
+  - The stylesheet (payroll/payslip_pdf.css) is parsed once per worker process and reused with a
+    shared FontConfiguration, instead of WeasyPrint re-parsing inline CSS / fonts for every slip.
+  - Each slip's PDF is stored as a PayslipRender keyed by the sha256 of its HTML: unchanged slips
+    are skipped, and a crashed job resumes from whatever was already stored.
+  - assemble_job_output() merges the stored PDFs into one PDF (pypdf) or a ZIP.
+"""
+from __future__ import annotations
+import hashlib
+import logging
+import tempfile
+import zipfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+
+from payroll.models import Payslip, PayslipItem, PayslipPdfJob, PayslipRender
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pypdf import PdfWriter
+    HAS_PYPDF = True
+except Exception:
+    PdfWriter = None
+    HAS_PYPDF = False
+
+# per-process WeasyPrint state
+_css = None
+_fonts = None
+
+
+def _stylesheet():
+    global _css, _fonts
+    if _css is None:
+        from weasyprint import CSS
+        from weasyprint.text.fonts import FontConfiguration
+        _fonts = FontConfiguration()
+        _css = CSS(string=render_to_string("payroll/payslip_pdf.css"), font_config=_fonts)
+    return _css, _fonts
+
+
+def _base_url() -> str:
+    return (getattr(settings, "SITE_URL", "") or str(settings.BASE_DIR)).rstrip("/") + "/"
+
+
+def slips_for_render(ids):
+    return (Payslip.objects.filter(id__in=ids)
+            .select_related("run__company_policy__currency", "employee__department", "employee__grade", "currency")
+            .prefetch_related(Prefetch("items", queryset=PayslipItem.objects.select_related("component"))))
+
+
+def render_html(slip: Payslip) -> str:
+    return render_to_string("payroll/payslip_pdf.html", {
+        "p": slip,
+        "employee": slip.employee,
+        "run": slip.run,
+        "items": list(slip.items.all()),
+        "company": getattr(slip.run, "company_policy", None),
+        "shared_css": True,
+    })
+
+
+def html_to_pdf(html: str) -> bytes:
+    from weasyprint import HTML
+    css, fonts = _stylesheet()
+    return HTML(string=html, base_url=_base_url()).write_pdf(stylesheets=[css], font_config=fonts)
+
+
+def pdf_filename(slip: Payslip) -> str:
+    emp = slip.employee
+    return f"payslip_{emp.last_name}_{emp.first_name}_{slip.run.month}_{slip.run.year}_{slip.id}.pdf".replace(" ", "_")
+
+
+def render_slips(ids) -> dict:
+    """Render (or skip) the given slips; returns counters and per-slip errors."""
+    out = {"rendered": 0, "skipped": 0, "failed": 0, "errors": []}
+    renders = {r.payslip_id: r for r in PayslipRender.objects.filter(payslip_id__in=ids)}
+
+    for slip in slips_for_render(ids):
+        try:
+            html = render_html(slip)
+            digest = hashlib.sha256(html.encode("utf-8")).hexdigest()
+            current = renders.get(slip.id)
+            if current and current.content_hash == digest and current.file:
+                out["skipped"] += 1
+                continue
+
+            pdf = html_to_pdf(html)
+            if current is None:
+                current = PayslipRender(payslip=slip)
+            elif current.file:
+                current.file.delete(save=False)
+            current.content_hash = digest
+            current.file.save(pdf_filename(slip), ContentFile(pdf), save=False)
+            current.save()
+            out["rendered"] += 1
+        except Exception as e:
+            logger.exception("PDF render failed for payslip %s", slip.id)
+            out["failed"] += 1
+            out["errors"].append({"payslip": slip.id, "error": f"{type(e).__name__}: {e}"})
+    return out
+
+
+def job_slip_ids(run) -> list[int]:
+    """Slips of the run in print order."""
+    return list(run.payslips.order_by("employee__department__name", "employee__last_name",
+                                      "employee__first_name", "id").values_list("id", flat=True))
+
+
+def assemble_job_output(job: PayslipPdfJob) -> None:
+    """Merge the stored per-slip PDFs into job.file (merged PDF or ZIP), streaming through a temp file."""
+    ids = job_slip_ids(job.run)
+    renders = {r.payslip_id: r for r in PayslipRender.objects.filter(payslip_id__in=ids).select_related("payslip__employee", "payslip__run")}
+    name = f"payslips_{job.run.year}_{str(job.run.month).zfill(2)}"
+
+    with tempfile.TemporaryFile() as tmp:
+        if job.output == PayslipPdfJob.PDF:
+            if not HAS_PYPDF:
+                raise RuntimeError("pypdf is not installed (needed for merged PDF output).")
+            writer = PdfWriter()
+            for sid in ids:
+                r = renders.get(sid)
+                if r and r.file:
+                    with r.file.open("rb") as fh:
+                        writer.append(fh)
+            writer.write(tmp)
+            fname = f"{name}.pdf"
+        else:
+            with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                for sid in ids:
+                    r = renders.get(sid)
+                    if r and r.file:
+                        with r.file.open("rb") as fh:
+                            zf.writestr(pdf_filename(r.payslip), fh.read())
+            fname = f"{name}.zip"
+
+        tmp.seek(0)
+        if job.file:
+            job.file.delete(save=False)
+        job.file.save(fname, File(tmp), save=False)
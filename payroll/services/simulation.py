@@ -0,0 +1,255 @@
+# payroll/services/simulation.py
+
+from __future__ import annotations
+import copy
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from types import SimpleNamespace
+from typing import Optional
+
+from payroll.models import *
+from payroll.services.bulk import BulkPayrollEngine
+from payroll.services.engines import Q, q2
+from payroll.services.evaluators import CompiledPolicy, compile_policy
+
+TOTAL_FIELDS = ["base_salary", "gross_pay", "taxable_gross", "employee_contrib",
+                "employer_contrib", "income_tax", "other_deductions", "net_pay"]
+
+
+def _dec(value, name: str) -> Decimal:
+    try:
+        return Q(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f"{name}: invalid number {value!r}")
+
+
+def _dict(value, name: str) -> dict:
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ValueError(f"{name}: expected an object, got {type(value).__name__}")
+    return value
+
+
+def _list_of_dicts(value, name: str) -> list:
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ValueError(f"{name}: expected a list, got {type(value).__name__}")
+    for i, item in enumerate(value):
+        if not isinstance(item, dict):
+            raise ValueError(f"{name}[{i}]: expected an object, got {type(item).__name__}")
+    return value
+
+
+@dataclass
+class Overrides:
+    """
+    What-if knobs (all optional):
+      tax_table_id   use another TaxTable
+      tax_brackets   [{lower, upper|null, rate}] ad-hoc table (wins over tax_table_id)
+      contributions  {scheme_code: {ee_rate?, er_rate?, cap?}} on the policy's active schemes
+      recurring      [{component: code, pct: 5, grade?: code, department?: id}] % change of assignments
+      fx             {currency_code: rate to policy currency}
+    """
+    tax_table_id: Optional[int] = None
+    tax_brackets: Optional[list] = None
+    contributions: dict = field(default_factory=dict)
+    recurring: list = field(default_factory=list)
+    fx: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_payload(cls, data: Optional[dict]) -> "Overrides":
+        # malformed input -> ValueError (400 in the view), never AttributeError/TypeError
+        data = _dict(data, "overrides")
+        brackets = None
+        if data.get("tax_brackets") is not None:
+            brackets = sorted(
+                (SimpleNamespace(lower=_dec(b.get("lower", 0), "tax_brackets.lower"),
+                                 upper=_dec(b["upper"], "tax_brackets.upper") if b.get("upper") is not None else None,
+                                 rate=_dec(b.get("rate", 0), "tax_brackets.rate"))
+                 for b in _list_of_dicts(data["tax_brackets"], "tax_brackets")),
+                key=lambda b: b.lower,
+            )
+        recurring = []
+        for r in _list_of_dicts(data.get("recurring"), "recurring"):
+            if not r.get("component"):
+                raise ValueError("recurring: 'component' is required")
+            recurring.append({
+                "component": r["component"],
+                "factor": 1 + _dec(r.get("pct", 0), "recurring.pct") / 100,
+                "grade": r.get("grade"),
+                "department": str(r["department"]) if r.get("department") is not None else None,
+            })
+        return cls(
+            tax_table_id=data.get("tax_table_id"),
+            tax_brackets=brackets,
+            contributions={
+                code: {k: (_dec(v, f"contributions.{code}.{k}") if v is not None else None)
+                       for k, v in _dict(vals, f"contributions.{code}").items() if k in ("ee_rate", "er_rate", "cap")}
+                for code, vals in _dict(data.get("contributions"), "contributions").items()
+            },
+            recurring=recurring,
+            fx={str(code).upper(): _dec(rate, f"fx.{code}") for code, rate in _dict(data.get("fx"), "fx").items()},
+        )
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.tax_table_id or self.tax_brackets is not None or self.contributions
+                    or self.recurring or self.fx)
+
+
+class SimulationEngine(BulkPayrollEngine):
+    """
+    Read-only what-if mode of the bulk engine: loads the run population once, applies the
+    overrides in memory and aggregates totals. Nothing is written (persist/compute raise).
+    Works on an existing run or an unsaved PayrollRun(company_policy, year, month).
+    """
+
+    def __init__(self, run: PayrollRun, overrides: Optional[Overrides] = None):
+        super().__init__(run)
+        self.overrides = overrides or Overrides()
+
+    # -------------- overrides --------------
+
+    def _compiled(self) -> CompiledPolicy:
+        if getattr(self, "_compiled_policy", None) is not None:
+            return self._compiled_policy
+        o = self.overrides
+        if o.tax_brackets is None and not o.tax_table_id and not o.contributions:
+            self._compiled_policy = super()._compiled()
+            return self._compiled_policy
+
+        brackets = o.tax_brackets
+        if brackets is None and o.tax_table_id:
+            table = TaxTable.objects.filter(id=o.tax_table_id).first()
+            if not table:
+                raise ValueError(f"tax_table_id: TaxTable {o.tax_table_id} not found")
+            brackets = list(table.brackets.all().order_by("lower"))
+
+        schemes = list(self.policy.active_contribs.all())
+        unknown = set(o.contributions) - {s.code for s in schemes}
+        if unknown:
+            raise ValueError(f"contributions: not active on this policy: {', '.join(sorted(unknown))}")
+        for i, sch in enumerate(schemes):
+            patch = o.contributions.get(sch.code)
+            if patch:
+                sch = copy.copy(sch)
+                for k, v in patch.items():
+                    setattr(sch, k, v)
+                schemes[i] = sch
+
+        self._compiled_policy = compile_policy(self.policy, brackets=brackets, schemes=schemes)
+        return self._compiled_policy
+
+    def _fx_rate(self, from_cur: Currency, policy_cur: Currency) -> Optional[Decimal]:
+        rate = self.overrides.fx.get(str(from_cur.pk).upper())
+        return rate if rate is not None else super()._fx_rate(from_cur, policy_cur)
+
+    def _recurring_rows(self, emp):
+        rows = super()._recurring_rows(emp)
+        rules = self.overrides.recurring
+        if not rules:
+            return rows
+        grade = getattr(getattr(emp, "grade", None), "code", None)
+        dept = str(emp.department_id) if emp.department_id else None
+        out = []
+        for r in rows:
+            factor = Q(1)
+            for rule in rules:
+                if rule["component"] != r.component.code:
+                    continue
+                if rule["grade"] and rule["grade"] != grade:
+                    continue
+                if rule["department"] and rule["department"] != dept:
+                    continue
+                factor *= rule["factor"]
+            if factor != 1:
+                r = copy.copy(r)
+                if r.amount:
+                    r.amount = q2(Q(r.amount) * factor)
+                elif r.percentage:
+                    r.percentage = Q(r.percentage) * factor
+            out.append(r)
+        return out
+
+    # -------------- read-only --------------
+
+    def _persist(self, *args, **kwargs):
+        raise RuntimeError("SimulationEngine never writes payslips.")
+
+    def compute_for_employee(self, emp):
+        raise RuntimeError("SimulationEngine never writes payslips.")
+
+    def compute_run(self, *args, **kwargs):
+        raise RuntimeError("SimulationEngine never writes payslips.")
+
+    def recompute_dirty(self):
+        raise RuntimeError("SimulationEngine never writes payslips.")
+
+    # -------------- aggregate --------------
+
+    def simulate(self, inputs=None) -> dict:
+        """
+        Totals + per-department breakdown for the whole population.
+        `inputs` lets a second engine (e.g. the baseline) reuse already loaded RunInputs.
+        """
+        if inputs is None:
+            self.inputs = self.load_inputs()
+        else:
+            self.inputs = inputs
+
+        zero = {f: Q("0.00") for f in TOTAL_FIELDS}
+        totals = dict(zero, headcount=0)
+        by_dept = defaultdict(lambda: dict(zero, headcount=0, name=None))
+
+        for emp, t, _ in self._build_many(self.inputs.employees):
+            d = by_dept[emp.department_id]
+            d["name"] = getattr(emp.department, "name", None) or "—"
+            for bucket in (totals, d):
+                bucket["headcount"] += 1
+                for f in TOTAL_FIELDS:
+                    bucket[f] += t[f]
+
+        def _out(bucket):
+            row = {f: str(q2(bucket[f])) for f in TOTAL_FIELDS}
+            row["headcount"] = bucket["headcount"]
+            row["employer_cost"] = str(q2(bucket["gross_pay"] + bucket["employer_contrib"]))
+            return row
+
+        return {
+            "policy": self.policy.id,
+            "year": self.run.year,
+            "month": self.run.month,
+            "currency": getattr(self.policy, "currency_id", None),
+            "totals": _out(totals),
+            "by_department": sorted(
+                ({"department_id": k, "department": v["name"], **_out(v)} for k, v in by_dept.items()),
+                key=lambda r: r["department"] or "",
+            ),
+        }
+
+
+def simulate_payroll(policy: CompanyPolicy, year: int, month: int,
+                     overrides: Optional[dict] = None, compare: bool = False) -> dict:
+    """
+    Entry point for the API. With compare=True also returns the baseline (no overrides)
+    and the delta of the totals; inputs are loaded once and shared.
+    """
+    run = (PayrollRun.objects.filter(company_policy=policy, year=year, month=month).first()
+           or PayrollRun(company_policy=policy, year=year, month=month))
+    ov = Overrides.from_payload(overrides)
+
+    engine = SimulationEngine(run, ov)
+    result = engine.simulate()
+    result["overrides"] = overrides or {}
+
+    if compare:
+        baseline = SimulationEngine(run).simulate(inputs=engine.inputs)
+        result["baseline"] = baseline["totals"]
+        result["delta"] = {
+            k: (str(Q(result["totals"][k]) - Q(v)) if k != "headcount" else result["totals"][k] - v)
+            for k, v in baseline["totals"].items()
+        }
+    return result
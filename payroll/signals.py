@@ -0,0 +1,146 @@
+# payroll/signals.py
+"""
+  - Dirty-set tracking for incremental recomputation: any change to an employee's payroll
+    inputs marks that employee dirty in every open (DRAFT / PROCESSED) run;
+    BulkPayrollEngine.recompute_dirty() then rebuilds only those slips.
+  - A Holiday change dirties the slips of the open WORKING-proration runs whose period holds
+    its date (working-day proration reads the holiday calendar).
+  - Invalidation of the compiled tax / contribution evaluators.
+"""
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from payroll.models import (
+    CompanyPolicy, ContributionScheme, Contract, PayrollDirtyMark, PayrollRun, Payslip,
+    RecurringComponentAssignment, TaxBracket, TaxTable, VariableInput,
+)
+from leave.models import Holiday
+from payroll.services.evaluators import invalidate_evaluators
+from situation.models import Situation
+
+OPEN_STATUSES = (PayrollRun.DRAFT, PayrollRun.PROCESSED)
+
+
+def mark_dirty(employee_id, reason: str = "", run_id=None) -> int:
+    """Mark one employee dirty in the open runs (or only in run_id). Returns #marks written."""
+    if not employee_id:
+        return 0
+    runs = PayrollRun.objects.filter(status__in=OPEN_STATUSES)
+    if run_id:
+        runs = runs.filter(id=run_id)
+    return _write_marks([(rid, employee_id) for rid in runs.values_list("id", flat=True)], reason)
+
+
+def _write_marks(pairs, reason: str) -> int:
+    now = timezone.now()
+    marks = [PayrollDirtyMark(run_id=rid, employee_id=eid, reason=reason[:64], marked_at=now) for rid, eid in pairs]
+    if marks:
+        # re-marking refreshes marked_at so a recompute already in flight doesn't clear it
+        PayrollDirtyMark.objects.bulk_create(
+            marks, update_conflicts=True, batch_size=1000,
+            unique_fields=["run", "employee"], update_fields=["reason", "marked_at"],
+        )
+    return len(marks)
+
+
+def _on_change(instance, action, raw=False, run_id=None):
+    if raw:  # loaddata
+        return
+    mark_dirty(instance.employee_id, f"{instance._meta.model_name}.{action}", run_id=run_id)
+
+
+@receiver(pre_save, sender=VariableInput)
+def variable_input_saving(sender, instance, raw=False, **kwargs):
+    # remember where the row was: moving it to another run (or employee) changes the old one too
+    if raw or instance._state.adding or not instance.pk:
+        instance._previous_link = None
+        return
+    instance._previous_link = (VariableInput.objects.filter(pk=instance.pk)
+                               .values_list("employee_id", "run_id").first())
+
+
+@receiver(post_save, sender=VariableInput)
+@receiver(post_delete, sender=VariableInput)
+def variable_input_changed(sender, instance, **kwargs):
+    # Run-linked inputs only affect that run; unlinked ones are picked up by period
+    raw = kwargs.get("raw", False)
+    _on_change(instance, "delete" if "created" not in kwargs else "save", raw=raw, run_id=instance.run_id)
+    previous = getattr(instance, "_previous_link", None)
+    instance._previous_link = None
+    if previous and not raw and previous != (instance.employee_id, instance.run_id):
+        employee_id, run_id = previous
+        mark_dirty(employee_id, "variableinput.move", run_id=run_id)
+
+
+@receiver(pre_save, sender=RecurringComponentAssignment)
+@receiver(pre_save, sender=Contract)
+@receiver(pre_save, sender=Situation)
+def payroll_input_saving(sender, instance, raw=False, **kwargs):
+    # a row reassigned to another employee changes the previous employee's slip too
+    if raw or instance._state.adding or not instance.pk:
+        instance._previous_employee = None
+        return
+    instance._previous_employee = sender.objects.filter(pk=instance.pk).values_list("employee_id", flat=True).first()
+
+
+@receiver(post_save, sender=RecurringComponentAssignment)
+@receiver(post_delete, sender=RecurringComponentAssignment)
+@receiver(post_save, sender=Contract)
+@receiver(post_delete, sender=Contract)
+@receiver(post_save, sender=Situation)
+@receiver(post_delete, sender=Situation)
+def payroll_input_changed(sender, instance, **kwargs):
+    raw = kwargs.get("raw", False)
+    _on_change(instance, "delete" if "created" not in kwargs else "save", raw=raw)
+    previous = getattr(instance, "_previous_employee", None)
+    instance._previous_employee = None
+    if previous and not raw and previous != instance.employee_id:
+        mark_dirty(previous, f"{instance._meta.model_name}.move")
+
+
+# ---------------- holidays ----------------
+
+@receiver(pre_save, sender=Holiday)
+def holiday_saving(sender, instance, raw=False, **kwargs):
+    # a holiday moved to another month changes the old period too
+    if raw or instance._state.adding or not instance.pk:
+        instance._previous_date = None
+        return
+    instance._previous_date = Holiday.objects.filter(pk=instance.pk).values_list("date", flat=True).first()
+
+
+@receiver(post_save, sender=Holiday)
+@receiver(post_delete, sender=Holiday)
+def holiday_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    days = {instance.date, getattr(instance, "_previous_date", None)} - {None}
+    instance._previous_date = None
+    periods = models.Q(pk__in=[])
+    for d in days:
+        periods |= models.Q(year=d.year, month=d.month)
+    runs = (PayrollRun.objects.filter(periods, status__in=OPEN_STATUSES, company_policy__proration_method="WORKING")
+            .values_list("id", flat=True))
+    slips = Payslip.objects.filter(run_id__in=list(runs))
+    if instance.region:
+        slips = slips.filter(employee__region__iexact=instance.region.strip())
+    _write_marks(slips.values_list("run_id", "employee_id"), "holiday.change")
+
+
+# ---------------- compiled evaluators ----------------
+
+@receiver(post_save, sender=TaxTable)
+@receiver(post_delete, sender=TaxTable)
+@receiver(post_save, sender=TaxBracket)
+@receiver(post_delete, sender=TaxBracket)
+@receiver(post_save, sender=ContributionScheme)
+@receiver(post_delete, sender=ContributionScheme)
+@receiver(post_save, sender=CompanyPolicy)
+@receiver(m2m_changed, sender=CompanyPolicy.active_contribs.through)
+def tax_setup_changed(sender, instance, **kwargs):
+    if kwargs.get("raw"):
+        return
+    # after commit: bumped earlier, another worker could compile the old brackets under the new generation
+    transaction.on_commit(invalidate_evaluators)
@@ -1,16 +1,25 @@
 # payroll/tasks.py
-from celery import shared_task
+from datetime import timedelta
+
+from celery import shared_task, chain, chord, group
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.urls import reverse
+from django.utils import timezone
 import logging
 
-from payroll.models import PayrollRun, Payslip
-from notifications.tasks import send_notification  # <- your Celery task
+from payroll.models import PayrollRun, PayrollRunJob, PayslipPdfJob
+from payroll.services.bulk import BulkPayrollEngine
+from notifications import outbox
+from notifications.tasks import send_notification, create_bulk_notifications  # <- your Celery task
 
 from config.monitoring.metrics import mark_beat_run
 
 logger = logging.getLogger(__name__)
 
+PAYROLL_CATEGORY = "payroll"
+
 
 def _notify_payroll(user_id, message, title=None, priority=3):
     """
@@ -21,6 +30,7 @@ def _notify_payroll(user_id, message, title=None, priority=3):
         user_id=user_id,
         message=message,
         title=title or "Notification paie",
+        category=PAYROLL_CATEGORY,
         priority=priority
     )
 
@@ -34,11 +44,11 @@ def _abs_url(relative: str) -> str:
     return f"{base}{relative}" if base else relative
 
 
-def _payslip_url(p: Payslip) -> str:
+def _payslip_url(payslip_id: int) -> str:
     try:
-        rel = reverse("payroll_payslip_detail", kwargs={"payslip_id": p.id})
+        rel = reverse("payroll_payslip_detail", kwargs={"payslip_id": payslip_id})
     except Exception:
-        rel = f"/api/v1/payroll/payslips/{p.id}/"
+        rel = f"/api/v1/payroll/payslips/{payslip_id}/"
     return _abs_url(rel)
 
 
@@ -73,35 +83,28 @@ def notify_run_generated(run_id: int, actor_id: int, count: int) -> bool:
 
 @shared_task
 def notify_employees_payslips_ready(run_id: int) -> dict:
-    """Notify each employee that their payslip is available (after Generate)."""
+    """Notify each employee that their payslip is available (after Generate), as one bulk fan-out."""
     
     # Mark task as run in monitoring
     mark_beat_run("payroll.tasks.notify_employees_payslips_ready")
     
     run = PayrollRun.objects.get(id=run_id)
-    slips = run.payslips.select_related("employee__user", "currency").all()
+    period = f"{str(run.month).zfill(2)}/{run.year}"
+    title = f"Bulletin de paie {period}"
 
-    sent = 0
-    skipped = 0
-    for p in slips:
-        uid = getattr(getattr(p.employee, "user", None), "id", None)
+    items = []
+    skipped = total = 0
+    for slip_id, uid, net_pay, cur in run.payslips.values_list("id", "employee__user_id", "net_pay", "currency_id").iterator():
+        total += 1
         if not uid:
             skipped += 1
             continue
-        period = f"{str(run.month).zfill(2)}/{run.year}"
-        net = f"{p.net_pay} {getattr(p.currency, 'code', '') or ''}".strip()
-        url = _payslip_url(p)
-        msg = f"Votre bulletin de paie {period} est disponible. Net à payer : {net}. Consulter : {url}"
-        try:
-            # send_notification.delay(uid, msg)
-            _notify_payroll(uid, msg, title=f"Bulletin de paie {period}")
-            
-            sent += 1
-        except Exception:
-            skipped += 1
-            logger.exception("Failed to enqueue employee notification for payslip %s", p.id)
+        net = f"{net_pay} {cur or ''}".strip()
+        msg = f"Votre bulletin de paie {period} est disponible. Net à payer : {net}. Consulter : {_payslip_url(slip_id)}"
+        items.append((uid, msg, title))
 
-    return {"sent": sent, "skipped": skipped, "total": slips.count()}
+    res = create_bulk_notifications(items, category=PAYROLL_CATEGORY, priority=3)
+    return {"sent": res["created"], "skipped": skipped + res["skipped"], "total": total}
 
 
 @shared_task
@@ -123,19 +126,15 @@ def notify_run_closed(run_id: int, actor_id: int) -> bool:
         # Actor
         _notify_payroll(actor_id, msg_actor, title=f"Lot de paie {period} — Fermeture")
 
-        # Notify all employees with payslips in this run
-        # employees
-        slips = run.payslips.select_related("employee__user", "currency").all()
+        # Notify all employees with payslips in this run (one bulk fan-out)
+        title = f"Paiement validé — {period}"
         link = _my_payslips_url()
-        for p in slips:
-            uid = getattr(getattr(p.employee, "user", None), "id", None)
-            if not uid:
-                continue
-            net = f"{p.net_pay} {getattr(p.currency, 'code', '') or ''}".strip()
-            msg = f"Paiement validé pour {period}. Net payé : {net}. Voir vos bulletins : {link}"
-            # send_notification.delay(uid, msg)
-            # Employees
-            _notify_payroll(uid, msg, title=f"Paiement validé — {period}")
+        items = []
+        for uid, net_pay, cur in run.payslips.exclude(employee__user__isnull=True).values_list(
+                "employee__user_id", "net_pay", "currency_id").iterator():
+            net = f"{net_pay} {cur or ''}".strip()
+            items.append((uid, f"Paiement validé pour {period}. Net payé : {net}. Voir vos bulletins : {link}", title))
+        create_bulk_notifications(items, category=PAYROLL_CATEGORY, priority=3)
 
         return True
     except Exception as e:
@@ -160,3 +159,229 @@ def notify_run_reopened(run_id: int, actor_id: int) -> bool:
     except Exception as e:
         logger.exception("notify_run_reopened failed: %s", e)
         return False
+
+
+# ---------------- Sharded (async) run generation ----------------
+
+def _job_stale_before():
+    return timezone.now() - timedelta(minutes=getattr(settings, "PAYROLL_JOB_STALE_MINUTES", 30))
+
+
+def running_job(run: PayrollRun):
+    """The run's active generation job, or None. Jobs without progress for PAYROLL_JOB_STALE_MINUTES don't count."""
+    return (run.jobs.filter(status__in=[PayrollRunJob.PENDING, PayrollRunJob.RUNNING],
+                            updated_at__gte=_job_stale_before())
+            .order_by('-created_at', '-id').first())
+
+
+def is_stale(job: PayrollRunJob) -> bool:
+    return job.status in (PayrollRunJob.PENDING, PayrollRunJob.RUNNING) and job.updated_at < _job_stale_before()
+
+
+def cancel_job(job: PayrollRunJob, reason: str) -> PayrollRunJob:
+    """Mark the job failed; a late chord callback keeps it failed (errors is not empty)."""
+    with transaction.atomic():
+        job = PayrollRunJob.objects.select_for_update().get(id=job.id)
+        job.errors = (job.errors or []) + [{"cancelled": reason}]
+        job.status = PayrollRunJob.FAILED
+        job.finished_at = timezone.now()
+        job.save(update_fields=["errors", "status", "finished_at", "updated_at"])
+    return job
+
+
+def _run_shards(run: PayrollRun) -> list:
+    size = max(1, getattr(run.company_policy, "shard_size", None) or 500)
+    ids = [str(x) for x in BulkPayrollEngine(run)._run_employees().order_by("id").values_list("id", flat=True)]
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+
+def start_sharded_run(run: PayrollRun, actor_id=None) -> PayrollRunJob:
+    """
+    Create the job and hand the dispatch to the outbox (notifications.outbox): the chord is
+    published by dispatch_payroll_run once the job row is committed, and a broker error is
+    retried by the relay instead of leaving the job RUNNING with nothing behind it.
+    """
+    with transaction.atomic():
+        job = PayrollRunJob.objects.create(run=run, actor_id=actor_id, shards_total=len(_run_shards(run)),
+                                           status=PayrollRunJob.RUNNING)
+        outbox.enqueue(dispatch_payroll_run, job.id)
+    return job
+
+
+@shared_task
+def dispatch_payroll_run(job_id: int) -> dict:
+    """
+    Split the run population into shards of policy.shard_size and compute them in parallel:
+    shards are dealt round-robin into policy.shard_concurrency chains, all chains run in a
+    group, and a chord callback finalizes the run once every shard has finished.
+    Publishes at most once per job (a re-published outbox row finds task_id set).
+    """
+    with transaction.atomic():
+        job = PayrollRunJob.objects.select_for_update().select_related("run__company_policy").get(id=job_id)
+        if job.task_id or job.status not in (PayrollRunJob.PENDING, PayrollRunJob.RUNNING):
+            return {"job": job.id, "dispatched": False}
+        run = job.run
+        shards = _run_shards(run)
+        lanes = max(1, getattr(run.company_policy, "shard_concurrency", None) or 4)
+
+        if not shards:
+            res = finalize_payroll_run.delay([], job.id)
+        else:
+            chains = [[] for _ in range(min(lanes, len(shards)))]
+            for n, shard in enumerate(shards):
+                chains[n % len(chains)].append(compute_payroll_shard.si(job.id, run.id, shard, n))
+            header = group(chain(*c) if len(c) > 1 else c[0] for c in chains)
+            res = chord(header)(finalize_payroll_run.s(job.id))
+        job.shards_total = len(shards)
+        job.task_id = res.id or ""
+        job.save(update_fields=["shards_total", "task_id", "updated_at"])
+    return {"job": job.id, "dispatched": True, "shards": len(shards)}
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def compute_payroll_shard(job_id: int, run_id: int, employee_ids: list, shard_no: int) -> dict:
+    """
+    Compute one shard with the set-based engine, in its own transaction.
+    Errors are recorded on the job instead of raised so the chord callback always runs.
+    Acked late: a shard lost with its worker is redelivered; slips are upserted on
+    (run, employee), so computing it again is harmless.
+    """
+    written = 0
+    error = None
+    try:
+        run = PayrollRun.objects.select_related("company_policy").get(id=run_id)
+        written = len(BulkPayrollEngine(run).compute_run(employee_ids=employee_ids, finalize=False))
+    except Exception as e:
+        logger.exception("Payroll shard %s of job %s failed", shard_no, job_id)
+        error = f"{type(e).__name__}: {e}"
+
+    with transaction.atomic():
+        job = PayrollRunJob.objects.select_for_update().get(id=job_id)
+        if shard_no in (job.done_shards or []):
+            return {"shard": shard_no, "written": written, "error": error, "duplicate": True}
+        job.done_shards = (job.done_shards or []) + [shard_no]
+        job.shards_done = F("shards_done") + 1
+        job.slips_written = F("slips_written") + written
+        if error:
+            job.errors = (job.errors or []) + [{"shard": shard_no, "size": len(employee_ids), "error": error}]
+        job.save(update_fields=["shards_done", "done_shards", "slips_written", "errors", "updated_at"])
+
+    return {"shard": shard_no, "written": written, "error": error}
+
+
+@shared_task
+def finalize_payroll_run(results, job_id: int) -> dict:
+    """Chord callback: mark the run PROCESSED (only if every shard succeeded) and notify."""
+
+    # Mark task as run in monitoring
+    mark_beat_run("payroll.tasks.finalize_payroll_run")
+
+    job = PayrollRunJob.objects.select_related("run__company_policy").get(id=job_id)
+    run = job.run
+
+    if job.errors:
+        job.status = PayrollRunJob.FAILED
+    else:
+        BulkPayrollEngine(run).mark_processed()
+        job.status = PayrollRunJob.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "finished_at", "updated_at"])
+
+    if job.status == PayrollRunJob.DONE:
+        if job.actor_id:
+            notify_run_generated.delay(run.id, job.actor_id, job.slips_written)
+        notify_employees_payslips_ready.delay(run.id)
+
+    return {"job": job.id, "status": job.status, "slips_written": job.slips_written,
+            "errors": len(job.errors or [])}
+
+
+# ---------------- Bulk payslip PDFs ----------------
+
+PDF_CHUNK_SIZE = 50
+
+
+def start_payslip_pdf_job(run: PayrollRun, output: str = PayslipPdfJob.ZIP, actor_id=None,
+                          job: PayslipPdfJob = None) -> PayslipPdfJob:
+    """
+    Render every slip of the run in parallel chunks (one Celery task per chunk, spread over the
+    worker process pool), then assemble one merged PDF or ZIP. Passing an existing job resumes it:
+    slips already rendered with the same content hash are skipped.
+    """
+    from payroll.services.pdf import job_slip_ids
+
+    ids = job_slip_ids(run)
+    chunks = [ids[i:i + PDF_CHUNK_SIZE] for i in range(0, len(ids), PDF_CHUNK_SIZE)]
+
+    fields = dict(total=len(ids), chunks_total=len(chunks), chunks_done=0, done_chunks=[], rendered=0, skipped=0,
+                  failed=0, errors=[], status=PayslipPdfJob.RUNNING, finished_at=None)
+    if job is None:
+        job = PayslipPdfJob.objects.create(run=run, output=output, actor_id=actor_id, **fields)
+    else:
+        for k, v in fields.items():
+            setattr(job, k, v)
+        job.save()
+
+    header = group(render_payslip_pdf_chunk.si(job.id, chunk, n) for n, chunk in enumerate(chunks))
+    transaction.on_commit(lambda: chord(header)(finalize_payslip_pdf_job.s(job.id)) if chunks
+                          else finalize_payslip_pdf_job.delay([], job.id))
+    return job
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def render_payslip_pdf_chunk(job_id: int, payslip_ids: list, chunk_no: int) -> dict:
+    """
+    Render one chunk. acks_late + reject_on_worker_lost: if the worker dies mid-chunk the message
+    is redelivered, and slips already stored are skipped by content hash. A chunk whose counters
+    were already recorded (worker lost after the commit, before the ack) is not counted twice.
+    """
+    from payroll.services.pdf import render_slips
+
+    try:
+        res = render_slips(payslip_ids)
+    except Exception as e:
+        logger.exception("PDF chunk %s of job %s failed", chunk_no, job_id)
+        res = {"rendered": 0, "skipped": 0, "failed": len(payslip_ids),
+               "errors": [{"chunk": chunk_no, "error": f"{type(e).__name__}: {e}"}]}
+
+    with transaction.atomic():
+        job = PayslipPdfJob.objects.select_for_update().get(id=job_id)
+        if chunk_no in (job.done_chunks or []):
+            return {"chunk": chunk_no, "duplicate": True, **{k: res[k] for k in ("rendered", "skipped", "failed")}}
+        job.done_chunks = (job.done_chunks or []) + [chunk_no]
+        job.chunks_done = F("chunks_done") + 1
+        job.rendered = F("rendered") + res["rendered"]
+        job.skipped = F("skipped") + res["skipped"]
+        job.failed = F("failed") + res["failed"]
+        if res["errors"]:
+            job.errors = (job.errors or []) + res["errors"]
+        job.save(update_fields=["chunks_done", "done_chunks", "rendered", "skipped", "failed", "errors", "updated_at"])
+
+    return {"chunk": chunk_no, **{k: res[k] for k in ("rendered", "skipped", "failed")}}
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def finalize_payslip_pdf_job(results, job_id: int) -> dict:
+    """Chord callback: merge stored per-slip PDFs into the job output."""
+    from payroll.services.pdf import assemble_job_output
+
+    # Mark task as run in monitoring
+    mark_beat_run("payroll.tasks.finalize_payslip_pdf_job")
+
+    job = PayslipPdfJob.objects.select_related("run").get(id=job_id)
+    try:
+        assemble_job_output(job)
+        job.status = PayslipPdfJob.FAILED if job.failed else PayslipPdfJob.DONE
+    except Exception as e:
+        logger.exception("Assembling PDF job %s failed", job_id)
+        job.errors = (job.errors or []) + [{"assemble": f"{type(e).__name__}: {e}"}]
+        job.status = PayslipPdfJob.FAILED
+    job.finished_at = timezone.now()
+    job.save(update_fields=["file", "status", "errors", "finished_at", "updated_at"])
+
+    if job.actor_id and job.status == PayslipPdfJob.DONE:
+        period = f"{str(job.run.month).zfill(2)}/{job.run.year}"
+        _notify_payroll(job.actor_id, f"Bulletins PDF du lot {period} prêts ({job.total} bulletins).",
+                        title=f"Bulletins PDF {period}")
+
+    return {"job": job.id, "status": job.status, "rendered": job.rendered, "skipped": job.skipped}
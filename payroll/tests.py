@@ -1,3 +1,511 @@
+import csv
+import io
+import zipfile
+from datetime import date, timedelta
+from types import SimpleNamespace
+from decimal import Decimal
+from unittest import mock
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authentication.models import User
+from employee.models import Department, Employee
+from payroll.models import (
+    CompanyPolicy, ContributionScheme, Contract, Currency, PayrollComponent, PayrollDirtyMark, PayrollRun, Payslip,
+    PayrollRunJob, PayslipItem, PayslipPdfJob, RecurringComponentAssignment, SituationType, TaxBracket, TaxTable, VariableInput,
+)
+from payroll.services.bulk import BulkPayrollEngine
+from payroll.services.columnar import ColumnarPayrollEngine, to_cents
+from payroll.services.engines import PayrollEngine
+from payroll.services.exports import BASE_HEADER, HAS_XLSX, iter_payslip_rows, stream_csv, xlsx_response
+from payroll.services.simulation import simulate_payroll
+from payroll.services.evaluators import CompiledPolicy, ContributionEvaluator, TaxEvaluator, tax_by_slabs, q2
+from notifications.models import OutboxMessage
+from payroll import tasks as payroll_tasks
+from payroll.tasks import (
+    compute_payroll_shard, dispatch_payroll_run, finalize_payroll_run, render_payslip_pdf_chunk, start_sharded_run,
+)
+from leave.models import Holiday
+from situation.models import Situation
+
+TOTALS = ["base_salary", "gross_pay", "taxable_gross", "employee_contrib",
+          "employer_contrib", "income_tax", "other_deductions", "net_pay"]
+
+
+class PayrollTestData(TestCase):
+    """
+    Small seeded population (odd cents, % lines, qty x rate inputs, capped schemes, one
+    suspended employee), shared by the payroll test cases.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        xof = Currency.objects.create(code="XOF", name="Franc CFA")
+        table = TaxTable.objects.create(country="CI", valid_from=date(2025, 1, 1))
+        for lower, upper, rate in (("0", "75000", "0"), ("75000.01", "240000", "0.16"),
+                                   ("240000.01", "800000", "0.21"), ("800000.01", None, "0.32")):
+            TaxBracket.objects.create(table=table, lower=Decimal(lower),
+                                      upper=Decimal(upper) if upper else None, rate=Decimal(rate))
+        cnps = ContributionScheme.objects.create(code="CNPS", name="Retraite", ee_rate=Decimal("0.0630"),
+                                                 er_rate=Decimal("0.0770"), valid_from=date(2025, 1, 1),
+                                                 cap=Decimal("1647315.00"))
+        cmu = ContributionScheme.objects.create(code="CMU", name="Santé", ee_rate=Decimal("0.0125"),
+                                                er_rate=Decimal("0.0125"), valid_from=date(2025, 1, 1),
+                                                cap=Decimal("300000.00"))
+        cls.policy = CompanyPolicy.objects.create(name="Test CI", country="CI", currency=xof,
+                                                  proration_method="CALENDAR", active_tax_table=table)
+        cls.policy.active_contribs.add(cnps, cmu)
+        cls.payroll_run = PayrollRun.objects.create(company_policy=cls.policy, year=2025, month=3)
+
+        PayrollComponent.objects.create(code="BASIC", name="Salaire de base", kind=PayrollComponent.EARNING,
+                                        taxable=True, contributory=True, sequence=10)
+        transport = PayrollComponent.objects.create(code="TRANSPORT", name="Transport", kind=PayrollComponent.EARNING,
+                                                    taxable=False, contributory=False, sequence=20)
+        prime = PayrollComponent.objects.create(code="PRIME", name="Prime d'ancienneté", kind=PayrollComponent.EARNING,
+                                                taxable=True, contributory=True, sequence=30)
+        overtime = PayrollComponent.objects.create(code="HS", name="Heures sup.", kind=PayrollComponent.EARNING,
+                                                   taxable=True, contributory=True, sequence=40)
+        loan = PayrollComponent.objects.create(code="PRET", name="Remboursement prêt", kind=PayrollComponent.DEDUCTION,
+                                               taxable=False, contributory=False, sequence=100)
+        suspend = SituationType.objects.create(name="Disponibilité", code="dispo", suspend_payroll=True)
+
+        dept = Department.objects.create(name="Finances")
+        salaries = ["123456.78", "250000.00", "87500.55", "999999.99", "1800000.01", "64000.00"]
+        cls.employees = []
+        for i, salary in enumerate(salaries):
+            user = User.objects.create_user(username=f"parity_{i}", password="x")
+            emp = Employee.objects.create(user=user, first_name="Test", last_name=str(i), gender="M",
+                                          employment_type="Fonctionnaire", department=dept if i % 2 else None)
+            Contract.objects.create(employee=emp, contract_type="PERMANENT", salary=Decimal(salary),
+                                    start_date=date(2020, 1, 1))
+            RecurringComponentAssignment.objects.create(employee=emp, component=transport,
+                                                        amount=Decimal("30000.00"), start_date=date(2024, 1, 1))
+            RecurringComponentAssignment.objects.create(employee=emp, component=prime, amount=0,
+                                                        percentage=Decimal("0.0333") * (i + 1),
+                                                        start_date=date(2024, 1, 1))
+            VariableInput.objects.create(run=cls.payroll_run, employee=emp, component=overtime,
+                                         quantity=Decimal("2.5") + i, rate=Decimal("1234.5678"), amount=0)
+            if i % 3 == 0:
+                VariableInput.objects.create(run=cls.payroll_run, employee=emp, component=loan, amount=Decimal("15000.33"))
+            cls.employees.append(emp)
+        Situation.objects.create(employee=cls.employees[2], situation_type=suspend, start_date=date(2025, 2, 1))
+        cls.ids = [e.id for e in cls.employees]
+
+
+class PayrollEngineParityTests(PayrollTestData):
+    """The bulk and columnar engines must agree with PayrollEngine.compute_for_employee to the cent."""
+
+    def _snapshot(self):
+        out = {}
+        for p in Payslip.objects.filter(run=self.payroll_run).prefetch_related("items"):
+            out[p.employee_id] = (
+                [getattr(p, f) for f in TOTALS], p.currency_id,
+                sorted((i.component_id, i.quantity, i.rate, i.amount) for i in p.items.all()),
+            )
+        return out
+
+    def _row_slips(self):
+        engine = PayrollEngine(self.payroll_run)
+        return {emp.id: engine.compute_for_employee(emp) for emp in engine._run_employees(self.ids)}
+
+    def test_bulk_matches_row_engine(self):
+        row = self._row_slips()
+        self.assertEqual(sum(1 for s in row.values() if s is not None), len(self.ids) - 1)   # one suspended
+        expected = self._snapshot()
+
+        Payslip.objects.filter(run=self.payroll_run).delete()
+        BulkPayrollEngine(self.payroll_run).compute_run(self.ids, finalize=False)
+        self.assertEqual(self._snapshot(), expected)
+
+    def test_bulk_evaluates_tax_and_contributions_in_one_batch(self):
+        engine = BulkPayrollEngine(self.payroll_run)
+        with mock.patch.object(CompiledPolicy, "tax_many", autospec=True, side_effect=CompiledPolicy.tax_many) as tax, \
+                mock.patch.object(ContributionEvaluator, "contributions_many", autospec=True,
+                                  side_effect=ContributionEvaluator.contributions_many) as contribs:
+            built = engine.build_all(self.ids)
+        self.assertEqual(len(built), len(self.ids) - 1)
+        self.assertEqual((tax.call_count, contribs.call_count), (1, 1))
+        self.assertEqual(len(tax.call_args[0][1]), len(built))
+
+    def test_columnar_matches_row_engine_to_the_cent(self):
+        col = ColumnarPayrollEngine(self.payroll_run)
+        col.load_columns(self.ids)
+        res = col.evaluate()
+        position = {eid: i for i, eid in enumerate(col.columns.employee_ids)}
+
+        for emp_id, slip in self._row_slips().items():
+            i = position[emp_id]
+            if slip is None:
+                self.assertFalse(res["eligible"][i])
+                continue
+            for f in TOTALS:
+                self.assertEqual(int(res[f][i]), to_cents(getattr(slip, f)), f"{emp_id} {f}")
+
+    def test_columnar_aggregate_matches_row_totals(self):
+        slips = [s for s in self._row_slips().values() if s is not None]
+        totals = ColumnarPayrollEngine(self.payroll_run).aggregate()["totals"]
+        self.assertEqual(totals["headcount"], len(slips))
+        for f in TOTALS:
+            self.assertEqual(totals[f], sum(getattr(s, f) for s in slips), f)
+
+    def test_fingerprint_reuses_build_inputs(self):
+        engine = PayrollEngine(self.payroll_run)
+        emp = self.employees[0]
+        slip = engine.compute_for_employee(emp)
+        self.assertEqual(slip.hash, PayrollEngine(self.payroll_run)._fingerprint(emp))
+
+    def test_moving_variable_input_marks_both_runs(self):
+        april = PayrollRun.objects.create(company_policy=self.policy, year=2025, month=4)
+        PayrollDirtyMark.objects.all().delete()
+        vi = VariableInput.objects.filter(run=self.payroll_run, employee=self.employees[1]).first()
+        vi.run = april
+        vi.save()
+        marked = set(PayrollDirtyMark.objects.filter(employee=self.employees[1]).values_list("run_id", flat=True))
+        self.assertEqual(marked, {self.payroll_run.id, april.id})
+
+    def test_reassigned_contract_marks_both_employees(self):
+        PayrollDirtyMark.objects.all().delete()
+        old, new = self.employees[3], self.employees[4]
+        contract = Contract.objects.get(employee=old)
+        contract.employee, contract.start_date = new, date(2021, 1, 1)
+        contract.save()
+        marked = set(PayrollDirtyMark.objects.filter(run=self.payroll_run).values_list("employee_id", flat=True))
+        self.assertEqual(marked, {old.id, new.id})
+
+    def test_redelivered_pdf_chunk_counts_once(self):
+        job = PayslipPdfJob.objects.create(run=self.payroll_run, total=2, chunks_total=1)
+        res = {"rendered": 2, "skipped": 0, "failed": 0, "errors": []}
+        with mock.patch("payroll.services.pdf.render_slips", return_value=res):
+            render_payslip_pdf_chunk(job.id, [1, 2], 0)
+            again = render_payslip_pdf_chunk(job.id, [1, 2], 0)
+        job.refresh_from_db()
+        self.assertTrue(again["duplicate"])
+        self.assertEqual((job.chunks_done, job.rendered, job.done_chunks), (1, 2, [0]))
+
+
+class ShardedRunTests(PayrollTestData):
+    """mode=async: outbox dispatch, idempotent shards, chord callback and the job endpoints."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.policy.shard_size, cls.policy.shard_concurrency = 2, 2
+        cls.policy.save(update_fields=["shard_size", "shard_concurrency"])
+        cls.hr = User.objects.create_user(username="payroll_hr", password="x", role="HR")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.hr)
+        for task in (payroll_tasks.notify_run_generated, payroll_tasks.notify_employees_payslips_ready):
+            patcher = mock.patch.object(task, "delay")
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _url(self, action):
+        return f"/api/v1/runs/{self.payroll_run.id}/{action}/"
+
+    def _dispatch(self, job):
+        """Run dispatch_payroll_run with the chord captured; returns the shard signatures."""
+        with mock.patch.object(payroll_tasks, "chord") as chord:
+            chord.return_value.return_value.id = "chord-1"
+            out = dispatch_payroll_run(job.id)
+        if not chord.called:
+            return out, []
+        header = chord.call_args[0][0]
+        shards = []
+        for lane in header.tasks:
+            shards += list(getattr(lane, "tasks", None) or [lane])
+        return out, shards
+
+    def test_dispatch_goes_through_outbox_and_runs_once(self):
+        job = start_sharded_run(self.payroll_run, actor_id=self.hr.id)
+        self.assertEqual(OutboxMessage.objects.filter(task=dispatch_payroll_run.name, args=[job.id]).count(), 1)
+
+        out, shards = self._dispatch(job)
+        self.assertEqual(out["shards"], 3)                       # 6 employees / shard_size 2
+        self.assertEqual(sorted(sig.args[3] for sig in shards), [0, 1, 2])
+        self.assertEqual(sorted(e for sig in shards for e in sig.args[2]), sorted(str(i) for i in self.ids))
+        job.refresh_from_db()
+        self.assertEqual((job.task_id, job.shards_total), ("chord-1", 3))
+
+        again, shards = self._dispatch(job)               # re-published outbox row
+        self.assertFalse(again["dispatched"])
+        self.assertEqual(shards, [])
+
+    def test_shards_and_chord_callback(self):
+        job = start_sharded_run(self.payroll_run, actor_id=self.hr.id)
+        _, shards = self._dispatch(job)
+        results = [compute_payroll_shard(*sig.args) for sig in shards]
+        compute_payroll_shard(*shards[0].args)               # redelivered after the commit
+        out = finalize_payroll_run(results, job.id)
+
+        job.refresh_from_db()
+        self.payroll_run.refresh_from_db()
+        self.assertEqual(out["status"], PayrollRunJob.DONE)
+        self.assertEqual((job.shards_done, job.slips_written), (3, len(self.ids) - 1))
+        self.assertEqual(self.payroll_run.status, PayrollRun.PROCESSED)
+        self.assertEqual(Payslip.objects.filter(run=self.payroll_run).count(), len(self.ids) - 1)
+        payroll_tasks.notify_run_generated.delay.assert_called_once_with(self.payroll_run.id, self.hr.id, len(self.ids) - 1)
+
+        res = self.client.get(self._url("progress"))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((res.data["status"], res.data["shards_done"], res.data["progress"]), ("done", 3, 1.0))
+
+    def test_failed_shard_fails_the_job(self):
+        job = start_sharded_run(self.payroll_run)
+        _, shards = self._dispatch(job)
+        with mock.patch.object(payroll_tasks.BulkPayrollEngine, "compute_run", side_effect=RuntimeError("boom")):
+            results = [compute_payroll_shard(*sig.args) for sig in shards]
+        finalize_payroll_run(results, job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PayrollRunJob.FAILED)
+        self.assertEqual(len(job.errors), 3)
+        self.payroll_run.refresh_from_db()
+        self.assertEqual(self.payroll_run.status, PayrollRun.DRAFT)
+
+    def test_stale_job_no_longer_blocks_and_can_be_resumed(self):
+        job = start_sharded_run(self.payroll_run)
+        res = self.client.post(self._url("generate"), {"mode": "async"}, format="json")
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(self.client.post(self._url("job/resume")).status_code, 409)
+
+        PayrollRunJob.objects.filter(id=job.id).update(updated_at=timezone.now() - timedelta(hours=2))
+        res = self.client.post(self._url("job/resume"))
+        self.assertEqual(res.status_code, 202)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PayrollRunJob.FAILED)
+        self.assertIn("cancelled", job.errors[0])
+
+        res = self.client.post(self._url("job/cancel"))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["status"], PayrollRunJob.FAILED)
+        res = self.client.post(self._url("generate"), {"mode": "async"}, format="json")
+        self.assertEqual(res.status_code, 202)
+
+
+class HolidayDirtyTests(PayrollTestData):
+    """WORKING proration reads the holiday calendar: a holiday edit must reach recompute_dirty."""
+
+    def setUp(self):
+        CompanyPolicy.objects.filter(id=self.policy.id).update(proration_method="WORKING")
+        self.payroll_run.company_policy.refresh_from_db()
+        BulkPayrollEngine(self.payroll_run).compute_run(self.ids, finalize=False)
+        PayrollDirtyMark.objects.all().delete()
+
+    def _marked(self):
+        return set(PayrollDirtyMark.objects.filter(run=self.payroll_run).values_list("employee_id", flat=True))
+
+    def test_holiday_in_period_dirties_the_run(self):
+        slips = set(Payslip.objects.filter(run=self.payroll_run).values_list("employee_id", flat=True))
+        Holiday.objects.create(date=date(2025, 3, 10), name="Férié test")
+        self.assertEqual(self._marked(), slips)
+
+        out = BulkPayrollEngine(self.payroll_run).recompute_dirty()
+        self.assertEqual(out["recomputed"], len(slips))     # fingerprint includes the period's holidays
+
+    def test_holiday_outside_period_or_region(self):
+        Holiday.objects.create(date=date(2025, 5, 1), name="Fête du travail")
+        self.assertEqual(self._marked(), set())
+        Employee.objects.filter(id=self.employees[0].id).update(region="Nord")
+        Holiday.objects.create(date=date(2025, 3, 12), name="Férié régional", region="nord")
+        self.assertEqual(self._marked(), {self.employees[0].id})
+
+    def test_moved_holiday_dirties_the_old_period(self):
+        holiday = Holiday.objects.create(date=date(2025, 5, 1), name="Fête du travail")
+        holiday.date = date(2025, 3, 3)
+        holiday.save()
+        PayrollDirtyMark.objects.all().delete()
+        holiday.date = date(2025, 6, 2)
+        holiday.save()
+        self.assertEqual(len(self._marked()), len(self.ids) - 1)
+
+
+class RecomputeDirtyTests(PayrollTestData):
+    """recompute_dirty: hash skip, removal of slips no longer payable, one transaction, job guard."""
+
+    def setUp(self):
+        BulkPayrollEngine(self.payroll_run).compute_run(self.ids, finalize=False)
+        PayrollDirtyMark.objects.all().delete()
+
+    def _mark_all(self):
+        PayrollDirtyMark.objects.bulk_create([PayrollDirtyMark(run=self.payroll_run, employee_id=i, reason="test")
+                                              for i in self.ids])
+
+    def test_unchanged_inputs_are_skipped(self):
+        self._mark_all()
+        before = dict(Payslip.objects.filter(run=self.payroll_run).values_list("id", "updated_at"))
+        out = BulkPayrollEngine(self.payroll_run).recompute_dirty()
+        self.assertEqual((out["recomputed"], out["unchanged"], out["removed"]), (0, len(self.ids) - 1, 0))
+        self.assertEqual(dict(Payslip.objects.filter(run=self.payroll_run).values_list("id", "updated_at")), before)
+        self.assertFalse(PayrollDirtyMark.objects.exists())
+
+    def test_changed_and_no_longer_payable(self):
+        emp, gone = self.employees[0], self.employees[1]
+        VariableInput.objects.filter(run=self.payroll_run, employee=emp).update(rate=Decimal("2000"))
+        Situation.objects.create(employee=gone, situation_type=SituationType.objects.get(code="dispo"),
+                                 start_date=date(2025, 3, 1))
+        PayrollDirtyMark.objects.create(run=self.payroll_run, employee=emp, reason="test")   # .update() bypasses signals
+
+        out = BulkPayrollEngine(self.payroll_run).recompute_dirty()
+        self.assertEqual((out["dirty"], out["recomputed"], out["removed"]), (2, 1, 1))
+        self.assertFalse(Payslip.objects.filter(run=self.payroll_run, employee=gone).exists())
+        self.assertEqual(Payslip.objects.get(run=self.payroll_run, employee=emp).hash,
+                         PayrollEngine(self.payroll_run)._fingerprint(emp))
+
+    def test_failure_rolls_back_slips_and_marks(self):
+        emp = self.employees[0]
+        VariableInput.objects.filter(run=self.payroll_run, employee=emp).update(rate=Decimal("2000"))
+        PayrollDirtyMark.objects.create(run=self.payroll_run, employee=emp, reason="test")
+        before = Payslip.objects.get(run=self.payroll_run, employee=emp).gross_pay
+
+        with mock.patch.object(BulkPayrollEngine, "_clear_dirty", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                BulkPayrollEngine(self.payroll_run).recompute_dirty()
+        self.assertEqual(Payslip.objects.get(run=self.payroll_run, employee=emp).gross_pay, before)
+        self.assertTrue(PayrollDirtyMark.objects.filter(employee=emp).exists())
+
+    def test_view_refuses_while_a_job_runs(self):
+        hr = User.objects.create_user(username="dirty_hr", password="x", role="HR")
+        client = APIClient()
+        client.force_authenticate(hr)
+        url = f"/api/v1/runs/{self.payroll_run.id}/recompute-dirty/"
+        PayrollRunJob.objects.create(run=self.payroll_run, status=PayrollRunJob.RUNNING)
+        self.assertEqual(client.post(url).status_code, 409)
+        PayrollRunJob.objects.update(status=PayrollRunJob.DONE)
+        self.assertEqual(client.post(url).status_code, 200)
+
+
+class EvaluatorTests(TestCase):
+    """Compiled PIT (bisect over cumulative slabs) against the reference slab walk."""
+
+    def _brackets(self, *rows):
+        return [SimpleNamespace(lower=Decimal(lo), upper=Decimal(up) if up else None, rate=Decimal(r))
+                for lo, up, r in rows]
+
+    BASES = [Decimal(b) for b in ("0", "1", "75000", "75000.01", "75000.02", "123456.78", "240000",
+                                   "240000.01", "799999.99", "800000.01", "5000000", "-10")]
+
+    def test_compiled_matches_slab_walk(self):
+        brackets = self._brackets(("0", "75000", "0"), ("75000.01", "240000", "0.16"),
+                                  ("240000.01", "800000", "0.21"), ("800000.01", None, "0.32"))
+        ev = TaxEvaluator.from_brackets(brackets)
+        self.assertTrue(ev.compiled)
+        expected = [q2(tax_by_slabs(brackets, b)) for b in self.BASES]
+        self.assertEqual([ev.tax(b) for b in self.BASES], expected)
+        self.assertEqual(ev.tax_many(self.BASES), expected)
+
+    def test_overlapping_brackets_fall_back_to_slab_walk(self):
+        brackets = self._brackets(("0", "100000", "0.10"), ("50000", "300000", "0.20"), ("250000", None, "0.30"))
+        ev = TaxEvaluator.from_brackets(brackets)
+        self.assertFalse(ev.compiled)
+        self.assertEqual(ev.tax_many(self.BASES), [q2(tax_by_slabs(brackets, b)) for b in self.BASES])
+
+    def test_bracket_change_invalidates_after_commit(self):
+        currency = Currency.objects.create(code="EUR", name="Euro")
+        table = TaxTable.objects.create(country="FR", valid_from=date(2025, 1, 1))
+        CompanyPolicy.objects.create(name="FR", country="FR", currency=currency, active_tax_table=table)
+        with mock.patch("payroll.signals.invalidate_evaluators") as invalidate:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                TaxBracket.objects.create(table=table, lower=0, upper=None, rate=Decimal("0.10"))
+                invalidate.assert_not_called()           # not before the new bracket is visible
+            self.assertTrue(callbacks)
+        invalidate.assert_called()
+
+
+class SimulationTests(PayrollTestData):
+    """What-if payroll: read-only, overrides move the totals as expected, bad payloads are 400s."""
+
+    def _row_totals(self):
+        engine = PayrollEngine(self.payroll_run)
+        built = [b for b in (engine._build(e) for e in engine._run_employees(self.ids)) if b is not None]
+        return {f: sum(t[f] for t, _ in built) for f in TOTALS}, len(built)
+
+    def _counts(self):
+        return (PayrollRun.objects.count(), Payslip.objects.count(), PayslipItem.objects.count(),
+                PayrollDirtyMark.objects.count())
+
+    def test_simulation_writes_nothing(self):
+        before = self._counts()
+        existing = simulate_payroll(self.policy, 2025, 3, compare=True)
+        unsaved = simulate_payroll(self.policy, 2025, 4, overrides={"fx": {"USD": "600"}})
+        self.assertEqual(self._counts(), before)
+
+        totals, headcount = self._row_totals()
+        self.assertEqual(existing["totals"]["headcount"], headcount)
+        for f in TOTALS:
+            self.assertEqual(Decimal(existing["totals"][f]), totals[f], f)
+        self.assertEqual(unsaved["month"], 4)
+
+    def test_overrides_change_the_totals(self):
+        totals, headcount = self._row_totals()
+        out = simulate_payroll(self.policy, 2025, 3, compare=True, overrides={
+            "tax_brackets": [{"lower": 0, "upper": None, "rate": 0}],
+            "recurring": [{"component": "TRANSPORT", "pct": 100}],
+        })
+        self.assertEqual(Decimal(out["totals"]["income_tax"]), 0)
+        # transport is neither taxable nor contributory: +30000 net per slip, plus the PIT no longer due
+        self.assertEqual(Decimal(out["delta"]["gross_pay"]), 30000 * headcount)
+        self.assertEqual(Decimal(out["delta"]["net_pay"]), 30000 * headcount + totals["income_tax"])
+        self.assertEqual(Decimal(out["baseline"]["net_pay"]), totals["net_pay"])
+
+    def test_malformed_overrides_are_400(self):
+        hr = User.objects.create_user(username="sim_hr", password="x", role="HR")
+        client = APIClient()
+        client.force_authenticate(hr)
+        url = "/api/v1/runs/simulate/"
+        body = {"company_policy_id": self.policy.id, "year": 2025, "month": 3}
+        for overrides in ({"tax_brackets": "flat"}, {"recurring": [1]}, {"recurring": [{"pct": 5}]},
+                          {"contributions": {"CNPS": {"ee_rate": "abc"}}}, {"contributions": {"XXX": {}}},
+                          {"fx": ["USD"]}):
+            res = client.post(url, {**body, "overrides": overrides}, format="json")
+            self.assertEqual(res.status_code, 400, overrides)
+        self.assertEqual(client.post(url, body, format="json").status_code, 200)
+
+
+class ExportTests(PayrollTestData):
+    """Streaming exports: one column per component, queries bounded per chunk."""
+
+    def setUp(self):
+        BulkPayrollEngine(self.payroll_run).compute_run(self.ids, finalize=False)
+        self.slips = Payslip.objects.filter(run=self.payroll_run)
+
+    def test_csv_pivots_components(self):
+        resp = stream_csv(self.slips, "run.csv")
+        rows = list(csv.reader(io.StringIO(b"".join(resp.streaming_content).decode("utf-8"))))
+        header, body = rows[0], rows[1:]
+        codes = header[len(BASE_HEADER):]
+        self.assertEqual(codes, ["BASIC", "TRANSPORT", "PRIME", "HS", "PRET"])
+        self.assertEqual(len(body), self.slips.count())
+
+        expected = {}
+        for item in PayslipItem.objects.filter(payslip__run=self.payroll_run).select_related("payslip__employee", "component"):
+            emp = item.payslip.employee
+            key = f"{emp.first_name} {emp.last_name}"
+            expected.setdefault(key, dict.fromkeys(codes, Decimal("0.00")))[item.component.code] += item.amount
+        for row in body:
+            self.assertEqual(dict(zip(codes, map(Decimal, row[len(BASE_HEADER):]))), expected[row[0]], row[0])
+
+    def test_queries_bounded_per_chunk(self):
+        def count(chunk_size):
+            with CaptureQueriesContext(connection) as ctx:
+                rows = list(iter_payslip_rows(self.slips, chunk_size=chunk_size))
+            self.assertEqual(len(rows), self.slips.count() + 1)
+            return len(ctx.captured_queries)
+
+        chunks = -(-self.slips.count() // 2)
+        # components + slips + one item prefetch per chunk, never one per slip
+        self.assertLessEqual(count(2), 2 + 2 * chunks)
+        self.assertEqual(count(1000), 3)
 
-# Create your tests here.
+    def test_xlsx_has_component_columns(self):
+        if not HAS_XLSX:
+            self.skipTest("XlsxWriter is not installed")
+        resp = xlsx_response(self.slips, "run.xlsx")
+        data = b"".join(resp.streaming_content)
+        sheet = zipfile.ZipFile(io.BytesIO(data)).read("xl/worksheets/sheet1.xml").decode("utf-8")
+        for code in ("BASIC", "TRANSPORT", "PRIME", "HS", "PRET"):
+            self.assertIn(f">{code}<", sheet)
@@ -118,12 +118,18 @@ from django.db.models import Q
 from django.utils import timezone
 from django.http import HttpResponse
 import csv, io, hashlib
+from datetime import timedelta
 from payroll.models import *
 from payroll.serializers import *
 from .permissions import *
 from payroll.services.engines import PayrollEngine
+from payroll.services.bulk import BulkPayrollEngine
+from payroll.services.simulation import simulate_payroll
+from payroll.services.exports import stream_csv, xlsx_response, HAS_XLSX
 from django.shortcuts import get_object_or_404
 from . tasks import *
+from django.db import transaction
+from notifications import outbox
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10; page_size_query_param = 'page_size'; max_page_size = 100
@@ -149,23 +155,144 @@ class PayrollRunViewSet(viewsets.ModelViewSet):
     def generate(self, request, pk=None):
         """
         (Re)compute the run: idempotent while run is DRAFT. Sets status=processed.
+        Body: { mode: "bulk" (default, set-based) | "row" (one employee at a time)
+                      | "async" (sharded over Celery, returns 202 + job; poll /progress/) }
+        A job without progress for PAYROLL_JOB_STALE_MINUTES no longer blocks (see /job/resume/).
         """
         run = self.get_object()
         if run.status == PayrollRun.CLOSED:
             return Response({'detail': 'Run is closed.'}, status=400)
-        engine = PayrollEngine(run)
-        ids = engine.compute_run()
-        
-        # Notify actor + employees (payslip ready)
-        try:
-            notify_run_generated.delay(run.id, request.user.id, len(ids))
-            notify_employees_payslips_ready.delay(run.id)
-        except Exception:
-            notify_run_generated(run.id, request.user.id, len(ids))
-            notify_employees_payslips_ready(run.id)
+        mode = (request.data.get('mode') or 'bulk').lower()
+
+        if mode == 'async':
+            if running_job(run):
+                return Response({'detail': 'A generation job is already running for this run.'}, status=409)
+            job = start_sharded_run(run, actor_id=request.user.id)
+            return Response(PayrollRunJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        engine = PayrollEngine(run) if mode == 'row' else BulkPayrollEngine(run)
+        with transaction.atomic():
+            ids = engine.compute_run()
+
+            # Notify actor + employees (payslip ready): outbox rows, relayed once the slips are committed
+            outbox.enqueue(notify_run_generated, run.id, request.user.id, len(ids))
+            outbox.enqueue(notify_employees_payslips_ready, run.id)
 
         return Response({"detail": "Run processed", "payslip_ids": ids})
 
+    @action(detail=False, methods=['post'], url_path="simulate", permission_classes=[IsAuthenticated, IsAdminOrHR])
+    def simulate(self, request):
+        """
+        What-if payroll for a policy/period, computed in memory (nothing is written).
+        Body: { company_policy_id, year, month, compare?: bool,
+                overrides?: { tax_table_id, tax_brackets: [{lower, upper, rate}],
+                              contributions: {CODE: {ee_rate, er_rate, cap}},
+                              recurring: [{component, pct, grade?, department?}],
+                              fx: {USD: rate} } }
+        """
+        data = request.data
+        policy = CompanyPolicy.objects.filter(id=data.get('company_policy_id')).first()
+        if not policy:
+            return Response({'detail': 'company_policy_id is required / unknown.'}, status=400)
+        try:
+            year, month = int(data.get('year')), int(data.get('month'))
+        except (TypeError, ValueError):
+            return Response({'detail': 'year and month are required.'}, status=400)
+        if not 1 <= month <= 12:
+            return Response({'detail': 'month must be 1..12.'}, status=400)
+
+        try:
+            result = simulate_payroll(policy, year, month,
+                                      overrides=data.get('overrides') or {},
+                                      compare=str(data.get('compare', '')).lower() in ('1', 'true', 'yes'))
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
+        return Response(result)
+
+    @action(detail=True, methods=['post'], url_path="pdf-bulk", permission_classes=[IsAuthenticated, IsAdminOrHR])
+    def pdf_bulk(self, request, pk=None):
+        """
+        Start a bulk PDF job for the run. Body: { output: "zip" (default) | "pdf" (merged) }.
+        Poll GET /pdf-job/ for progress; the result file is in file_url.
+        """
+        run = self.get_object()
+        output = (request.data.get('output') or PayslipPdfJob.ZIP).lower()
+        if output not in (PayslipPdfJob.ZIP, PayslipPdfJob.PDF):
+            return Response({'detail': 'output must be "zip" or "pdf".'}, status=400)
+        if run.pdf_jobs.filter(status__in=[PayslipPdfJob.PENDING, PayslipPdfJob.RUNNING]).exists():
+            return Response({'detail': 'A PDF job is already running for this run.'}, status=409)
+        job = start_payslip_pdf_job(run, output=output, actor_id=request.user.id)
+        return Response(PayslipPdfJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'], url_path="pdf-job", permission_classes=[IsAuthenticated, IsAdminOrHR])
+    def pdf_job(self, request, pk=None):
+        run = self.get_object()
+        job = run.pdf_jobs.order_by('-created_at', '-id').first()
+        if not job:
+            return Response({'detail': 'No PDF job for this run.'}, status=404)
+        return Response(PayslipPdfJobSerializer(job).data)
+
+    @action(detail=True, methods=['post'], url_path="pdf-job/resume", permission_classes=[IsAuthenticated, IsAdminOrHR])
+    def pdf_job_resume(self, request, pk=None):
+        """Re-dispatch the latest PDF job (failed, or running without progress for 10+ min)."""
+        run = self.get_object()
+        job = run.pdf_jobs.order_by('-created_at', '-id').first()
+        if not job:
+            return Response({'detail': 'No PDF job for this run.'}, status=404)
+        stale = job.status == PayslipPdfJob.RUNNING and job.updated_at < timezone.now() - timedelta(minutes=10)
+        if job.status != PayslipPdfJob.FAILED and not stale:
+            return Response({'detail': 'Job is not failed or stalled.'}, status=409)
+        job = start_payslip_pdf_job(run, output=job.output, actor_id=request.user.id, job=job)
+        return Response(PayslipPdfJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['post'], url_path="recompute-dirty", permission_classes=[IsAuthenticated, IsAdminOrHR])
+    def recompute_dirty(self, request, pk=None):
+        """
+        Rebuild only the slips whose inputs changed since the last compute
+        (variables, recurring components, contracts, situations).
+        """
+        run = self.get_object()
+        if run.status == PayrollRun.CLOSED:
+            return Response({'detail': 'Run is closed.'}, status=400)
+        if running_job(run):
+            return Response({'detail': 'A generation job is already running for this run.'}, status=409)
+        return Response(BulkPayrollEngine(run).recompute_dirty())
+
+    @action(detail=True, methods=['get'], url_path="progress", permission_classes=[IsAuthenticated, IsAdminOrHR])
+    def progress(self, request, pk=None):
+        """Latest async generation job of the run: shards done/total, slips written, errors."""
+        run = self.get_object()
+        job = run.jobs.order_by('-created_at', '-id').first()
+        if not job:
+            return Response({'detail': 'No generation job for this run.'}, status=404)
+        return Response(PayrollRunJobSerializer(job).data)
+
+    @action(detail=True, methods=['post'], url_path="job/resume", permission_classes=[IsAuthenticated, IsAdminOrHR])
+    def job_resume(self, request, pk=None):
+        """Restart the latest generation job if it failed or stalled (the stale one is cancelled)."""
+        run = self.get_object()
+        if run.status == PayrollRun.CLOSED:
+            return Response({'detail': 'Run is closed.'}, status=400)
+        job = run.jobs.order_by('-created_at', '-id').first()
+        if not job:
+            return Response({'detail': 'No generation job for this run.'}, status=404)
+        if job.status != PayrollRunJob.FAILED and not is_stale(job):
+            return Response({'detail': 'Job is not failed or stalled.'}, status=409)
+        if is_stale(job):
+            cancel_job(job, f"stalled, resumed by user {request.user.id}")
+        job = start_sharded_run(run, actor_id=request.user.id)
+        return Response(PayrollRunJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['post'], url_path="job/cancel", permission_classes=[IsAuthenticated, IsAdminOrHR])
+    def job_cancel(self, request, pk=None):
+        """Mark the latest pending/running generation job failed; shards still in flight only update counters."""
+        run = self.get_object()
+        job = run.jobs.filter(status__in=[PayrollRunJob.PENDING, PayrollRunJob.RUNNING]).order_by('-created_at', '-id').first()
+        if not job:
+            return Response({'detail': 'No running generation job for this run.'}, status=404)
+        job = cancel_job(job, f"cancelled by user {request.user.id}")
+        return Response(PayrollRunJobSerializer(job).data)
+
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated, IsAdminOrHR])
     def close(self, request, pk=None):
         run = self.get_object()
@@ -173,13 +300,11 @@ class PayrollRunViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'Run must be processed before closing.'}, status=400)
         run.status = PayrollRun.CLOSED
         run.closed_at = timezone.now()
-        run.save(update_fields=['status','closed_at'])
+        with transaction.atomic():
+            run.save(update_fields=['status','closed_at'])
 
-        # Notify actor + employees (payment)
-        try:
-            notify_run_closed.delay(run.id, request.user.id)
-        except Exception:
-            notify_run_closed(run.id, request.user.id)
+            # Notify actor + employees (payment)
+            outbox.enqueue(notify_run_closed, run.id, request.user.id)
 
         return Response(PayrollRunSerializer(run).data)
 
@@ -191,29 +316,28 @@ class PayrollRunViewSet(viewsets.ModelViewSet):
         run.status = PayrollRun.DRAFT
         run.closed_at = None
         run.processed_at = None
-        run.save(update_fields=['status','closed_at','processed_at'])
-        # (optional) delete payslips so it can be recomputed fresh
-        run.payslips.all().delete()
+        with transaction.atomic():
+            run.save(update_fields=['status','closed_at','processed_at'])
+            # (optional) delete payslips so it can be recomputed fresh
+            run.payslips.all().delete()
+
+            # Notify actor only
+            outbox.enqueue(notify_run_reopened, run.id, request.user.id)
 
-        # Notify actor only
-        try:
-            notify_run_reopened.delay(run.id, request.user.id)
-        except Exception:
-            notify_run_reopened(run.id, request.user.id)
-            
         return Response(PayrollRunSerializer(run).data)
 
     @action(detail=True, methods=['get'])
     def export_csv(self, request, pk=None):
+        """Streamed CSV of the run's payslips, one column per payroll component."""
         run = self.get_object()
-        resp = HttpResponse(content_type='text/csv; charset=utf-8')
-        resp['Content-Disposition'] = f'attachment; filename="payslips_{run.year}_{run.month}.csv"'
-        w = csv.writer(resp)
-        w.writerow(['Employee','Gross','Taxable','EE Contrib','ER Contrib','Tax','Other Deds','Net'])
-        for p in run.payslips.select_related('employee'):
-            full = f"{p.employee.first_name} {p.employee.last_name}"
-            w.writerow([full, p.gross_pay, p.taxable_gross, p.employee_contrib, p.employer_contrib, p.income_tax, p.other_deductions, p.net_pay])
-        return resp
+        return stream_csv(run.payslips.all(), f"payslips_{run.year}_{str(run.month).zfill(2)}.csv")
+
+    @action(detail=True, methods=['get'])
+    def export_xlsx(self, request, pk=None):
+        run = self.get_object()
+        if not HAS_XLSX:
+            return Response({'detail': 'XLSX export unavailable (XlsxWriter not installed).'}, status=501)
+        return xlsx_response(run.payslips.all(), f"payslips_{run.year}_{str(run.month).zfill(2)}.xlsx")
 
 
 class PayslipViewSet(viewsets.ReadOnlyModelViewSet):
@@ -313,41 +437,27 @@ class PayslipViewSet(viewsets.ReadOnlyModelViewSet):
         resp['Content-Disposition'] = f'inline; filename="{fname}"'
         return resp
 
+    def _export_slips(self, request):
+        """Slips of the same run as this payslip, limited to what the caller may see."""
+        slip = self.get_object()
+        return slip.run, self.get_queryset().filter(run=slip.run)
+
     @action(detail=True, methods=['get'])
     def export_csv(self, request, pk=None):
         """
-        Export all payslips of this run as CSV.
-        Columns: Employee, Matricule, Dept, Grade, Gross, Taxable, EE Contrib, ER Contrib, Tax, Other Deds, Net, Currency, Finalized, Created
+        Export all payslips of this payslip's run as a streamed CSV.
+        Columns: Employee, Matricule, Dept, Grade, Gross, Taxable, EE Contrib, ER Contrib, Tax, Other Deds, Net,
+                 Currency, Finalized, Created, then one column per payroll component.
         """
-        run = self.get_object()
-
-        resp = HttpResponse(content_type='text/csv; charset=utf-8')
-        resp['Content-Disposition'] = f'attachment; filename="payslips_{run.year}_{str(run.month).zfill(2)}.csv"'
-        w = csv.writer(resp)
-
-        w.writerow([
-            'Employee', 'Matricule', 'Department', 'Grade',
-            'Gross', 'Taxable Gross', 'EE Contrib', 'ER Contrib',
-            'Income Tax', 'Other Deductions', 'Net Pay',
-            'Currency', 'Finalized', 'Created At'
-        ])
-
-        qs = run.payslips.select_related('employee', 'employee__department', 'employee__grade', 'currency').all()
-        for p in qs:
-            emp = p.employee
-            w.writerow([
-                f"{emp.first_name} {emp.last_name}",
-                getattr(emp, 'matricule', '') or '',
-                getattr(getattr(emp, 'department', None), 'name', '') or '',
-                getattr(getattr(emp, 'grade', None), 'name', '') or '',
-                p.gross_pay, p.taxable_gross, p.employee_contrib, p.employer_contrib,
-                p.income_tax, p.other_deductions, p.net_pay,
-                getattr(p.currency, 'code', '') or '',
-                'YES' if p.finalized else 'NO',
-                p.created_at.strftime('%Y-%m-%d %H:%M'),
-            ])
+        run, qs = self._export_slips(request)
+        return stream_csv(qs, f"payslips_{run.year}_{str(run.month).zfill(2)}.csv")
 
-        return resp
+    @action(detail=True, methods=['get'])
+    def export_xlsx(self, request, pk=None):
+        run, qs = self._export_slips(request)
+        if not HAS_XLSX:
+            return Response({'detail': 'XLSX export unavailable (XlsxWriter not installed).'}, status=501)
+        return xlsx_response(qs, f"payslips_{run.year}_{str(run.month).zfill(2)}.xlsx")
 
 
 class CompanyPolicyViewSet(viewsets.ModelViewSet):
@@ -2,7 +2,6 @@
 from celery import shared_task
 from django.utils import timezone
 from .models import Situation
-from notifications.tasks import send_notification
 from config.monitoring.metrics import mark_beat_run
 
 # @shared_task
@@ -39,7 +38,8 @@ from django.utils import timezone
 from django.db.models import Q
 from authentication.models import User
 from .models import Situation
-from notifications.tasks import send_notification
+from notifications.scheduling import digest_time
+from notifications.tasks import create_bulk_notifications
 
 import logging
 logger = logging.getLogger(__name__)
@@ -49,6 +49,16 @@ SITUATION_CATEGORY = "situation"
 def _fmt_d(d):
     return d.strftime("%d/%m/%Y") if d else "—"
 
+def _fan_out(items, priority: int, scheduled_for=None, expires_at=None, coalesce=False):
+    """One bulk notification call for a list of (user_id, message, title, metadata)."""
+    if not items:
+        return
+    try:
+        create_bulk_notifications(items, category=SITUATION_CATEGORY, priority=priority,
+                                  scheduled_for=scheduled_for, expires_at=expires_at, coalesce=coalesce)
+    except Exception as e:
+        logger.error("Failed to fan out situation notifications (%s recipients): %s", len(items), e)
+
 @shared_task
 def monitor_situations():
     """
@@ -84,10 +94,11 @@ def monitor_situations():
         )
 
         # Cache HR/ADMIN recipients once
-        hr_admin_users = list(User.objects.filter(role__in=["HR", "ADMIN"]).only("id"))
+        hr_admin_ids = list(User.objects.filter(role__in=["HR", "ADMIN"]).values_list("id", flat=True))
 
         # 1) Upcoming end in 5 days (still active)
         upcoming = qs.filter(status="actif", end_date=in_five_days)
+        reminders = []
         for sit in upcoming:
             employee = sit.employee
             emp_user = getattr(employee, "user", None)
@@ -101,42 +112,30 @@ def monitor_situations():
                 " (⚠︎ reprise de paie à préparer)" if needs_payroll_suspend else ""
             )
 
+            meta = {"situation_id": sit.id, "situation_code": st_code, "suspend_payroll": needs_payroll_suspend}
+
             # Employee reminder
             if emp_user:
-                send_notification.delay(
-                    user_id=emp_user.id,
-                    title="Rappel — Fin de situation",
-                    message=f"Votre {st_name} se termine le {end_s}.{payroll_hint}",
-                    category=SITUATION_CATEGORY,
-                    priority=3,
-                    metadata={"situation_id": sit.id, "situation_code": st_code, "suspend_payroll": needs_payroll_suspend},
-                )
+                reminders.append((emp_user.id, f"Votre {st_name} se termine le {end_s}.{payroll_hint}",
+                                  "Rappel — Fin de situation", meta))
 
             # Manager reminder
             if mgr_user:
-                send_notification.delay(
-                    user_id=mgr_user.id,
-                    title="Rappel — Fin de situation (équipe)",
-                    message=f"{st_name} de {employee} se termine le {end_s}. Préparez la reprise administrative.{payroll_hint}",
-                    category=SITUATION_CATEGORY,
-                    priority=3,
-                    metadata={"situation_id": sit.id, "situation_code": st_code, "suspend_payroll": needs_payroll_suspend},
-                )
+                reminders.append((mgr_user.id,
+                                  f"{st_name} de {employee} se termine le {end_s}. Préparez la reprise administrative.{payroll_hint}",
+                                  "Rappel — Fin de situation (équipe)", meta))
 
             # HR / ADMIN reminder (+ payroll hint if applicable)
             hr_msg = f"{st_name} de {employee} se termine le {end_s}. Veuillez préparer la reprise.{payroll_hint}"
-            for hr in hr_admin_users:
-                send_notification.delay(
-                    user_id=hr.id,
-                    title="Rappel — Fin de situation",
-                    message=hr_msg,
-                    category=SITUATION_CATEGORY,
-                    priority=3,
-                    metadata={"situation_id": sit.id, "situation_code": st_code, "suspend_payroll": needs_payroll_suspend},
-                )
+            reminders.extend((hr_id, hr_msg, "Rappel — Fin de situation", meta) for hr_id in hr_admin_ids)
+
+        # Reminders wait for the digest slot (this runs at midnight); alerts below go out now
+        slot = digest_time()
+        _fan_out(reminders, priority=3, scheduled_for=slot, expires_at=slot + timezone.timedelta(days=1), coalesce=True)
 
         # 2) Ended but not closed: end_date passed but status still 'actif'
         overdue = qs.filter(status="actif", end_date__lt=today)
+        alerts = []
         for sit in overdue:
             st_name = sit.situation_type.name
             st_code = (sit.situation_type.code or "").lower()
@@ -149,20 +148,15 @@ def monitor_situations():
                 f"La situation {st_name} pour {sit.employee} aurait dû se terminer le {end_s} "
                 f"mais est toujours marquée 'actif'.{resume_hint}"
             )
-            for hr in hr_admin_users:
-                send_notification.delay(
-                    user_id=hr.id,
-                    title="Alerte — Situation à clôturer",
-                    message=msg,
-                    category=SITUATION_CATEGORY,
-                    priority=2,
-                    metadata={"situation_id": sit.id, "situation_code": st_code, "suspend_payroll": needs_payroll_suspend},
-                )
+            meta = {"situation_id": sit.id, "situation_code": st_code, "suspend_payroll": needs_payroll_suspend}
+            alerts.extend((hr_id, msg, "Alerte — Situation à clôturer", meta) for hr_id in hr_admin_ids)
 
             # Auto-close to keep the dataset consistent
             sit.status = "terminé"
             sit.save(update_fields=["status"])
 
+        _fan_out(alerts, priority=2, coalesce=True)
+
         # 3) Death reported but employee still active
         deaths = qs.filter(
             situation_type__code__iexact="exit"
@@ -181,15 +175,8 @@ def monitor_situations():
                     f"Alerte: {employee} déclaré décédé le {_fmt_d(sit.start_date)} "
                     f"mais toujours actif dans le système."
                 )
-                for hr in hr_admin_users:
-                    send_notification.delay(
-                        user_id=hr.id,
-                        title="Alerte — Décès vs statut actif",
-                        message=msg,
-                        category=SITUATION_CATEGORY,
-                        priority=1,
-                        metadata={"situation_id": sit.id, "employee_id": str(getattr(employee, 'id', None)), "situation_code": "exit"},
-                    )
+                meta = {"situation_id": sit.id, "employee_id": str(getattr(employee, 'id', None)), "situation_code": "exit"}
+                _fan_out([(hr_id, msg, "Alerte — Décès vs statut actif", meta) for hr_id in hr_admin_ids], priority=1)
                 try:
                     employee.is_active = False
                     employee.save(update_fields=["is_active"])